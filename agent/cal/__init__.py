@@ -1,8 +1,22 @@
 """
 Calendar agent package - Contains modules for calendar intent recognition and processing
+
+Components are imported on first access so that importing the package does not load LangChain.
 """
+import importlib
+
+_LAZY_EXPORTS = {
+    'CalendarAgent': 'agent.cal.calendar_agent',
+    'create_calendar_intent_chain': 'agent.cal.calendar_intent',
+    'parse_intent_response': 'agent.cal.calendar_intent',
+    'parse_relative_date': 'agent.cal.calendar_utils',
+    'parse_time': 'agent.cal.calendar_utils',
+}
 
-# Import key components for easier access
-from agent.cal.calendar_agent import CalendarAgent
-from agent.cal.calendar_intent import create_calendar_intent_chain, parse_intent_response
-from agent.cal.calendar_utils import parse_relative_date, parse_time
\ No newline at end of file
+def __getattr__(name):
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
@@ -9,7 +9,6 @@ Questo modulo:
 """
 import os
 import logging
-from langchain_openai import ChatOpenAI
 
 # Inizializza il logger
 logging.basicConfig(level=logging.INFO)
@@ -31,6 +30,7 @@ def get_calendar_agent():
         try:
             # Importazione locale per evitare dipendenze circolari
             from agent.cal.calendar_agent import CalendarAgent
+            from langchain_openai import ChatOpenAI
             
             # Ottieni la chiave API dall'ambiente
             api_key = os.getenv("OPENROUTER_API_KEY")
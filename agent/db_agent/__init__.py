@@ -1,9 +1,24 @@
 """
 Modulo per l'agente di query sul database.
+
+I componenti vengono importati al primo accesso: app.py importa agent.db_agent.routes
+all'avvio e non deve caricare LangChain e ReportLab finché l'agente non viene usato.
 """
+import importlib
+
+_LAZY_EXPORTS = {
+    'DBQueryAgent': 'agent.db_agent.db_query_agent',
+    'PDFGenerator': 'agent.db_agent.pdf_generator',
+    'DBAgentMiddleware': 'agent.db_agent.db_agent_middleware',
+    'get_db_query_agent': 'agent.db_agent.db_agent_middleware',
+}
 
-from agent.db_agent.db_query_agent import DBQueryAgent
-from agent.db_agent.pdf_generator import PDFGenerator
-from agent.db_agent.db_agent_middleware import DBAgentMiddleware, get_db_query_agent
+__all__ = ['DBQueryAgent', 'PDFGenerator', 'DBAgentMiddleware', 'get_db_query_agent']
 
-__all__ = ['DBQueryAgent', 'PDFGenerator', 'DBAgentMiddleware', 'get_db_query_agent']
\ No newline at end of file
+def __getattr__(name):
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
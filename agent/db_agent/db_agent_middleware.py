@@ -10,7 +10,6 @@ Questo modulo:
 import os
 import logging
 import re
-from langchain_openai import ChatOpenAI
 
 # Inizializza il logger
 logging.basicConfig(level=logging.INFO)
@@ -32,6 +31,7 @@ def get_db_query_agent():
         try:
             # Importazione locale per evitare dipendenze circolari
             from agent.db_agent.db_query_agent import DBQueryAgent
+            from langchain_openai import ChatOpenAI
             
             # Ottieni la chiave API dall'ambiente
             api_key = os.getenv("OPENROUTER_API_KEY")
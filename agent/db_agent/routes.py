@@ -3,7 +3,6 @@ from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 import logging
 import os
-from chat.database import get_db
 
 # Configura il logging
 logging.basicConfig(level=logging.INFO)
@@ -31,12 +30,10 @@ def execute_query():
         logger.info(f"Esecuzione query: {query}")
         
         # Esegui la query
-        # Importa direttamente l'engine e crea una sessione
-        from common.db.connection import get_engine
-        from sqlalchemy.orm import sessionmaker
+        # Usa l'engine condiviso del processo (nessun nuovo pool per richiesta)
+        from common.db.connection import get_engine, create_session_factory
         
-        engine = get_engine()
-        Session = sessionmaker(bind=engine)
+        Session = create_session_factory(get_engine())
         db = Session()
         
         try:
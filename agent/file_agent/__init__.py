@@ -1,10 +1,24 @@
 """
 File agent package - Contains modules for file analysis intent recognition and processing
+
+Components are imported on first access so that importing the package does not load LangChain.
 """
+import importlib
+
+_LAZY_EXPORTS = {
+    'FileAgent': 'agent.file_agent.file_agent',
+    'create_file_intent_chain': 'agent.file_agent.file_intent',
+    'parse_intent_response': 'agent.file_agent.file_intent',
+    'FileAgentMiddleware': 'agent.file_agent.file_agent_middleware',
+    'get_file_agent': 'agent.file_agent.file_agent_middleware',
+}
 
-# Import key components for easier access
-from agent.file_agent.file_agent import FileAgent
-from agent.file_agent.file_intent import create_file_intent_chain, parse_intent_response
-from agent.file_agent.file_agent_middleware import FileAgentMiddleware, get_file_agent
+__all__ = ['FileAgent', 'FileAgentMiddleware', 'get_file_agent', 'create_file_intent_chain', 'parse_intent_response']
 
-__all__ = ['FileAgent', 'FileAgentMiddleware', 'get_file_agent', 'create_file_intent_chain', 'parse_intent_response']
\ No newline at end of file
+def __getattr__(name):
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
@@ -10,9 +10,6 @@ import os
 import re
 import json
 import logging
-from langchain_openai import ChatOpenAI
-from agent.file_agent.file_agent import FileAgent
-from langchain.prompts import ChatPromptTemplate
 
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO)
@@ -32,6 +29,10 @@ def get_file_query_chain():
     global _file_intent_chain
     
     if _file_intent_chain is None:
+        # Dipendenze LangChain caricate solo al primo uso
+        from langchain_openai import ChatOpenAI
+        from langchain.prompts import ChatPromptTemplate
+
         # Ottieni il modello di linguaggio
         api_key = os.getenv("OPENROUTER_API_KEY")
         api_base = os.getenv("OPENROUTER_API_BASE", "https://openrouter.ai/api/v1")
@@ -75,6 +76,9 @@ def get_file_agent():
     global _file_agent
     
     if _file_agent is None:
+        from langchain_openai import ChatOpenAI
+        from agent.file_agent.file_agent import FileAgent
+
         # Ottieni il modello di linguaggio
         api_key = os.getenv("OPENROUTER_API_KEY")
         api_base = os.getenv("OPENROUTER_API_BASE", "https://openrouter.ai/api/v1")
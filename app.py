@@ -21,7 +21,7 @@ logging.getLogger('werkzeug').setLevel(logging.ERROR)
 sys.setrecursionlimit(1000)
 
 # Importa la configurazione centralizzata
-from common.config import SECRET_KEY, DEBUG, PORT, FLASK_ENV, log_config_info
+from common.config import SECRET_KEY, DEBUG, PORT, FLASK_ENV, EMBEDDING_WARMUP, log_config_info
 
 # Verifica che gevent-websocket sia installato
 try:
@@ -42,6 +42,10 @@ from chat.handlers import register_handlers
 # Importa le funzionalità di database
 from common.db.connection import get_engine
 
+# Client manager Socket.IO condiviso tra worker (opzionale)
+from common.socketio_queue import get_socketio_queue_kwargs, get_socketio_transports
+from common.serialization import SocketIOPacket
+
 # Crea l'applicazione Flask
 app = Flask(__name__)
 app.config['SECRET_KEY'] = SECRET_KEY
@@ -54,6 +58,11 @@ common_static = Blueprint('common_static', __name__,
 # Registra il blueprint degli elementi statici comuni
 app.register_blueprint(common_static)
 
+# Espone ai template i trasporti Socket.IO consentiti dal server
+@app.context_processor
+def inject_socketio_options():
+    return {'socketio_transports': get_socketio_transports()}
+
 # Inizializza gli schemi del database
 import logging
 logger = logging.getLogger(__name__)
@@ -64,11 +73,19 @@ app.jinja_loader.searchpath.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)), 'common/templates')
 )
 
-# Configura Socket.IO con le impostazioni per una migliore stabilità
+# Configura Socket.IO con le impostazioni per una migliore stabilità.
+# Con SOCKETIO_MESSAGE_QUEUE gli emit vengono distribuiti a tutti i worker/nodi.
 socketio = SocketIO(app, cors_allowed_origins="*",
                     async_mode='gevent', 
                     ping_timeout=60, 
-                    ping_interval=25)
+                    ping_interval=25,
+                    serializer=SocketIOPacket,  # payload codificati una sola volta (orjson se disponibile)
+                    **get_socketio_queue_kwargs())
+
+# Warm-up opzionale del modello di embedding in background (altrimenti al primo uso)
+if EMBEDDING_WARMUP:
+    from common.embeddings import get_embedding_service
+    get_embedding_service().warm_up(background=True)
 
 # Registra i blueprint
 app.register_blueprint(chat_bp, url_prefix='/chat')
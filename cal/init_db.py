@@ -29,8 +29,6 @@ def init_db():
         
         # Esegui lo script SQL
         with engine.connect() as conn:
-            conn.execute(text(f"SET search_path TO {DB_SCHEMA}, public"))
-            
             # Dividi lo script in singole istruzioni SQL
             # Nota: questo è un approccio semplificato, potrebbe non funzionare con SQL complessi
             statements = sql_schema.split(';')
@@ -38,9 +36,13 @@ def init_db():
             for stmt in statements:
                 if stmt.strip():
                     try:
+                        # SET LOCAL vale solo per questa transazione: la connessione torna
+                        # al pool condiviso senza search_path modificato
+                        conn.execute(text(f"SET LOCAL search_path TO {DB_SCHEMA}, public"))
                         conn.execute(text(stmt))
                         conn.commit()
                     except Exception as e:
+                        conn.rollback()
                         logger.warning(f"Errore nell'esecuzione dell'istruzione SQL: {e}")
                         # Continua con la prossima istruzione
             
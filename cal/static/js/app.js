@@ -118,7 +118,9 @@ export function initSocketListeners() {
         console.log('[CALENDAR_DEBUG] Socket.IO is available');
 
         // Inizializza una nuova connessione Socket.IO
-        window.socket = io();
+        window.socket = io({
+            transports: window.SOCKETIO_TRANSPORTS || ['polling', 'websocket']
+        });
 
         // Aggiungi log per verificare la connessione
         socket.on('connect', function () {
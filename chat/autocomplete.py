@@ -0,0 +1,282 @@
+"""
+Indice in memoria per l'autocompletamento di utenti e canali.
+
+La ricerca di utenti e canali girava due ILIKE '%q%' (più join e GROUP BY per il
+numero di membri dei canali) a ogni tasto premuto. Qui l'indice viene costruito una
+volta con utenti (dalla rubrica, chat/user_directory.py) e canali con il numero di
+membri, e interrogato in memoria:
+- prefisso: chiavi ordinate (campo intero e singole parole di username, displayName,
+  nome e descrizione del canale) cercate con bisect, cioè un trie appiattito in un
+  array: stesso risultato della discesa nel trie con molta meno memoria in Python
+- trigrammi: se i prefissi non bastano, parole con almeno metà dei trigrammi della
+  query (tollera refusi e corrispondenze a metà parola)
+- sottostringa: per le query di 1-2 caratteri, dove i trigrammi non si applicano
+
+Il confronto ignora maiuscole e accenti. L'indice viene scartato alle scritture ORM su
+User, Channel e ChannelMember (al flush e di nuovo al commit), con invalidate() per le
+modifiche in blocco e con AUTOCOMPLETE_TTL per quelle fatte da altri processi.
+"""
+import bisect
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+from common.config import AUTOCOMPLETE_TTL
+from chat.cache_invalidation import invalidate_on_write
+from chat.database import SessionLocal
+from chat.directory_snapshot import load_channels
+from chat.models import User, Channel, ChannelMember
+from chat.user_directory import list_users
+from common.db.connection import get_db_session
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 10
+AUTOCOMPLETE_TYPES = ('users', 'channels')
+TRIGRAM_THRESHOLD = 0.5
+
+# Punteggi (più basso = migliore)
+_EXACT, _FIELD_PREFIX, _WORD_PREFIX, _TRIGRAM, _SUBSTRING = 0.0, 1.0, 2.0, 3.0, 4.0
+
+_WORD_SPLIT = re.compile(r'[\W_]+')
+
+def normalize(value):
+    """Minuscolo e senza accenti: 'Élodie' -> 'elodie'"""
+    decomposed = unicodedata.normalize('NFKD', (value or '').casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+def parse_types(value):
+    """
+    Tipi richiesti dal client: un solo tipo ('users') o una lista; ignora quelli sconosciuti.
+
+    Returns:
+        list: Tipi validi senza duplicati, tutti se il valore è vuoto o non valido
+    """
+    if not value:
+        return list(AUTOCOMPLETE_TYPES)
+    if isinstance(value, str):
+        value = [value]
+    elif not isinstance(value, (list, tuple)):
+        return list(AUTOCOMPLETE_TYPES)
+    return [kind for kind in AUTOCOMPLETE_TYPES if kind in value]
+
+def trigrams(word):
+    """Trigrammi di una parola con il padding di pg_trgm ('  w', ' wo', ..., 'rd ')"""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class _Snapshot:
+    """Indice immutabile: viene sostituito in blocco a ogni ricostruzione"""
+
+    def __init__(self, users, channels):
+        self.entries = []  # (tipo, dizionario, testo normalizzato per la sottostringa, chiave di ordinamento)
+        self.entries_by_kind = {'users': [], 'channels': []}
+        self.trigram_index = {'users': {}, 'channels': {}}  # tipo -> trigramma -> indici delle entry
+        keys = []  # (chiave, punteggio del prefisso, indice dell'entry)
+
+        for kind, items, fields, label in (
+                ('users', users, ('username', 'displayName'), 'displayName'),
+                ('channels', channels, ('name', 'description'), 'name')):
+            trigram_index = self.trigram_index[kind]
+            for item in items:
+                entry_index = len(self.entries)
+                values = [normalize(item.get(field)) for field in fields]
+                self.entries.append((kind, item, ' '.join(values), normalize(item.get(label))))
+                self.entries_by_kind[kind].append(entry_index)
+                for value in values:
+                    if not value:
+                        continue
+                    keys.append((value, _FIELD_PREFIX, entry_index))
+                    for word in _WORD_SPLIT.split(value):
+                        if word:
+                            keys.append((word, _WORD_PREFIX, entry_index))
+                            for trigram in trigrams(word):
+                                trigram_index.setdefault(trigram, set()).add(entry_index)
+
+        keys.sort()
+        self.keys = [key for key, _, _ in keys]
+        self.key_scores = [score for _, score, _ in keys]
+        self.key_entries = [entry_index for _, _, entry_index in keys]
+
+    def search(self, query, types, limit):
+        """Restituisce {tipo: [(punteggio, chiave di ordinamento, indice)]} per la query normalizzata"""
+        best = {}
+
+        def offer(entry_index, score):
+            if score < best.get(entry_index, _SUBSTRING + 1):
+                best[entry_index] = score
+
+        start = bisect.bisect_left(self.keys, query)
+        for position in range(start, len(self.keys)):
+            key = self.keys[position]
+            if not key.startswith(query):
+                break
+            score = self.key_scores[position]
+            offer(self.key_entries[position], _EXACT if key == query and score == _FIELD_PREFIX else score)
+
+        found = Counter(self.entries[entry_index][0] for entry_index in best)
+        for kind in types:
+            if found[kind] >= limit:
+                continue
+            # Fallback solo per i tipi con meno di limit risultati per prefisso
+            if len(query) >= 3:
+                for word in _WORD_SPLIT.split(query):
+                    if word:
+                        for entry_index, similarity in self._similar(kind, word):
+                            offer(entry_index, _TRIGRAM + 1 - similarity)
+            else:
+                for entry_index in self.entries_by_kind[kind]:
+                    if query in self.entries[entry_index][2]:
+                        offer(entry_index, _SUBSTRING)
+
+        results = {kind: [] for kind in types}
+        for entry_index, score in best.items():
+            kind, _, _, sort_key = self.entries[entry_index]
+            if kind in results:
+                results[kind].append((score, sort_key, entry_index))
+        return results
+
+    def _similar(self, kind, word):
+        """
+        Entry con almeno TRIGRAM_THRESHOLD dei trigrammi di word.
+
+        Chi ne condivide almeno need su n deve averne uno tra gli n - need + 1 più rari:
+        i candidati vengono solo da quelli, gli altri trigrammi servono a contare.
+        """
+        index = self.trigram_index[kind]
+        query_trigrams = sorted(trigrams(word), key=lambda trigram: len(index.get(trigram, ())))
+        need = max(1, math.ceil(TRIGRAM_THRESHOLD * len(query_trigrams)))
+        candidates = set()
+        for trigram in query_trigrams[:len(query_trigrams) - need + 1]:
+            candidates.update(index.get(trigram, ()))
+        for entry_index in candidates:
+            count = sum(1 for trigram in query_trigrams if entry_index in index.get(trigram, ()))
+            if count >= need:
+                yield entry_index, count / len(query_trigrams)
+
+class AutocompleteIndex:
+    """
+    Indice di autocompletamento costruito in blocco e invalidato alle modifiche.
+
+    Args:
+        session_factory: Factory delle sessioni usata per caricare i canali
+        ttl (float): Secondi dopo i quali l'indice viene ricostruito (0 = mai)
+    """
+
+    def __init__(self, session_factory=SessionLocal, ttl=AUTOCOMPLETE_TTL):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self._snapshot = None
+        self._built_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {'lookups': 0, 'builds': 0, 'invalidations': 0, 'lookup_seconds': 0.0,
+                       'build_seconds': 0.0}
+
+    def search(self, query, types=('users', 'channels'), limit=DEFAULT_LIMIT):
+        """
+        Utenti e canali che corrispondono alla query, i migliori per primi.
+
+        Args:
+            query (str): Testo digitato
+            types (tuple): Tipi richiesti ('users', 'channels')
+            limit (int): Risultati massimi per tipo
+
+        Returns:
+            dict: {'users': [...], 'channels': [...]} nel formato di /api/search
+        """
+        results = {kind: [] for kind in types}
+        needle = normalize(query).strip()
+        if not needle:
+            return results
+
+        snapshot = self._get_snapshot()
+        start = time.perf_counter()
+        matches = snapshot.search(needle, types, limit)
+        for kind in types:
+            ranked = sorted(matches.get(kind, ()))[:limit]
+            results[kind] = [dict(snapshot.entries[entry_index][1]) for _, _, entry_index in ranked]
+        with self._lock:
+            self._stats['lookups'] += 1
+            self._stats['lookup_seconds'] += time.perf_counter() - start
+        return results
+
+    def invalidate(self):
+        """Scarta l'indice: verrà ricostruito alla prossima ricerca"""
+        with self._lock:
+            self._snapshot = None
+            self._generation += 1
+            self._stats['invalidations'] += 1
+
+    def get_stats(self):
+        """Dimensione dell'indice e tempi medi di ricerca e costruzione"""
+        with self._lock:
+            stats = dict(self._stats)
+            snapshot = self._snapshot
+        lookup_seconds = stats.pop('lookup_seconds')
+        build_seconds = stats.pop('build_seconds')
+        return dict(
+            stats,
+            entries=len(snapshot.entries) if snapshot is not None else 0,
+            keys=len(snapshot.keys) if snapshot is not None else 0,
+            loaded=snapshot is not None,
+            avg_lookup_us=round(lookup_seconds / stats['lookups'] * 1e6, 1) if stats['lookups'] else None,
+            avg_build_ms=round(build_seconds / stats['builds'] * 1e3, 2) if stats['builds'] else None,
+            ttl=self.ttl,
+        )
+
+    def _get_snapshot(self):
+        with self._lock:
+            expired = self.ttl and time.monotonic() - self._built_at > self.ttl
+            if self._snapshot is not None and not expired:
+                return self._snapshot
+            generation = self._generation
+
+        start = time.perf_counter()
+        snapshot = _Snapshot(list_users(), self._load_channels())
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self._stats['builds'] += 1
+            self._stats['build_seconds'] += elapsed
+            # Un'invalidazione durante la costruzione rende i dati letti già vecchi
+            if generation == self._generation:
+                self._snapshot = snapshot
+                self._built_at = time.monotonic()
+        return snapshot
+
+    def _load_channels(self):
+        """Canali con il numero di membri, in una sola query (come lo snapshot di initialData)"""
+        with get_db_session(self.session_factory) as db:
+            return load_channels(db)
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_autocomplete_index():
+    """Restituisce l'indice condiviso del processo, creandolo al primo utilizzo"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = AutocompleteIndex()
+    return _index
+
+def autocomplete(query, types=('users', 'channels'), limit=DEFAULT_LIMIT):
+    """Utenti e canali per la query dall'indice condiviso"""
+    return get_autocomplete_index().search(query, types, limit)
+
+def invalidate_autocomplete():
+    """Invalida l'indice dopo modifiche a utenti o canali fatte senza ORM"""
+    get_autocomplete_index().invalidate()
+
+def get_autocomplete_stats():
+    """Metriche dell'indice per la dashboard"""
+    return get_autocomplete_index().get_stats()
+
+invalidate_on_write((User, Channel, ChannelMember), invalidate_autocomplete)
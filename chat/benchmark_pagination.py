@@ -0,0 +1,126 @@
+"""
+Benchmark della paginazione della cronologia su un canale con 1M di messaggi.
+
+Crea uno schema temporaneo con una tabella messages minimale e confronta, a varie
+profondità della cronologia:
+- legacy: filtro id < before_id con ORDER BY created_at DESC e solo l'indice su
+  conversation_id (com'era in chat/routes.py)
+- keyset: confronto (created_at, id) < cursore in index-only scan sull'indice composito
+  covering, poi le righe della pagina per chiave primaria (come chat/pagination.py)
+
+Utilizzo:
+    python -m chat.benchmark_pagination --messages 1000000 --page-size 50
+"""
+import argparse
+import statistics
+import time
+
+from common.db.connection import get_raw_connection
+
+BENCH_SCHEMA = 'bench_pagination'
+
+LEGACY_QUERY = f"""
+    SELECT id, created_at, user_id, text FROM {BENCH_SCHEMA}.messages
+    WHERE conversation_id = 1 AND message_type <> 'memory' AND id < %(before_id)s
+    ORDER BY created_at DESC
+    LIMIT %(limit)s
+"""
+
+KEYSET_QUERY = f"""
+    WITH page AS (
+        SELECT id, created_at FROM {BENCH_SCHEMA}.messages
+        WHERE conversation_id = 1 AND message_type <> 'memory' AND user_id IS NOT NULL
+          AND (created_at, id) < (%(created_at)s, %(before_id)s)
+        ORDER BY created_at DESC, id DESC
+        LIMIT %(limit)s
+    )
+    SELECT m.id, m.created_at, m.user_id, m.text
+    FROM page JOIN {BENCH_SCHEMA}.messages m ON m.id = page.id
+    ORDER BY page.created_at DESC, page.id DESC
+"""
+
+def setup(cur, messages, other_messages):
+    """Crea lo schema di prova: 1 canale grande e altri messaggi su conversazioni diverse"""
+    cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+    cur.execute(f"""
+        CREATE TABLE {BENCH_SCHEMA}.messages (
+            id SERIAL PRIMARY KEY,
+            conversation_id INTEGER,
+            user_id INTEGER,
+            text TEXT,
+            message_type VARCHAR(50) DEFAULT 'normal',
+            created_at TIMESTAMP
+        )
+    """)
+    # Timestamp con collisioni (stesso secondo) per verificare il tie-break su id
+    cur.execute(f"""
+        INSERT INTO {BENCH_SCHEMA}.messages (conversation_id, user_id, text, message_type, created_at)
+        SELECT 1, 1 + (g % 7), 'messaggio ' || g,
+               CASE WHEN g % 1000 = 0 THEN 'memory' ELSE 'normal' END,
+               TIMESTAMP '2024-01-01' + (g / 3) * INTERVAL '1 second'
+        FROM generate_series(1, %s) AS g
+    """, (messages,))
+    cur.execute(f"""
+        INSERT INTO {BENCH_SCHEMA}.messages (conversation_id, user_id, text, created_at)
+        SELECT 2 + (g % 50), 1, 'altro ' || g, TIMESTAMP '2024-01-01' + g * INTERVAL '1 second'
+        FROM generate_series(1, %s) AS g
+    """, (other_messages,))
+    cur.execute(f"CREATE INDEX ON {BENCH_SCHEMA}.messages (conversation_id)")
+    cur.execute(f"CREATE INDEX ON {BENCH_SCHEMA}.messages (created_at)")
+    cur.execute(f"CREATE INDEX idx_bench_keyset ON {BENCH_SCHEMA}.messages "
+                f"(conversation_id, created_at, id) INCLUDE (message_type, user_id)")
+    cur.execute(f"VACUUM ANALYZE {BENCH_SCHEMA}.messages")
+
+def time_query(cur, sql, params, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cur.execute(sql, params)
+        cur.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def run(messages, other_messages, page_size, repeat, keep):
+    conn = get_raw_connection()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            print(f"Preparazione: {messages} messaggi nel canale, {other_messages} in altre conversazioni...")
+            start = time.perf_counter()
+            setup(cur, messages, other_messages)
+            print(f"Dati pronti in {time.perf_counter() - start:.1f}s\n")
+
+            print(f"{'profondità':>12} {'legacy (ms)':>12} {'keyset (ms)':>12}")
+            for depth in (0.0, 0.01, 0.25, 0.5, 0.99):
+                # Il cursore punta al messaggio che si trova a questa profondità dalla fine
+                position = max(1, int(messages * (1 - depth)))
+                cur.execute(f"SELECT id, created_at FROM {BENCH_SCHEMA}.messages "
+                            f"WHERE conversation_id = 1 AND id = %s", (position,))
+                before_id, created_at = cur.fetchone()
+                params = {'before_id': before_id, 'created_at': created_at, 'limit': page_size}
+                legacy_ms = time_query(cur, LEGACY_QUERY, params, repeat)
+                keyset_ms = time_query(cur, KEYSET_QUERY, params, repeat)
+                print(f"{depth:>11.0%} {legacy_ms:>12.2f} {keyset_ms:>12.2f}")
+
+            cur.execute(f"EXPLAIN {KEYSET_QUERY}", {'before_id': messages // 2, 'created_at': '2024-01-02',
+                                                     'limit': page_size})
+            print("\nPiano keyset:")
+            for (line,) in cur.fetchall():
+                print(f"  {line}")
+
+            if not keep:
+                cur.execute(f"DROP SCHEMA {BENCH_SCHEMA} CASCADE")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark paginazione legacy contro keyset")
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--other-messages', type=int, default=200_000)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--keep', action='store_true', help="Non elimina lo schema di prova")
+    args = parser.parse_args()
+
+    run(args.messages, args.other_messages, args.page_size, args.repeat, args.keep)
@@ -0,0 +1,104 @@
+"""
+Benchmark della serializzazione dei payload Socket.IO sui percorsi caldi.
+
+Misura il costo completo di un emit (preparazione del payload + codifica del
+pacchetto Socket.IO) per:
+- messageHistory: 50 messaggi idratati con risposte, allegati e metadata
+- newMessage: un singolo messaggio
+
+Varianti:
+- legacy: json.loads(json.dumps(..., cls=CustomJSONEncoder)) e Packet standard
+- single-pass: to_jsonable() e Packet standard
+- single-pass+packet: to_jsonable() e SocketIOPacket (percorso di newMessage)
+- diretto+packet: nessuna preparazione, i messaggi idratati sono già JSON, e
+  SocketIOPacket (percorso di messageHistory)
+
+Utilizzo:
+    python -m chat.benchmark_serialization --repeat 2000
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from socketio import packet
+
+from common.serialization import SocketIOPacket, get_backend_name, to_jsonable
+from common.utils import CustomJSONEncoder
+
+def make_message(message_id, created_at):
+    """Messaggio nel formato prodotto da chat/hydration.py"""
+    user = {
+        'id': 1 + message_id % 4,
+        'username': f"user{message_id % 4}",
+        'displayName': f"Utente {message_id % 4}",
+        'avatarUrl': 'https://ui-avatars.com/api/?name=Utente',
+        'status': 'online'
+    }
+    return {
+        'id': message_id,
+        'conversationId': 1,
+        'user': user,
+        'text': "Messaggio di prova con un testo di lunghezza realistica per una chat " * 2,
+        'timestamp': created_at.isoformat(),
+        'type': 'normal',
+        'fileData': {'name': 'report.pdf', 'path': '/uploads/documents/report.pdf', 'ext': 'pdf',
+                     'size': 12345} if message_id % 10 == 0 else None,
+        'replyTo': {
+            'id': message_id - 1,
+            'text': 'Messaggio citato',
+            'message_type': 'normal',
+            'fileData': None,
+            'user': user
+        } if message_id % 3 == 0 else None,
+        'forwardedFrom': None,
+        'message_metadata': {'db_query_intent': True} if message_id % 7 == 0 else {},
+        'edited': False,
+        'editedAt': None,
+        'isOwn': message_id % 4 == 0
+    }
+
+def legacy_prepare(data):
+    return json.loads(json.dumps(data, cls=CustomJSONEncoder))
+
+def time_emit(prepare, packet_class, event, payload, repeat):
+    """Tempo mediano (µs) di preparazione + codifica di un pacchetto EVENT"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = prepare(payload)
+        packet_class(packet.EVENT, data=[event, data], namespace='/').encode()
+        timings.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(timings)
+
+def run(history_size, repeat):
+    start = datetime(2024, 5, 1, 9, 0)
+    history = [make_message(i, start + timedelta(seconds=i)) for i in range(1, history_size + 1)]
+    new_message = dict(make_message(history_size + 1, start), tempId='temp-1')
+
+    variants = [
+        ('legacy', legacy_prepare, packet.Packet),
+        ('single-pass', to_jsonable, packet.Packet),
+        ('single-pass+packet', to_jsonable, SocketIOPacket),
+        ('diretto+packet', lambda data: data, SocketIOPacket),
+    ]
+
+    print(f"Backend JSON: {get_backend_name()}, ripetizioni: {repeat}\n")
+    print(f"{'variante':<22} {'messageHistory (µs)':>20} {'newMessage (µs)':>16}")
+    baseline = None
+    for name, prepare, packet_class in variants:
+        history_us = time_emit(prepare, packet_class, 'messageHistory', history, repeat)
+        message_us = time_emit(prepare, packet_class, 'newMessage', new_message, repeat)
+        if baseline is None:
+            baseline = (history_us, message_us)
+        print(f"{name:<22} {history_us:>12.1f} ({baseline[0] / history_us:>4.1f}x) "
+              f"{message_us:>9.1f} ({baseline[1] / message_us:>4.1f}x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark serializzazione dei payload Socket.IO")
+    parser.add_argument('--history-size', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    run(args.history_size, args.repeat)
@@ -0,0 +1,45 @@
+"""
+Invalidazione delle cache in memoria della chat alle scritture ORM.
+
+Rubrica utenti (chat/user_directory.py), indice di autocompletamento (chat/autocomplete.py)
+e snapshot di utenti e canali (chat/directory_snapshot.py) si registrano qui con i modelli
+che leggono. La cache viene invalidata subito agli eventi del mapper (al flush) e di nuovo
+al commit della sessione: una ricostruzione concorrente tra flush e commit legge ancora i
+dati precedenti e non deve restare in cache.
+
+Le scritture che non passano dall'ORM (UPDATE testuali o in blocco) devono chiamare
+l'invalidazione esplicita di ogni cache.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Chiave di session.info con le invalidazioni da ripetere al commit
+_PENDING_KEY = 'cache_invalidations'
+
+def invalidate_on_write(models, invalidate, on_write=None):
+    """
+    Registra una cache da invalidare alle scritture (insert, update, delete) dei modelli.
+
+    Args:
+        models (tuple): Modelli ORM letti dalla cache
+        invalidate (callable): Invalida l'intera cache; viene ripetuta al commit
+        on_write (callable, optional): Invalidazione al flush con l'oggetto scritto
+            (es. solo il suo id), al posto di invalidate()
+    """
+    def _on_write(mapper, connection, target):
+        if on_write is not None:
+            on_write(target)
+        else:
+            invalidate()
+        session = Session.object_session(target)
+        if session is not None:
+            session.info.setdefault(_PENDING_KEY, set()).add(invalidate)
+
+    for model in models:
+        for event_name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(model, event_name, _on_write)
+
+@event.listens_for(Session, 'after_commit')
+def _on_commit(session):
+    for invalidate in session.info.pop(_PENDING_KEY, ()):
+        invalidate()
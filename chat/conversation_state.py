@@ -0,0 +1,286 @@
+"""
+Contatori dei non letti e ultima attività per la lista delle conversazioni.
+
+/api/conversations contava i non letti con NOT IN su message_read_status per ogni
+messaggio e cercava l'ultima attività con una subquery correlata: il costo cresceva
+con tutta la cronologia. Ora due tabelle denormalizzate vengono lette per chiave:
+- conversation_state: ultimo messaggio (id, autore, data, anteprima) per conversazione
+- conversation_unread: watermark di lettura (last_read_message_id) e non letti per
+  (conversazione, utente)
+
+Le tabelle sono mantenute dai trigger su messages (migrazione 'conversation_state'
+in chat/migrations.py), quindi nella stessa transazione dell'inserimento o della
+cancellazione del messaggio, qualunque sia il percorso che scrive. Sono non letti i
+messaggi degli altri con id maggiore del watermark; i messaggi 'memory' non contano.
+La lettura sposta il watermark in avanti con una sola scrittura, qualunque sia il
+numero di messaggi letti (mark_conversation_read).
+
+Le righe dei non letti sono create dai trigger quando un utente diventa destinatario
+(partecipante, membro del canale, migrazione 'conversation_readers'): la lista delle
+conversazioni non scrive nulla. Per i dati esistenti c'è il backfill:
+    python -m chat.conversation_state backfill
+"""
+import argparse
+import logging
+
+from sqlalchemy import text
+
+from common.config import CHAT_SCHEMA
+from common.db.connection import get_raw_connection
+from chat.user_directory import get_user
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+# Ultimo messaggio visibile di ogni conversazione (alias m, richiede c.id)
+_LATEST_MESSAGE = """
+    LEFT JOIN LATERAL (
+        SELECT id, user_id, created_at, {schema}.message_preview(text, file_data) AS preview
+        FROM {schema}.messages
+        WHERE conversation_id = c.id AND coalesce(message_type, 'normal') <> 'memory'
+        ORDER BY created_at DESC, id DESC
+        LIMIT 1
+    ) m ON TRUE
+"""
+
+# Conversazioni visibili a :user_id: tutti i canali e i messaggi diretti di cui è partecipante
+_VISIBLE = """
+    (c.type = 'channel' OR (c.type = 'direct' AND EXISTS (
+        SELECT 1 FROM {schema}.conversation_participants p
+        WHERE p.conversation_id = c.id AND p.user_id = :user_id)))
+"""
+
+# Messaggi non letti di un utente (alias m), stessa definizione usata dai trigger
+_UNREAD_FILTER = """
+    m.user_id <> {user} AND coalesce(m.message_type, 'normal') <> 'memory'
+    AND m.id > coalesce({watermark}, 0)
+"""
+
+_SUMMARIES_SQL = """
+    SELECT c.id, c.name, c.type, s.last_message_id, s.last_message_user_id, s.last_message_at,
+           s.last_message_preview, coalesce(u.unread_count, 0) AS unread_count, u.last_read_message_id,
+           other.user_id AS other_user_id
+    FROM {schema}.conversations c
+    LEFT JOIN {schema}.conversation_state s ON s.conversation_id = c.id
+    LEFT JOIN {schema}.conversation_unread u ON u.conversation_id = c.id AND u.user_id = :user_id
+    LEFT JOIN LATERAL (
+        SELECT p.user_id FROM {schema}.conversation_participants p
+        WHERE p.conversation_id = c.id AND p.user_id <> :user_id
+        ORDER BY p.user_id
+        LIMIT 1
+    ) other ON c.type = 'direct'
+    WHERE """ + _VISIBLE + """
+    ORDER BY s.last_message_at DESC NULLS LAST, c.id
+"""
+
+# Il watermark è l'ultimo messaggio della conversazione con id <= :up_to (tutti se NULL)
+# e non torna mai indietro
+_MARK_READ_SQL = """
+    INSERT INTO {schema}.conversation_unread AS u (conversation_id, user_id, last_read_message_id)
+    SELECT :conversation_id, :user_id, max(id) FROM {schema}.messages
+    WHERE conversation_id = :conversation_id
+      AND (CAST(:up_to AS INTEGER) IS NULL OR id <= CAST(:up_to AS INTEGER))
+    ON CONFLICT (conversation_id, user_id) DO UPDATE SET
+        last_read_message_id = GREATEST(u.last_read_message_id, EXCLUDED.last_read_message_id)
+"""
+
+# Contatore ricalcolato sui soli messaggi successivi al watermark
+_RECOUNT_SQL = """
+    UPDATE {schema}.conversation_unread u
+    SET unread_count = (
+        SELECT count(*) FROM {schema}.messages m
+        WHERE m.conversation_id = u.conversation_id AND """ + _UNREAD_FILTER.format(
+            user='u.user_id', watermark='u.last_read_message_id') + """
+    )
+    WHERE u.conversation_id = :conversation_id AND u.user_id = :user_id
+    RETURNING u.last_read_message_id, u.unread_count
+"""
+
+_BACKFILL_STATE_SQL = """
+    INSERT INTO {schema}.conversation_state AS s
+        (conversation_id, last_message_id, last_message_user_id, last_message_at, last_message_preview)
+    SELECT c.id, m.id, m.user_id, m.created_at, m.preview
+    FROM {schema}.conversations c
+    """ + _LATEST_MESSAGE + """
+    ON CONFLICT (conversation_id) DO UPDATE SET
+        last_message_id = EXCLUDED.last_message_id,
+        last_message_user_id = EXCLUDED.last_message_user_id,
+        last_message_at = EXCLUDED.last_message_at,
+        last_message_preview = EXCLUDED.last_message_preview,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+# Destinatari: partecipanti dei messaggi diretti, membri dei canali (channels.name =
+# conversations.name) e utenti che hanno già un contatore
+_BACKFILL_UNREAD_SQL = """
+    WITH audience AS (
+        SELECT conversation_id, user_id FROM {schema}.conversation_participants
+        UNION
+        SELECT c.id, cm.user_id
+        FROM {schema}.conversations c
+        JOIN {schema}.channels ch ON ch.name = c.name
+        JOIN {schema}.channel_members cm ON cm.channel_id = ch.id
+        WHERE c.type = 'channel'
+        UNION
+        SELECT conversation_id, user_id FROM {schema}.conversation_unread
+    )
+    INSERT INTO {schema}.conversation_unread AS cu (conversation_id, user_id, unread_count)
+    SELECT a.conversation_id, a.user_id, (
+        SELECT count(*) FROM {schema}.messages m
+        WHERE m.conversation_id = a.conversation_id AND """ + _UNREAD_FILTER.format(
+            user='a.user_id', watermark='u.last_read_message_id') + """
+    )
+    FROM audience a
+    LEFT JOIN {schema}.conversation_unread u
+        ON u.conversation_id = a.conversation_id AND u.user_id = a.user_id
+    ON CONFLICT (conversation_id, user_id) DO UPDATE SET unread_count = EXCLUDED.unread_count
+"""
+
+# Esistenza della conversazione e appartenenza del messaggio del watermark
+_READ_TARGET_SQL = """
+    SELECT EXISTS (SELECT 1 FROM {schema}.conversations WHERE id = :conversation_id) AS conversation_exists,
+           CAST(:up_to AS INTEGER) IS NULL OR EXISTS (
+               SELECT 1 FROM {schema}.messages
+               WHERE id = CAST(:up_to AS INTEGER) AND conversation_id = :conversation_id
+           ) AS message_in_conversation
+"""
+
+class ConversationNotFound(LookupError):
+    """La conversazione da segnare come letta non esiste"""
+
+class InvalidReadTarget(ValueError):
+    """Il messaggio del watermark non appartiene alla conversazione"""
+
+def is_valid_watermark(value):
+    """upToMessageId accettato: assente o un intero (non un booleano, che in Python è un int)"""
+    return value is None or (isinstance(value, int) and not isinstance(value, bool))
+
+def _sql(template, schema):
+    return text(template.format(schema=schema))
+
+def get_conversation_summaries(db, user_id=1, schema=CHAT_SCHEMA):
+    """
+    Lista delle conversazioni dell'utente con non letti e ultima attività (sola lettura).
+
+    Args:
+        db: Sessione o connessione SQLAlchemy
+        user_id (int): ID dell'utente
+        schema (str): Schema della chat
+
+    Returns:
+        list: Conversazioni nel formato di /api/conversations, dalla più recente
+    """
+    rows = db.execute(_sql(_SUMMARIES_SQL, schema), {'user_id': user_id}).mappings().all()
+
+    conversations = []
+    for row in rows:
+        conversation = {
+            "id": row['id'],
+            "name": row['name'],
+            "type": row['type'],
+            "userId": None,
+            "displayName": row['name'],
+            "avatarUrl": None,
+            "status": None,
+            "unreadCount": row['unread_count'],
+            "lastActivity": row['last_message_at'].isoformat() if row['last_message_at'] else None,
+            "lastMessageId": row['last_message_id'],
+            "lastMessageUserId": row['last_message_user_id'],
+            "lastMessagePreview": row['last_message_preview'],
+            "lastReadMessageId": row['last_read_message_id']
+        }
+        if row['type'] == 'direct':
+            other = get_user(row['other_user_id']) if row['other_user_id'] is not None else None
+            if other is None:
+                # Come la vecchia query (join sull'altro partecipante): DM senza interlocutore esclusi
+                continue
+            conversation.update({
+                "userId": other['id'],
+                "displayName": other['displayName'],
+                "avatarUrl": other['avatarUrl'],
+                "status": other['status']
+            })
+        conversations.append(conversation)
+    return conversations
+
+def mark_conversation_read(db, conversation_id, user_id=1, up_to_message_id=None, schema=CHAT_SCHEMA):
+    """
+    Segna come letta la conversazione fino a un messaggio (o fino all'ultimo).
+
+    Una sola riga aggiornata qualunque sia il numero di messaggi letti. Eseguito in un
+    savepoint: un errore (es. migrazione non applicata) non annulla la transazione del
+    chiamante. Conversazione e messaggio vengono verificati prima della scrittura.
+
+    Args:
+        db: Sessione SQLAlchemy
+        conversation_id (int): ID della conversazione
+        user_id (int): ID dell'utente che legge
+        up_to_message_id (int, optional): Ultimo messaggio letto; None = tutta la conversazione
+        schema (str): Schema della chat
+
+    Returns:
+        dict or None: conversationId, lastReadMessageId e unreadCount dopo l'aggiornamento,
+        None in caso di errore
+
+    Raises:
+        ConversationNotFound: se la conversazione non esiste
+        InvalidReadTarget: se up_to_message_id non è un messaggio della conversazione
+    """
+    params = {'conversation_id': conversation_id, 'user_id': user_id, 'up_to': up_to_message_id}
+    target = db.execute(_sql(_READ_TARGET_SQL, schema), params).one()
+    if not target.conversation_exists:
+        raise ConversationNotFound(f"Conversation {conversation_id} not found")
+    if not target.message_in_conversation:
+        raise InvalidReadTarget(f"Message {up_to_message_id} is not in conversation {conversation_id}")
+    try:
+        with db.begin_nested():
+            db.execute(_sql(_MARK_READ_SQL, schema), params)
+            row = db.execute(_sql(_RECOUNT_SQL, schema), params).one()
+        return {
+            'conversationId': conversation_id,
+            'lastReadMessageId': row.last_read_message_id,
+            'unreadCount': row.unread_count
+        }
+    except Exception as e:
+        logger.warning(f"Impossibile aggiornare i non letti della conversazione {conversation_id}: {str(e)}")
+        return None
+
+def backfill(schema=CHAT_SCHEMA):
+    """
+    Ricalcola stato e contatori di tutte le conversazioni dai messaggi esistenti.
+
+    Blocca le scritture su messages per la durata del ricalcolo (LOCK IN SHARE MODE),
+    così nessun trigger aggiorna i contatori mentre vengono riscritti.
+
+    Args:
+        schema (str): Schema della chat
+
+    Returns:
+        dict: Righe scritte per tabella
+    """
+    conn = get_raw_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"LOCK TABLE {schema}.messages IN SHARE MODE")
+            cur.execute(_BACKFILL_STATE_SQL.format(schema=schema))
+            state_rows = cur.rowcount
+            cur.execute(_BACKFILL_UNREAD_SQL.format(schema=schema))
+            unread_rows = cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    logger.info(f"Backfill conversazioni: {state_rows} stati, {unread_rows} contatori")
+    return {'conversation_state': state_rows, 'conversation_unread': unread_rows}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stato denormalizzato della lista conversazioni")
+    parser.add_argument('command', choices=['backfill'])
+    parser.add_argument('--schema', default=CHAT_SCHEMA)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    result = backfill(args.schema)
+    print(f"Stati aggiornati: {result['conversation_state']}, contatori aggiornati: {result['conversation_unread']}")
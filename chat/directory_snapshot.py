@@ -0,0 +1,225 @@
+"""
+Snapshot versionato di utenti e canali per initialData.
+
+handle_connect leggeva a ogni connessione (e riconnessione) tutti gli utenti e i
+canali con il numero di membri (join e GROUP BY), e inviava le liste complete. Dopo un
+deploy tutti i client si riconnettono insieme e ripetono lo stesso lavoro.
+
+Qui lo snapshot {users, channels} è tenuto in memoria e ricostruito solo quando
+cambiano User, Channel o ChannelMember (eventi ORM al flush e al commit, più
+DIRECTORY_SNAPSHOT_TTL per le modifiche di altri processi). La versione è l'hash del
+contenuto: è la stessa su tutti i worker e non cambia se la ricostruzione produce
+gli stessi dati. Il client invia l'ultima versione ricevuta e riceve:
+- 'unchanged' se è quella attuale
+- 'delta' (upsert e removed per utenti e canali) se la sua versione è tra le ultime
+  DIRECTORY_SNAPSHOT_HISTORY conservate; il delta verso la versione attuale è
+  calcolato una volta e riusato da tutti i client con la stessa versione
+- 'full' altrimenti
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import func
+
+from common.config import DIRECTORY_SNAPSHOT_TTL, DIRECTORY_SNAPSHOT_HISTORY
+from common.serialization import dumps
+from chat.cache_invalidation import invalidate_on_write
+from chat.database import SessionLocal
+from chat.models import User, Channel, ChannelMember
+from chat.user_directory import list_users
+from common.db.connection import get_db_session
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+def load_channels(db):
+    """Canali con il numero di membri ordinati per nome, nel formato del frontend"""
+    rows = (
+        db.query(Channel, func.count(ChannelMember.user_id).label('member_count'))
+        .outerjoin(ChannelMember, Channel.id == ChannelMember.channel_id)
+        .group_by(Channel.id)
+        .order_by(Channel.name)
+        .all()
+    )
+    return [{
+        "id": channel.id,
+        "name": channel.name,
+        "description": channel.description,
+        "isPrivate": channel.is_private,
+        "memberCount": member_count
+    } for channel, member_count in rows]
+
+def list_channels():
+    """Canali con il numero di membri, letti dal database"""
+    with get_db_session(SessionLocal) as db:
+        return load_channels(db)
+
+def _diff(old, new):
+    """Differenza tra due mappe id -> dizionario: {'upsert': [...], 'removed': [...]}"""
+    return {
+        'upsert': [item for item_id, item in new.items() if old.get(item_id) != item],
+        'removed': [item_id for item_id in old if item_id not in new],
+    }
+
+class _Version:
+    """Contenuto di una versione dello snapshot"""
+
+    __slots__ = ('version', 'users', 'channels', 'users_by_id', 'channels_by_id')
+
+    def __init__(self, users, channels):
+        self.users = users
+        self.channels = channels
+        self.users_by_id = {user['id']: user for user in users}
+        self.channels_by_id = {channel['id']: channel for channel in channels}
+        payload = dumps({'users': users, 'channels': channels})
+        self.version = hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+class DirectorySnapshot:
+    """
+    Snapshot di utenti e canali ricostruito solo alle modifiche.
+
+    Args:
+        load_users (callable): Restituisce la lista degli utenti
+        load_channels (callable): Restituisce la lista dei canali con memberCount
+        ttl (float): Secondi dopo i quali lo snapshot viene ricostruito (0 = mai)
+        history (int): Versioni precedenti conservate per calcolare i delta
+    """
+
+    def __init__(self, load_users=list_users, load_channels=list_channels,
+                 ttl=DIRECTORY_SNAPSHOT_TTL, history=DIRECTORY_SNAPSHOT_HISTORY):
+        self.load_users = load_users
+        self.load_channels = load_channels
+        self.ttl = ttl
+        self.history = history
+        self._current = None
+        self._versions = OrderedDict()  # versione -> _Version, dalla più vecchia
+        self._deltas = {}  # versione del client -> delta verso la versione attuale
+        self._built_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {'builds': 0, 'invalidations': 0, 'full': 0, 'delta': 0, 'unchanged': 0}
+
+    def current(self):
+        """
+        Versione attuale e liste complete.
+
+        Returns:
+            tuple: (versione, utenti, canali)
+        """
+        snapshot = self._get_current()
+        return snapshot.version, snapshot.users, snapshot.channels
+
+    def sync(self, client_version=None):
+        """
+        Cosa inviare a un client che ha già la versione client_version.
+
+        Args:
+            client_version (str, optional): Ultima versione ricevuta dal client
+
+        Returns:
+            dict: {'directoryVersion', 'mode': 'unchanged' | 'delta' | 'full'} più
+                  'delta' ({'users': {upsert, removed}, 'channels': {...}}) oppure
+                  'users' e 'channels' completi
+        """
+        snapshot = self._get_current()
+        result = {'directoryVersion': snapshot.version}
+        if client_version == snapshot.version:
+            self._count('unchanged')
+            return dict(result, mode='unchanged')
+
+        delta = self._delta_from(client_version, snapshot) if client_version else None
+        if delta is not None:
+            self._count('delta')
+            return dict(result, mode='delta', delta=delta)
+
+        self._count('full')
+        return dict(result, mode='full', users=snapshot.users, channels=snapshot.channels)
+
+    def invalidate(self):
+        """Scarta lo snapshot attuale: verrà ricostruito alla prossima richiesta"""
+        with self._lock:
+            self._current = None
+            self._generation += 1
+            self._stats['invalidations'] += 1
+
+    def get_stats(self):
+        """Versione attuale, versioni conservate e risposte per tipo"""
+        with self._lock:
+            return dict(
+                self._stats,
+                version=self._current.version if self._current is not None else None,
+                versions_kept=len(self._versions),
+                users=len(self._current.users) if self._current is not None else 0,
+                channels=len(self._current.channels) if self._current is not None else 0,
+                ttl=self.ttl,
+            )
+
+    def _get_current(self):
+        with self._lock:
+            expired = self.ttl and time.monotonic() - self._built_at > self.ttl
+            if self._current is not None and not expired:
+                return self._current
+            generation = self._generation
+
+        snapshot = _Version(self.load_users(), self.load_channels())
+
+        with self._lock:
+            self._stats['builds'] += 1
+            # Un'invalidazione durante la costruzione rende i dati letti già vecchi
+            if generation != self._generation:
+                return snapshot
+            self._built_at = time.monotonic()
+            if self._current is not None and self._current.version == snapshot.version:
+                return self._current
+            self._current = snapshot
+            self._versions.pop(snapshot.version, None)
+            self._versions[snapshot.version] = snapshot
+            while len(self._versions) > self.history:
+                self._versions.popitem(last=False)
+            self._deltas = {}
+        return snapshot
+
+    def _delta_from(self, client_version, snapshot):
+        with self._lock:
+            if self._current is snapshot and client_version in self._deltas:
+                return self._deltas[client_version]
+            old = self._versions.get(client_version)
+        if old is None:
+            return None
+        delta = {
+            'users': _diff(old.users_by_id, snapshot.users_by_id),
+            'channels': _diff(old.channels_by_id, snapshot.channels_by_id),
+        }
+        with self._lock:
+            if self._current is snapshot:
+                self._deltas[client_version] = delta
+        return delta
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+def get_directory_snapshot():
+    """Restituisce lo snapshot condiviso del processo, creandolo al primo utilizzo"""
+    global _snapshot
+    if _snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _snapshot = DirectorySnapshot()
+    return _snapshot
+
+def invalidate_directory_snapshot():
+    """Invalida lo snapshot dopo modifiche a utenti o canali fatte senza ORM"""
+    get_directory_snapshot().invalidate()
+
+def get_directory_snapshot_stats():
+    """Metriche dello snapshot per la dashboard"""
+    return get_directory_snapshot().get_stats()
+
+invalidate_on_write((User, Channel, ChannelMember), invalidate_directory_snapshot)
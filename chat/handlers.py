@@ -1,24 +1,39 @@
 # Update imports
 from datetime import datetime
+from flask import request
 from flask_socketio import emit, join_room, leave_room
 import time
 import json
 import requests
 import re
 import traceback
-from sentence_transformers import SentenceTransformer
-from common.config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
-import psycopg2
-import psycopg2.extras
 
-from chat.models import User, Conversation, Message, ConversationParticipant, Channel, ChannelMember, MessageReadStatus
+from chat.models import User, Conversation, Message, ConversationParticipant, Channel, ChannelMember
 from chat.database import SessionLocal
-from common.config import OPENROUTER_API_KEY, OPENROUTER_API_URL
-from chat.routes import safe_json, CustomJSONEncoder 
+from common.config import (OPENROUTER_API_KEY, OPENROUTER_API_URL, RAG_HYBRID, RAG_SPECULATIVE, SYNC_MAX_CHANGES,
+                           CHAT_AUTO_MIGRATE)
+from common.serialization import to_jsonable
+from chat.pagination import get_message_page, page_info
+from chat.hydration import hydrate_messages
+from chat.message_cache import get_message_cache, cache_new_message
+from chat.user_directory import get_user, list_users, invalidate_users
+from chat.conversation_state import ConversationNotFound, InvalidReadTarget, is_valid_watermark, mark_conversation_read
+from chat.autocomplete import autocomplete, parse_types
+from chat.live_search import LiveSearch
+from chat.subscriptions import get_subscriptions
+from chat.protocol import emit_message, get_protocol_registry
+from chat.sync import get_changes_since, get_conversation_seq
+from chat.migrations import run_pending_migrations
+from chat.directory_snapshot import get_directory_snapshot
+from chat.presence import init_presence
 from agent.chat_agents_middleware import process_message_through_agents, should_generate_assistant_response, get_assistant_response
 
 from contextlib import contextmanager
 from common.db.connection import get_db_session
+from common.embeddings import get_embedding_service
+from common.rag.retrieval import search_articles
+from common.rag.hybrid import hybrid_search
+from common.rag.speculative import start_speculative_retrieval
 
 @contextmanager
 def get_db():
@@ -54,7 +69,7 @@ def check_calendar_intent(message_text, user_id, conversation_id, room, original
         if response:
             with get_db() as db:
                 # Ottieni dati utente AI dal database (useremo John Doe come mittente)
-                ai_user = db.query(User).filter(User.id == 2).first()
+                ai_user = get_user(2)
                 
                 # Crea messaggio di risposta con reply_to_id
                 ai_message = Message(
@@ -67,6 +82,7 @@ def check_calendar_intent(message_text, user_id, conversation_id, room, original
                 db.add(ai_message)
                 db.commit()
                 db.refresh(ai_message)
+                cache_new_message(db, ai_message)
                 
                 ai_message_id = ai_message.id
                 ai_created_at = ai_message.created_at
@@ -76,33 +92,21 @@ def check_calendar_intent(message_text, user_id, conversation_id, room, original
                 if original_message_id:
                     original_message = db.query(Message).get(original_message_id)
                     if original_message:
-                        original_user = db.query(User).get(original_message.user_id)
+                        original_user = get_user(original_message.user_id)
                         if original_user:
                             reply_to = {
                                 'id': original_message.id,
                                 'text': original_message.text,
                                 'message_type': original_message.message_type,
                                 'fileData': original_message.file_data,
-                                'user': {
-                                    'id': original_user.id,
-                                    'username': original_user.username,
-                                    'displayName': original_user.display_name,
-                                    'avatarUrl': original_user.avatar_url,
-                                    'status': original_user.status
-                                }
+                                'user': original_user
                             }
                 
                 # Invia la risposta dell'agente
                 ai_message_dict = {
                     'id': ai_message_id,
                     'conversationId': conversation_id,
-                    'user': {
-                        'id': ai_user.id,
-                        'username': ai_user.username,
-                        'displayName': ai_user.display_name,
-                        'avatarUrl': ai_user.avatar_url,
-                        'status': ai_user.status
-                    },
+                    'user': ai_user,
                     'text': response,
                     'timestamp': ai_created_at.isoformat(),
                     'type': 'normal',
@@ -115,7 +119,7 @@ def check_calendar_intent(message_text, user_id, conversation_id, room, original
                     'isOwn': False
                 }
                 
-                emit('newMessage', prepare_for_socketio(ai_message_dict), room=room)
+                emit_message('newMessage', ai_message_dict, room)
                 
                 # Emetti un evento Socket.IO per notificare il frontend del calendario
                 if agent_result.get('action') in ['create', 'update', 'delete', 'view']:
@@ -142,11 +146,49 @@ def check_calendar_intent(message_text, user_id, conversation_id, room, original
 
 def prepare_for_socketio(data):
     """Prepara i dati per essere inviati tramite Socket.IO"""
-    # Serializza e deserializza per garantire che tutti gli oggetti siano JSON-compatibili
-    return json.loads(safe_json(data))
+    # Converte datetime/UUID in una sola passata, senza il giro dumps/loads
+    return to_jsonable(data)
+
+def load_recent_history(db, conversation_id, limit=50):
+    """
+    Ultimi messaggi di una conversazione per i join, serviti dal ring buffer quando possibile.
+
+    Args:
+        db (Session): Sessione del database
+        conversation_id (int): ID della conversazione
+        limit (int): Numero di messaggi
+
+    Returns:
+        tuple: (messaggi idratati in ordine cronologico, cursori come page_info)
+    """
+    cache = get_message_cache()
+    generation = None
+    if cache is not None:
+        cached = cache.get_page(conversation_id, limit)
+        if cached is not None:
+            return cached
+        # Prima della query: una scrittura durante la lettura impedisce il salvataggio
+        generation = cache.begin_load(conversation_id)
+
+    page = get_message_page(db, conversation_id, limit=limit)
+    # Utenti, risposte e inoltri risolti in blocco (chat/hydration.py)
+    message_list = hydrate_messages(db, page['rows'])
+    if cache is not None:
+        cache.store(conversation_id, message_list, page['has_more_before'], generation=generation)
+    return message_list, page_info(page)
+
+def parse_since_seq(data):
+    """sinceSeq di un join dopo una riconnessione (None se assente o non valido)"""
+    if not isinstance(data, dict) or data.get('sinceSeq') is None:
+        return None
+    try:
+        return max(int(data['sinceSeq']), 0)
+    except (TypeError, ValueError):
+        return None
 
 def ensure_users_exist():
     """Ensure that basic users exist in the database with proper data"""
+    # users.status è lo stato di presenza aggregato (chat/presence.py): qui non viene scritto
     with get_db() as db:
         # Check if AI user exists
         ai_user = db.query(User).filter(User.id == 2).first()
@@ -155,8 +197,7 @@ def ensure_users_exist():
                 id=2,
                 username='john_doe',
                 display_name='John Doe',
-                avatar_url='https://ui-avatars.com/api/?name=John+Doe&background=0D8ABC&color=fff',
-                status='online'
+                avatar_url='https://ui-avatars.com/api/?name=John+Doe&background=0D8ABC&color=fff'
             )
             db.add(ai_user)
             db.commit()
@@ -166,7 +207,6 @@ def ensure_users_exist():
             ai_user.username = 'john_doe'
             ai_user.display_name = 'John Doe'
             ai_user.avatar_url = 'https://ui-avatars.com/api/?name=John+Doe&background=0D8ABC&color=fff'
-            ai_user.status = 'online'
             db.commit()
             print("Updated AI user")
 
@@ -177,8 +217,7 @@ def ensure_users_exist():
                 id=3,
                 username='dbagent',
                 display_name='Database Agent',
-                avatar_url='https://ui-avatars.com/api/?name=DB+Agent&background=4A235A&color=fff',
-                status='online'
+                avatar_url='https://ui-avatars.com/api/?name=DB+Agent&background=4A235A&color=fff'
             )
             db.add(db_agent_user)
             db.commit()
@@ -188,7 +227,6 @@ def ensure_users_exist():
             db_agent_user.username = 'dbagent'
             db_agent_user.display_name = 'Database Agent'
             db_agent_user.avatar_url = 'https://ui-avatars.com/api/?name=DB+Agent&background=4A235A&color=fff'
-            db_agent_user.status = 'online'
             db.commit()
             print("Updated Database Agent user")
 
@@ -199,8 +237,7 @@ def ensure_users_exist():
                 id=1,
                 username='owner',
                 display_name='Owner',
-                avatar_url='https://ui-avatars.com/api/?name=Owner&background=27AE60&color=fff',
-                status='online'
+                avatar_url='https://ui-avatars.com/api/?name=Owner&background=27AE60&color=fff'
             )
             db.add(current_user)
             db.commit()
@@ -210,10 +247,12 @@ def ensure_users_exist():
             current_user.username = 'owner'
             current_user.display_name = 'Owner'
             current_user.avatar_url = 'https://ui-avatars.com/api/?name=Owner&background=27AE60&color=fff'
-            current_user.status = 'online'
             db.commit()
             print("Updated current user")
 
+    # Gli eventi del mapper invalidano già la rubrica; qui per chiarezza all'avvio
+    invalidate_users()
+
 def get_llm_response(message_text):
     """Get a response from the LLM API"""
     try:
@@ -253,80 +292,92 @@ def get_llm_response(message_text):
 
 # Helper functions
 def get_users_data():
-    """Get all users from database in format needed by frontend"""
-    with get_db() as db:
-        users = db.query(User).order_by(User.display_name).all()
-        
-        # Convert to dictionary format expected by frontend
-        user_list = []
-        for user in users:
-            user_list.append({
-                "id": user.id,
-                "username": user.username,
-                "displayName": user.display_name,
-                "avatarUrl": user.avatar_url,
-                "status": user.status
-            })
-        
-        return user_list
+    """Get all users in format needed by frontend (dalla rubrica in memoria)"""
+    return list_users()
 
 def get_channels_data():
-    """Get all channels from database in format needed by frontend"""
-    with get_db() as db:
-        try:
-            # SQLAlchemy query with join and group by
-            from sqlalchemy import func
-            
-            channels_with_counts = (
-                db.query(Channel, func.count(ChannelMember.user_id).label('member_count'))
-                .outerjoin(ChannelMember, Channel.id == ChannelMember.channel_id)
-                .group_by(Channel.id)
-                .order_by(Channel.name)
-                .all()
-            )
-            
-            # Convert to dictionary format expected by frontend
-            channel_list = []
-            for channel, member_count in channels_with_counts:
-                channel_list.append({
-                    "id": channel.id,
-                    "name": channel.name,
-                    "description": channel.description,
-                    "isPrivate": channel.is_private,
-                    "memberCount": member_count
-                })
-            
-            return channel_list
-        except Exception as e:
-            print(f"Error getting channels: {str(e)}")
-            return []
+    """Get all channels in format needed by frontend (dallo snapshot in memoria)"""
+    try:
+        return get_directory_snapshot().current()[2]
+    except Exception as e:
+        print(f"Error getting channels: {str(e)}")
+        return []
 
 
 def register_handlers(socketio):
     """
     Register all Socket.IO event handlers.
     """
+    # Migrazioni mancanti prima di ogni altra query: i modelli assumono lo schema completo.
+    # Un errore ferma l'avvio invece di servire richieste su uno schema parziale
+    if CHAT_AUTO_MIGRATE:
+        try:
+            applied = run_pending_migrations()
+        except Exception as e:
+            print(f"Error applying chat migrations (eseguire python -m chat.migrations --pending): {str(e)}")
+            raise
+        if applied:
+            print(f"Migrazioni chat applicate all'avvio: {', '.join(applied)}")
     # Ensure users exist before registering handlers
     ensure_users_exist()
     # per assicurarti che le conversazioni dei canali esistano
     ensure_channel_conversations_exist()
+    # Ricerca mentre si digita: debounce e annullamento per connessione
+    live_search = LiveSearch(socketio.emit, socketio.start_background_task, sleep=socketio.sleep)
+    # Room per connessione: solo la conversazione aperta più quelle fissate dal client
+    subscriptions = get_subscriptions()
+    # Versione del protocollo dei messaggi per connessione (chat/protocol.py)
+    protocol = get_protocol_registry()
+    # Utenti e canali di initialData, con delta per i client che hanno già una versione
+    directory = get_directory_snapshot()
+    # Connessioni per utente con heartbeat; le differenze di stato partono a tick fissi
+    presence = init_presence(socketio)
+
+    def on_event(name):
+        """Come socketio.on, ma ogni evento ricevuto dal client vale anche come heartbeat di presenza"""
+        def decorator(handler):
+            return socketio.on(name)(presence.on_traffic(handler))
+        return decorator
+
+    def directory_payload(client_version=None):
+        """
+        Utenti e canali per un client che ha già la versione client_version.
+
+        Returns:
+            dict: directoryVersion e 'unchanged': True, 'delta' oppure 'users' e 'channels'
+        """
+        try:
+            result = directory.sync(client_version)
+        except Exception as e:
+            print(f"Error getting directory snapshot: {str(e)}")
+            return {'users': get_users_data(), 'channels': []}
+        if result.pop('mode') == 'unchanged':
+            result['unchanged'] = True
+        # Dopo la risposta il client ha gli utenti della versione attuale
+        protocol.remember_users(request.sid, result.get('users') or directory.current()[1])
+        return result
 
     # In handle_connect
     @socketio.on('connect')
-    def handle_connect():
+    def handle_connect(auth=None):
         print('Client connected')
+        if isinstance(auth, dict) and auth.get('protocol'):
+            emit('protocol', {'version': protocol.negotiate(request.sid, auth['protocol'])})
+        # Con auth.directoryVersion initialData contiene solo 'unchanged' o il delta;
+        # gli utenti inviati non vengono ripetuti nei messaggi del protocollo compatto
+        client_version = auth.get('directoryVersion') if isinstance(auth, dict) else None
         # Send initial data with app configuration
-        emit('initialData', prepare_for_socketio({
-            'users': get_users_data(),
-            'channels': get_channels_data(),
-            'currentUser': {
-                'id': 1,
-                'username': 'owner',
-                'displayName': 'Owner',
-                'avatarUrl': 'https://ui-avatars.com/api/?name=Owner&background=27AE60&color=fff',
-                'status': 'online'
-            }
-        }))
+        emit('initialData', prepare_for_socketio(dict(directory_payload(client_version), currentUser={
+            'id': 1,
+            'username': 'owner',
+            'displayName': 'Owner',
+            'avatarUrl': 'https://ui-avatars.com/api/?name=Owner&background=27AE60&color=fff',
+            'status': 'online'
+        })))
+
+        # L'utente corrente è sempre l'id 1; gli stati attuali arrivano subito, i cambiamenti a ogni tick
+        presence.connect(request.sid, 1)
+        emit('presence', {'changes': presence.statuses()})
 
         # Send app configuration
         emit('appConfig', {
@@ -340,8 +391,52 @@ def register_handlers(socketio):
     # Modificato per accettare l'argomento reason
     def handle_disconnect(reason=None):
         print(f'Client disconnected: {reason}')
-
-    @socketio.on('joinChannel')
+        live_search.forget(request.sid)
+        subscriptions.forget(request.sid)
+        protocol.forget(request.sid)
+        presence.disconnect(request.sid)
+
+    def sync_payload(db, conversation_id, since_seq, limit=SYNC_MAX_CHANGES):
+        """Modifiche successive a since_seq per la connessione (compatte con il protocollo v2)"""
+        changes = get_changes_since(db, conversation_id, since_seq, limit=limit)
+        messages = protocol.history_payload(request.sid, changes['messages'])
+        if isinstance(messages, dict):
+            changes.update(messages)
+        return changes
+
+    @on_event('hello')
+    def handle_hello(data):
+        """Negozia la versione del protocollo dei messaggi ({protocol: 2} = compatto)"""
+        requested = data.get('protocol') if isinstance(data, dict) else data
+        emit('protocol', {'version': protocol.negotiate(request.sid, requested)})
+
+    @socketio.on('heartbeat')
+    def handle_heartbeat(data=None):
+        """
+        Tiene viva la presenza della connessione, registrandola di nuovo se era scaduta.
+
+        Returns:
+            dict: Ack per il client, registered=False se la connessione era scaduta
+        """
+        registered = presence.heartbeat(request.sid)
+        if not registered:
+            presence.connect(request.sid, 1)
+        return {'registered': registered}
+
+    @on_event('setStatus')
+    def handle_set_status(data):
+        """Stato scelto dall'utente ({status: 'online' | 'away' | 'busy'}), inviato al prossimo tick"""
+        status = data.get('status') if isinstance(data, dict) else data
+        if presence.set_status(request.sid, status) is None:
+            print(f"Error: Invalid status: {status}")
+
+    @on_event('syncDirectory')
+    def handle_sync_directory(data=None):
+        """Utenti e canali cambiati dalla versione del client ({version}), risposta 'directorySync'"""
+        client_version = data.get('version') if isinstance(data, dict) else data
+        emit('directorySync', prepare_for_socketio(directory_payload(client_version)))
+
+    @on_event('joinChannel')
     def handle_join_channel(data):
         """Handle client joining a channel"""
         # Gestisci sia stringhe che dizionari
@@ -358,9 +453,9 @@ def register_handlers(socketio):
 
         print(f"Client joining channel: {channel_name}")
 
-        # Join the room for this channel
+        # Join the room for this channel (ed esci da quella aperta prima, se non fissata)
         room = f"channel:{channel_name}"
-        join_room(room)
+        subscriptions.activate(request.sid, room)
 
         # Notify other users that someone joined
         emit('userJoined', {
@@ -377,106 +472,37 @@ def register_handlers(socketio):
             )
 
             if not conversation:
-                emit('messageHistory', [])
+                emit('messageHistory', protocol.history_payload(request.sid, []))
                 return
 
             conversation_id = conversation.id
 
-            # Get messages
-            messages = (
-                db.query(Message, User)
-                .join(User, Message.user_id == User.id)
-                .filter(
-                    Message.conversation_id == conversation_id,
-                    Message.message_type != 'memory'  # Escludi i messaggi di tipo memory
-                )
-                .order_by(Message.created_at.desc())
-                .limit(50)
-                .all()
-            )
-            
-            # Collect reply_to_ids
-            reply_ids = [msg.reply_to_id for msg, _ in messages if msg.reply_to_id is not None]
-            reply_messages = {}
-            
-            if reply_ids:
-                # Fetch reply messages
-                reply_msg_users = (
-                    db.query(Message, User)
-                    .join(User, Message.user_id == User.id)
-                    .filter(Message.id.in_(reply_ids))
-                    .all()
-                )
-                
-                # Process reply messages
-                for reply, user in reply_msg_users:
-                    # Parse file_data for reply
-                    reply_file_data = None
-                    if reply.file_data:
-                        reply_file_data = reply.file_data
-                    
-                    # Build reply message object
-                    reply_messages[reply.id] = {
-                        'id': reply.id,
-                        'text': reply.text,
-                        'message_type': reply.message_type,
-                        'fileData': reply_file_data,
-                        'user': {
-                            'id': user.id,
-                            'username': user.username,
-                            'displayName': user.display_name,
-                            'avatarUrl': user.avatar_url,
-                            'status': user.status
-                        }
-                    }
-
-            # Convert to dictionary format
-            message_list = []
-            for msg, user in messages:
-                # Handle file_data
-                file_data = msg.file_data
-                
-                # Get reply_to from cached results
-                reply_to = None
-                if msg.reply_to_id and msg.reply_to_id in reply_messages:
-                    reply_to = reply_messages[msg.reply_to_id]
-
-                message_list.append({
-                    'id': msg.id,
-                    'conversationId': msg.conversation_id,
-                    'user': {
-                        'id': user.id,
-                        'username': user.username,
-                        'displayName': user.display_name,
-                        'avatarUrl': user.avatar_url,
-                        'status': user.status
-                    },
-                    'text': msg.text,
-                    'timestamp': msg.created_at.isoformat(),
-                    'type': msg.message_type,
-                    'fileData': file_data,
-                    'replyTo': reply_to,
-                    'forwardedFrom': None,
-                    'message_metadata': msg.message_metadata or {},
-                    'edited': msg.edited,
-                    'editedAt': msg.edited_at.isoformat() if msg.edited_at else None,
-                    'isOwn': msg.user_id == 1  # Assume current user is ID 1
-                })
+            # Riconnessione (sinceSeq): solo le modifiche perse, se le tombstone ci sono ancora
+            since_seq = parse_since_seq(data)
+            if since_seq is not None:
+                changes = sync_payload(db, conversation_id, since_seq)
+                if not changes['reset']:
+                    emit('syncChanges', changes)
+                    return
 
-            # Reverse to show oldest messages first
-            message_list.reverse()
+            # Sequenza letta prima della cronologia: le modifiche successive arrivano con syncSince
+            last_seq = get_conversation_seq(db, conversation_id)
+            # Get messages: dal ring buffer in memoria o prima pagina keyset, in ordine cronologico
+            message_list, cursor_info = load_recent_history(db, conversation_id)
+            # Aprire la conversazione la segna come letta: azzera i non letti della lista
+            mark_conversation_read(db, conversation_id, user_id=1)
 
             try:
-                # Prima serializza in JSON, poi deserializza per garantire che sia valido
-                serialized_data = json.dumps(message_list, cls=CustomJSONEncoder)
-                deserialized_data = json.loads(serialized_data)
-                # Send channel history
-                emit('messageHistory', deserialized_data)
+                # I messaggi idratati contengono solo tipi JSON: nessuna conversione prima dell'emit
+                emit('messageHistory', protocol.history_payload(request.sid, message_list))
+                # Cursore per caricare i messaggi precedenti
+                emit('historyCursor', dict(cursor_info, channel=channel_name, conversationId=conversation_id,
+                                          seq=last_seq))
             except Exception as e:
                 print(f"Error preparing message history for Socket.IO: {str(e)}")
-                emit('messageHistory', [])  # Invia una lista vuota in caso di errore
+                emit('messageHistory', protocol.history_payload(request.sid, []))  # Invia una lista vuota in caso di errore
 
-    @socketio.on('joinDirectMessage')
+    @on_event('joinDirectMessage')
     def handle_join_dm(data):
         """Handle client joining a direct message conversation"""
         # Handle both integers and dictionaries
@@ -493,9 +519,9 @@ def register_handlers(socketio):
 
         print(f"Client joining DM with user: {user_id}")
 
-        # Join the room for this DM
+        # Join the room for this DM (ed esci da quella aperta prima, se non fissata)
         room = f"dm:{user_id}"
-        join_room(room)
+        subscriptions.activate(request.sid, room)
 
         # Find the DM conversation
         with get_db() as db:
@@ -518,7 +544,7 @@ def register_handlers(socketio):
             )
 
             if not conversation:
-                emit('messageHistory', [])
+                emit('messageHistory', protocol.history_payload(request.sid, []))
                 return
 
             conversation_id = conversation.id
@@ -530,105 +556,27 @@ def register_handlers(socketio):
                 'userId': user_id
             })
 
-            # Get messages
-            messages = (
-                db.query(Message, User)
-                .join(User, Message.user_id == User.id)
-                .filter(
-                    Message.conversation_id == conversation_id,
-                    Message.message_type != 'memory'  # Escludi i messaggi di tipo memory
-                )
-                .order_by(Message.created_at.desc())
-                .limit(50)
-                .all()
-            )
-            
-            # Collect reply_to_ids
-            reply_ids = [msg.reply_to_id for msg, _ in messages if msg.reply_to_id is not None]
-            reply_messages = {}
-            
-            if reply_ids:
-                # Fetch reply messages
-                reply_msg_users = (
-                    db.query(Message, User)
-                    .join(User, Message.user_id == User.id)
-                    .filter(Message.id.in_(reply_ids))
-                    .all()
-                )
-                
-                # Process reply messages
-                for reply, user in reply_msg_users:
-                    # Parse file_data for reply
-                    reply_file_data = reply.file_data
-                    
-                    # Build reply message object
-                    reply_messages[reply.id] = {
-                        'id': reply.id,
-                        'text': reply.text,
-                        'message_type': reply.message_type,
-                        'fileData': reply_file_data,
-                        'user': {
-                            'id': user.id,
-                            'username': user.username,
-                            'displayName': user.display_name,
-                            'avatarUrl': user.avatar_url,
-                            'status': user.status
-                        }
-                    }
+            # Riconnessione (sinceSeq): solo le modifiche perse, se le tombstone ci sono ancora
+            since_seq = parse_since_seq(data)
+            if since_seq is not None:
+                changes = sync_payload(db, conversation_id, since_seq)
+                if not changes['reset']:
+                    emit('syncChanges', changes)
+                    return
 
-            # Convert to dictionary format
-            message_list = []
-            for msg, user in messages:
-                # Get forwarded user data (if present)
-                forwarded_from = None
-                if msg.forwarded_from_id:
-                    forwarded_user = db.query(User).get(msg.forwarded_from_id)
-                    if forwarded_user:
-                        forwarded_from = {
-                            'id': msg.forwarded_from_id,
-                            'user': {
-                                'id': forwarded_user.id,
-                                'username': forwarded_user.username,
-                                'displayName': forwarded_user.display_name,
-                                'avatarUrl': forwarded_user.avatar_url,
-                                'status': forwarded_user.status
-                            }
-                        }
-                
-                # Get reply_to from cached results
-                reply_to = None
-                if msg.reply_to_id and msg.reply_to_id in reply_messages:
-                    reply_to = reply_messages[msg.reply_to_id]
-
-                message_list.append({
-                    'id': msg.id,
-                    'conversationId': msg.conversation_id,
-                    'user': {
-                        'id': user.id,
-                        'username': user.username,
-                        'displayName': user.display_name,
-                        'avatarUrl': user.avatar_url,
-                        'status': user.status
-                    },
-                    'text': msg.text,
-                    'timestamp': msg.created_at.isoformat(),
-                    'type': msg.message_type,
-                    'fileData': msg.file_data,
-                    'replyTo': reply_to,
-                    'forwardedFrom': forwarded_from,
-                    'message_metadata': msg.message_metadata or {},
-                    'edited': msg.edited,
-                    'editedAt': msg.edited_at.isoformat() if msg.edited_at else None,
-                    'isOwn': msg.user_id == 1  # Assume current user is ID 1
-                })
-
-            # Reverse to show oldest messages first
-            message_list.reverse()
-
-            # Send DM history using prepare_for_socketio to ensure proper serialization
-            emit('messageHistory', prepare_for_socketio(message_list))
-
-    @socketio.on('channelMessage')
+            # Sequenza letta prima della cronologia: le modifiche successive arrivano con syncSince
+            last_seq = get_conversation_seq(db, conversation_id)
+            # Get messages: dal ring buffer in memoria o prima pagina keyset, in ordine cronologico
+            message_list, cursor_info = load_recent_history(db, conversation_id)
+            # Aprire la conversazione la segna come letta: azzera i non letti della lista
+            mark_conversation_read(db, conversation_id, user_id=1)
+
+            # I messaggi idratati contengono solo tipi JSON: nessuna conversione prima dell'emit
+            emit('messageHistory', protocol.history_payload(request.sid, message_list))
+            # Cursore per caricare i messaggi precedenti
+            emit('historyCursor', dict(cursor_info, userId=user_id, conversationId=conversation_id, seq=last_seq))
+
+    @on_event('channelMessage')
     def handle_channel_message(data):
         """Handle channel message from client"""
         channel_name = data.get('channelName')
@@ -702,14 +650,16 @@ def register_handlers(socketio):
                 db.add(new_message)
                 db.commit()
                 db.refresh(new_message)
+                cache_new_message(db, new_message)
                 
                 message_id = new_message.id
                 created_at = new_message.created_at
+                message_seq = new_message.seq  # assegnato dal trigger (chat/sync.py)
 
                 print(f"Successfully inserted message with ID {message_id} for channel {channel_name}")
 
                 # Get user details
-                current_user = db.query(User).filter(User.id == 1).first()
+                current_user = get_user(1)
             except Exception as e:
                 db.rollback()
                 print(f"Error saving channel message: {str(e)}")
@@ -719,29 +669,24 @@ def register_handlers(socketio):
             message_dict = {
                 'id': message_id,
                 'conversationId': conversation_id,
-                'user': {
-                    'id': current_user.id,
-                    'username': current_user.username,
-                    'displayName': current_user.display_name,
-                    'avatarUrl': current_user.avatar_url,
-                    'status': current_user.status
-                },
+                'user': current_user,
                 'text': message_data.get('text'),
                 'timestamp': created_at.isoformat(),
                 'type': message_data.get('type', 'normal'),
                 'fileData': file_data,
                 'replyTo': None,  # Would need to fetch reply details
-                'forwardedFrom': None,  # Would need to fetch forwarded details
+                'forwardedFrom': get_user(forwarded_from_id) if forwarded_from_id else None,  # Utente di origine, come nella cronologia
                 'message_metadata': message_data.get('message_metadata'),
                 'edited': False,
                 'editedAt': None,
                 'isOwn': True,  # Mark as own message for sender
+                'seq': message_seq,
                 'tempId': message_data.get('tempId')
             }
 
             # Broadcast to channel
             room = f"channel:{channel_name}"
-            emit('newMessage', prepare_for_socketio(message_dict), room=room)
+            emit_message('newMessage', message_dict, room)
             print(f"Broadcasted message {message_id} to room {room}")
             
             # Verifica intento calendario per messaggi di canale
@@ -766,7 +711,7 @@ def register_handlers(socketio):
                         original_message_id=message_id
                     )                
 
-    @socketio.on('directMessage')
+    @on_event('directMessage')
     def handle_direct_message(data):
         """Handle direct message from client"""
         print(f"Received direct message: {data}")
@@ -789,8 +734,8 @@ def register_handlers(socketio):
 
         with get_db() as db:
             # Check if users exist
-            target_user = db.query(User).filter(User.id == user_id).first()
-            current_user = db.query(User).filter(User.id == 1).first()
+            target_user = get_user(user_id)
+            current_user = get_user(1)
 
             # Verify users exist and have valid data
             if not target_user or not current_user:
@@ -798,8 +743,8 @@ def register_handlers(socketio):
                 return
 
             # Log user data for debugging
-            print(f"Target user: {target_user.username}")
-            print(f"Current user: {current_user.username}")
+            print(f"Target user: {target_user['username']}")
+            print(f"Current user: {current_user['username']}")
 
             # Find the DM conversation between current user and specified user
             conversation = (
@@ -880,31 +825,28 @@ def register_handlers(socketio):
             db.add(new_message)
             db.commit()
             db.refresh(new_message)
+            cache_new_message(db, new_message)
             
             message_id = new_message.id
             created_at = new_message.created_at
+            message_seq = new_message.seq  # assegnato dal trigger (chat/sync.py)
 
             # Prepare the message with all necessary fields
             message_dict = {
                 'id': message_id,
                 'conversationId': conversation_id,
-                'user': {
-                    'id': current_user.id,
-                    'username': current_user.username,
-                    'displayName': current_user.display_name,
-                    'avatarUrl': current_user.avatar_url,
-                    'status': current_user.status
-                },
+                'user': current_user,
                 'text': message_text,
                 'timestamp': created_at.isoformat(),
                 'type': message_data.get('type', 'normal'),
                 'fileData': file_data,
                 'replyTo': None,  # Would need to fetch reply details
-                'forwardedFrom': None,  # Would need to fetch forwarded details
+                'forwardedFrom': get_user(forwarded_from_id) if forwarded_from_id else None,  # Utente di origine, come nella cronologia
                 'message_metadata': message_data.get('message_metadata', {}),
                 'edited': False,
                 'editedAt': None,
                 'isOwn': True,
+                'seq': message_seq,
                 'tempId': message_data.get('tempId')
             }
 
@@ -912,7 +854,7 @@ def register_handlers(socketio):
             print(f"Sending message: {message_dict}")
 
             # Send message to everyone in the room (including sender)
-            emit('newMessage', prepare_for_socketio(message_dict), room=room)
+            emit_message('newMessage', message_dict, room)
             
             # NUOVA IMPLEMENTAZIONE: Verifica intento calendario
             message_text = message_data.get('text', '')
@@ -1032,6 +974,8 @@ def register_handlers(socketio):
                         print(f"📝 Prompt generato con {len(history)} scambi precedenti")
                         
                         # 5. Otteniamo la risposta dal modello
+                        # In modalità speculativa la ricerca legale parte in parallelo con il messaggio grezzo
+                        speculation = start_speculative_retrieval(message_text, search_semantica) if RAG_SPECULATIVE else None
                         ai_response = get_llm_response(prompt)
                         print(f"✅ Risposta generata: {ai_response[:50]}...")
 
@@ -1062,7 +1006,7 @@ def register_handlers(socketio):
                                 if rag_data.get('is_legal') and rag_data.get('query'):
                                     query = rag_data['query']
                                     print(f"Executing legal search for query: '{query}'")
-                                    articles = search_semantica(query)
+                                    articles = speculation.resolve(query) if speculation else search_semantica(query)
                                     
                                     if articles:
                                         ai_response += f"\n\n📚 **Riferimenti dal Codice Civile** (ricerca: '{query}'):\n\n"
@@ -1078,6 +1022,10 @@ def register_handlers(socketio):
                                 import traceback
                                 print(traceback.format_exc())
                         
+                        # Nessuna ricerca richiesta dal tag: la speculazione non viene usata
+                        if speculation:
+                            speculation.discard()
+                        
                         # 6. Aggiorniamo la memoria
                         MAX_HISTORY = 5
                         history.append({
@@ -1103,7 +1051,7 @@ def register_handlers(socketio):
                         time.sleep(1.5)
 
                         # 9. Otteniamo i dati utente dal database
-                        ai_user = db.query(User).filter(User.id == 4).first()
+                        ai_user = get_user(4)
 
                         # 10. Creiamo il messaggio di risposta
                         ai_message = Message(
@@ -1116,13 +1064,14 @@ def register_handlers(socketio):
                         db.add(ai_message)
                         db.commit()
                         db.refresh(ai_message)
+                        cache_new_message(db, ai_message)
                         
                         ai_message_id = ai_message.id
                         ai_created_at = ai_message.created_at
 
                         # 11. Recuperiamo i dettagli del messaggio originale
                         reply_message = db.query(Message).get(message_id)
-                        reply_message_user = db.query(User).get(reply_message.user_id)
+                        reply_message_user = get_user(reply_message.user_id)
                         
                         # Prepariamo l'oggetto replyTo
                         reply_to = None
@@ -1132,26 +1081,14 @@ def register_handlers(socketio):
                                 'text': reply_message.text,
                                 'message_type': reply_message.message_type,
                                 'fileData': reply_message.file_data,
-                                'user': {
-                                    'id': reply_message_user.id,
-                                    'username': reply_message_user.username,
-                                    'displayName': reply_message_user.display_name,
-                                    'avatarUrl': reply_message_user.avatar_url,
-                                    'status': reply_message_user.status
-                                }
+                                'user': reply_message_user
                             }
 
                         # 12. Inviamo la risposta al client
                         ai_message_dict = {
                             'id': ai_message_id,
                             'conversationId': conversation_id,
-                            'user': {
-                                'id': ai_user.id,
-                                'username': ai_user.username,
-                                'displayName': ai_user.display_name,
-                                'avatarUrl': ai_user.avatar_url,
-                                'status': ai_user.status
-                            },
+                            'user': ai_user,
                             'text': ai_response,
                             'timestamp': ai_created_at.isoformat(),
                             'type': 'normal',
@@ -1164,7 +1101,7 @@ def register_handlers(socketio):
                             'isOwn': False
                         }
 
-                        emit('newMessage', prepare_for_socketio(ai_message_dict), room=room)
+                        emit_message('newMessage', ai_message_dict, room)
                         
                         # 13. Se la memoria è stata troncata, inviamo un messaggio di sistema
                         if memory_truncated:
@@ -1177,17 +1114,12 @@ def register_handlers(socketio):
                             db.add(memory_notice)
                             db.commit()
                             db.refresh(memory_notice)
+                            cache_new_message(db, memory_notice)
                             
                             notice_dict = {
                                 'id': memory_notice.id,
                                 'conversationId': conversation_id,
-                                'user': {
-                                    'id': ai_user.id,
-                                    'username': ai_user.username,
-                                    'displayName': ai_user.display_name,
-                                    'avatarUrl': ai_user.avatar_url,
-                                    'status': ai_user.status
-                                },
+                                'user': ai_user,
                                 'text': memory_notice.text,
                                 'timestamp': memory_notice.created_at.isoformat(),
                                 'type': 'system',
@@ -1200,7 +1132,7 @@ def register_handlers(socketio):
                                 'isOwn': False
                             }
                             
-                            emit('newMessage', prepare_for_socketio(notice_dict), room=room)
+                            emit_message('newMessage', notice_dict, room)
                             
                     except Exception as e:
                         print(f"❌ ERRORE nell'agente memoria Jane Smith: {str(e)}")
@@ -1209,7 +1141,7 @@ def register_handlers(socketio):
                         # Risposta di fallback senza memoria in caso di errore
                         try:
                             ai_response = get_llm_response(message_text)
-                            ai_user = db.query(User).filter(User.id == 4).first()
+                            ai_user = get_user(4)
                             
                             ai_message = Message(
                                 conversation_id=conversation_id,
@@ -1221,17 +1153,12 @@ def register_handlers(socketio):
                             db.add(ai_message)
                             db.commit()
                             db.refresh(ai_message)
+                            cache_new_message(db, ai_message)
                             
                             ai_message_dict = {
                                 'id': ai_message.id,
                                 'conversationId': conversation_id,
-                                'user': {
-                                    'id': ai_user.id,
-                                    'username': ai_user.username,
-                                    'displayName': ai_user.display_name,
-                                    'avatarUrl': ai_user.avatar_url,
-                                    'status': ai_user.status
-                                },
+                                'user': ai_user,
                                 'text': f"{ai_response}\n\n(Nota: risposta senza memoria per un errore temporaneo)",
                                 'timestamp': ai_message.created_at.isoformat(),
                                 'type': 'normal',
@@ -1244,7 +1171,7 @@ def register_handlers(socketio):
                                 'isOwn': False
                             }
                             
-                            emit('newMessage', prepare_for_socketio(ai_message_dict), room=room)
+                            emit_message('newMessage', ai_message_dict, room)
                         except Exception as fallback_error:
                             print(f"❌ ERRORE anche nel fallback: {str(fallback_error)}")
                     finally:
@@ -1270,8 +1197,8 @@ def register_handlers(socketio):
                         time.sleep(1.5)
 
                         # Get AI user data from database
-                        ai_user = db.query(User).filter(User.id == 2).first()
-                        print(f"AI user data from database: {ai_user.username if ai_user else 'Not found'}")
+                        ai_user = get_user(2)
+                        print(f"AI user data from database: {ai_user['username'] if ai_user else 'Not found'}")
 
                         # Create response message
                         ai_message = Message(
@@ -1284,13 +1211,14 @@ def register_handlers(socketio):
                         db.add(ai_message)
                         db.commit()
                         db.refresh(ai_message)
+                        cache_new_message(db, ai_message)
                         
                         ai_message_id = ai_message.id
                         ai_created_at = ai_message.created_at
 
                         # Recuperiamo i dettagli del messaggio a cui stiamo rispondendo
                         reply_message = db.query(Message).get(message_id)
-                        reply_message_user = db.query(User).get(reply_message.user_id)
+                        reply_message_user = get_user(reply_message.user_id)
                         
                         # Prepara l'oggetto replyTo
                         reply_to = None
@@ -1301,26 +1229,14 @@ def register_handlers(socketio):
                                 'text': reply_message.text,
                                 'message_type': reply_message.message_type,
                                 'fileData': reply_message.file_data,
-                                'user': {
-                                    'id': reply_message_user.id,
-                                    'username': reply_message_user.username,
-                                    'displayName': reply_message_user.display_name,
-                                    'avatarUrl': reply_message_user.avatar_url,
-                                    'status': reply_message_user.status
-                                }
+                                'user': reply_message_user
                             }
 
                         # Send AI response with user data from database
                         ai_message_dict = {
                             'id': ai_message_id,
                             'conversationId': conversation_id,
-                            'user': {
-                                'id': ai_user.id,
-                                'username': ai_user.username,
-                                'displayName': ai_user.display_name,
-                                'avatarUrl': ai_user.avatar_url,
-                                'status': ai_user.status
-                            },
+                            'user': ai_user,
                             'text': ai_response,
                             'timestamp': ai_created_at.isoformat(),
                             'type': 'normal',
@@ -1334,9 +1250,9 @@ def register_handlers(socketio):
                         }
 
                         print(f"Sending AI response with user data: {ai_message_dict['user']}")
-                        emit('newMessage', prepare_for_socketio(ai_message_dict), room=room)
+                        emit_message('newMessage', ai_message_dict, room)
 
-                        if ai_user.id == 2:
+                        if ai_user['id'] == 2:
                             # Broadcast del messaggio a tutti i client 
                             emit('newMessage', prepare_for_socketio(ai_message_dict), broadcast=True)
                     finally:
@@ -1347,7 +1263,7 @@ def register_handlers(socketio):
                         }, room=room)
 
     # In handlers.py, aggiungi a register_handlers
-    @socketio.on('clearAgentMemory')
+    @on_event('clearAgentMemory')
     def handle_clear_agent_memory(data):
         """Handle request to clear agent memory"""
 
@@ -1384,7 +1300,7 @@ def register_handlers(socketio):
                     
                     # Invia messaggio di sistema
                     room = f"dm:{user_id}"
-                    ai_user = db.query(User).filter(User.id == 4).first()
+                    ai_user = get_user(4)
                     
                     # Crea messaggio di sistema
                     memory_notice = Message(
@@ -1396,18 +1312,13 @@ def register_handlers(socketio):
                     db.add(memory_notice)
                     db.commit()
                     db.refresh(memory_notice)
+                    cache_new_message(db, memory_notice)
                     
                     # Invia notifica
                     notice_dict = {
                         'id': memory_notice.id,
                         'conversationId': conversation_id,
-                        'user': {
-                            'id': ai_user.id,
-                            'username': ai_user.username,
-                            'displayName': ai_user.display_name,
-                            'avatarUrl': ai_user.avatar_url,
-                            'status': ai_user.status
-                        },
+                        'user': ai_user,
                         'text': memory_notice.text,
                         'timestamp': memory_notice.created_at.isoformat(),
                         'type': 'system',
@@ -1420,12 +1331,12 @@ def register_handlers(socketio):
                         'isOwn': False
                     }
                     
-                    emit('newMessage', prepare_for_socketio(notice_dict), room=room)
+                    emit_message('newMessage', notice_dict, room)
             except Exception as e:
                 print(f"❌ Errore durante l'azzeramento della memoria: {str(e)}")
                 print(traceback.format_exc())
 
-    @socketio.on('channelMessage')
+    @on_event('channelMessage')
     def handle_channel_message(data):
         """Handle channel message from client"""
         channel_name = data.get('channelName')
@@ -1506,14 +1417,16 @@ def register_handlers(socketio):
                 db.add(new_message)
                 db.commit()
                 db.refresh(new_message)
+                cache_new_message(db, new_message)
                 
                 message_id = new_message.id
                 created_at = new_message.created_at
+                message_seq = new_message.seq  # assegnato dal trigger (chat/sync.py)
 
                 print(f"Successfully inserted message with ID {message_id} for channel {channel_name}")
 
                 # Get user details
-                current_user = db.query(User).filter(User.id == 1).first()
+                current_user = get_user(1)
             except Exception as e:
                 db.rollback()
                 print(f"Error saving channel message: {str(e)}")
@@ -1523,29 +1436,24 @@ def register_handlers(socketio):
             message_dict = {
                 'id': message_id,
                 'conversationId': conversation_id,
-                'user': {
-                    'id': current_user.id,
-                    'username': current_user.username,
-                    'displayName': current_user.display_name,
-                    'avatarUrl': current_user.avatar_url,
-                    'status': current_user.status
-                },
+                'user': current_user,
                 'text': message_text,
                 'timestamp': created_at.isoformat(),
                 'type': message_data.get('type', 'normal'),
                 'fileData': file_data,
                 'replyTo': None,  # Would need to fetch reply details
-                'forwardedFrom': None,  # Would need to fetch forwarded details
+                'forwardedFrom': get_user(forwarded_from_id) if forwarded_from_id else None,  # Utente di origine, come nella cronologia
                 'message_metadata': message_data.get('message_metadata'),
                 'edited': False,
                 'editedAt': None,
                 'isOwn': True,  # Mark as own message for sender
+                'seq': message_seq,
                 'tempId': message_data.get('tempId')
             }
 
             # Broadcast to channel
             room = f"channel:{channel_name}"
-            emit('newMessage', prepare_for_socketio(message_dict), room=room)
+            emit_message('newMessage', message_dict, room)
             print(f"Broadcasted message {message_id} to room {room}")
             
             # Verifica intento calendario per messaggi di canale
@@ -1570,7 +1478,7 @@ def register_handlers(socketio):
                         original_message_id=message_id
                     )   
 
-    @socketio.on('deleteMessage')
+    @on_event('deleteMessage')
     def handle_delete_message(data):
         """Handle message deletion request from client"""
         message_id = data.get('messageId')
@@ -1635,6 +1543,11 @@ def register_handlers(socketio):
                 db.commit()
                 
                 print(f"Successfully deleted message {message_id} from database")
+
+                # Allinea il ring buffer della conversazione
+                message_cache = get_message_cache()
+                if message_cache is not None:
+                    message_cache.remove(conversation.id, message_id)
                 
                 # Determina la stanza per l'emissione dell'evento
                 if conversation.type == 'channel':
@@ -1665,7 +1578,7 @@ def register_handlers(socketio):
                 db.rollback()
                 print(f"Error during message deletion: {str(e)}")
 
-    @socketio.on('editMessage')
+    @on_event('editMessage')
     def handle_edit_message(data):
         """Handle message edit request from client"""
         message_id = data.get('messageId')
@@ -1719,6 +1632,17 @@ def register_handlers(socketio):
                 db.commit()
                 
                 edited_at = message.edited_at
+                message_seq = message.seq  # nuova sequenza assegnata dal trigger (chat/sync.py)
+
+                # Allinea il ring buffer della conversazione
+                message_cache = get_message_cache()
+                if message_cache is not None:
+                    message_cache.update(conversation.id, message_id, {
+                        'text': new_text,
+                        'edited': True,
+                        'editedAt': edited_at.isoformat(),
+                        'seq': message_seq
+                    })
                 
                 # Determina la stanza per l'emissione dell'evento
                 if conversation.type == 'channel':
@@ -1745,7 +1669,8 @@ def register_handlers(socketio):
                     'messageId': message_id,
                     'conversationId': conversation.id,
                     'newText': new_text,
-                    'editedAt': edited_at.isoformat()
+                    'editedAt': edited_at.isoformat(),
+                    'seq': message_seq
                 }, room=room)
                 
                 print(f"Successfully updated message {message_id} and broadcasted to {room}")
@@ -1753,7 +1678,105 @@ def register_handlers(socketio):
                 db.rollback()
                 print(f"Error during message edit: {str(e)}")
 
-    @socketio.on('userStartTyping')
+    @on_event('markConversationRead')
+    def handle_mark_conversation_read(data):
+        """Segna come letta una conversazione fino a upToMessageId (o fino all'ultimo messaggio)"""
+        if not isinstance(data, dict) or not data.get('conversationId') or isinstance(data['conversationId'], bool):
+            print(f"Error: invalid markConversationRead payload: {data}")
+            return
+        try:
+            conversation_id = int(data['conversationId'])
+        except (TypeError, ValueError):
+            print(f"Error: invalid markConversationRead payload: {data}")
+            return
+        # Stessa validazione di POST /api/conversations/<id>/read
+        up_to_message_id = data.get('upToMessageId')
+        if not is_valid_watermark(up_to_message_id):
+            print(f"Error: upToMessageId must be an integer: {data}")
+            return
+
+        with get_db() as db:
+            try:
+                read_state = mark_conversation_read(db, conversation_id, user_id=1,
+                                                    up_to_message_id=up_to_message_id)
+            except (ConversationNotFound, InvalidReadTarget) as e:
+                print(f"Error marking conversation read: {str(e)}")
+                return
+
+        if read_state is not None:
+            emit('readState', read_state)
+
+    @on_event('syncSince')
+    def handle_sync_since(data):
+        """Dopo una riconnessione: solo inserimenti, modifiche ed eliminazioni successivi a seq"""
+        if not isinstance(data, dict) or not data.get('conversationId'):
+            print(f"Error: invalid syncSince payload: {data}")
+            return
+        try:
+            conversation_id = int(data['conversationId'])
+            since_seq = int(data.get('seq') or 0)
+            limit = int(data.get('limit') or SYNC_MAX_CHANGES)
+        except (TypeError, ValueError):
+            print(f"Error: invalid syncSince payload: {data}")
+            return
+
+        with get_db() as db:
+            changes = sync_payload(db, conversation_id, since_seq, limit=limit)
+        emit('syncChanges', changes)
+
+    @on_event('autocomplete')
+    def handle_autocomplete(data):
+        """Suggerimenti di utenti e canali dall'indice in memoria, a ogni tasto premuto"""
+        if isinstance(data, str):
+            data = {'q': data}
+        if not isinstance(data, dict):
+            print(f"Error: unexpected data type for autocomplete: {type(data)}: {data}")
+            return
+
+        query = data.get('q') or ''
+        types = parse_types(data.get('types'))
+        try:
+            limit = max(1, min(int(data.get('limit', 10)), 50))
+        except (TypeError, ValueError):
+            limit = 10
+
+        start = time.perf_counter()
+        results = autocomplete(query, types=types, limit=limit)
+        emit('autocompleteResults', dict(
+            results,
+            q=query,
+            seq=data.get('seq'),  # il client scarta le risposte di query già superate
+            tookMs=round((time.perf_counter() - start) * 1000, 3)
+        ))
+
+    def rooms_from_payload(data):
+        """Room di {channels: [...], userIds: [...]}"""
+        if not isinstance(data, dict):
+            return []
+        return ([f"channel:{name}" for name in data.get('channels') or [] if name]
+                + [f"dm:{user_id}" for user_id in data.get('userIds') or [] if user_id])
+
+    @on_event('subscribeRooms')
+    def handle_subscribe_rooms(data):
+        """Modalità multi-iscrizione: riceve i messaggi di queste conversazioni anche se non aperte"""
+        emit('subscriptions', subscriptions.subscribe(request.sid, rooms_from_payload(data)))
+
+    @on_event('unsubscribeRooms')
+    def handle_unsubscribe_rooms(data):
+        """Smette di seguire le conversazioni fissate (quella aperta resta)"""
+        emit('subscriptions', subscriptions.unsubscribe(request.sid, rooms_from_payload(data)))
+
+    @on_event('search')
+    def handle_search(data):
+        """Ricerca a ogni tasto: utenti e canali subito, messaggi dopo il debounce (chat/live_search.py)"""
+        if isinstance(data, str):
+            data = {'q': data}
+        if not isinstance(data, dict):
+            print(f"Error: unexpected data type for search: {type(data)}: {data}")
+            return
+        live_search.submit(request.sid, data)
+
+    @on_event('userStartTyping')
     def handle_start_typing(data):
         """Handle user typing event start"""
         print(f"Received typing start event: {data}")
@@ -1776,19 +1799,19 @@ def register_handlers(socketio):
             
         # Trova l'utente corrente (ID 1)
         with get_db() as db:
-            current_user = db.query(User).filter(User.id == 1).first()
+            current_user = get_user(1)
             if not current_user:
                 print("Error: Current user not found")
                 return
                 
             # Propaga l'evento agli altri utenti nella stanza, escludendo mittente
             emit('userStartTyping', {
-                'userId': current_user.id,  # ID utente che sta digitando
+                'userId': current_user['id'],  # ID utente che sta digitando
                 'isDirect': isDirect
             }, room=room, include_self=False)
             print(f"Broadcast typing start event to room {room}")
 
-    @socketio.on('userStopTyping')
+    @on_event('userStopTyping')
     def handle_stop_typing(data):
         """Handle user typing event stop"""
         print(f"Received typing stop event: {data}")
@@ -1811,14 +1834,14 @@ def register_handlers(socketio):
             
         # Trova l'utente corrente (ID 1)
         with get_db() as db:
-            current_user = db.query(User).filter(User.id == 1).first()
+            current_user = get_user(1)
             if not current_user:
                 print("Error: Current user not found")
                 return
                 
             # Propaga l'evento agli altri utenti nella stanza, escludendo mittente
             emit('userStopTyping', {
-                'userId': current_user.id,  # ID utente che ha smesso di digitare
+                'userId': current_user['id'],  # ID utente che ha smesso di digitare
                 'isDirect': isDirect
             }, room=room, include_self=False)
             print(f"Broadcast typing stop event to room {room}")                
@@ -1897,7 +1920,7 @@ def check_db_query_intent(message_text, user_id, conversation_id, room, original
         if agent_result and agent_result.get('response'):
             with get_db() as db:
                 # Ottieni dati utente DB Agent dal database
-                db_agent_user = db.query(User).filter(User.id == 3).first()
+                db_agent_user = get_user(3)
                 
                 # Prepara i dati del file se disponibili
                 file_data = agent_result.get('file_data')
@@ -1915,6 +1938,7 @@ def check_db_query_intent(message_text, user_id, conversation_id, room, original
                 db.add(db_agent_message)
                 db.commit()
                 db.refresh(db_agent_message)
+                cache_new_message(db, db_agent_message)
                 
                 db_message_id = db_agent_message.id
                 db_created_at = db_agent_message.created_at
@@ -1924,33 +1948,21 @@ def check_db_query_intent(message_text, user_id, conversation_id, room, original
                 if original_message_id:
                     original_message = db.query(Message).get(original_message_id)
                     if original_message:
-                        original_user = db.query(User).get(original_message.user_id)
+                        original_user = get_user(original_message.user_id)
                         if original_user:
                             reply_to = {
                                 'id': original_message.id,
                                 'text': original_message.text,
                                 'message_type': original_message.message_type,
                                 'fileData': original_message.file_data,
-                                'user': {
-                                    'id': original_user.id,
-                                    'username': original_user.username,
-                                    'displayName': original_user.display_name,
-                                    'avatarUrl': original_user.avatar_url,
-                                    'status': original_user.status
-                                }
+                                'user': original_user
                             }
                 
                 # Invia la risposta dell'agente
                 db_message_dict = {
                     'id': db_message_id,
                     'conversationId': conversation_id,
-                    'user': {
-                        'id': db_agent_user.id,
-                        'username': db_agent_user.username,
-                        'displayName': db_agent_user.display_name,
-                        'avatarUrl': db_agent_user.avatar_url,
-                        'status': db_agent_user.status
-                    },
+                    'user': db_agent_user,
                     'text': agent_result.get('response'),
                     'timestamp': db_created_at.isoformat(),
                     'type': 'normal',
@@ -1964,7 +1976,7 @@ def check_db_query_intent(message_text, user_id, conversation_id, room, original
                 }
                 
                 print(f"Invio risposta dell'agente database: {db_message_dict}")
-                emit('newMessage', prepare_for_socketio(db_message_dict), room=room)
+                emit_message('newMessage', db_message_dict, room)
                 print(f"Inviata risposta dell'agente database per la query: '{message_text}'")
             
             # Emetti evento modelInference 'completed' prima di restituire True
@@ -2034,7 +2046,7 @@ def check_file_analysis_intent(message_text, file_path, file_type, user_id, conv
         if agent_result and agent_result.get('response'):
             with get_db() as db:
                 # Ottieni dati utente File Agent dal database
-                file_agent_user = db.query(User).filter(User.id == 7).first()
+                file_agent_user = get_user(7)
                 
                 # Se l'utente file agent non esiste, crealo
                 if not file_agent_user:
@@ -2047,7 +2059,8 @@ def check_file_analysis_intent(message_text, file_path, file_type, user_id, conv
                     )
                     db.add(file_agent_user)
                     db.commit()
-                    db.refresh(file_agent_user)
+                    # La rubrica è già stata invalidata dall'insert
+                    file_agent_user = get_user(7)
                 
                 # Crea messaggio di risposta con reply_to_id
                 file_agent_message = Message(
@@ -2061,6 +2074,7 @@ def check_file_analysis_intent(message_text, file_path, file_type, user_id, conv
                 db.add(file_agent_message)
                 db.commit()
                 db.refresh(file_agent_message)
+                cache_new_message(db, file_agent_message)
                 
                 file_message_id = file_agent_message.id
                 file_created_at = file_agent_message.created_at
@@ -2070,33 +2084,21 @@ def check_file_analysis_intent(message_text, file_path, file_type, user_id, conv
                 if original_message_id:
                     original_message = db.query(Message).get(original_message_id)
                     if original_message:
-                        original_user = db.query(User).get(original_message.user_id)
+                        original_user = get_user(original_message.user_id)
                         if original_user:
                             reply_to = {
                                 'id': original_message.id,
                                 'text': original_message.text,
                                 'message_type': original_message.message_type,
                                 'fileData': original_message.file_data,
-                                'user': {
-                                    'id': original_user.id,
-                                    'username': original_user.username,
-                                    'displayName': original_user.display_name,
-                                    'avatarUrl': original_user.avatar_url,
-                                    'status': original_user.status
-                                }
+                                'user': original_user
                             }
                 
                 # Invia la risposta dell'agente
                 file_message_dict = {
                     'id': file_message_id,
                     'conversationId': conversation_id,
-                    'user': {
-                        'id': file_agent_user.id,
-                        'username': file_agent_user.username,
-                        'displayName': file_agent_user.display_name,
-                        'avatarUrl': file_agent_user.avatar_url,
-                        'status': file_agent_user.status
-                    },
+                    'user': file_agent_user,
                     'text': agent_result.get('response'),
                     'timestamp': file_created_at.isoformat(),
                     'type': 'normal',
@@ -2109,7 +2111,7 @@ def check_file_analysis_intent(message_text, file_path, file_type, user_id, conv
                     'isOwn': False
                 }
                 
-                emit('newMessage', prepare_for_socketio(file_message_dict), room=room)
+                emit_message('newMessage', file_message_dict, room)
                 
                 # Emetti evento modelInference 'completed' alla fine dell'elaborazione
                 emit('modelInference', {'status': 'completed', 'userId': user_id or 7}, room=room)
@@ -2122,26 +2124,26 @@ def check_file_analysis_intent(message_text, file_path, file_type, user_id, conv
     
     return False
 
-def search_semantica(query, top_k=3):
-    """Esegue ricerca semantica nella tabella codice_civile"""
+def search_semantica(query, top_k=3, ef_search=None, probes=None):
+    """
+    Esegue ricerca semantica (ibrida se RAG_HYBRID) nella tabella codice_civile
+    
+    Args:
+        query (str): Testo della domanda
+        top_k (int): Numero di articoli da restituire
+        ef_search (int, optional): hnsw.ef_search per questa ricerca
+        probes (int, optional): ivfflat.probes per questa ricerca
+    """
     try:
-        model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
-        query_embedding = model.encode(query).tolist()
-        
-        conn = psycopg2.connect(
-            host=DB_HOST, port=DB_PORT, dbname=DB_NAME, 
-            user=DB_USER, password=DB_PASSWORD
-        )
-        cur = conn.cursor()
+        if RAG_HYBRID:
+            # Full-text italiano e vettoriale in parallelo, fusi con RRF (stessa forma dei risultati)
+            return hybrid_search(query, top_k=top_k, ef_search=ef_search, probes=probes)
         
-        cur.execute("""
-        SELECT article_number, content, 1 - (embedding <=> %s::vector) AS similarity
-        FROM codice_civile
-        ORDER BY embedding <=> %s::vector
-        LIMIT %s;
-        """, (query_embedding, query_embedding, top_k))
+        # Modello caldo condiviso dal processo, richieste concorrenti raggruppate in batch
+        query_embedding = get_embedding_service().encode(query)
         
-        results = cur.fetchall()
+        # Backend scelto da RAG_BACKEND: pgvector o indice locale numpy
+        results = search_articles(query_embedding, top_k=top_k, ef_search=ef_search, probes=probes)
         articles = []
         
         for article_number, content, similarity in results:
@@ -2151,8 +2153,6 @@ def search_semantica(query, top_k=3):
                 "similarity": round(similarity, 4)
             })
         
-        cur.close()
-        conn.close()
         return articles
     except Exception as e:
         print(f"Errore ricerca semantica: {str(e)}")
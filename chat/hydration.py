@@ -0,0 +1,170 @@
+"""
+Idratazione a lotti dei messaggi della chat.
+
+Converte una pagina di righe Message (con il relativo User) nel formato atteso dal
+frontend, risolvendo utenti, anteprime delle risposte e origine dei messaggi inoltrati
+con un numero costante di query set-based, indipendente dalla dimensione della pagina:
+
+- 1 query IN sugli utenti: gli autori mancanti (0 se le righe arrivano già come
+  (Message, User)) e gli utenti da cui è stato inoltrato un messaggio
+- 1 query IN per i messaggi citati (reply_to_id), in join esterno con i loro autori
+
+forwarded_from_id contiene l'id dell'utente di origine (i writer in chat/handlers.py
+salvano forwardedFrom.id, che il frontend valorizza con message.user), non un messaggio.
+
+Usato da tutte le letture della cronologia: route REST e join Socket.IO.
+"""
+import logging
+
+from chat.models import User, Message
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+CURRENT_USER_ID = 1  # Utente corrente (non esiste ancora l'autenticazione)
+
+DEFAULT_USERNAME = 'unknown'
+DEFAULT_DISPLAY_NAME = 'Unknown User'
+DEFAULT_AVATAR_URL = 'https://ui-avatars.com/api/?name=Unknown'
+DEFAULT_STATUS = 'offline'
+
+def user_to_dict(user):
+    """
+    Converte un utente nel formato del frontend, con valori di default per i campi vuoti.
+
+    Args:
+        user (User): Utente (può essere None)
+
+    Returns:
+        dict or None: Dizionario dell'utente
+    """
+    if user is None:
+        return None
+    return {
+        'id': user.id,
+        'username': user.username or DEFAULT_USERNAME,
+        'displayName': user.display_name or DEFAULT_DISPLAY_NAME,
+        'avatarUrl': user.avatar_url or DEFAULT_AVATAR_URL,
+        'status': user.status or DEFAULT_STATUS
+    }
+
+def _split_rows(rows):
+    """Normalizza le righe in coppie (Message, User or None)"""
+    pairs = []
+    for row in rows:
+        if isinstance(row, Message):
+            pairs.append((row, None))
+        else:
+            message, user = row
+            pairs.append((message, user))
+    return pairs
+
+def _load_users(db, user_ids):
+    """Carica gli utenti mancanti con una sola query IN"""
+    if not user_ids:
+        return {}
+    users = db.query(User).filter(User.id.in_(user_ids)).all()
+    return {user.id: user for user in users}
+
+def _load_referenced(db, message_ids):
+    """
+    Carica i messaggi citati insieme ai loro autori con una sola query.
+
+    Returns:
+        dict: id messaggio -> (Message, User or None)
+    """
+    if not message_ids:
+        return {}
+    rows = (
+        db.query(Message, User)
+        .outerjoin(User, Message.user_id == User.id)
+        .filter(Message.id.in_(message_ids))
+        .all()
+    )
+    return {message.id: (message, user) for message, user in rows}
+
+def _reply_preview(message, user):
+    """Anteprima del messaggio citato"""
+    return {
+        'id': message.id,
+        'text': message.text,
+        'message_type': message.message_type,
+        'fileData': message.file_data,
+        'user': user_to_dict(user)
+    }
+
+def message_to_dict(message, user, reply_to=None, forwarded_from=None, current_user_id=CURRENT_USER_ID):
+    """
+    Costruisce il dizionario di un messaggio già idratato.
+
+    Args:
+        message (Message): Messaggio
+        user (User): Autore del messaggio
+        reply_to (dict, optional): Anteprima del messaggio citato
+        forwarded_from (dict, optional): Utente da cui è stato inoltrato il messaggio
+        current_user_id (int): Utente corrente, per il flag isOwn
+
+    Returns:
+        dict: Messaggio nel formato del frontend
+    """
+    return {
+        'id': message.id,
+        'conversationId': message.conversation_id,
+        'user': user_to_dict(user),
+        'text': message.text or '',
+        'timestamp': message.created_at.isoformat() if message.created_at else None,
+        'type': message.message_type or 'normal',
+        'fileData': message.file_data,
+        'replyTo': reply_to,
+        'forwardedFrom': forwarded_from,
+        'message_metadata': message.message_metadata or {},
+        'edited': message.edited,
+        'editedAt': message.edited_at.isoformat() if message.edited_at else None,
+        'isOwn': message.user_id == current_user_id,
+        'seq': message.seq
+    }
+
+def hydrate_messages(db, rows, current_user_id=CURRENT_USER_ID):
+    """
+    Idrata una pagina di messaggi con un numero costante di query.
+
+    Args:
+        db (Session): Sessione del database
+        rows (list): Righe (Message, User) come restituite da get_message_page,
+            oppure oggetti Message (gli autori vengono caricati in blocco)
+        current_user_id (int): Utente corrente, per il flag isOwn
+
+    Returns:
+        list: Messaggi nel formato del frontend, nello stesso ordine delle righe
+    """
+    pairs = _split_rows(rows)
+    if not pairs:
+        return []
+
+    missing_user_ids = {message.user_id for message, user in pairs
+                        if user is None and message.user_id is not None}
+    missing_user_ids.update(message.forwarded_from_id for message, _ in pairs if message.forwarded_from_id)
+    users = _load_users(db, missing_user_ids)
+
+    referenced_ids = {message.reply_to_id for message, _ in pairs if message.reply_to_id}
+    referenced = _load_referenced(db, referenced_ids)
+
+    result = []
+    for message, user in pairs:
+        try:
+            if user is None:
+                user = users.get(message.user_id)
+
+            reply_to = None
+            if message.reply_to_id in referenced:
+                reply_to = _reply_preview(*referenced[message.reply_to_id])
+
+            forwarded_from = None
+            if message.forwarded_from_id in users:
+                forwarded_from = user_to_dict(users[message.forwarded_from_id])
+
+            result.append(message_to_dict(message, user, reply_to, forwarded_from, current_user_id))
+        except Exception as e:
+            # Un messaggio malformato non deve far fallire l'intera pagina
+            logger.error(f"Errore nell'idratazione del messaggio {message.id}: {e}")
+    return result
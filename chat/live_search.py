@@ -0,0 +1,192 @@
+"""
+Ricerca mentre si digita su Socket.IO (evento 'search').
+
+Ogni query porta il numero di sequenza del client (seq) e arriva in due fasi con
+l'evento 'searchResults':
+- 'quick': utenti e canali dall'indice in memoria (chat/autocomplete.py), inviati
+  subito perché costano meno di un millisecondo
+- 'messages': ricerca full-text (chat/message_search.py), avviata solo dopo
+  SEARCH_DEBOUNCE_MS senza nuove query dalla stessa connessione
+
+Una query più recente della stessa connessione supera le precedenti: quelle ancora in
+attesa non partono, quella già in esecuzione su Postgres viene annullata
+(cancel di psycopg2) e il suo risultato scartato. Il client mostra solo le risposte
+con l'ultimo seq inviato.
+"""
+import logging
+import threading
+import time
+
+from common.config import SEARCH_DEBOUNCE_MS
+from common.db.connection import get_engine
+from chat.autocomplete import autocomplete
+from chat.message_search import parse_message_search_args, search_messages
+from chat.pagination import InvalidCursor
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+SEARCH_TYPES = ('all', 'messages', 'users', 'channels')
+
+def search_messages_cancellable(query, filters, set_cancel):
+    """
+    Ricerca messaggi su una connessione dedicata, annullabile da un altro greenlet.
+
+    Args:
+        query (str): Testo cercato
+        filters (dict): Argomenti per search_messages
+        set_cancel (callable): Registra la funzione che annulla la query; restituisce
+            False se la ricerca è già stata superata
+
+    Returns:
+        tuple or None: (risultati, cursore) oppure None se superata prima di partire
+    """
+    with get_engine().connect() as conn:
+        if not set_cancel(conn.connection.dbapi_connection.cancel):
+            return None
+        try:
+            return search_messages(conn, query, user_id=1, **filters)
+        finally:
+            set_cancel(None)
+            conn.rollback()
+
+class _SearchState:
+    """Ultima query di una connessione e annullamento di quella in corso"""
+
+    __slots__ = ('generation', 'cancel')
+
+    def __init__(self):
+        self.generation = 0
+        self.cancel = None
+
+class LiveSearch:
+    """
+    Ricerche per connessione con debounce e annullamento delle query superate.
+
+    Args:
+        emit (callable): emit(evento, payload, to=sid), di solito socketio.emit
+        start_task (callable): Avvia una funzione in background (socketio.start_background_task)
+        sleep (callable): Attesa cooperativa (socketio.sleep)
+        debounce (float): Secondi di attesa prima della ricerca messaggi
+        message_search (callable): Ricerca messaggi, vedi search_messages_cancellable
+    """
+
+    def __init__(self, emit, start_task, sleep=time.sleep, debounce=SEARCH_DEBOUNCE_MS / 1000,
+                 message_search=search_messages_cancellable):
+        self.emit = emit
+        self.start_task = start_task
+        self.sleep = sleep
+        self.debounce = debounce
+        self.message_search = message_search
+        self._states = {}
+        self._lock = threading.Lock()
+        self._stats = {'queries': 0, 'message_searches': 0, 'debounced': 0, 'cancelled': 0,
+                       'discarded': 0, 'errors': 0}
+
+    def submit(self, sid, data):
+        """
+        Nuova query della connessione sid: invia la fase 'quick' e pianifica i messaggi.
+
+        Args:
+            sid (str): Identificativo della connessione Socket.IO
+            data (dict): {q, seq, type, conversationId, userId, from, to, hasFile, cursor, limit}
+        """
+        query = (data.get('q') or '').strip()
+        seq = data.get('seq')
+        search_type = data.get('type') or 'all'
+
+        with self._lock:
+            state = self._states.setdefault(sid, _SearchState())
+            state.generation += 1
+            generation = state.generation
+            cancel, state.cancel = state.cancel, None
+            self._stats['queries'] += 1
+        if cancel is not None:
+            self._cancel(cancel)
+
+        if search_type not in SEARCH_TYPES:
+            self._emit_error(sid, seq, query, f"Tipo di ricerca non valido: {search_type}")
+            return
+        try:
+            filters = parse_message_search_args(data)
+        except (ValueError, TypeError, InvalidCursor) as e:
+            self._emit_error(sid, seq, query, str(e))
+            return
+
+        types = [kind for kind in ('users', 'channels') if search_type in ('all', kind)]
+        quick = autocomplete(query, types=types, limit=10) if query and types else {}
+        self.emit('searchResults', dict(quick, seq=seq, q=query, phase='quick',
+                                        final=not query or search_type not in ('all', 'messages')), to=sid)
+
+        if query and search_type in ('all', 'messages'):
+            self.start_task(self._run, sid, state, generation, seq, query, filters)
+
+    def forget(self, sid):
+        """Alla disconnessione: annulla la ricerca in corso e libera lo stato"""
+        with self._lock:
+            state = self._states.pop(sid, None)
+            if state is None:
+                return
+            state.generation += 1
+            cancel, state.cancel = state.cancel, None
+        if cancel is not None:
+            self._cancel(cancel)
+
+    def get_stats(self):
+        """Contatori di query, ricerche eseguite, saltate e annullate"""
+        with self._lock:
+            return dict(self._stats, connections=len(self._states))
+
+    def _run(self, sid, state, generation, seq, query, filters):
+        self.sleep(self.debounce)
+        if not self._is_current(state, generation):
+            self._count('debounced')
+            return
+
+        self._count('message_searches')
+        start = time.perf_counter()
+        try:
+            found = self.message_search(query, filters, lambda cancel: self._set_cancel(state, generation, cancel))
+        except Exception as e:
+            if not self._is_current(state, generation):
+                self._count('cancelled')
+                return
+            self._count('errors')
+            logger.error(f"Errore nella ricerca messaggi '{query}': {e}")
+            self._emit_error(sid, seq, query, str(e))
+            return
+
+        if found is None or not self._is_current(state, generation):
+            self._count('discarded')
+            return
+        messages, next_cursor = found
+        self.emit('searchResults', {
+            'seq': seq, 'q': query, 'phase': 'messages', 'final': True,
+            'messages': messages, 'messagesCursor': next_cursor,
+            'tookMs': round((time.perf_counter() - start) * 1000, 1)
+        }, to=sid)
+
+    def _set_cancel(self, state, generation, cancel):
+        with self._lock:
+            if state.generation != generation:
+                return False
+            state.cancel = cancel
+            return True
+
+    def _is_current(self, state, generation):
+        with self._lock:
+            return state.generation == generation
+
+    def _cancel(self, cancel):
+        try:
+            cancel()
+        except Exception as e:
+            logger.warning(f"Annullamento della ricerca non riuscito: {e}")
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _emit_error(self, sid, seq, query, error):
+        self.emit('searchResults', {'seq': seq, 'q': query, 'phase': 'error', 'final': True, 'error': error},
+                  to=sid)
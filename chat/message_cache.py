@@ -0,0 +1,402 @@
+"""
+Buffer in memoria dei messaggi recenti delle conversazioni più attive.
+
+Ogni conversazione ha un ring buffer con gli ultimi messaggi già idratati (formato del
+frontend, vedi chat/hydration.py). I join Socket.IO vengono serviti dalla memoria quando
+il buffer copre la finestra richiesta, evitando di rileggere da Postgres la stessa
+pagina per ogni client che entra nello stesso canale.
+
+- Popolamento in lettura: il primo join legge dal database e salva la pagina
+- Aggiornamento in scrittura: gli handler di invio/modifica/eliminazione in
+  chat/handlers.py aggiornano il buffer dopo il commit
+- Scritture non applicate al buffer (altri percorsi che salvano messaggi) sono
+  intercettate dagli eventi del mapper Message: la conversazione viene letta dal
+  database al join successivo
+- Lettura e salvataggio non sono atomici: una scrittura tra la lettura dal database e
+  store() (anche su una conversazione non ancora in cache) incrementa la generazione
+  della conversazione, e store() scarta la pagina letta prima di quella scrittura
+- Memoria limitata: dimensione totale stimata (JSON serializzato) con eviction LRU
+  tra le conversazioni, capienza massima per conversazione e TTL
+
+Il buffer è locale al processo: con più worker (SOCKETIO_MESSAGE_QUEUE) le scritture
+di un worker non aggiornano gli altri, per questo di default è disattivato in quel caso.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from common.config import (
+    HOT_CACHE_ENABLED, HOT_CACHE_MAX_BYTES, HOT_CACHE_MESSAGES_PER_CONVERSATION, HOT_CACHE_TTL
+)
+from chat.models import Message
+from chat.hydration import hydrate_messages
+from chat.pagination import encode_cursor
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+ENTRY_OVERHEAD_BYTES = 64  # Stima dell'overhead per messaggio oltre al JSON
+
+def estimate_size(message):
+    """Dimensione stimata di un messaggio idratato (byte del JSON serializzato)"""
+    return len(json.dumps(message, default=str)) + ENTRY_OVERHEAD_BYTES
+
+def _cursor(message):
+    """Cursore di paginazione di un messaggio idratato"""
+    if not message.get('timestamp'):
+        return None
+    return encode_cursor(datetime.fromisoformat(message['timestamp']), message['id'])
+
+class _ConversationBuffer:
+    """Ring buffer dei messaggi di una conversazione, in ordine cronologico"""
+
+    def __init__(self, capacity, has_more_before):
+        self.entries = deque(maxlen=capacity)  # (messaggio, dimensione)
+        self.bytes = 0
+        self.has_more_before = has_more_before
+        self.loaded_at = time.monotonic()
+
+    def append(self, message, size):
+        if len(self.entries) == self.entries.maxlen:
+            # Il messaggio più vecchio esce dal buffer: esistono messaggi precedenti
+            self.bytes -= self.entries[0][1]
+            self.has_more_before = True
+        self.entries.append((message, size))
+        self.bytes += size
+
+    def replace(self, predicate, transform):
+        """Sostituisce (copy-on-write) i messaggi che soddisfano predicate"""
+        for index, (message, size) in enumerate(self.entries):
+            if predicate(message):
+                updated = transform(message)
+                new_size = estimate_size(updated)
+                self.entries[index] = (updated, new_size)
+                self.bytes += new_size - size
+
+    def remove(self, message_id):
+        for index, (message, size) in enumerate(self.entries):
+            if message['id'] == message_id:
+                del self.entries[index]
+                self.bytes -= size
+                return True
+        return False
+
+    def position(self, message_id):
+        for index, (message, _) in enumerate(self.entries):
+            if message['id'] == message_id:
+                return index
+        return None
+
+class HotMessageCache:
+    """
+    Cache LRU di ring buffer per conversazione.
+
+    Args:
+        max_bytes (int): Dimensione totale stimata oltre la quale si evincono le
+            conversazioni usate meno di recente
+        per_conversation (int): Messaggi massimi tenuti per conversazione
+        ttl (float): Secondi dopo i quali un buffer viene riletto dal database
+    """
+
+    def __init__(self, max_bytes=HOT_CACHE_MAX_BYTES, per_conversation=HOT_CACHE_MESSAGES_PER_CONVERSATION,
+                 ttl=HOT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.per_conversation = per_conversation
+        self.ttl = ttl
+        self._buffers = OrderedDict()  # conversation_id -> _ConversationBuffer
+        self._pending = {}  # conversation_id -> id dei messaggi scritti ma non ancora nel buffer
+        self._generations = {}  # conversation_id -> scritture viste (anche senza buffer)
+        self._epoch = 0  # invalidazioni dell'intera cache
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'stale': 0, 'evictions': 0,
+                       'discarded_stores': 0}
+
+    def get_page(self, conversation_id, limit):
+        """
+        Ultimi limit messaggi della conversazione, se il buffer copre la finestra.
+
+        Args:
+            conversation_id (int): ID della conversazione
+            limit (int): Numero di messaggi richiesti
+
+        Returns:
+            tuple or None: (messaggi, info cursori come page_info) oppure None (miss)
+        """
+        with self._lock:
+            buffer = self._buffers.get(conversation_id)
+            if buffer is None:
+                self._stats['misses'] += 1
+                return None
+            if self._pending.get(conversation_id):
+                # Scritture non applicate al buffer: rileggi dal database
+                self._drop(conversation_id)
+                self._stats['stale'] += 1
+                self._stats['misses'] += 1
+                return None
+            if self.ttl and time.monotonic() - buffer.loaded_at > self.ttl:
+                self._drop(conversation_id)
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            if len(buffer.entries) < limit and buffer.has_more_before:
+                self._stats['misses'] += 1
+                return None
+
+            self._buffers.move_to_end(conversation_id)
+            self._stats['hits'] += 1
+            messages = [message for message, _ in buffer.entries][-limit:]
+            has_more_before = len(buffer.entries) > limit or buffer.has_more_before
+
+        info = {
+            'before': _cursor(messages[0]) if messages else None,
+            'after': _cursor(messages[-1]) if messages else None,
+            'hasMoreBefore': has_more_before,
+            'hasMoreAfter': False,
+        }
+        return messages, info
+
+    def begin_load(self, conversation_id):
+        """
+        Generazione della conversazione da passare a store(), letta prima della query.
+
+        Returns:
+            tuple: Invalidazioni totali e scritture viste finora per la conversazione
+        """
+        with self._lock:
+            return self._generation(conversation_id)
+
+    def store(self, conversation_id, messages, has_more_before, generation=None):
+        """
+        Salva l'ultima pagina letta dal database (popolamento in lettura).
+
+        Args:
+            conversation_id (int): ID della conversazione
+            messages (list): Messaggi idratati in ordine cronologico
+            has_more_before (bool): Esistono messaggi precedenti alla pagina
+            generation (tuple, optional): Valore di begin_load() prima della lettura; se
+                nel frattempo c'è stata una scrittura la pagina non viene salvata
+
+        Returns:
+            bool: False se la pagina è stata scartata perché superata da una scrittura
+        """
+        buffer = _ConversationBuffer(self.per_conversation, has_more_before)
+        for message in messages:
+            buffer.append(message, estimate_size(message))
+        with self._lock:
+            if generation is not None and self._generation(conversation_id) != generation:
+                # La pagina potrebbe non contenere la scrittura: il prossimo join rilegge
+                self._stats['discarded_stores'] += 1
+                return False
+            self._drop(conversation_id)
+            self._pending.pop(conversation_id, None)
+            self._buffers[conversation_id] = buffer
+            self._bytes += buffer.bytes
+            self._evict()
+        return True
+
+    def append(self, conversation_id, message):
+        """Aggiunge un nuovo messaggio in coda al buffer (se la conversazione è in cache)"""
+        size = estimate_size(message)
+        with self._lock:
+            self._written(conversation_id)
+            self._clear_pending(conversation_id, message['id'])
+            buffer = self._buffers.get(conversation_id)
+            if buffer is None:
+                return
+            before = buffer.bytes
+            if buffer.position(message['id']) is not None:
+                buffer.replace(lambda m: m['id'] == message['id'], lambda m: message)
+            else:
+                buffer.append(message, size)
+            self._bytes += buffer.bytes - before
+            self._buffers.move_to_end(conversation_id)
+            self._evict()
+
+    def update(self, conversation_id, message_id, changes):
+        """
+        Applica una modifica a un messaggio e alle anteprime delle risposte che lo citano.
+
+        Args:
+            conversation_id (int): ID della conversazione
+            message_id (int): ID del messaggio modificato
+            changes (dict): Campi aggiornati (es. text, edited, editedAt)
+        """
+        with self._lock:
+            self._written(conversation_id)
+            self._clear_pending(conversation_id, message_id)
+            buffer = self._buffers.get(conversation_id)
+            if buffer is None:
+                return
+            before = buffer.bytes
+            buffer.replace(lambda m: m['id'] == message_id, lambda m: dict(m, **changes))
+            if 'text' in changes:
+                buffer.replace(
+                    lambda m: (m.get('replyTo') or {}).get('id') == message_id,
+                    lambda m: dict(m, replyTo=dict(m['replyTo'], text=changes['text']))
+                )
+            self._bytes += buffer.bytes - before
+
+    def remove(self, conversation_id, message_id):
+        """Rimuove un messaggio eliminato e le risposte che lo citano"""
+        with self._lock:
+            self._written(conversation_id)
+            self._clear_pending(conversation_id, message_id)
+            buffer = self._buffers.get(conversation_id)
+            if buffer is None:
+                return
+            before = buffer.bytes
+            buffer.remove(message_id)
+            # Le chiavi esterne sono ON DELETE SET NULL
+            buffer.replace(lambda m: (m.get('replyTo') or {}).get('id') == message_id,
+                           lambda m: dict(m, replyTo=None))
+            self._bytes += buffer.bytes - before
+
+    def mark_pending(self, conversation_id, message_id):
+        """Segnala una scrittura sul database non ancora applicata al buffer"""
+        with self._lock:
+            self._written(conversation_id)
+            if conversation_id in self._buffers:
+                self._pending.setdefault(conversation_id, set()).add(message_id)
+
+    def invalidate(self, conversation_id=None):
+        """Elimina il buffer di una conversazione (o tutti se conversation_id è None)"""
+        with self._lock:
+            if conversation_id is None:
+                self._epoch += 1
+                self._buffers.clear()
+                self._pending.clear()
+                self._bytes = 0
+            else:
+                self._written(conversation_id)
+                self._drop(conversation_id)
+                self._pending.pop(conversation_id, None)
+
+    def mark_committed(self, conversation_id):
+        """Segnala il commit di una scrittura: le letture iniziate prima non vanno salvate"""
+        with self._lock:
+            self._written(conversation_id)
+
+    def is_cached(self, conversation_id):
+        with self._lock:
+            return conversation_id in self._buffers
+
+    def get_stats(self):
+        """Hit rate, occupazione ed eviction della cache"""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(
+                self._stats,
+                enabled=HOT_CACHE_ENABLED,
+                hit_rate=round(self._stats['hits'] / lookups, 4) if lookups else None,
+                conversations=len(self._buffers),
+                messages=sum(len(buffer.entries) for buffer in self._buffers.values()),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+                per_conversation=self.per_conversation,
+                ttl=self.ttl,
+            )
+
+    def _written(self, conversation_id):
+        # Va chiamata con il lock acquisito
+        self._generations[conversation_id] = self._generations.get(conversation_id, 0) + 1
+
+    def _generation(self, conversation_id):
+        return self._epoch, self._generations.get(conversation_id, 0)
+
+    def _clear_pending(self, conversation_id, message_id):
+        pending = self._pending.get(conversation_id)
+        if pending:
+            pending.discard(message_id)
+            if not pending:
+                del self._pending[conversation_id]
+
+    def _drop(self, conversation_id):
+        buffer = self._buffers.pop(conversation_id, None)
+        if buffer is not None:
+            self._bytes -= buffer.bytes
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._buffers:
+            conversation_id, buffer = self._buffers.popitem(last=False)
+            self._bytes -= buffer.bytes
+            self._pending.pop(conversation_id, None)
+            self._stats['evictions'] += 1
+
+_message_cache = None
+_cache_lock = threading.Lock()
+
+def get_message_cache():
+    """
+    Restituisce la cache condivisa del processo, creandola al primo utilizzo.
+
+    Returns:
+        HotMessageCache or None: None se disattivata da configurazione (HOT_CACHE_ENABLED)
+    """
+    global _message_cache
+    if not HOT_CACHE_ENABLED:
+        return None
+    if _message_cache is None:
+        with _cache_lock:
+            if _message_cache is None:
+                _message_cache = HotMessageCache()
+    return _message_cache
+
+def get_message_cache_stats():
+    """Metriche della cache per la dashboard"""
+    cache = get_message_cache()
+    if cache is None:
+        return {'enabled': False}
+    return cache.get_stats()
+
+def cache_new_message(db, message):
+    """
+    Aggiunge al buffer un messaggio appena salvato (dopo il commit).
+
+    Il messaggio viene idratato solo se la sua conversazione è in cache; in caso di
+    errore il buffer della conversazione viene scartato.
+
+    Args:
+        db (Session): Sessione del database
+        message (Message): Messaggio salvato
+    """
+    cache = get_message_cache()
+    if cache is None or message.message_type == 'memory':
+        return
+    conversation_id = message.conversation_id
+    if not cache.is_cached(conversation_id):
+        return
+    try:
+        hydrated = hydrate_messages(db, [message])
+        cache.append(conversation_id, hydrated[0])
+    except Exception as e:
+        logger.warning(f"Impossibile aggiornare la cache della conversazione {conversation_id}: {e}")
+        cache.invalidate(conversation_id)
+
+def _on_message_write(mapper, connection, target):
+    """Evento del mapper: ogni scrittura di un messaggio in cache è pendente finché non applicata"""
+    cache = get_message_cache()
+    if cache is None or target.message_type == 'memory':
+        return
+    cache.mark_pending(target.conversation_id, target.id)
+    # Una lettura iniziata tra il flush e il commit non vede ancora la scrittura
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('message_cache_written', set()).add(target.conversation_id)
+
+@event.listens_for(Session, 'after_commit')
+def _on_commit(session):
+    written = session.info.pop('message_cache_written', None)
+    cache = get_message_cache()
+    if written and cache is not None:
+        for conversation_id in written:
+            cache.mark_committed(conversation_id)
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Message, _event_name, _on_message_write)
@@ -0,0 +1,253 @@
+"""
+Ricerca full-text dei messaggi con ranking, evidenziazione e paginazione.
+
+La colonna generata messages.search_vector (migrazione 'messages_search_vector')
+unisce due configurazioni:
+- italian (peso A): parole ridotte alla radice, "riunioni" trova "riunione"
+- simple (peso B): parole esatte, anche nomi propri, codici e nome del file allegato
+ed è indicizzata con GIN. La query è websearch_to_tsquery('italian') sul testo intero,
+in OR con le parole precedenti (sempre in sintassi websearch) unite a un prefisso
+sull'ultima parola in 'simple', così anche la parola ancora in digitazione trova
+risultati. Il prefisso si applica solo a una parola semplice: non a un -escluso, a una
+"frase" o all'operatore or.
+
+I risultati sono ordinati per rilevanza (ts_rank_cd), poi dal più recente; il cursore
+contiene (rank, created_at, id) dell'ultimo risultato. Lo snippet (ts_headline) è
+calcolato solo sulle righe della pagina ed è HTML già escapato con i termini in <mark>.
+"""
+import base64
+import html
+import json
+import logging
+import re
+from datetime import datetime
+
+from sqlalchemy import text
+
+from common.config import CHAT_SCHEMA
+from chat.pagination import InvalidCursor
+from chat.user_directory import get_user
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+
+# Delimitatori dei termini evidenziati (caratteri ad uso privato, sostituiti dopo l'escape HTML)
+_START_SEL = '\ue000'
+_STOP_SEL = '\ue001'
+_HEADLINE_OPTIONS = f"StartSel={_START_SEL}, StopSel={_STOP_SEL}, MaxWords=25, MinWords=8, MaxFragments=2"
+
+_WORD = re.compile(r'\w+')
+# Token della sintassi websearch: "frase" (anche non ancora chiusa) o sequenza senza spazi
+_TOKEN = re.compile(r'"[^"]*"?|\S+')
+
+# Testo intero, oppure in OR le parole precedenti unite (&& o ||) al prefisso dell'ultima
+_PLAIN_QUERY = "websearch_to_tsquery('italian', :q)"
+_PREFIX_QUERY = ("websearch_to_tsquery('italian', :q) || "
+                 "(websearch_to_tsquery('italian', :head) {operator} to_tsquery('simple', :prefix))")
+
+_SEARCH_SQL = """
+    WITH q AS (
+        SELECT {query} AS query
+    ), hits AS (
+        SELECT m.id, m.conversation_id, m.user_id, m.text, m.created_at,
+               c.type AS conversation_type, c.name AS conversation_name,
+               ts_rank_cd(m.search_vector, q.query)::float8 AS rank, q.query
+        FROM {schema}.messages m
+        CROSS JOIN q
+        JOIN {schema}.conversations c ON c.id = m.conversation_id
+        WHERE m.search_vector @@ q.query
+          AND m.user_id IS NOT NULL
+          AND coalesce(m.message_type, 'normal') <> 'memory'
+          AND (c.type = 'channel' OR (c.type = 'direct' AND EXISTS (
+              SELECT 1 FROM {schema}.conversation_participants p
+              WHERE p.conversation_id = c.id AND p.user_id = :user_id)))
+          {filters}
+        ORDER BY rank DESC, m.created_at DESC, m.id DESC
+        LIMIT :limit
+    )
+    SELECT id, conversation_id, user_id, text, created_at, conversation_type, conversation_name, rank,
+           ts_headline('italian', coalesce(text, ''), query, :headline_options) AS snippet
+    FROM hits
+    ORDER BY rank DESC, created_at DESC, id DESC
+"""
+
+# Filtri opzionali: (nome del parametro, condizione SQL)
+_FILTERS = [
+    ('conversation_id', "m.conversation_id = :conversation_id"),
+    ('sender_id', "m.user_id = :sender_id"),
+    ('since', "m.created_at >= :since"),
+    ('until', "m.created_at < :until"),
+]
+
+def _last_token(query):
+    tokens = list(_TOKEN.finditer(query))
+    return tokens[-1] if tokens else None
+
+def build_prefix_query(query):
+    """
+    Separa l'ultima parola semplice di query, da cercare come prefisso.
+
+    Args:
+        query (str): Testo cercato dall'utente (sintassi websearch)
+
+    Returns:
+        tuple or None: (parole precedenti in sintassi websearch, tsquery 'simple' del
+            prefisso, operatore '&&' o '||' se preceduto da or), es.
+            ('riunione', 'doman:*', '&&'); None se l'ultimo token è un -escluso, una
+            "frase", or o non contiene parole
+    """
+    last = _last_token(query)
+    if last is None:
+        return None
+    token = last.group()
+    words = _WORD.findall(token.casefold())
+    if token.startswith(('"', '-')) or token.casefold() == 'or' or not words:
+        return None
+
+    head = query[:last.start()].rstrip()
+    operator = '&&'
+    previous = _last_token(head)
+    if previous is not None and previous.group().casefold() == 'or':
+        # "a or doman": il prefisso è un'alternativa alle parole precedenti
+        head = head[:previous.start()].rstrip()
+        operator = '||'
+    return head, ' & '.join(words[:-1] + [f"{words[-1]}:*"]), operator
+
+def encode_search_cursor(rank, created_at, message_id):
+    """Cursore opaco della posizione (rank, created_at, id) di un risultato"""
+    payload = json.dumps({'r': rank, 't': created_at.isoformat(), 'i': message_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_search_cursor(cursor):
+    """
+    Decodifica un cursore prodotto da encode_search_cursor.
+
+    Returns:
+        tuple: (rank, created_at, message_id)
+
+    Raises:
+        InvalidCursor: se il cursore non è valido
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return float(payload['r']), datetime.fromisoformat(payload['t']), int(payload['i'])
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        raise InvalidCursor(f"Cursore non valido: {cursor}") from e
+
+def render_snippet(snippet):
+    """Escape HTML dello snippet di ts_headline con i termini trovati in <mark>"""
+    return html.escape(snippet or '').replace(_START_SEL, '<mark>').replace(_STOP_SEL, '</mark>')
+
+def parse_message_search_args(args):
+    """
+    Legge filtri e paginazione della ricerca messaggi dalla query string di
+    /api/search o dal payload dell'evento Socket.IO 'search'.
+
+    Parametri: conversationId, userId, from/to (date ISO 8601), hasFile (true/false),
+    cursor, limit.
+
+    Args:
+        args: request.args o dizionario del payload
+
+    Returns:
+        dict: Argomenti per search_messages (solo quelli presenti)
+
+    Raises:
+        ValueError: se un parametro non è valido
+    """
+    filters = {}
+    for arg, name in (('conversationId', 'conversation_id'), ('userId', 'sender_id'), ('limit', 'limit')):
+        if args.get(arg):
+            filters[name] = int(args[arg])
+    for arg, name in (('from', 'since'), ('to', 'until')):
+        if args.get(arg):
+            filters[name] = datetime.fromisoformat(args[arg])
+    if args.get('hasFile') not in (None, ''):
+        filters['has_file'] = str(args['hasFile']).lower() in ('true', '1', 't')
+    if args.get('cursor'):
+        decode_search_cursor(args['cursor'])
+        filters['cursor'] = args['cursor']
+    return filters
+
+def search_messages(db, query, user_id=1, conversation_id=None, sender_id=None, since=None, until=None,
+                    has_file=None, cursor=None, limit=DEFAULT_SEARCH_LIMIT, schema=CHAT_SCHEMA):
+    """
+    Cerca i messaggi delle conversazioni accessibili all'utente.
+
+    Args:
+        db: Sessione o connessione SQLAlchemy
+        query (str): Testo da cercare (sintassi websearch: "frase esatta", -escluso, or)
+        user_id (int): Utente che cerca (canali e suoi messaggi diretti)
+        conversation_id (int, optional): Solo questa conversazione
+        sender_id (int, optional): Solo i messaggi di questo utente
+        since (datetime, optional): Solo messaggi creati da questa data (inclusa)
+        until (datetime, optional): Solo messaggi creati prima di questa data
+        has_file (bool, optional): Solo messaggi con (True) o senza (False) allegato
+        cursor (str, optional): Cursore della pagina precedente
+        limit (int): Risultati per pagina (massimo MAX_SEARCH_LIMIT)
+        schema (str): Schema della chat
+
+    Returns:
+        tuple: (risultati nel formato di /api/search, cursore della pagina successiva o None)
+
+    Raises:
+        InvalidCursor: se il cursore non è valido
+    """
+    if not _WORD.search(query):
+        return [], None
+    limit = max(1, min(int(limit), MAX_SEARCH_LIMIT))
+
+    params = {
+        'q': query, 'user_id': user_id, 'limit': limit + 1,
+        'headline_options': _HEADLINE_OPTIONS,
+        'conversation_id': conversation_id, 'sender_id': sender_id, 'since': since, 'until': until,
+    }
+    filters = [condition for name, condition in _FILTERS if params[name] is not None]
+    if has_file is True:
+        filters.append("jsonb_typeof(m.file_data) = 'object'")
+    elif has_file is False:
+        filters.append("coalesce(jsonb_typeof(m.file_data), 'null') <> 'object'")
+    if cursor:
+        params['cursor_rank'], params['cursor_created_at'], params['cursor_id'] = decode_search_cursor(cursor)
+        filters.append("(ts_rank_cd(m.search_vector, q.query)::float8, m.created_at, m.id)"
+                       " < (:cursor_rank, :cursor_created_at, :cursor_id)")
+
+    prefix = build_prefix_query(query)
+    if prefix is None:
+        tsquery = _PLAIN_QUERY
+    else:
+        params['head'], params['prefix'], operator = prefix
+        tsquery = _PREFIX_QUERY.format(operator=operator)
+
+    sql = _SEARCH_SQL.format(schema=schema, query=tsquery, filters=''.join(f"\n          AND {f}" for f in filters))
+    rows = db.execute(text(sql), params).mappings().all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_search_cursor(last['rank'], last['created_at'], last['id'])
+
+    results = []
+    for row in rows:
+        user = get_user(row['user_id']) or {}
+        results.append({
+            "id": row['id'],
+            "conversationId": row['conversation_id'],
+            "text": row['text'],
+            "timestamp": row['created_at'].isoformat(),
+            "user": {
+                "id": row['user_id'],
+                "username": user.get('username'),
+                "displayName": user.get('displayName'),
+                "avatarUrl": user.get('avatarUrl')
+            },
+            "conversationType": row['conversation_type'],
+            "conversationName": row['conversation_name'],
+            "snippet": render_snippet(row['snippet'])
+        })
+    return results, next_cursor
@@ -0,0 +1,492 @@
+"""
+Migrazioni incrementali dello schema chat per i database già esistenti.
+
+chat/schema.sql descrive lo schema completo per le nuove installazioni; qui ogni
+migrazione è idempotente (IF NOT EXISTS) e può essere rieseguita senza effetti.
+
+Le migrazioni applicate sono registrate in schema_migrations. Modelli e query assumono lo
+schema completo (es. messages.seq): le migrazioni mancanti vanno applicate a ogni deploy,
+prima di avviare i worker (python -m chat.migrations --pending, fase release del Procfile).
+Alcune riscrivono o bloccano tabelle grandi, per questo l'applicazione all'avvio dei worker
+(register_handlers, CHAT_AUTO_MIGRATE) è disattivata di default. Un advisory lock evita
+che più processi le eseguano insieme.
+
+Un CREATE INDEX CONCURRENTLY interrotto lascia un indice INVALID che IF NOT EXISTS
+salterebbe per sempre: viene eliminato e ricreato alla riesecuzione.
+
+Utilizzo:
+    python -m chat.migrations            # applica tutte le migrazioni
+    python -m chat.migrations --pending  # applica solo quelle non registrate
+    python -m chat.migrations --list     # elenca le migrazioni disponibili
+    python -m chat.migrations --cleanup drop_read_status  # pulizia irreversibile, a mano
+"""
+import argparse
+import logging
+import re
+import sys
+
+from common.config import CHAT_SCHEMA
+from common.db.connection import get_raw_connection
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+# Trigger che mantiene conversation_state e conversation_unread (chat/conversation_state.py).
+# Un messaggio è non letto per un utente se non è suo, non è 'memory' e ha id maggiore
+# del watermark last_read_message_id.
+CONVERSATION_STATE_FUNCTION = """
+CREATE OR REPLACE FUNCTION {schema}.maintain_conversation_state() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF coalesce(NEW.message_type, 'normal') = 'memory' THEN RETURN NULL; END IF;
+        INSERT INTO {schema}.conversation_state AS cs
+            (conversation_id, last_message_id, last_message_user_id, last_message_at, last_message_preview, updated_at)
+        VALUES (NEW.conversation_id, NEW.id, NEW.user_id, NEW.created_at,
+                {schema}.message_preview(NEW.text, NEW.file_data), CURRENT_TIMESTAMP)
+        ON CONFLICT (conversation_id) DO UPDATE SET
+            last_message_id = EXCLUDED.last_message_id,
+            last_message_user_id = EXCLUDED.last_message_user_id,
+            last_message_at = EXCLUDED.last_message_at,
+            last_message_preview = EXCLUDED.last_message_preview,
+            updated_at = EXCLUDED.updated_at
+        WHERE cs.last_message_id IS NULL
+           OR (cs.last_message_at, cs.last_message_id) < (EXCLUDED.last_message_at, EXCLUDED.last_message_id);
+        UPDATE {schema}.conversation_unread
+        SET unread_count = unread_count + 1
+        WHERE conversation_id = NEW.conversation_id
+          AND user_id <> NEW.user_id
+          AND NEW.id > coalesce(last_read_message_id, 0);
+        RETURN NULL;
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE {schema}.conversation_state
+        SET last_message_preview = {schema}.message_preview(NEW.text, NEW.file_data)
+        WHERE conversation_id = NEW.conversation_id AND last_message_id = NEW.id;
+        RETURN NULL;
+    END IF;
+    IF coalesce(OLD.message_type, 'normal') <> 'memory' THEN
+        UPDATE {schema}.conversation_unread
+        SET unread_count = GREATEST(unread_count - 1, 0)
+        WHERE conversation_id = OLD.conversation_id
+          AND user_id <> OLD.user_id
+          AND OLD.id > coalesce(last_read_message_id, 0);
+    END IF;
+    -- Se era l'ultimo messaggio ricalcola il precedente (solo UPDATE: con la
+    -- cancellazione a cascata della conversazione la riga non va ricreata)
+    UPDATE {schema}.conversation_state cs
+    SET last_message_id = m.id,
+        last_message_user_id = m.user_id,
+        last_message_at = m.created_at,
+        last_message_preview = {schema}.message_preview(m.text, m.file_data),
+        updated_at = CURRENT_TIMESTAMP
+    FROM (SELECT 1) AS one
+    LEFT JOIN LATERAL (
+        SELECT id, user_id, created_at, text, file_data FROM {schema}.messages
+        WHERE conversation_id = OLD.conversation_id AND coalesce(message_type, 'normal') <> 'memory'
+        ORDER BY created_at DESC, id DESC LIMIT 1
+    ) m ON TRUE
+    WHERE cs.conversation_id = OLD.conversation_id AND cs.last_message_id = OLD.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+# Righe di conversation_unread create quando un utente diventa destinatario (partecipante di
+# un messaggio diretto, membro di un canale, conversazione creata per un canale esistente),
+# così la lista conversazioni non scrive nulla in lettura. I messaggi già presenti sono non letti.
+CONVERSATION_READERS_FUNCTION = """
+CREATE OR REPLACE FUNCTION {schema}.add_conversation_readers() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'conversations' THEN
+        INSERT INTO {schema}.conversation_unread (conversation_id, user_id)
+        SELECT NEW.id, cm.user_id
+        FROM {schema}.channels ch
+        JOIN {schema}.channel_members cm ON cm.channel_id = ch.id
+        WHERE NEW.type = 'channel' AND ch.name = NEW.name
+        ON CONFLICT (conversation_id, user_id) DO NOTHING;
+    ELSIF TG_TABLE_NAME = 'conversation_participants' THEN
+        INSERT INTO {schema}.conversation_unread (conversation_id, user_id, unread_count)
+        SELECT NEW.conversation_id, NEW.user_id, count(*)
+        FROM {schema}.messages m
+        WHERE m.conversation_id = NEW.conversation_id AND m.user_id <> NEW.user_id
+          AND coalesce(m.message_type, 'normal') <> 'memory'
+        ON CONFLICT (conversation_id, user_id) DO NOTHING;
+    ELSE
+        INSERT INTO {schema}.conversation_unread (conversation_id, user_id, unread_count)
+        SELECT c.id, NEW.user_id, (
+            SELECT count(*) FROM {schema}.messages m
+            WHERE m.conversation_id = c.id AND m.user_id <> NEW.user_id
+              AND coalesce(m.message_type, 'normal') <> 'memory')
+        FROM {schema}.conversations c
+        JOIN {schema}.channels ch ON ch.name = c.name
+        WHERE c.type = 'channel' AND ch.id = NEW.channel_id
+        ON CONFLICT (conversation_id, user_id) DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+# Converte le letture per messaggio (message_read_status) e last_read_at in watermark e
+# ricalcola i contatori. Le scritture su messages attendono la fine. Tabella e colonna
+# restano al loro posto (la versione precedente del codice le usa ancora, per un eventuale
+# rollback del deploy): le elimina solo la migrazione di pulizia drop_read_status.
+COLLAPSE_READ_STATUS = """
+DO $$
+DECLARE
+    collapsed BOOLEAN := FALSE;
+BEGIN
+    LOCK TABLE {schema}.messages IN SHARE MODE;
+    IF to_regclass('{schema}.message_read_status') IS NOT NULL THEN
+        INSERT INTO {schema}.conversation_unread AS cu (conversation_id, user_id, last_read_message_id)
+        SELECT m.conversation_id, r.user_id, max(r.message_id)
+        FROM {schema}.message_read_status r
+        JOIN {schema}.messages m ON m.id = r.message_id
+        GROUP BY m.conversation_id, r.user_id
+        ON CONFLICT (conversation_id, user_id) DO UPDATE SET
+            last_read_message_id = GREATEST(cu.last_read_message_id, EXCLUDED.last_read_message_id);
+        collapsed := TRUE;
+    END IF;
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = '{schema}' AND table_name = 'conversation_unread'
+                 AND column_name = 'last_read_at') THEN
+        UPDATE {schema}.conversation_unread cu
+        SET last_read_message_id = GREATEST(cu.last_read_message_id, (
+            SELECT max(m.id) FROM {schema}.messages m
+            WHERE m.conversation_id = cu.conversation_id AND m.created_at <= cu.last_read_at))
+        WHERE cu.last_read_at IS NOT NULL;
+        collapsed := TRUE;
+    END IF;
+    IF collapsed THEN
+        UPDATE {schema}.conversation_unread cu
+        SET unread_count = (
+            SELECT count(*) FROM {schema}.messages m
+            WHERE m.conversation_id = cu.conversation_id AND m.user_id <> cu.user_id
+              AND coalesce(m.message_type, 'normal') <> 'memory'
+              AND m.id > coalesce(cu.last_read_message_id, 0));
+    END IF;
+END;
+$$
+"""
+
+# Numeri di sequenza per conversazione (chat/sync.py). Il contatore è conversation_state.last_seq:
+# il lock sulla riga resta fino al commit, quindi i seq diventano visibili in ordine crescente.
+# In UPDATE e DELETE la riga non viene mai creata (eliminazione a cascata della conversazione).
+MESSAGE_SEQUENCE_FUNCTION = """
+CREATE OR REPLACE FUNCTION {schema}.assign_message_seq() RETURNS TRIGGER AS $$
+DECLARE
+    next_seq BIGINT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE {schema}.conversation_state SET last_seq = last_seq + 1
+        WHERE conversation_id = OLD.conversation_id
+        RETURNING last_seq INTO next_seq;
+        IF next_seq IS NOT NULL THEN
+            INSERT INTO {schema}.message_tombstones (conversation_id, seq, message_id)
+            VALUES (OLD.conversation_id, next_seq, OLD.id);
+        END IF;
+        RETURN NULL;
+    END IF;
+    IF NEW.conversation_id IS NULL THEN RETURN NEW; END IF;
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO {schema}.conversation_state AS cs (conversation_id, last_seq)
+        VALUES (NEW.conversation_id, 1)
+        ON CONFLICT (conversation_id) DO UPDATE SET last_seq = cs.last_seq + 1
+        RETURNING last_seq INTO next_seq;
+    ELSE
+        UPDATE {schema}.conversation_state SET last_seq = last_seq + 1
+        WHERE conversation_id = NEW.conversation_id
+        RETURNING last_seq INTO next_seq;
+    END IF;
+    NEW.seq := coalesce(next_seq, NEW.seq);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+# Numera i messaggi esistenti (per conversazione, in ordine di id) e crea i trigger nella
+# stessa transazione, con le scritture su messages bloccate: nessun messaggio resta senza seq.
+BACKFILL_MESSAGE_SEQUENCE = """
+DO $$
+BEGIN
+    LOCK TABLE {schema}.messages IN SHARE ROW EXCLUSIVE MODE;
+    UPDATE {schema}.messages m SET seq = n.base + n.rn
+    FROM (
+        SELECT m2.id, coalesce(cs.last_seq, 0) AS base,
+               row_number() OVER (PARTITION BY m2.conversation_id ORDER BY m2.id) AS rn
+        FROM {schema}.messages m2
+        LEFT JOIN {schema}.conversation_state cs ON cs.conversation_id = m2.conversation_id
+        WHERE m2.seq IS NULL AND m2.conversation_id IS NOT NULL
+    ) n
+    WHERE m.id = n.id;
+    INSERT INTO {schema}.conversation_state AS cs (conversation_id, last_seq)
+    SELECT conversation_id, max(seq) FROM {schema}.messages
+    WHERE conversation_id IS NOT NULL
+    GROUP BY conversation_id
+    ON CONFLICT (conversation_id) DO UPDATE SET last_seq = GREATEST(cs.last_seq, EXCLUDED.last_seq);
+    DROP TRIGGER IF EXISTS message_seq_insert ON {schema}.messages;
+    CREATE TRIGGER message_seq_insert BEFORE INSERT ON {schema}.messages
+        FOR EACH ROW EXECUTE FUNCTION {schema}.assign_message_seq();
+    DROP TRIGGER IF EXISTS message_seq_update ON {schema}.messages;
+    CREATE TRIGGER message_seq_update BEFORE UPDATE OF
+        text, file_data, message_type, metadata, edited, reply_to_id, forwarded_from_id, user_id
+        ON {schema}.messages FOR EACH ROW EXECUTE FUNCTION {schema}.assign_message_seq();
+    DROP TRIGGER IF EXISTS message_seq_delete ON {schema}.messages;
+    CREATE TRIGGER message_seq_delete AFTER DELETE ON {schema}.messages
+        FOR EACH ROW EXECUTE FUNCTION {schema}.assign_message_seq();
+END;
+$$
+"""
+
+# (nome, istruzioni SQL) in ordine di applicazione; {schema} viene sostituito con CHAT_SCHEMA.
+# Le istruzioni CONCURRENTLY richiedono autocommit: ogni istruzione è eseguita da sola.
+MIGRATIONS = [
+    ('messages_keyset_index', [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_conversation_created_id "
+        "ON {schema}.messages (conversation_id, created_at, id) INCLUDE (message_type, user_id)",
+    ]),
+    # Contatori non letti e ultimo messaggio per la lista conversazioni (chat/conversation_state.py).
+    # Dopo la migrazione: python -m chat.conversation_state backfill
+    ('conversation_state', [
+        "CREATE TABLE IF NOT EXISTS {schema}.conversation_state ("
+        " conversation_id INTEGER PRIMARY KEY REFERENCES {schema}.conversations(id) ON DELETE CASCADE,"
+        " last_message_id INTEGER,"
+        " last_message_user_id INTEGER,"
+        " last_message_at TIMESTAMP,"
+        " last_message_preview TEXT,"
+        " updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+        "CREATE TABLE IF NOT EXISTS {schema}.conversation_unread ("
+        " conversation_id INTEGER REFERENCES {schema}.conversations(id) ON DELETE CASCADE,"
+        " user_id INTEGER REFERENCES {schema}.users(id) ON DELETE CASCADE,"
+        " unread_count INTEGER NOT NULL DEFAULT 0,"
+        " last_read_message_id INTEGER,"
+        " PRIMARY KEY (conversation_id, user_id))",
+        "CREATE INDEX IF NOT EXISTS idx_conversation_unread_user_id ON {schema}.conversation_unread (user_id)",
+        # Anteprima dell'ultimo messaggio: testo o nome del file allegato
+        "CREATE OR REPLACE FUNCTION {schema}.message_preview(body TEXT, file_data JSONB) RETURNS TEXT AS $$"
+        " SELECT left(coalesce(nullif(body, ''), file_data->>'name', ''), 200)"
+        " $$ LANGUAGE sql IMMUTABLE",
+        # Le tabelle create prima di read_watermarks hanno ancora last_read_at
+        "ALTER TABLE {schema}.conversation_unread ADD COLUMN IF NOT EXISTS last_read_message_id INTEGER",
+        CONVERSATION_STATE_FUNCTION,
+        "DROP TRIGGER IF EXISTS conversation_state_insert ON {schema}.messages",
+        "CREATE TRIGGER conversation_state_insert AFTER INSERT ON {schema}.messages"
+        " FOR EACH ROW EXECUTE FUNCTION {schema}.maintain_conversation_state()",
+        "DROP TRIGGER IF EXISTS conversation_state_update ON {schema}.messages",
+        "CREATE TRIGGER conversation_state_update AFTER UPDATE OF text, file_data ON {schema}.messages"
+        " FOR EACH ROW EXECUTE FUNCTION {schema}.maintain_conversation_state()",
+        "DROP TRIGGER IF EXISTS conversation_unread_delete ON {schema}.messages",
+        "DROP TRIGGER IF EXISTS conversation_state_delete ON {schema}.messages",
+        "CREATE TRIGGER conversation_state_delete AFTER DELETE ON {schema}.messages"
+        " FOR EACH ROW EXECUTE FUNCTION {schema}.maintain_conversation_state()",
+    ]),
+    # Watermark di lettura al posto di una riga per (messaggio, utente): vedi COLLAPSE_READ_STATUS
+    ('read_watermarks', [
+        COLLAPSE_READ_STATUS,
+    ]),
+    # Ricerca full-text (chat/message_search.py). Aggiungere una colonna STORED riscrive la
+    # tabella messages sotto lock esclusivo: da eseguire in un momento di basso traffico
+    ('messages_search_vector', [
+        "ALTER TABLE {schema}.messages ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        "GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('italian', coalesce(text, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(text, '') || ' ' || coalesce(file_data->>'name', '')), 'B')"
+        ") STORED",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_search_vector "
+        "ON {schema}.messages USING GIN (search_vector)",
+    ]),
+    # Recupero dopo la riconnessione (chat/sync.py): richiede conversation_state. Il backfill
+    # riscrive tutti i messaggi con le scritture bloccate: da eseguire con poco traffico
+    ('message_sequence', [
+        "ALTER TABLE {schema}.conversation_state ADD COLUMN IF NOT EXISTS last_seq BIGINT NOT NULL DEFAULT 0",
+        "ALTER TABLE {schema}.conversation_state ADD COLUMN IF NOT EXISTS sync_floor_seq BIGINT NOT NULL DEFAULT 0",
+        "ALTER TABLE {schema}.messages ADD COLUMN IF NOT EXISTS seq BIGINT",
+        "CREATE TABLE IF NOT EXISTS {schema}.message_tombstones ("
+        " conversation_id INTEGER NOT NULL,"
+        " seq BIGINT NOT NULL,"
+        " message_id INTEGER NOT NULL,"
+        " deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,"
+        " PRIMARY KEY (conversation_id, seq))",
+        MESSAGE_SEQUENCE_FUNCTION,
+        BACKFILL_MESSAGE_SEQUENCE,
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_conversation_seq "
+        "ON {schema}.messages (conversation_id, seq)",
+    ]),
+    # Righe dei non letti create dalle scritture (vedi CONVERSATION_READERS_FUNCTION); quelle
+    # dei destinatari esistenti vengono dal backfill di chat.conversation_state
+    ('conversation_readers', [
+        CONVERSATION_READERS_FUNCTION,
+        "DROP TRIGGER IF EXISTS conversation_readers_conversation ON {schema}.conversations",
+        "CREATE TRIGGER conversation_readers_conversation AFTER INSERT ON {schema}.conversations"
+        " FOR EACH ROW EXECUTE FUNCTION {schema}.add_conversation_readers()",
+        "DROP TRIGGER IF EXISTS conversation_readers_participant ON {schema}.conversation_participants",
+        "CREATE TRIGGER conversation_readers_participant AFTER INSERT ON {schema}.conversation_participants"
+        " FOR EACH ROW EXECUTE FUNCTION {schema}.add_conversation_readers()",
+        "DROP TRIGGER IF EXISTS conversation_readers_member ON {schema}.channel_members",
+        "CREATE TRIGGER conversation_readers_member AFTER INSERT ON {schema}.channel_members"
+        " FOR EACH ROW EXECUTE FUNCTION {schema}.add_conversation_readers()",
+    ]),
+    # Presenza condivisa tra i worker (chat/presence.py)
+    ('user_presence', [
+        "CREATE TABLE IF NOT EXISTS {schema}.user_presence ("
+        " worker_id VARCHAR(100) NOT NULL,"
+        " user_id INTEGER NOT NULL REFERENCES {schema}.users(id) ON DELETE CASCADE,"
+        " status VARCHAR(50) NOT NULL,"
+        " updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,"
+        " expires_at TIMESTAMP NOT NULL,"
+        " PRIMARY KEY (worker_id, user_id))",
+        "CREATE INDEX IF NOT EXISTS idx_user_presence_user_id ON {schema}.user_presence (user_id)",
+    ]),
+]
+
+# Migrazioni di pulizia irreversibili: mai applicate da --pending né all'avvio, solo con
+# python -m chat.migrations --cleanup <nome> quando non serve più tornare alla versione precedente
+CLEANUP_MIGRATIONS = [
+    # Letture per messaggio già convertite in watermark da read_watermarks
+    ('drop_read_status', [
+        "DROP TABLE IF EXISTS {schema}.message_read_status",
+        "ALTER TABLE {schema}.conversation_unread DROP COLUMN IF EXISTS last_read_at",
+    ]),
+]
+
+# Registro delle migrazioni applicate
+_CREATE_REGISTRY_SQL = """
+    CREATE TABLE IF NOT EXISTS {schema}.schema_migrations (
+        name TEXT PRIMARY KEY,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
+"""
+
+# Chiave dell'advisory lock che serializza le migrazioni tra processi
+_MIGRATION_LOCK_KEY = 'chat_schema_migrations'
+
+# Indici creati con CONCURRENTLY: un'esecuzione interrotta li lascia INVALID
+_CONCURRENT_INDEX_RE = re.compile(r'CREATE INDEX CONCURRENTLY IF NOT EXISTS (\w+)')
+
+_INVALID_INDEX_SQL = """
+    SELECT 1 FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = %s AND c.relname = %s AND NOT i.indisvalid
+"""
+
+def _drop_invalid_index(cur, schema, index_name):
+    """Elimina l'indice se è rimasto INVALID, così CREATE INDEX ... IF NOT EXISTS lo ricrea"""
+    cur.execute(_INVALID_INDEX_SQL, (schema, index_name))
+    if cur.fetchone():
+        logger.warning(f"Indice {schema}.{index_name} non valido (creazione interrotta): viene ricreato")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {schema}.{index_name}")
+
+def _apply(cur, names, schema, migrations=MIGRATIONS):
+    """Esegue le migrazioni indicate (tutte se names è vuoto) e le registra"""
+    applied = []
+    cur.execute(_CREATE_REGISTRY_SQL.format(schema=schema))
+    for name, statements in migrations:
+        if names and name not in names:
+            continue
+        logger.info(f"Migrazione {name}")
+        for statement in statements:
+            index = _CONCURRENT_INDEX_RE.search(statement)
+            if index:
+                _drop_invalid_index(cur, schema, index.group(1))
+            cur.execute(statement.format(schema=schema))
+        cur.execute(f"INSERT INTO {schema}.schema_migrations (name) VALUES (%s) ON CONFLICT (name) DO NOTHING",
+                    (name,))
+        applied.append(name)
+    return applied
+
+def run_migrations(names=None, schema=CHAT_SCHEMA):
+    """
+    Applica le migrazioni (tutte o solo quelle indicate).
+
+    Args:
+        names (list, optional): Nomi delle migrazioni da applicare
+        schema (str): Schema su cui applicarle
+
+    Returns:
+        list: Nomi delle migrazioni applicate
+    """
+    conn = get_raw_connection()
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            return _apply(cur, names, schema)
+    finally:
+        conn.close()
+
+def run_cleanup_migrations(names, schema=CHAT_SCHEMA):
+    """
+    Applica le migrazioni di pulizia indicate per nome (mai tutte implicitamente).
+
+    Args:
+        names (list): Nomi delle migrazioni di CLEANUP_MIGRATIONS da applicare
+        schema (str): Schema su cui applicarle
+
+    Returns:
+        list: Nomi delle migrazioni applicate
+    """
+    unknown = set(names) - {name for name, _ in CLEANUP_MIGRATIONS}
+    if not names or unknown:
+        raise ValueError(f"Migrazioni di pulizia da indicare per nome: {', '.join(sorted(unknown)) or 'nessuna'}")
+    conn = get_raw_connection()
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            return _apply(cur, names, schema, migrations=CLEANUP_MIGRATIONS)
+    finally:
+        conn.close()
+
+def run_pending_migrations(schema=CHAT_SCHEMA):
+    """
+    Applica le migrazioni non ancora registrate in schema_migrations.
+
+    Le migrazioni già eseguite a mano prima del registro vengono rieseguite una volta
+    (sono idempotenti). Dopo 'conversation_state' o 'conversation_readers' ricalcola i
+    contatori e crea le righe dei destinatari esistenti (backfill).
+
+    Args:
+        schema (str): Schema su cui applicarle
+
+    Returns:
+        list: Nomi delle migrazioni applicate
+    """
+    conn = get_raw_connection()
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(hashtext(%s))", (_MIGRATION_LOCK_KEY,))
+            try:
+                cur.execute(_CREATE_REGISTRY_SQL.format(schema=schema))
+                cur.execute(f"SELECT name FROM {schema}.schema_migrations")
+                done = {row[0] for row in cur.fetchall()}
+                pending = [name for name, _ in MIGRATIONS if name not in done]
+                applied = _apply(cur, pending, schema) if pending else []
+                if {'conversation_state', 'conversation_readers'} & set(applied):
+                    # Import locale: chat.conversation_state importa i modelli
+                    from chat.conversation_state import backfill
+                    backfill(schema)
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(hashtext(%s))", (_MIGRATION_LOCK_KEY,))
+    finally:
+        conn.close()
+    return applied
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrazioni dello schema chat")
+    parser.add_argument('names', nargs='*', help="Migrazioni da applicare (default: tutte)")
+    parser.add_argument('--list', action='store_true')
+    parser.add_argument('--pending', action='store_true', help="Solo le migrazioni non registrate")
+    parser.add_argument('--cleanup', action='store_true',
+                        help="Migrazioni di pulizia irreversibili indicate per nome (es. drop_read_status)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.list:
+        for name, _ in MIGRATIONS:
+            print(name)
+        for name, _ in CLEANUP_MIGRATIONS:
+            print(f"{name} (--cleanup)")
+        sys.exit(0)
+    if args.cleanup:
+        applied = run_cleanup_migrations(args.names)
+    else:
+        applied = run_pending_migrations() if args.pending else run_migrations(args.names)
+    print(f"Migrazioni applicate: {', '.join(applied) or 'nessuna'}")
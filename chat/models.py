@@ -3,7 +3,8 @@ Modelli SQLAlchemy per il modulo chat.
 """
 import json
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, ForeignKey, Text, JSON, UniqueConstraint
+from sqlalchemy import (Column, String, Integer, BigInteger, Boolean, DateTime, ForeignKey, Text, JSON, UniqueConstraint,
+                        Index, FetchedValue)
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -86,6 +87,8 @@ class Message(Base):
     edited = Column(Boolean, default=False)
     edited_at = Column(DateTime)
     created_at = Column(DateTime, server_default=func.now())
+    # Numero di sequenza dell'ultima modifica nella conversazione, assegnato dai trigger (chat/sync.py)
+    seq = Column(BigInteger, server_default=FetchedValue(), server_onupdate=FetchedValue())
     
     # Relazioni
     conversation = relationship("Conversation", back_populates="messages")
@@ -93,6 +96,12 @@ class Message(Base):
     reply_to = relationship("Message", remote_side=[id], foreign_keys=[reply_to_id])
     forwarded_from = relationship("Message", remote_side=[id], foreign_keys=[forwarded_from_id])
     
+    __table_args__ = (
+        # Indice composito per la paginazione a cursore (chat/pagination.py)
+        Index('idx_messages_conversation_created_id', 'conversation_id', 'created_at', 'id',
+              postgresql_include=['message_type', 'user_id']),
+    )
+    
     def to_dict(self):
         """Converte l'oggetto in dizionario"""
         user_dict = None
@@ -171,24 +180,43 @@ class ChannelMember(Base):
     channel = relationship("Channel", back_populates="members")
     user = relationship("User")
 
-class MessageReadStatus(Base):
-    """Modello per tracciare lo stato di lettura dei messaggi"""
-    __tablename__ = "message_read_status"
-    
-    id = Column(Integer, primary_key=True)
-    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"))
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
-    read_at = Column(DateTime, server_default=func.now())
-    
-    # Relazioni
-    message = relationship("Message")
-    user = relationship("User")
-    
+class ConversationState(Base):
+    """Ultimo messaggio di una conversazione, mantenuto dai trigger su messages"""
+    __tablename__ = "conversation_state"
+
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True)
+    last_message_id = Column(Integer)
+    last_message_user_id = Column(Integer)
+    last_message_at = Column(DateTime)
+    last_message_preview = Column(Text)
+    updated_at = Column(DateTime, server_default=func.now())
+    # Ultimo numero di sequenza assegnato e primo da cui syncSince è affidabile (chat/sync.py)
+    last_seq = Column(BigInteger, nullable=False, server_default='0')
+    sync_floor_seq = Column(BigInteger, nullable=False, server_default='0')
+
+class ConversationUnread(Base):
+    """Watermark di lettura e contatore dei non letti per (conversazione, utente), mantenuto dai trigger su messages"""
+    __tablename__ = "conversation_unread"
+
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    unread_count = Column(Integer, nullable=False, default=0)
+    last_read_message_id = Column(Integer)  # watermark: letti tutti i messaggi con id <= di questo
+
     __table_args__ = (
-        # Garantisce che un messaggio sia marcato come letto solo una volta per utente
-        UniqueConstraint('message_id', 'user_id', name='uq_message_read_user'),
+        Index('idx_conversation_unread_user_id', 'user_id'),
     )
 
+class MessageTombstone(Base):
+    """Messaggio eliminato, con il numero di sequenza dell'eliminazione (chat/sync.py)"""
+    __tablename__ = "message_tombstones"
+
+    # Senza chiave esterna: le eliminazioni a cascata della conversazione possono scriverne ancora
+    conversation_id = Column(Integer, primary_key=True)
+    seq = Column(BigInteger, primary_key=True)
+    message_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, server_default=func.now())
+
 class UserSetting(Base):
     """Modello per le impostazioni degli utenti"""
     __tablename__ = "user_settings"
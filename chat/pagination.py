@@ -0,0 +1,167 @@
+"""
+Paginazione a cursore (keyset) della cronologia dei messaggi.
+
+Le pagine sono ordinate su (created_at, id): il cursore contiene la coppia del primo o
+dell'ultimo messaggio della pagina ed è opaco per il client (base64 url-safe).
+
+La pagina si legge in due passi: il confronto tra tuple seleziona solo (id, created_at)
+filtrando su message_type e user_id, colonne tutte presenti nell'indice covering
+idx_messages_conversation_created_id (conversation_id, created_at, id) INCLUDE
+(message_type, user_id), quindi è un index-only scan il cui costo non dipende dalla
+profondità della pagina; poi le righe Message e User vengono caricate per chiave primaria
+solo per gli id della pagina.
+"""
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+from chat.models import Message, User
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+class InvalidCursor(ValueError):
+    """Cursore di paginazione non valido o manomesso"""
+
+def encode_cursor(created_at, message_id):
+    """
+    Codifica la posizione (created_at, id) di un messaggio in un cursore opaco.
+
+    Args:
+        created_at (datetime): Data di creazione del messaggio
+        message_id (int): ID del messaggio
+
+    Returns:
+        str: Cursore base64 url-safe
+    """
+    payload = json.dumps({'t': created_at.isoformat(), 'i': message_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    Decodifica un cursore prodotto da encode_cursor.
+
+    Returns:
+        tuple: (created_at, message_id)
+
+    Raises:
+        InvalidCursor: se il cursore non è valido
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(payload['t']), int(payload['i'])
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        raise InvalidCursor(f"Cursore non valido: {cursor}") from e
+
+def cursor_from_message_id(db, message_id):
+    """
+    Converte il vecchio parametro before_id in un cursore (compatibilità con i client esistenti).
+
+    Returns:
+        str or None: Cursore del messaggio, None se il messaggio non esiste
+    """
+    message = db.query(Message.created_at, Message.id).filter(Message.id == message_id).first()
+    if not message or message.created_at is None:
+        return None
+    return encode_cursor(message.created_at, message.id)
+
+def clamp_page_size(limit):
+    """Limita la dimensione della pagina a [1, MAX_PAGE_SIZE]"""
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def get_message_page(db, conversation_id, limit=DEFAULT_PAGE_SIZE, before=None, after=None):
+    """
+    Restituisce una pagina di messaggi di una conversazione.
+
+    Senza cursori restituisce i messaggi più recenti; con before la pagina precedente
+    (più vecchia), con after quella successiva (più recente).
+
+    Args:
+        db (Session): Sessione SQLAlchemy
+        conversation_id (int): ID della conversazione
+        limit (int): Messaggi per pagina
+        before (str, optional): Cursore: messaggi strettamente più vecchi
+        after (str, optional): Cursore: messaggi strettamente più recenti
+
+    Returns:
+        dict: rows (coppie Message, User dal più vecchio al più recente), before e after
+              (cursori per le pagine adiacenti), has_more_before, has_more_after
+
+    Raises:
+        InvalidCursor: se un cursore non è valido
+    """
+    limit = clamp_page_size(limit)
+    position = tuple_(Message.created_at, Message.id)
+
+    # Solo colonne dell'indice: user_id non nullo equivale al join con users (FK ON DELETE SET NULL)
+    query = (
+        db.query(Message.id, Message.created_at)
+        .filter(
+            Message.conversation_id == conversation_id,
+            Message.message_type != 'memory',  # Escludi i messaggi di tipo memory
+            Message.user_id.isnot(None)
+        )
+    )
+
+    if after:
+        created_at, message_id = decode_cursor(after)
+        query = query.filter(position > tuple_(created_at, message_id))
+        query = query.order_by(Message.created_at.asc(), Message.id.asc())
+    else:
+        if before:
+            created_at, message_id = decode_cursor(before)
+            query = query.filter(position < tuple_(created_at, message_id))
+        query = query.order_by(Message.created_at.desc(), Message.id.desc())
+
+    # Una riga in più per sapere se esiste un'altra pagina nella stessa direzione
+    keys = query.limit(limit + 1).all()
+    has_more = len(keys) > limit
+    keys = keys[:limit]
+    if not after:
+        keys.reverse()
+
+    rows = []
+    if keys:
+        rows = (
+            db.query(Message, User)
+            .join(User, Message.user_id == User.id)
+            .filter(Message.id.in_([key.id for key in keys]))
+            .order_by(Message.created_at.asc(), Message.id.asc())
+            .all()
+        )
+
+    return {
+        'rows': rows,
+        'before': encode_cursor(keys[0].created_at, keys[0].id) if keys else before,
+        'after': encode_cursor(keys[-1].created_at, keys[-1].id) if keys else after,
+        'has_more_before': has_more if not after else True,
+        'has_more_after': has_more if after else bool(before),
+    }
+
+def page_headers(page):
+    """Intestazioni HTTP con i cursori della pagina (il corpo resta la lista dei messaggi)"""
+    headers = {
+        'X-Has-More-Before': 'true' if page['has_more_before'] else 'false',
+        'X-Has-More-After': 'true' if page['has_more_after'] else 'false',
+    }
+    if page['before']:
+        headers['X-Cursor-Before'] = page['before']
+    if page['after']:
+        headers['X-Cursor-After'] = page['after']
+    return headers
+
+def page_info(page):
+    """Cursori della pagina per gli eventi Socket.IO"""
+    return {
+        'before': page['before'],
+        'after': page['after'],
+        'hasMoreBefore': page['has_more_before'],
+        'hasMoreAfter': page['has_more_after'],
+    }
@@ -0,0 +1,400 @@
+"""
+Presenza degli utenti (eventi Socket.IO 'heartbeat', 'setStatus' e 'presence').
+
+User.status era solo una colonna riscritta da ensure_users_exist: nessuno seguiva le
+connessioni reali. Qui ogni connessione (sid) è associata al suo utente e tiene vivo
+lo stato con i heartbeat:
+- un utente con almeno una connessione attiva è 'online' (o lo stato scelto con
+  setStatus: 'away', 'busy')
+- una connessione senza heartbeat (l'evento 'heartbeat', inviato da socket.js ogni 30
+  secondi, o qualsiasi altro evento del client) da PRESENCE_HEARTBEAT_TIMEOUT secondi
+  non conta più per la presenza (il socket resta aperto; il prossimo heartbeat la registra
+  di nuovo)
+- dopo l'ultima disconnessione l'utente resta nello stato precedente per
+  PRESENCE_GRACE_SECONDS: un ricaricamento della pagina o una riconnessione non
+  producono offline/online
+
+Le connessioni sono per processo, ma con più worker lo stesso utente può avere socket su
+worker diversi. Ogni worker scrive lo stato dei propri utenti nella tabella user_presence
+(una riga per worker e utente) e users.status è lo stato aggregato di tutte le righe (la
+più recente vince, nessuna riga = 'offline'). Le righe vengono rinnovate ogni
+PRESENCE_PERSIST_INTERVAL secondi e scadono dopo tre intervalli senza rinnovo (worker
+fermato o bloccato).
+
+I cambiamenti non vengono inviati a ogni evento: ogni PRESENCE_TICK_SECONDS un task in
+background sincronizza le righe cambiate e ricalcola users.status; solo il worker il cui
+UPDATE cambia lo stato aggregato trasmette l'evento 'presence' {changes: [{userId, status}]},
+così un utente passato da un worker all'altro non viene mostrato offline e nessun
+cambiamento viene inviato due volte.
+"""
+import functools
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from flask import request
+from sqlalchemy import text
+
+from common.config import (CHAT_SCHEMA, PRESENCE_TICK_SECONDS, PRESENCE_GRACE_SECONDS, PRESENCE_HEARTBEAT_TIMEOUT,
+                           PRESENCE_PERSIST_INTERVAL)
+from common.db.connection import get_db_session
+from chat.database import SessionLocal
+from chat.user_directory import invalidate_users
+from chat.directory_snapshot import invalidate_directory_snapshot
+from chat.autocomplete import invalidate_autocomplete
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+ONLINE = 'online'
+OFFLINE = 'offline'
+MANUAL_STATUSES = ('online', 'away', 'busy')
+# Intervalli di rinnovo mancati dopo i quali le righe di un worker scadono
+PRESENCE_TTL_INTERVALS = 3
+
+# Serializza le sincronizzazioni dei worker: lo stato aggregato viene calcolato dopo
+# che le scritture degli altri worker sono visibili
+_LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext('chat_presence'))"
+
+_DELETE_ROWS_SQL = """
+    DELETE FROM {schema}.user_presence
+    WHERE worker_id = :worker_id AND user_id = ANY(CAST(:user_ids AS INTEGER[]))
+"""
+
+_UPSERT_ROW_SQL = """
+    INSERT INTO {schema}.user_presence AS p (worker_id, user_id, status, updated_at, expires_at)
+    VALUES (:worker_id, :user_id, :status, clock_timestamp(),
+            clock_timestamp() + make_interval(secs => :ttl))
+    ON CONFLICT (worker_id, user_id) DO UPDATE SET
+        status = EXCLUDED.status,
+        updated_at = CASE WHEN p.status = EXCLUDED.status THEN p.updated_at ELSE EXCLUDED.updated_at END,
+        expires_at = EXCLUDED.expires_at
+"""
+
+_EXPIRE_ROWS_SQL = "DELETE FROM {schema}.user_presence WHERE expires_at < clock_timestamp()"
+
+# Stato aggregato degli utenti toccati e di quelli non offline (righe scadute, stati
+# lasciati dalle versioni precedenti): la riga cambiata più di recente vince
+_AGGREGATE_SQL = """
+    UPDATE {schema}.users u SET status = agg.status
+    FROM (
+        SELECT t.id, coalesce((
+            SELECT p.status FROM {schema}.user_presence p
+            WHERE p.user_id = t.id
+            ORDER BY p.updated_at DESC, p.worker_id
+            LIMIT 1), 'offline') AS status
+        FROM (SELECT unnest(CAST(:user_ids AS INTEGER[])) AS id
+              UNION
+              SELECT id FROM {schema}.users WHERE status IS DISTINCT FROM 'offline') t
+    ) agg
+    WHERE u.id = agg.id AND u.status IS DISTINCT FROM agg.status
+    RETURNING u.id, u.status
+"""
+
+_LOAD_SQL = """
+    SELECT id, status FROM {schema}.users
+    WHERE status IS NOT NULL AND status <> 'offline'
+    ORDER BY id
+"""
+
+def _sql(template, schema):
+    return text(template.format(schema=schema))
+
+class PresenceStore:
+    """
+    Righe di presenza del worker in user_presence e stato aggregato in users.status.
+
+    Args:
+        worker_id (str, optional): Identificativo del processo (default: host, pid e suffisso casuale)
+        ttl (float): Secondi dopo i quali le righe non rinnovate scadono
+        schema (str): Schema della chat
+    """
+
+    def __init__(self, worker_id=None, ttl=PRESENCE_TTL_INTERVALS * PRESENCE_PERSIST_INTERVAL, schema=CHAT_SCHEMA):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.ttl = ttl
+        self.schema = schema
+
+    def sync(self, statuses, removed):
+        """
+        Scrive le righe del worker e ricalcola lo stato aggregato degli utenti.
+
+        Args:
+            statuses (dict): user_id -> stato da scrivere o rinnovare
+            removed (iterable): Utenti non più presenti su questo worker
+
+        Returns:
+            list: [{'userId', 'status'}] per gli utenti il cui stato aggregato è cambiato
+        """
+        removed = sorted(removed)
+        with get_db_session(SessionLocal) as db:
+            db.execute(text(_LOCK_SQL))
+            if removed:
+                db.execute(_sql(_DELETE_ROWS_SQL, self.schema), {'worker_id': self.worker_id, 'user_ids': removed})
+            if statuses:
+                db.execute(_sql(_UPSERT_ROW_SQL, self.schema), [
+                    {'worker_id': self.worker_id, 'user_id': user_id, 'status': status, 'ttl': self.ttl}
+                    for user_id, status in statuses.items()
+                ])
+            db.execute(_sql(_EXPIRE_ROWS_SQL, self.schema))
+            rows = db.execute(_sql(_AGGREGATE_SQL, self.schema),
+                              {'user_ids': sorted(set(statuses) | set(removed))}).all()
+        changes = [{'userId': user_id, 'status': status} for user_id, status in sorted(rows)]
+        if changes:
+            # L'UPDATE testuale non genera gli eventi del mapper: le cache vanno invalidate qui
+            for change in changes:
+                invalidate_users(change['userId'])
+            invalidate_directory_snapshot()
+            invalidate_autocomplete()
+        return changes
+
+    def load(self):
+        """
+        Stati aggregati degli utenti non offline.
+
+        Returns:
+            list: [{'userId', 'status'}]
+        """
+        with get_db_session(SessionLocal) as db:
+            rows = db.execute(_sql(_LOAD_SQL, self.schema)).all()
+        return [{'userId': user_id, 'status': status} for user_id, status in rows]
+
+class PresenceTracker:
+    """
+    Connessioni per utente con heartbeat, periodo di grazia e sincronizzazione a tick fissi.
+
+    Args:
+        emit (callable): emit(evento, payload) a tutti i client, di solito socketio.emit
+        start_task (callable): Avvia una funzione in background (socketio.start_background_task)
+        sleep (callable): Attesa cooperativa (socketio.sleep)
+        store: Stato condiviso tra i worker con sync(statuses, removed) e load(), vedi PresenceStore
+        clock (callable): Orologio monotono in secondi
+    """
+
+    def __init__(self, emit, start_task, sleep=time.sleep, store=None, clock=time.monotonic,
+                 tick=PRESENCE_TICK_SECONDS, grace=PRESENCE_GRACE_SECONDS,
+                 heartbeat_timeout=PRESENCE_HEARTBEAT_TIMEOUT, persist_interval=PRESENCE_PERSIST_INTERVAL):
+        self.emit = emit
+        self.start_task = start_task
+        self.sleep = sleep
+        self.store = store if store is not None else PresenceStore()
+        self.clock = clock
+        self.tick_seconds = tick
+        self.grace = grace
+        self.heartbeat_timeout = heartbeat_timeout
+        self.persist_interval = persist_interval
+        self._sessions = {}  # sid -> (user_id, ultimo heartbeat)
+        self._sids_by_user = {}  # user_id -> set di sid
+        self._manual = {}  # user_id -> stato scelto con setStatus
+        self._offline_at = {}  # user_id -> fine del periodo di grazia
+        self._synced = {}  # user_id -> stato scritto nelle righe di questo worker
+        self._last_refresh = None
+        self._running = False
+        self._lock = threading.Lock()
+        self._stats = {'ticks': 0, 'broadcasts': 0, 'changes_sent': 0, 'expired_sessions': 0,
+                       'syncs': 0, 'rows_synced': 0, 'sync_errors': 0}
+
+    def connect(self, sid, user_id):
+        """Registra una connessione dell'utente e avvia il task dei tick al primo utilizzo"""
+        with self._lock:
+            self._sessions[sid] = (user_id, self.clock())
+            self._sids_by_user.setdefault(user_id, set()).add(sid)
+            self._offline_at.pop(user_id, None)
+            start = not self._running
+            self._running = True
+        if start:
+            self.start_task(self._run)
+
+    def heartbeat(self, sid):
+        """
+        Segnale di vita della connessione.
+
+        Returns:
+            bool: False se la connessione non è registrata (il client deve rifare connect)
+        """
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session is None:
+                return False
+            self._sessions[sid] = (session[0], self.clock())
+            return True
+
+    def on_traffic(self, handler):
+        """
+        Decora un handler Socket.IO: ogni evento ricevuto vale anche come heartbeat.
+
+        Un client che invia messaggi o cambia conversazione resta online anche se i suoi
+        heartbeat periodici non arrivano.
+        """
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            self.heartbeat(request.sid)
+            return handler(*args, **kwargs)
+        return wrapper
+
+    def set_status(self, sid, status):
+        """
+        Stato scelto dall'utente della connessione ('online', 'away', 'busy').
+
+        Returns:
+            str or None: Lo stato impostato, None se la connessione o lo stato non sono validi
+        """
+        if status not in MANUAL_STATUSES:
+            return None
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session is None:
+                return None
+            user_id = session[0]
+            self._sessions[sid] = (user_id, self.clock())
+            if status == ONLINE:
+                self._manual.pop(user_id, None)
+            else:
+                self._manual[user_id] = status
+        return status
+
+    def disconnect(self, sid):
+        """Rimuove la connessione; l'ultima di un utente avvia il periodo di grazia"""
+        with self._lock:
+            self._drop(sid)
+
+    def statuses(self):
+        """
+        Stati attuali di tutti i worker, per i client appena connessi.
+
+        Returns:
+            list: [{'userId', 'status'}] per gli utenti non offline
+        """
+        try:
+            return self.store.load()
+        except Exception as e:
+            logger.error(f"Errore nella lettura degli stati di presenza: {e}")
+            return []
+
+    def tick(self):
+        """
+        Scarta le connessioni senza heartbeat, sincronizza le righe del worker e invia i
+        cambiamenti dello stato aggregato.
+
+        Returns:
+            list: Cambiamenti inviati ([{'userId', 'status'}])
+        """
+        now = self.clock()
+        with self._lock:
+            self._stats['ticks'] += 1
+            for sid, (_, last_seen) in list(self._sessions.items()):
+                if now - last_seen > self.heartbeat_timeout:
+                    # Già in silenzio da heartbeat_timeout: nessun periodo di grazia
+                    self._drop(sid, grace=0)
+                    self._stats['expired_sessions'] += 1
+
+            local = {}
+            for user_id in set(self._sids_by_user) | set(self._offline_at) | set(self._synced):
+                status = self._status_of(user_id, now)
+                if status is None:
+                    # Periodo di grazia: resta lo stato già scritto
+                    if user_id in self._synced:
+                        local[user_id] = self._synced[user_id]
+                elif status == OFFLINE:
+                    self._offline_at.pop(user_id, None)
+                    self._manual.pop(user_id, None)
+                else:
+                    local[user_id] = status
+
+            refresh = self._last_refresh is None or now - self._last_refresh >= self.persist_interval
+            statuses = dict(local) if refresh else {
+                user_id: status for user_id, status in local.items() if self._synced.get(user_id) != status
+            }
+            removed = set(self._synced) - set(local)
+        if not (statuses or removed or refresh):
+            return []
+
+        try:
+            changes = self.store.sync(statuses, removed)
+        except Exception as e:
+            # Le differenze restano: riprova al prossimo tick
+            logger.error(f"Errore nella sincronizzazione della presenza: {e}")
+            with self._lock:
+                self._stats['sync_errors'] += 1
+            return []
+
+        with self._lock:
+            self._synced.update(statuses)
+            for user_id in removed:
+                self._synced.pop(user_id, None)
+            if refresh:
+                self._last_refresh = now
+            self._stats['syncs'] += 1
+            self._stats['rows_synced'] += len(statuses) + len(removed)
+            if changes:
+                self._stats['broadcasts'] += 1
+                self._stats['changes_sent'] += len(changes)
+
+        if changes:
+            self.emit('presence', {'changes': changes})
+        return changes
+
+    def get_stats(self):
+        """Connessioni, utenti per stato su questo worker e contatori di tick e sincronizzazioni"""
+        with self._lock:
+            by_status = {}
+            for status in self._synced.values():
+                by_status[status] = by_status.get(status, 0) + 1
+            return dict(
+                self._stats,
+                connections=len(self._sessions),
+                users_by_status=by_status,
+                in_grace=len(self._offline_at),
+                tick_seconds=self.tick_seconds,
+                persist_interval=self.persist_interval,
+            )
+
+    def _drop(self, sid, grace=None):
+        # Va chiamata con il lock acquisito
+        session = self._sessions.pop(sid, None)
+        if session is None:
+            return
+        user_id = session[0]
+        sids = self._sids_by_user.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._sids_by_user[user_id]
+                self._offline_at[user_id] = self.clock() + (self.grace if grace is None else grace)
+
+    def _status_of(self, user_id, now):
+        # Stato su questo worker; None durante il periodo di grazia (resta quello scritto)
+        if user_id in self._sids_by_user:
+            return self._manual.get(user_id, ONLINE)
+        offline_at = self._offline_at.get(user_id)
+        if offline_at is not None and now < offline_at:
+            return None
+        return OFFLINE
+
+    def _run(self):
+        while True:
+            self.sleep(self.tick_seconds)
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Errore nel tick della presenza: {e}")
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+def init_presence(socketio):
+    """Crea il tracker del processo sui metodi di socketio (chiamata da register_handlers)"""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = PresenceTracker(socketio.emit, socketio.start_background_task, sleep=socketio.sleep)
+    return _tracker
+
+def get_presence_stats():
+    """Metriche della presenza per la dashboard"""
+    if _tracker is None:
+        return {'connections': 0, 'users_by_status': {}}
+    return _tracker.get_stats()
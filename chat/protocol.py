@@ -0,0 +1,220 @@
+"""
+Versioni del protocollo Socket.IO per i messaggi, negoziate per connessione.
+
+- 1 (completo, default): ogni messaggio contiene l'oggetto utente intero e replyTo
+  con testo e fileData del messaggio citato, come sempre
+- 2 (compatto): i messaggi riferiscono l'autore con userId e gli utenti viaggiano a
+  parte nella lista 'users', solo se il client non li ha già ricevuti (o sono cambiati);
+  replyTo diventa un'anteprima con il testo troncato a REPLY_SNIPPET_CHARS
+
+Il client chiede la versione con auth={'protocol': 2} alla connessione o con l'evento
+'hello' {protocol: 2}; il server risponde con 'protocol' {version}. Gli utenti di
+initialData contano come già ricevuti.
+
+Le emissioni a una room restano nel formato completo per le connessioni v1 (e per i
+worker remoti con la message queue: un client v2 deve accettare anche messaggi con
+'user'); le connessioni v2 di questo processo ricevono la versione compatta. Per ogni
+payload compatto vengono misurati i byte rispetto al formato completo.
+"""
+import logging
+import threading
+
+from flask_socketio import emit
+
+from common.config import REPLY_SNIPPET_CHARS
+from common.serialization import dumps, to_jsonable
+from chat.subscriptions import get_subscriptions
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+PROTOCOL_FULL = 1
+PROTOCOL_COMPACT = 2
+SUPPORTED_PROTOCOLS = (PROTOCOL_FULL, PROTOCOL_COMPACT)
+
+def truncate_snippet(text, limit=REPLY_SNIPPET_CHARS):
+    """Testo accorciato a limit caratteri, con '…' se troncato"""
+    text = (text or '').strip()
+    if len(text) <= limit:
+        return text
+    return text[:limit - 1].rstrip() + '…'
+
+def _reference(user, users):
+    """Aggiunge l'utente alla tabella users e ne restituisce l'id"""
+    if not isinstance(user, dict) or user.get('id') is None:
+        return None
+    users[user['id']] = user
+    return user['id']
+
+def _compact_reply(reply_to, users):
+    """Anteprima compatta del messaggio citato"""
+    preview = {
+        'id': reply_to.get('id'),
+        'userId': _reference(reply_to.get('user'), users),
+        'snippet': truncate_snippet(reply_to.get('text')),
+        'message_type': reply_to.get('message_type'),
+    }
+    file_data = reply_to.get('fileData')
+    if isinstance(file_data, dict) and file_data.get('name'):
+        preview['fileName'] = file_data['name']
+    return preview
+
+def compact_message(message, users):
+    """
+    Versione compatta di un messaggio idratato (il dizionario originale non cambia).
+
+    Args:
+        message (dict): Messaggio nel formato completo
+        users (dict): Raccoglie id -> utente degli utenti riferiti
+
+    Returns:
+        dict: Messaggio con userId al posto di user e replyTo abbreviato
+    """
+    compact = dict(message)
+    compact['userId'] = _reference(compact.pop('user', None), users)
+    if compact.get('replyTo'):
+        compact['replyTo'] = _compact_reply(compact['replyTo'], users)
+    forwarded_from = compact.get('forwardedFrom')
+    if forwarded_from:
+        # forwardedFrom è l'utente di origine dell'inoltro
+        compact['forwardedFrom'] = {'userId': _reference(forwarded_from, users)}
+    return compact
+
+class _Connection:
+    """Versione negoziata e utenti già inviati a una connessione"""
+
+    __slots__ = ('version', 'known_users')
+
+    def __init__(self):
+        self.version = PROTOCOL_FULL
+        self.known_users = {}
+
+class ProtocolRegistry:
+    """Versione del protocollo e utenti noti di ogni connessione, con i byte risparmiati"""
+
+    def __init__(self):
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._stats = {'compact_payloads': 0, 'full_bytes': 0, 'compact_bytes': 0}
+
+    def negotiate(self, sid, requested):
+        """
+        Imposta la versione per la connessione: la più alta supportata non oltre requested.
+
+        Returns:
+            int: Versione in uso
+        """
+        try:
+            requested = int(requested)
+        except (TypeError, ValueError):
+            requested = PROTOCOL_FULL
+        version = max([v for v in SUPPORTED_PROTOCOLS if v <= requested] or [PROTOCOL_FULL])
+        with self._lock:
+            self._connections.setdefault(sid, _Connection()).version = version
+        return version
+
+    def version_of(self, sid):
+        with self._lock:
+            connection = self._connections.get(sid)
+            return connection.version if connection else PROTOCOL_FULL
+
+    def remember_users(self, sid, users):
+        """Segna gli utenti come già ricevuti dal client (es. con initialData)"""
+        with self._lock:
+            known = self._connections.setdefault(sid, _Connection()).known_users
+            for user in users:
+                known[user['id']] = user
+
+    def forget(self, sid):
+        with self._lock:
+            self._connections.pop(sid, None)
+
+    def history_payload(self, sid, messages):
+        """
+        Payload di messageHistory per la connessione.
+
+        Returns:
+            list or dict: La lista dei messaggi (v1) o {'messages', 'users'} (v2)
+        """
+        if self.version_of(sid) != PROTOCOL_COMPACT:
+            return messages
+        users = {}
+        compact = [compact_message(message, users) for message in messages]
+        payload = {'messages': compact, 'users': self._unknown_users(sid, users)}
+        self._measure(messages, payload)
+        return payload
+
+    def message_payload(self, sid, message):
+        """Payload di newMessage per la connessione: compatto con 'users' solo se servono"""
+        if self.version_of(sid) != PROTOCOL_COMPACT:
+            return message
+        users = {}
+        payload = compact_message(message, users)
+        unknown = self._unknown_users(sid, users)
+        if unknown:
+            payload['users'] = unknown
+        self._measure(message, payload)
+        return payload
+
+    def compact_sids(self, sids):
+        """Le connessioni v2 tra sids"""
+        with self._lock:
+            return [sid for sid in sids
+                    if sid in self._connections and self._connections[sid].version == PROTOCOL_COMPACT]
+
+    def get_stats(self):
+        """Connessioni per versione e byte risparmiati dai payload compatti"""
+        with self._lock:
+            stats = dict(self._stats)
+            versions = {}
+            for connection in self._connections.values():
+                versions[connection.version] = versions.get(connection.version, 0) + 1
+        saved = stats['full_bytes'] - stats['compact_bytes']
+        return dict(
+            stats,
+            connections_by_version={str(version): count for version, count in sorted(versions.items())},
+            bytes_saved=saved,
+            saved_ratio=round(saved / stats['full_bytes'], 4) if stats['full_bytes'] else None,
+        )
+
+    def _unknown_users(self, sid, users):
+        # Utenti che il client non ha o che sono cambiati dall'ultimo invio
+        with self._lock:
+            known = self._connections.setdefault(sid, _Connection()).known_users
+            unknown = [user for user_id, user in users.items() if known.get(user_id) != user]
+            for user in unknown:
+                known[user['id']] = user
+        return unknown
+
+    def _measure(self, full, compact):
+        full_bytes = len(dumps(full).encode('utf-8'))
+        compact_bytes = len(dumps(compact).encode('utf-8'))
+        with self._lock:
+            self._stats['compact_payloads'] += 1
+            self._stats['full_bytes'] += full_bytes
+            self._stats['compact_bytes'] += compact_bytes
+
+_registry = ProtocolRegistry()
+
+def get_protocol_registry():
+    """Restituisce il registro delle versioni del processo"""
+    return _registry
+
+def get_protocol_stats():
+    """Metriche del protocollo compatto per la dashboard"""
+    return _registry.get_stats()
+
+def emit_message(event, message, room):
+    """
+    Emette un messaggio a una room: completo per le connessioni v1, compatto per le v2.
+
+    Args:
+        event (str): Evento Socket.IO (es. 'newMessage')
+        message (dict): Messaggio idratato nel formato completo
+        room (str): Room di destinazione
+    """
+    message = to_jsonable(message)
+    compact_sids = _registry.compact_sids(get_subscriptions().members(room))
+    emit(event, message, room=room, skip_sid=compact_sids or None)
+    for sid in compact_sids:
+        emit(event, _registry.message_payload(sid, message), to=sid)
@@ -1,7 +1,7 @@
-from flask import Blueprint, render_template, jsonify, request, send_from_directory
+from flask import Blueprint, render_template, jsonify, request, send_from_directory, Response
 from common.config import SECRET_KEY
 from sqlalchemy import and_, or_, func, desc, select
-from chat.models import User, Conversation, Message, Channel, ChannelMember, ConversationParticipant, MessageReadStatus
+from chat.models import User, Conversation, Message, Channel, ChannelMember, ConversationParticipant
 from chat.database import SessionLocal
 import json
 from datetime import datetime
@@ -10,6 +10,14 @@ from contextlib import contextmanager
 from common.db.connection import get_db_session
 
 from chat.file_utils import save_uploaded_file, init_upload_dir
+from chat.pagination import get_message_page, cursor_from_message_id, page_headers, InvalidCursor
+from chat.hydration import hydrate_messages
+from chat.user_directory import list_users
+from chat.conversation_state import (ConversationNotFound, InvalidReadTarget, get_conversation_summaries,
+                                     is_valid_watermark, mark_conversation_read)
+from chat.message_search import search_messages, parse_message_search_args
+from chat.autocomplete import autocomplete
+from common.serialization import dumps
 
 @contextmanager
 def get_db():
@@ -29,6 +37,32 @@ class CustomJSONEncoder(json.JSONEncoder):
 def safe_json(data):
     return json.dumps(data, cls=CustomJSONEncoder)
 
+def json_response(data, status=200, headers=None):
+    """Risposta JSON già codificata con il backend di common.serialization"""
+    return Response(dumps(data), status=status, headers=headers, mimetype='application/json')
+
+def get_page_from_request(db, conversation_id):
+    """
+    Legge i parametri di paginazione della richiesta e restituisce la pagina di messaggi.
+    
+    Parametri: limit, before/after (cursori opachi), before_id (compatibilità).
+    
+    Raises:
+        InvalidCursor: se un cursore non è valido
+    """
+    before = request.args.get('before')
+    after = request.args.get('after')
+    before_id = request.args.get('before_id')
+    
+    if not before and not after and before_id:
+        try:
+            before = cursor_from_message_id(db, int(before_id))
+        except (ValueError, TypeError):
+            # Log dell'errore, continuiamo senza filtro
+            print(f"Valore before_id non valido: {before_id}")
+    
+    return get_message_page(db, conversation_id, limit=request.args.get('limit', 50), before=before, after=after)
+
 # Create a Blueprint for chat
 chat_bp = Blueprint('chat', __name__, 
                     template_folder='templates',
@@ -47,10 +81,7 @@ def serve_static(filename):
 
 @chat_bp.route('/api/messages/channel/<channel_name>')
 def get_channel_messages(channel_name):
-    """Get messages for a channel"""
-    before_id = request.args.get('before_id')
-    limit = int(request.args.get('limit', 50))
-    
+    """Get messages for a channel (paginazione a cursore: before/after, limit)"""
     try:
         with get_db() as db:
             # Trova la conversazione del canale usando SQLAlchemy
@@ -67,110 +98,20 @@ def get_channel_messages(channel_name):
                 
             conversation_id = conversation.id
             
-            # Costruisci la query SQLAlchemy base
-            query = (
-                db.query(Message, User)
-                .join(User, Message.user_id == User.id)
-                .filter(
-                    Message.conversation_id == conversation_id,                    
-                    Message.message_type != 'memory'  # Escludi i messaggi di tipo memory
-                )
-            )
-            
-              # Aggiunta filtro paginazione con controllo validità
-            if before_id:
-                try:
-                    before_id_int = int(before_id)
-                    query = query.filter(Message.id < before_id_int)
-                except (ValueError, TypeError):
-                    # Log dell'errore, continuiamo senza filtro
-                    print(f"Valore before_id non valido per il canale {channel_name}: {before_id}")
-                
-            # Ordina e limita
-            query = query.order_by(desc(Message.created_at)).limit(limit)
-            
-            # Esegui la query
-            messages = query.all()
-            
-            # Converti in formato per il frontend
-            message_list = []
-            
-            # Crea un dizionario per tenere traccia dei messaggi per riferimento
-            reply_messages = {}
-            reply_ids = [msg.reply_to_id for msg, _ in messages if msg.reply_to_id]
-            
-            # Carica tutti i messaggi citati in un'unica query (per performance)
-            if reply_ids:
-                reply_msg_users = (
-                    db.query(Message, User)
-                    .join(User, Message.user_id == User.id)
-                    .filter(Message.id.in_(reply_ids))
-                    .all()
-                )
-                
-                for reply, user in reply_msg_users:
-                    # Prepara il messaggio di risposta per il riferimento
-                    reply_messages[reply.id] = {
-                        'id': reply.id,
-                        'text': reply.text,
-                        'message_type': reply.message_type,
-                        'fileData': reply.file_data,
-                        'user': {
-                            'id': user.id,
-                            'username': user.username,
-                            'displayName': user.display_name,
-                            'avatarUrl': user.avatar_url,
-                            'status': user.status
-                        }
-                    }
-            
-            for msg, user in messages:
-                try:
-                    # Gestisce il messaggio di risposta
-                    reply_to = None
-                    if msg.reply_to_id and msg.reply_to_id in reply_messages:
-                        reply_to = reply_messages[msg.reply_to_id]
-                    
-                    # Costruisci un dizionario base con valori di default
-                    message_dict = {
-                        'id': msg.id,
-                        'conversationId': msg.conversation_id,
-                        'user': {
-                            'id': user.id,
-                            'username': user.username or 'unknown',
-                            'displayName': user.display_name or 'Unknown User',
-                            'avatarUrl': user.avatar_url or 'https://ui-avatars.com/api/?name=Unknown',
-                            'status': user.status or 'offline'
-                        },
-                        'text': msg.text or '',
-                        'timestamp': msg.created_at.isoformat() if msg.created_at else None,
-                        'type': msg.message_type or 'normal',
-                        'fileData': msg.file_data,
-                        'replyTo': reply_to,
-                        'forwardedFrom': None,  # Si potrebbe espandere anche questo se necessario
-                        'message_metadata': msg.message_metadata or {},
-                        'edited': msg.edited,
-                        'editedAt': msg.edited_at.isoformat() if msg.edited_at else None,
-                        'isOwn': msg.user_id == 1
-                    }
-                    message_list.append(message_dict)
-                except Exception as field_error:
-                    print(f"Error processing message {msg.id} for channel {channel_name}: {str(field_error)}")
-                    print(f"Message data: {msg}")
-                    # Continua con il prossimo messaggio invece di far fallire tutto
-                    continue
-            
-            # Inverti per mostrare i messaggi più vecchi prima
-            message_list.reverse()
+            # Pagina keyset su (created_at, id), già in ordine cronologico
+            page = get_page_from_request(db, conversation_id)
+            # Utenti, risposte e inoltri risolti in blocco (chat/hydration.py)
+            message_list = hydrate_messages(db, page['rows'])
     
             try:
-                # Serializza e poi deserializza per garantire compatibilità JSON
-                serialized_data = safe_json(message_list)
-                return jsonify(json.loads(serialized_data))
+                # Codifica in una sola passata (orjson se disponibile)
+                return json_response(message_list, headers=page_headers(page))
             except Exception as json_error:
                 print(f"Error serializing messages for channel {channel_name}: {str(json_error)}")
                 return jsonify([])
             
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error getting channel messages for {channel_name}: {str(e)}")
         # Ritorna un errore più amichevole e informativo
@@ -182,10 +123,7 @@ def get_channel_messages(channel_name):
 
 @chat_bp.route('/api/messages/dm/<int:user_id>')
 def get_dm_messages(user_id):
-    """Get direct messages with a specific user"""
-    before_id = request.args.get('before_id')
-    limit = int(request.args.get('limit', 50))
-    
+    """Get direct messages with a specific user (paginazione a cursore: before/after, limit)"""
     try:
         with get_db() as db: 
             # Find the DM conversation
@@ -241,110 +179,16 @@ def get_dm_messages(user_id):
             
             conversation_id = conversation.id
             
-            # Costruisci query di base
-            query = (
-                db.query(Message, User)
-                .join(User, Message.user_id == User.id)
-                .filter(
-                    Message.conversation_id == conversation_id,
-                    Message.message_type != 'memory'  # Escludi i messaggi di tipo memory
-                )
-            )
+            # Pagina keyset su (created_at, id), già in ordine cronologico
+            page = get_page_from_request(db, conversation_id)
+            # Utenti, risposte e inoltri risolti in blocco (chat/hydration.py)
+            message_list = hydrate_messages(db, page['rows'])
             
-            # Aggiungi filtro paginazione solo se before_id è valido
-            if before_id:
-                try:
-                    before_id_int = int(before_id)
-                    query = query.filter(Message.id < before_id_int)
-                except (ValueError, TypeError):
-                    # Log, ma continua senza filtro
-                    print(f"Valore before_id non valido: {before_id}")
-            
-            # Ordina e limita
-            query = query.order_by(desc(Message.created_at)).limit(limit)
-            
-            # Execute query
-            messages = query.all()
-            
-            # Carica tutti i messaggi di risposta in un'unica query per migliorare le performance
-            reply_ids = [msg.reply_to_id for msg, _ in messages if msg.reply_to_id]
-            reply_messages = {}
-            
-            if reply_ids:
-                reply_msg_users = (
-                    db.query(Message, User)
-                    .join(User, Message.user_id == User.id)
-                    .filter(Message.id.in_(reply_ids))
-                    .all()
-                )
-                
-                for reply, user in reply_msg_users:
-                    reply_messages[reply.id] = {
-                        'id': reply.id,
-                        'text': reply.text,
-                        'message_type': reply.message_type,
-                        'fileData': reply.file_data,
-                        'user': {
-                            'id': user.id,
-                            'username': user.username,
-                            'displayName': user.display_name,
-                            'avatarUrl': user.avatar_url,
-                            'status': user.status
-                        }
-                    }
-            
-            # Convert to frontend format
-            message_list = []
-            for msg, user in messages:
-                # Get forwarded user data (if present)
-                forwarded_from = None
-                if msg.forwarded_from_id:
-                    forwarded_user = db.query(User).get(msg.forwarded_from_id)
-                    if forwarded_user:
-                        forwarded_from = {
-                            'id': msg.forwarded_from_id,
-                            'user': {
-                                'id': forwarded_user.id,
-                                'username': forwarded_user.username,
-                                'displayName': forwarded_user.display_name,
-                                'avatarUrl': forwarded_user.avatar_url,
-                                'status': forwarded_user.status
-                            }
-                        }
-                
-                # Get reply_to from cached results
-                reply_to = None
-                if msg.reply_to_id and msg.reply_to_id in reply_messages:
-                    reply_to = reply_messages[msg.reply_to_id]
-                
-                message_list.append({
-                    'id': msg.id,
-                    'conversationId': msg.conversation_id,
-                    'user': {
-                        'id': user.id,
-                        'username': user.username,
-                        'displayName': user.display_name,
-                        'avatarUrl': user.avatar_url,
-                        'status': user.status
-                    },
-                    'text': msg.text,
-                    'timestamp': msg.created_at.isoformat(),
-                    'type': msg.message_type,
-                    'fileData': msg.file_data,
-                    'replyTo': reply_to,
-                    'forwardedFrom': forwarded_from,
-                    'message_metadata': msg.message_metadata or {},
-                    'edited': msg.edited,
-                    'editedAt': msg.edited_at.isoformat() if msg.edited_at else None,
-                    'isOwn': msg.user_id == 1  # Assume current user is ID 1
-                })
-            
-            # Reverse order to show oldest messages first
-            message_list.reverse()
-            
-            # Use safe_json to ensure all data is properly serialized
-            return jsonify(json.loads(safe_json(message_list)))
+            # Codifica in una sola passata (orjson se disponibile)
+            return json_response(message_list, headers=page_headers(page))
             
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error getting DM messages: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -353,23 +197,8 @@ def get_dm_messages(user_id):
 def get_users():
     """Get all users"""
     try:
-        with get_db() as db: 
-            # Query usando SQLAlchemy
-            users = db.query(User).order_by(User.display_name).all()
-            
-            # Converti in lista di dizionari
-            user_list = [
-                {
-                    "id": user.id,
-                    "username": user.username,
-                    "displayName": user.display_name,
-                    "avatarUrl": user.avatar_url,
-                    "status": user.status
-                }
-                for user in users
-            ]
-            
-            return jsonify(user_list)
+        # Rubrica utenti in memoria (chat/user_directory.py)
+        return jsonify(list_users())
 
     except Exception as e:
         print(f"Error getting users: {str(e)}")
@@ -506,128 +335,33 @@ def get_conversations():
     """Get all conversations for the current user"""
     try:
         with get_db() as db:
-            # Per conversazioni di tipo channel
-            channel_convs = (
-                db.query(
-                    Conversation.id, 
-                    Conversation.name, 
-                    Conversation.type, 
-                    Conversation.created_at,
-                    func.count(Message.id).filter(
-                        Message.user_id != 1,
-                        ~Message.id.in_(
-                            db.query(MessageReadStatus.message_id)
-                            .filter(MessageReadStatus.user_id == 1)
-                            .subquery()
-                        )
-                    ).label('unread_count'),
-                    db.query(Message.created_at)
-                    .filter(Message.conversation_id == Conversation.id)
-                    .order_by(desc(Message.created_at))
-                    .limit(1)
-                    .scalar_subquery()
-                    .label('last_activity')
-                )
-                .outerjoin(Message, Conversation.id == Message.conversation_id)
-                .filter(Conversation.type == 'channel')
-                .group_by(Conversation.id)
-            )
-            
-            # Per conversazioni di tipo direct
-            from sqlalchemy.sql import text, null
-            
-            # Subquery per trovare le conversazioni direct dell'utente corrente
-            current_user_dm_convs = (
-                db.query(ConversationParticipant.conversation_id)
-                .join(Conversation, ConversationParticipant.conversation_id == Conversation.id)
-                .filter(
-                    ConversationParticipant.user_id == 1,
-                    Conversation.type == 'direct'
-                )
-                .subquery()
-            )
-            
-            # Trova l'altro utente in ogni conversazione direct
-            direct_convs = (
-                db.query(
-                    Conversation.id, 
-                    Conversation.name, 
-                    Conversation.type, 
-                    Conversation.created_at,
-                    User.id.label('user_id'),
-                    User.username,
-                    User.display_name,
-                    User.avatar_url,
-                    User.status,
-                    func.count(Message.id).filter(
-                        Message.user_id != 1,
-                        ~Message.id.in_(
-                            db.query(MessageReadStatus.message_id)
-                            .filter(MessageReadStatus.user_id == 1)
-                            .subquery()
-                        )
-                    ).label('unread_count'),
-                    db.query(Message.created_at)
-                    .filter(Message.conversation_id == Conversation.id)
-                    .order_by(desc(Message.created_at))
-                    .limit(1)
-                    .scalar_subquery()
-                    .label('last_activity')
-                )
-                .join(ConversationParticipant, Conversation.id == ConversationParticipant.conversation_id)
-                .join(User, ConversationParticipant.user_id == User.id)
-                .outerjoin(Message, Conversation.id == Message.conversation_id)
-                .filter(
-                    Conversation.id.in_(current_user_dm_convs),
-                    ConversationParticipant.user_id != 1,  # Non l'utente corrente
-                    Conversation.type == 'direct'
-                )
-                .group_by(Conversation.id, User.id)
-            )
-            
-            # Unione di tutte le conversazioni
-            all_conversations = []
-            
-            # Aggiungi conversazioni channel
-            for conv in channel_convs:
-                all_conversations.append({
-                    "id": conv.id,
-                    "name": conv.name,
-                    "type": conv.type,
-                    "userId": None,
-                    "displayName": conv.name,
-                    "avatarUrl": None,
-                    "status": None,
-                    "unreadCount": conv.unread_count,
-                    "lastActivity": conv.last_activity.isoformat() if conv.last_activity else None
-                })
-            
-            # Aggiungi conversazioni direct
-            for conv in direct_convs:
-                all_conversations.append({
-                    "id": conv.id,
-                    "name": conv.name,
-                    "type": conv.type,
-                    "userId": conv.user_id,
-                    "displayName": conv.display_name,
-                    "avatarUrl": conv.avatar_url,
-                    "status": conv.status,
-                    "unreadCount": conv.unread_count,
-                    "lastActivity": conv.last_activity.isoformat() if conv.last_activity else None
-                })
-            
-            # Ordina per ultima attività
-            all_conversations.sort(
-                key=lambda x: x.get('lastActivity') or '1970-01-01',
-                reverse=True
-            )
-            
-            return jsonify(all_conversations)
+            # Non letti e ultima attività dalle tabelle mantenute dai trigger (chat/conversation_state.py)
+            return jsonify(get_conversation_summaries(db, user_id=1))
 
     except Exception as e:
         print(f"Error getting conversations: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@chat_bp.route('/api/conversations/<int:conversation_id>/read', methods=['POST'])
+def mark_read(conversation_id):
+    """Segna come letta la conversazione fino a upToMessageId (o fino all'ultimo messaggio)"""
+    data = request.get_json(silent=True) or {}
+    up_to_message_id = data.get('upToMessageId')
+    if not is_valid_watermark(up_to_message_id):
+        return jsonify({'error': 'upToMessageId must be an integer'}), 400
+
+    with get_db() as db:
+        try:
+            read_state = mark_conversation_read(db, conversation_id, user_id=1, up_to_message_id=up_to_message_id)
+        except ConversationNotFound as e:
+            return jsonify({'error': str(e)}), 404
+        except InvalidReadTarget as e:
+            return jsonify({'error': str(e)}), 400
+
+    if read_state is None:
+        return jsonify({'error': 'Unable to update read state'}), 500
+    return jsonify(read_state)
+
 @chat_bp.route('/api/search', methods=['GET'])
 def search():
     """Search for messages, users, or channels"""
@@ -641,6 +375,13 @@ def search():
             "channels": []
         })
     
+    # Filtri e paginazione dei messaggi; senza, la risposta ha la forma di sempre
+    try:
+        message_filters = parse_message_search_args(request.args)
+    except (ValueError, InvalidCursor) as e:
+        return jsonify({'error': str(e)}), 400
+    paginated = bool(message_filters)
+
     try:
         results = {
             "messages": [],
@@ -649,93 +390,16 @@ def search():
         }
         
         with get_db() as db:
-            # Search messages
+            # Search messages: full-text indicizzato con ranking e snippet (chat/message_search.py)
             if search_type in ['all', 'messages']:
-                messages = (
-                    db.query(Message, User, Conversation)
-                    .join(User, Message.user_id == User.id)
-                    .join(Conversation, Message.conversation_id == Conversation.id)
-                    .filter(Message.text.ilike(f"%{query}%"))
-                    .filter(
-                        # Solo messaggi delle conversazioni accessibili
-                        (Conversation.type == 'channel') |
-                        (
-                            (Conversation.type == 'direct') &
-                            Conversation.id.in_(
-                                db.query(ConversationParticipant.conversation_id)
-                                .filter(ConversationParticipant.user_id == 1)
-                            )
-                        )
-                    )
-                    .order_by(desc(Message.created_at))
-                    .limit(10)
-                    .all()
-                )
-                
-                for msg, user, conv in messages:
-                    results["messages"].append({
-                        "id": msg.id,
-                        "conversationId": msg.conversation_id,
-                        "text": msg.text,
-                        "timestamp": msg.created_at.isoformat(),
-                        "user": {
-                            "id": user.id,
-                            "username": user.username,
-                            "displayName": user.display_name,
-                            "avatarUrl": user.avatar_url
-                        },
-                        "conversationType": conv.type,
-                        "conversationName": conv.name
-                    })
-            
-            # Search users
-            if search_type in ['all', 'users']:
-                users = (
-                    db.query(User)
-                    .filter(
-                        User.username.ilike(f"%{query}%") | 
-                        User.display_name.ilike(f"%{query}%")
-                    )
-                    .order_by(User.display_name)
-                    .limit(10)
-                    .all()
-                )
-                
-                for user in users:
-                    results["users"].append({
-                        "id": user.id,
-                        "username": user.username,
-                        "displayName": user.display_name,
-                        "avatarUrl": user.avatar_url,
-                        "status": user.status
-                    })
-            
-            # Search channels
-            if search_type in ['all', 'channels']:
-                channels = (
-                    db.query(
-                        Channel,
-                        func.count(ChannelMember.user_id).label('member_count')
-                    )
-                    .outerjoin(ChannelMember, Channel.id == ChannelMember.channel_id)
-                    .filter(
-                        Channel.name.ilike(f"%{query}%") | 
-                        Channel.description.ilike(f"%{query}%")
-                    )
-                    .group_by(Channel.id)
-                    .order_by(Channel.name)
-                    .limit(10)
-                    .all()
-                )
-                
-                for channel, member_count in channels:
-                    results["channels"].append({
-                        "id": channel.id,
-                        "name": channel.name,
-                        "description": channel.description,
-                        "isPrivate": channel.is_private,
-                        "memberCount": member_count
-                    })
+                results["messages"], next_cursor = search_messages(db, query, user_id=1, **message_filters)
+                if paginated:
+                    results["messagesCursor"] = next_cursor
+
+            # Search users and channels: indice di autocompletamento in memoria (chat/autocomplete.py)
+            types = [kind for kind in ('users', 'channels') if search_type in ('all', kind)]
+            if types:
+                results.update(autocomplete(query, types=types, limit=10))
         
         return jsonify(results)
     except Exception as e:
@@ -45,7 +45,13 @@ CREATE TABLE messages (
     metadata JSONB,
     edited BOOLEAN DEFAULT FALSE,
     edited_at TIMESTAMP,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    seq BIGINT, -- sequenza dell'ultima modifica nella conversazione (chat/sync.py)
+    -- Ricerca full-text: radici italiane (peso A) e parole esatte con nome del file (peso B)
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('italian', coalesce(text, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(text, '') || ' ' || coalesce(file_data->>'name', '')), 'B')
+    ) STORED
 );
 
 -- Tabella canali
@@ -81,17 +87,217 @@ $$ LANGUAGE plpgsql;
 CREATE INDEX idx_messages_conversation_id ON messages(conversation_id);
 CREATE INDEX idx_messages_user_id ON messages(user_id);
 CREATE INDEX idx_messages_created_at ON messages(created_at);
+-- Paginazione a cursore su (conversation_id, created_at, id)
+CREATE INDEX idx_messages_conversation_created_id ON messages(conversation_id, created_at, id) INCLUDE (message_type, user_id);
+CREATE INDEX idx_messages_search_vector ON messages USING GIN (search_vector);
+CREATE INDEX idx_messages_conversation_seq ON messages(conversation_id, seq);
 CREATE INDEX idx_channel_members_user_id ON channel_members(user_id);
 CREATE INDEX idx_conversation_participants_user_id ON conversation_participants(user_id);
 
--- Table for tracking read status of messages
-CREATE TABLE message_read_status (
-    id SERIAL PRIMARY KEY,
-    message_id INTEGER REFERENCES messages(id) ON DELETE CASCADE,
+-- Stato denormalizzato della lista conversazioni (chat/conversation_state.py):
+-- ultimo messaggio, watermark di lettura e contatori dei non letti mantenuti dai trigger su messages
+CREATE TABLE conversation_state (
+    conversation_id INTEGER PRIMARY KEY REFERENCES conversations(id) ON DELETE CASCADE,
+    last_message_id INTEGER,
+    last_message_user_id INTEGER,
+    last_message_at TIMESTAMP,
+    last_message_preview TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_seq BIGINT NOT NULL DEFAULT 0, -- ultimo numero di sequenza assegnato (chat/sync.py)
+    sync_floor_seq BIGINT NOT NULL DEFAULT 0 -- tombstone eliminate fino a questo seq
+);
+
+CREATE TABLE conversation_unread (
+    conversation_id INTEGER REFERENCES conversations(id) ON DELETE CASCADE,
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-    read_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    UNIQUE (message_id, user_id)
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    last_read_message_id INTEGER, -- watermark: letti tutti i messaggi con id <= di questo
+    PRIMARY KEY (conversation_id, user_id)
+);
+CREATE INDEX idx_conversation_unread_user_id ON conversation_unread(user_id);
+
+-- Anteprima dell'ultimo messaggio: testo o nome del file allegato.
+-- Nelle funzioni i nomi sono qualificati: il search_path delle connessioni può non includere lo schema
+CREATE OR REPLACE FUNCTION chat_schema.message_preview(body TEXT, file_data JSONB)
+RETURNS TEXT AS $$
+    SELECT left(coalesce(nullif(body, ''), file_data->>'name', ''), 200)
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION chat_schema.maintain_conversation_state() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF coalesce(NEW.message_type, 'normal') = 'memory' THEN RETURN NULL; END IF;
+        INSERT INTO chat_schema.conversation_state AS cs
+            (conversation_id, last_message_id, last_message_user_id, last_message_at, last_message_preview, updated_at)
+        VALUES (NEW.conversation_id, NEW.id, NEW.user_id, NEW.created_at,
+                chat_schema.message_preview(NEW.text, NEW.file_data), CURRENT_TIMESTAMP)
+        ON CONFLICT (conversation_id) DO UPDATE SET
+            last_message_id = EXCLUDED.last_message_id,
+            last_message_user_id = EXCLUDED.last_message_user_id,
+            last_message_at = EXCLUDED.last_message_at,
+            last_message_preview = EXCLUDED.last_message_preview,
+            updated_at = EXCLUDED.updated_at
+        WHERE cs.last_message_id IS NULL
+           OR (cs.last_message_at, cs.last_message_id) < (EXCLUDED.last_message_at, EXCLUDED.last_message_id);
+        UPDATE chat_schema.conversation_unread
+        SET unread_count = unread_count + 1
+        WHERE conversation_id = NEW.conversation_id
+          AND user_id <> NEW.user_id
+          AND NEW.id > coalesce(last_read_message_id, 0);
+        RETURN NULL;
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE chat_schema.conversation_state
+        SET last_message_preview = chat_schema.message_preview(NEW.text, NEW.file_data)
+        WHERE conversation_id = NEW.conversation_id AND last_message_id = NEW.id;
+        RETURN NULL;
+    END IF;
+    IF coalesce(OLD.message_type, 'normal') <> 'memory' THEN
+        UPDATE chat_schema.conversation_unread
+        SET unread_count = GREATEST(unread_count - 1, 0)
+        WHERE conversation_id = OLD.conversation_id
+          AND user_id <> OLD.user_id
+          AND OLD.id > coalesce(last_read_message_id, 0);
+    END IF;
+    -- Se era l'ultimo messaggio ricalcola il precedente (solo UPDATE: con la
+    -- cancellazione a cascata della conversazione la riga non va ricreata)
+    UPDATE chat_schema.conversation_state cs
+    SET last_message_id = m.id,
+        last_message_user_id = m.user_id,
+        last_message_at = m.created_at,
+        last_message_preview = chat_schema.message_preview(m.text, m.file_data),
+        updated_at = CURRENT_TIMESTAMP
+    FROM (SELECT 1) AS one
+    LEFT JOIN LATERAL (
+        SELECT id, user_id, created_at, text, file_data FROM chat_schema.messages
+        WHERE conversation_id = OLD.conversation_id AND coalesce(message_type, 'normal') <> 'memory'
+        ORDER BY created_at DESC, id DESC LIMIT 1
+    ) m ON TRUE
+    WHERE cs.conversation_id = OLD.conversation_id AND cs.last_message_id = OLD.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER conversation_state_insert
+AFTER INSERT ON messages
+FOR EACH ROW EXECUTE FUNCTION chat_schema.maintain_conversation_state();
+
+CREATE TRIGGER conversation_state_update
+AFTER UPDATE OF text, file_data ON messages
+FOR EACH ROW EXECUTE FUNCTION chat_schema.maintain_conversation_state();
+
+CREATE TRIGGER conversation_state_delete
+AFTER DELETE ON messages
+FOR EACH ROW EXECUTE FUNCTION chat_schema.maintain_conversation_state();
+
+-- Righe dei non letti create quando un utente diventa destinatario di una conversazione
+CREATE OR REPLACE FUNCTION chat_schema.add_conversation_readers() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'conversations' THEN
+        INSERT INTO chat_schema.conversation_unread (conversation_id, user_id)
+        SELECT NEW.id, cm.user_id
+        FROM chat_schema.channels ch
+        JOIN chat_schema.channel_members cm ON cm.channel_id = ch.id
+        WHERE NEW.type = 'channel' AND ch.name = NEW.name
+        ON CONFLICT (conversation_id, user_id) DO NOTHING;
+    ELSIF TG_TABLE_NAME = 'conversation_participants' THEN
+        INSERT INTO chat_schema.conversation_unread (conversation_id, user_id, unread_count)
+        SELECT NEW.conversation_id, NEW.user_id, count(*)
+        FROM chat_schema.messages m
+        WHERE m.conversation_id = NEW.conversation_id AND m.user_id <> NEW.user_id
+          AND coalesce(m.message_type, 'normal') <> 'memory'
+        ON CONFLICT (conversation_id, user_id) DO NOTHING;
+    ELSE
+        INSERT INTO chat_schema.conversation_unread (conversation_id, user_id, unread_count)
+        SELECT c.id, NEW.user_id, (
+            SELECT count(*) FROM chat_schema.messages m
+            WHERE m.conversation_id = c.id AND m.user_id <> NEW.user_id
+              AND coalesce(m.message_type, 'normal') <> 'memory')
+        FROM chat_schema.conversations c
+        JOIN chat_schema.channels ch ON ch.name = c.name
+        WHERE c.type = 'channel' AND ch.id = NEW.channel_id
+        ON CONFLICT (conversation_id, user_id) DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER conversation_readers_conversation
+AFTER INSERT ON conversations
+FOR EACH ROW EXECUTE FUNCTION chat_schema.add_conversation_readers();
+
+CREATE TRIGGER conversation_readers_participant
+AFTER INSERT ON conversation_participants
+FOR EACH ROW EXECUTE FUNCTION chat_schema.add_conversation_readers();
+
+CREATE TRIGGER conversation_readers_member
+AFTER INSERT ON channel_members
+FOR EACH ROW EXECUTE FUNCTION chat_schema.add_conversation_readers();
+
+-- Messaggi eliminati per syncSince (chat/sync.py); senza chiave esterna: le eliminazioni
+-- a cascata della conversazione possono scriverne ancora, le rimuove il prune
+CREATE TABLE message_tombstones (
+    conversation_id INTEGER NOT NULL,
+    seq BIGINT NOT NULL,
+    message_id INTEGER NOT NULL,
+    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (conversation_id, seq)
+);
+
+-- Presenza per worker (chat/presence.py): ogni processo rinnova le righe dei propri utenti
+-- connessi, users.status è lo stato aggregato; le righe di un worker fermo scadono
+CREATE TABLE user_presence (
+    worker_id VARCHAR(100) NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    status VARCHAR(50) NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (worker_id, user_id)
 );
+CREATE INDEX idx_user_presence_user_id ON user_presence(user_id);
+
+-- Numero di sequenza per conversazione a ogni inserimento, modifica ed eliminazione.
+-- Il lock sulla riga di conversation_state resta fino al commit: i seq diventano visibili in ordine
+CREATE OR REPLACE FUNCTION chat_schema.assign_message_seq() RETURNS TRIGGER AS $$
+DECLARE
+    next_seq BIGINT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE chat_schema.conversation_state SET last_seq = last_seq + 1
+        WHERE conversation_id = OLD.conversation_id
+        RETURNING last_seq INTO next_seq;
+        IF next_seq IS NOT NULL THEN
+            INSERT INTO chat_schema.message_tombstones (conversation_id, seq, message_id)
+            VALUES (OLD.conversation_id, next_seq, OLD.id);
+        END IF;
+        RETURN NULL;
+    END IF;
+    IF NEW.conversation_id IS NULL THEN RETURN NEW; END IF;
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO chat_schema.conversation_state AS cs (conversation_id, last_seq)
+        VALUES (NEW.conversation_id, 1)
+        ON CONFLICT (conversation_id) DO UPDATE SET last_seq = cs.last_seq + 1
+        RETURNING last_seq INTO next_seq;
+    ELSE
+        UPDATE chat_schema.conversation_state SET last_seq = last_seq + 1
+        WHERE conversation_id = NEW.conversation_id
+        RETURNING last_seq INTO next_seq;
+    END IF;
+    NEW.seq := coalesce(next_seq, NEW.seq);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER message_seq_insert
+BEFORE INSERT ON messages
+FOR EACH ROW EXECUTE FUNCTION chat_schema.assign_message_seq();
+
+CREATE TRIGGER message_seq_update
+BEFORE UPDATE OF text, file_data, message_type, metadata, edited, reply_to_id, forwarded_from_id, user_id ON messages
+FOR EACH ROW EXECUTE FUNCTION chat_schema.assign_message_seq();
+
+CREATE TRIGGER message_seq_delete
+AFTER DELETE ON messages
+FOR EACH ROW EXECUTE FUNCTION chat_schema.assign_message_seq();
 
 -- Table for user settings
 CREATE TABLE user_settings (
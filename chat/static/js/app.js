@@ -26,6 +26,7 @@ window.isLoadingMessages = false;
 window.hasMoreMessages = true;
 window.currentConversationId = 'general';
 window.oldestMessageId = null;
+window.oldestCursor = null;
 window.isChannel = false;
 window.currentlyConnected = false;
 window.socket = null;
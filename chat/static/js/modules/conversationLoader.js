@@ -5,6 +5,14 @@ import { showLoader, hideLoader } from './utils.js';
  * conversationLoader.js - Functions for loading conversations and messages
  */
 
+/**
+ * Legge dalle intestazioni della risposta il cursore per la pagina precedente
+ */
+function readHistoryCursor(response) {
+    oldestCursor = response.headers.get('X-Cursor-Before');
+    hasMoreMessages = response.headers.get('X-Has-More-Before') !== 'false';
+}
+
 function loadChannelMessages(channelName, scrollToBottom = true) {
     currentConversationId = channelName;
     isChannel = true;
@@ -13,6 +21,7 @@ function loadChannelMessages(channelName, scrollToBottom = true) {
     const chatMessages = document.querySelector('.chat-messages');
     chatMessages.innerHTML = '';
     oldestMessageId = null;
+    oldestCursor = null;
     hasMoreMessages = true;
     isLoadingMessages = false;
     
@@ -30,6 +39,7 @@ function loadChannelMessages(channelName, scrollToBottom = true) {
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
+            readHistoryCursor(response);
             return response.json();
         })
         .then(messages => {
@@ -97,6 +107,7 @@ function loadDirectMessages(userId, userName, scrollToBottom = true) {
     const chatMessages = document.querySelector('.chat-messages');
     chatMessages.innerHTML = '';
     oldestMessageId = null;
+    oldestCursor = null;
     hasMoreMessages = true;
     isLoadingMessages = false;
     
@@ -109,7 +120,10 @@ function loadDirectMessages(userId, userName, scrollToBottom = true) {
     
     // Carica i messaggi dal server
     fetch(`/chat/api/messages/dm/${userId}`)
-        .then(response => response.json())
+        .then(response => {
+            readHistoryCursor(response);
+            return response.json();
+        })
         .then(messages => {
             hideLoader();
             
@@ -45,17 +45,14 @@ function loadOlderMessages() {
     // In coreMessages.js, modifichiamo la costruzione dell'URL:
     //FIXME: da refattorizzare la parte in cui si richiamano le vecchie conversazioni
    
-    let url;
-    if (isChannel) {
-        url = `/chat/api/messages/channel/${currentConversationId}?limit=20`;
-        if (oldestMessageId) {
-            url += `&before_id=${oldestMessageId}`;
-        }
-    } else {
-        url = `/chat/api/messages/dm/${currentConversationId}?limit=20`;
-        if (oldestMessageId) {
-            url += `&before_id=${oldestMessageId}`;
-        }
+    let url = isChannel
+        ? `/chat/api/messages/channel/${currentConversationId}?limit=20`
+        : `/chat/api/messages/dm/${currentConversationId}?limit=20`;
+    // Cursore opaco restituito dal server; before_id resta come fallback
+    if (oldestCursor) {
+        url += `&before=${encodeURIComponent(oldestCursor)}`;
+    } else if (oldestMessageId) {
+        url += `&before_id=${oldestMessageId}`;
     }
     
     console.log("Fetching older messages from URL:", url);
@@ -66,6 +63,14 @@ function loadOlderMessages() {
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
+            // Aggiorna il cursore per la pagina successiva
+            const nextCursor = response.headers.get('X-Cursor-Before');
+            if (nextCursor) {
+                oldestCursor = nextCursor;
+            }
+            if (response.headers.get('X-Has-More-Before') === 'false') {
+                hasMoreMessages = false;
+            }
             return response.json();
         })
         .then(messages => {
@@ -9,12 +9,25 @@ import { showLoader, hideLoader, formatTime, formatDate, linkifyText, showNotifi
  * Questo file è stato generato automaticamente dal tool di refactoring.
  */
 
+// Intervallo dei heartbeat di presenza (il server chiude le connessioni silenziose
+// dopo PRESENCE_HEARTBEAT_TIMEOUT, 90 secondi di default)
+const PRESENCE_HEARTBEAT_MS = window.PRESENCE_HEARTBEAT_MS || 30000;
+let presenceHeartbeatTimer = null;
+
+// Recupero dopo la riconnessione: conversazione aperta e seq più alto ricevuto
+// (historyCursor, newMessage, messageEdited, syncChanges)
+let hasConnectedBefore = false;
+window.syncConversationId = null;
+window.lastSyncSeq = null;
+
 function initializeSocketIO() {
 	socket = io({
 		debug: false,
 		autoConnect: true,
 		reconnection: true,
-		forceNew: true
+		forceNew: true,
+		// Con più worker il server può accettare solo websocket (niente sticky session per il polling)
+		transports: window.SOCKETIO_TRANSPORTS || ['polling', 'websocket']
 	});
 
 	setupSocketIOEvents();
@@ -31,6 +44,7 @@ function setupSocketIOEvents() {
     socket.on('newMessage', handleNewMessage);
     socket.on('modelInference', handleModelInference);
     socket.on('userStatusUpdate', handleUserStatusUpdate);
+    socket.on('presence', handlePresence);
     
     // Aggiunti nuovi eventi per gestire le features mancanti
     socket.on('messageDeleted', handleMessageDeleted); 
@@ -40,6 +54,8 @@ function setupSocketIOEvents() {
     socket.on('userStopTyping', (data) => handleUserTyping({...data, isTyping: false}));
     
     socket.on('conversationInfo', handleConversationInfo);
+    socket.on('historyCursor', handleHistoryCursor);
+    socket.on('syncChanges', handleSyncChanges);
 }
 
 function handleSocketConnect() {
@@ -52,13 +68,92 @@ function handleSocketConnect() {
         hideLoader(); // Nascondi sempre il loader in caso di errore di connessione
     });
 
-    // Entra nel canale default
-    joinChannel('general');
+    startPresenceHeartbeat();
+
+    if (hasConnectedBefore && window.lastSyncSeq !== null) {
+        // Riconnessione: rientra nella conversazione aperta chiedendo solo le modifiche perse
+        rejoinWithSync();
+    } else {
+        // Entra nel canale default
+        joinChannel('general');
+    }
+    hasConnectedBefore = true;
+}
+
+function rejoinWithSync() {
+    const sinceSeq = window.lastSyncSeq;
+    if (isDirectMessage && currentUser) {
+        socket.emit('joinDirectMessage', { userId: currentUser.id, sinceSeq });
+    } else {
+        socket.emit('joinChannel', { channel: currentChannel, sinceSeq });
+    }
+}
+
+function trackSyncSeq(conversationId, seq) {
+    if (conversationId != window.syncConversationId || typeof seq !== 'number') return;
+    if (window.lastSyncSeq === null || seq > window.lastSyncSeq) {
+        window.lastSyncSeq = seq;
+    }
+}
+
+// Modifiche perse durante la disconnessione: {conversationId, messages, deleted, seq, hasMore, reset}
+function handleSyncChanges(changes) {
+    if (!changes || changes.conversationId != window.syncConversationId) return;
+    if (changes.reset) {
+        // Tombstone già eliminate: ricarica la cronologia
+        window.lastSyncSeq = null;
+        if (isDirectMessage && currentUser) {
+            joinDirectMessage(currentUser.id);
+        } else {
+            joinChannel(currentChannel);
+        }
+        return;
+    }
+
+    (changes.messages || []).forEach(message => {
+        if (displayedMessages.some(m => m.id == message.id)) {
+            handleMessageEdited({
+                messageId: message.id,
+                conversationId: changes.conversationId,
+                newText: message.text,
+                editedAt: message.editedAt
+            });
+        } else {
+            handleNewMessage(message);
+        }
+    });
+    (changes.deleted || []).forEach(messageId => handleMessageDeleted({ messageId }));
+    trackSyncSeq(changes.conversationId, changes.seq);
+
+    if (changes.hasMore) {
+        socket.emit('syncSince', { conversationId: changes.conversationId, seq: changes.seq });
+    }
+}
+
+function startPresenceHeartbeat() {
+    stopPresenceHeartbeat();
+    presenceHeartbeatTimer = setInterval(() => {
+        if (!currentlyConnected) return;
+        // Se la connessione era scaduta il server la registra di nuovo e lo segnala
+        socket.emit('heartbeat', {}, (reply) => {
+            if (reply && reply.registered === false) {
+                console.warn('Presenza scaduta: connessione registrata di nuovo');
+            }
+        });
+    }, PRESENCE_HEARTBEAT_MS);
+}
+
+function stopPresenceHeartbeat() {
+    if (presenceHeartbeatTimer) {
+        clearInterval(presenceHeartbeatTimer);
+        presenceHeartbeatTimer = null;
+    }
 }
 
 function handleSocketDisconnect() {
 	console.log('Disconnesso dal server Socket.IO');
 	currentlyConnected = false;
+	stopPresenceHeartbeat();
 	showNotification('Connessione al server persa', true);
 }
 
@@ -176,9 +271,19 @@ function handleConversationInfo(data) {
     }
 }
 
+// Cursore della cronologia: usato per caricare i messaggi precedenti
+function handleHistoryCursor(data) {
+    window.oldestCursor = data.before || null;
+    window.hasMoreMessages = !!data.hasMoreBefore;
+    // Nuova conversazione aperta: da qui parte il recupero dopo una riconnessione
+    window.syncConversationId = data.conversationId;
+    window.lastSyncSeq = typeof data.seq === 'number' ? data.seq : null;
+}
+
 // Funzione per gestire nuovi messaggi
 function handleNewMessage(message) {
     console.log('Nuovo messaggio ricevuto:', message);
+    trackSyncSeq(message.conversationId, message.seq);
 
     // Converti timestamp in oggetto Date se necessario
     if (typeof message.timestamp === 'string') {
@@ -500,6 +605,7 @@ function handleMessageEdited(data) {
     const messageId = data.messageId;
     const newText = data.newText;
     const editedAt = data.editedAt;
+    trackSyncSeq(data.conversationId, data.seq);
     
     // Trova il messaggio nell'array
     const message = displayedMessages.find(m => m.id == messageId);
@@ -655,6 +761,11 @@ function handleUserStatusUpdate(data) {
 	}
 }
 
+// Cambiamenti di stato inviati dal server a ogni tick: {changes: [{userId, status}]}
+function handlePresence(data) {
+	(data && data.changes || []).forEach(handleUserStatusUpdate);
+}
+
 function joinChannel(channelName) {
     if (currentlyConnected) {
         showLoader(); // Mostra il loader quando si inizia a caricare
@@ -788,5 +899,6 @@ export {
     joinDirectMessage,
     sendChannelMessage,
     setupTypingTimeoutChecker,
-    handleConversationInfo
+    handleConversationInfo,
+    handleHistoryCursor
 };
\ No newline at end of file
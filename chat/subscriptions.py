@@ -0,0 +1,148 @@
+"""
+Iscrizioni delle connessioni Socket.IO alle room delle conversazioni.
+
+joinChannel e joinDirectMessage entravano nella room senza mai uscire da quella
+precedente: dopo aver aperto dieci canali un client riceveva newMessage e indicatori
+di digitazione di tutti e dieci. Qui ogni connessione ha:
+- una room attiva, la conversazione aperta: aprirne un'altra esce dalla precedente
+- room fissate (modalità multi-iscrizione, eventi subscribeRooms/unsubscribeRooms):
+  restano sottoscritte anche quando non sono attive
+
+Alla disconnessione Socket.IO toglie già la connessione da tutte le room; forget()
+aggiorna solo la contabilità. I conteggi per room sono locali al processo (con più
+worker ognuno conta le proprie connessioni).
+"""
+import logging
+import threading
+
+from flask_socketio import join_room, leave_room
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+class _Subscription:
+    """Room attiva e room fissate di una connessione"""
+
+    __slots__ = ('active', 'pinned')
+
+    def __init__(self):
+        self.active = None
+        self.pinned = set()
+
+    def rooms(self):
+        return self.pinned | ({self.active} if self.active else set())
+
+class RoomSubscriptions:
+    """
+    Gestisce le room di ogni connessione e il numero di iscritti per room.
+
+    Args:
+        join (callable): join(room, sid), di default flask_socketio.join_room
+        leave (callable): leave(room, sid), di default flask_socketio.leave_room
+    """
+
+    def __init__(self, join=None, leave=None):
+        self._join = join or (lambda room, sid: join_room(room, sid=sid))
+        self._leave = leave or (lambda room, sid: leave_room(room, sid=sid))
+        self._connections = {}
+        self._members = {}  # room -> sid iscritti
+        self._lock = threading.Lock()
+
+    def activate(self, sid, room):
+        """
+        Rende room la conversazione aperta da sid, uscendo dalla precedente se non fissata.
+
+        Returns:
+            list: Room abbandonate
+        """
+        with self._lock:
+            subscription = self._connections.setdefault(sid, _Subscription())
+            before = subscription.rooms()
+            subscription.active = room
+            return self._apply(sid, before, subscription.rooms())
+
+    def subscribe(self, sid, rooms):
+        """Fissa le room: restano sottoscritte anche quando non sono quella attiva"""
+        with self._lock:
+            subscription = self._connections.setdefault(sid, _Subscription())
+            before = subscription.rooms()
+            subscription.pinned.update(rooms)
+            self._apply(sid, before, subscription.rooms())
+            return self._describe(subscription)
+
+    def unsubscribe(self, sid, rooms):
+        """Toglie le room fissate; la room attiva resta sottoscritta"""
+        with self._lock:
+            subscription = self._connections.setdefault(sid, _Subscription())
+            before = subscription.rooms()
+            subscription.pinned.difference_update(rooms)
+            self._apply(sid, before, subscription.rooms())
+            return self._describe(subscription)
+
+    def forget(self, sid):
+        """Alla disconnessione: rimuove la connessione dai conteggi"""
+        with self._lock:
+            subscription = self._connections.pop(sid, None)
+            if subscription is not None:
+                for room in subscription.rooms():
+                    self._remove_member(room, sid)
+
+    def rooms_of(self, sid):
+        """Room attiva e room fissate di una connessione"""
+        with self._lock:
+            subscription = self._connections.get(sid)
+            return self._describe(subscription) if subscription else {'active': None, 'rooms': []}
+
+    def members(self, room):
+        """Connessioni di questo processo iscritte alla room"""
+        with self._lock:
+            return set(self._members.get(room, ()))
+
+    def room_counts(self):
+        """Numero di connessioni iscritte a ogni room"""
+        with self._lock:
+            return {room: len(sids) for room, sids in self._members.items()}
+
+    def get_stats(self):
+        """Connessioni, room e iscrizioni totali con il dettaglio per room"""
+        counts = self.room_counts()
+        with self._lock:
+            connections = len(self._connections)
+        return {
+            'connections': connections,
+            'rooms': len(counts),
+            'subscriptions': sum(counts.values()),
+            'room_counts': dict(sorted(counts.items(), key=lambda item: -item[1])),
+        }
+
+    def _apply(self, sid, before, after):
+        # Chiamato con il lock acquisito: allinea le room Socket.IO e i conteggi
+        for room in after - before:
+            self._join(room, sid)
+            self._members.setdefault(room, set()).add(sid)
+        left = sorted(before - after)
+        for room in left:
+            self._leave(room, sid)
+            self._remove_member(room, sid)
+        return left
+
+    def _remove_member(self, room, sid):
+        sids = self._members.get(room)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._members[room]
+
+    @staticmethod
+    def _describe(subscription):
+        return {'active': subscription.active, 'rooms': sorted(subscription.rooms())}
+
+_subscriptions = RoomSubscriptions()
+
+def get_subscriptions():
+    """Restituisce il gestore delle iscrizioni del processo"""
+    return _subscriptions
+
+def get_subscription_stats():
+    """Metriche delle iscrizioni per la dashboard"""
+    return _subscriptions.get_stats()
@@ -0,0 +1,169 @@
+"""
+Recupero delle modifiche dopo una riconnessione (evento Socket.IO 'syncSince').
+
+Dopo una disconnessione il frontend ricaricava gli ultimi 50 messaggi: quelli più
+vecchi della finestra e le modifiche o eliminazioni fatte nel frattempo andavano persi.
+Ogni inserimento, modifica ed eliminazione di un messaggio prende ora un numero di
+sequenza crescente per conversazione (migrazione 'message_sequence' in chat/migrations.py):
+- messages.seq: sequenza dell'ultima modifica del messaggio
+- message_tombstones: messaggi eliminati con la sequenza dell'eliminazione
+- conversation_state.last_seq: ultima sequenza assegnata
+
+Il client conserva il seq più alto ricevuto (historyCursor.seq al join, seq di ogni
+messaggio, seq delle risposte di syncSince) e alla riconnessione chiede solo le
+modifiche successive: il costo dipende dal numero di modifiche, non dalla cronologia.
+
+Le tombstone più vecchie di SYNC_TOMBSTONE_RETENTION_DAYS vengono eliminate dal prune;
+sync_floor_seq ricorda fin dove, e un client fermo a un seq precedente riceve reset=True
+(deve ricaricare la cronologia):
+    python -m chat.sync prune [--days 30]
+"""
+import argparse
+import logging
+
+from common.config import CHAT_SCHEMA, SYNC_MAX_CHANGES, SYNC_TOMBSTONE_RETENTION_DAYS
+from common.db.connection import get_raw_connection
+from chat.hydration import hydrate_messages
+from chat.models import ConversationState, Message, MessageTombstone, User
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+# Elimina le tombstone scadute (e quelle delle conversazioni eliminate) e alza sync_floor_seq
+_PRUNE_SQL = """
+    WITH pruned AS (
+        DELETE FROM {schema}.message_tombstones
+        WHERE deleted_at < CURRENT_TIMESTAMP - make_interval(days => %(days)s)
+        RETURNING conversation_id, seq
+    ), floors AS (
+        UPDATE {schema}.conversation_state cs
+        SET sync_floor_seq = GREATEST(cs.sync_floor_seq, p.max_seq)
+        FROM (SELECT conversation_id, max(seq) AS max_seq FROM pruned GROUP BY conversation_id) p
+        WHERE cs.conversation_id = p.conversation_id
+    )
+    SELECT count(*) FROM pruned
+"""
+
+_PRUNE_ORPHANS_SQL = """
+    DELETE FROM {schema}.message_tombstones t
+    WHERE NOT EXISTS (SELECT 1 FROM {schema}.conversations c WHERE c.id = t.conversation_id)
+"""
+
+def get_conversation_seq(db, conversation_id):
+    """
+    Ultima sequenza assegnata nella conversazione (0 se non ci sono ancora messaggi).
+
+    Va letta prima di caricare la cronologia: le modifiche successive arrivano con syncSince.
+    """
+    last_seq = (
+        db.query(ConversationState.last_seq)
+        .filter(ConversationState.conversation_id == conversation_id)
+        .scalar()
+    )
+    return last_seq or 0
+
+def get_changes_since(db, conversation_id, since_seq, limit=SYNC_MAX_CHANGES):
+    """
+    Modifiche di una conversazione successive a since_seq, in ordine di sequenza.
+
+    Args:
+        db (Session): Sessione del database
+        conversation_id (int): ID della conversazione
+        since_seq (int): Ultima sequenza ricevuta dal client
+        limit (int): Modifiche massime (messaggi più eliminazioni) per risposta
+
+    Returns:
+        dict: conversationId, seq (nuovo watermark del client), messages (inseriti o
+              modificati, nel formato del frontend), deleted (id eliminati), hasMore
+              (richiamare con il nuovo seq) e reset (ricaricare la cronologia)
+    """
+    since_seq = max(int(since_seq or 0), 0)
+    limit = max(1, min(int(limit), SYNC_MAX_CHANGES))
+    result = {'conversationId': conversation_id, 'seq': since_seq, 'messages': [], 'deleted': [],
+              'hasMore': False, 'reset': False}
+
+    state = (
+        db.query(ConversationState.last_seq, ConversationState.sync_floor_seq)
+        .filter(ConversationState.conversation_id == conversation_id)
+        .first()
+    )
+    if state is None:
+        return result
+    last_seq, floor_seq = state
+    if since_seq < floor_seq or since_seq > last_seq:
+        # Tombstone già eliminate (o seq di un altro database): serve la cronologia completa
+        return dict(result, seq=last_seq, reset=True)
+    if since_seq == last_seq:
+        return result
+
+    # Le sequenze fino a last_seq sono tutte già committate (lock sulla riga di conversation_state)
+    rows = (
+        db.query(Message, User)
+        .outerjoin(User, Message.user_id == User.id)
+        .filter(Message.conversation_id == conversation_id,
+                Message.seq > since_seq, Message.seq <= last_seq)
+        .order_by(Message.seq)
+        .limit(limit + 1)
+        .all()
+    )
+    tombstones = (
+        db.query(MessageTombstone.seq, MessageTombstone.message_id)
+        .filter(MessageTombstone.conversation_id == conversation_id,
+                MessageTombstone.seq > since_seq, MessageTombstone.seq <= last_seq)
+        .order_by(MessageTombstone.seq)
+        .limit(limit + 1)
+        .all()
+    )
+
+    # Le due liste unite in ordine di seq, tagliate a limit modifiche
+    changes = sorted([(message.seq, 'message', (message, user)) for message, user in rows]
+                     + [(seq, 'deleted', message_id) for seq, message_id in tombstones],
+                     key=lambda change: change[0])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    upper = changes[-1][0] if has_more else last_seq
+
+    visible, deleted = [], []
+    for _, kind, change in changes:
+        if kind == 'deleted':
+            deleted.append(change)
+        elif change[0].message_type == 'memory':
+            # Come nella cronologia: i messaggi 'memory' non sono visibili al client
+            deleted.append(change[0].id)
+        else:
+            visible.append(change)
+
+    return dict(result, seq=upper, messages=hydrate_messages(db, visible), deleted=deleted, hasMore=has_more)
+
+def prune_tombstones(days=SYNC_TOMBSTONE_RETENTION_DAYS, schema=CHAT_SCHEMA):
+    """
+    Elimina le tombstone più vecchie di days giorni e aggiorna sync_floor_seq.
+
+    Returns:
+        int: Tombstone eliminate
+    """
+    conn = get_raw_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(_PRUNE_SQL.format(schema=schema), {'days': days})
+            pruned = cur.fetchone()[0]
+            cur.execute(_PRUNE_ORPHANS_SQL.format(schema=schema))
+            pruned += cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    logger.info(f"Prune tombstone: {pruned} eliminate")
+    return pruned
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sequenze dei messaggi per syncSince")
+    parser.add_argument('command', choices=['prune'])
+    parser.add_argument('--days', type=int, default=SYNC_TOMBSTONE_RETENTION_DAYS)
+    parser.add_argument('--schema', default=CHAT_SCHEMA)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(f"Tombstone eliminate: {prune_tombstones(args.days, args.schema)}")
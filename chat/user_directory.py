@@ -0,0 +1,169 @@
+"""
+Rubrica in memoria degli utenti della chat.
+
+Gli handler e le route chiedono continuamente gli stessi utenti (utente corrente 1,
+agenti 2/3/4/7, autori delle risposte) e ricostruiscono a mano lo stesso dizionario.
+La rubrica carica tutti gli utenti con una sola query e restituisce copie dei dizionari
+nel formato del frontend (come User.to_dict()).
+
+Invalidazione:
+- eventi del mapper User (insert/update/delete) al flush e di nuovo al commit della
+  sessione, così una lettura concorrente tra flush e commit non resta in cache
+- invalidate() esplicito per gli aggiornamenti in blocco che non passano dall'ORM
+- TTL (USER_DIRECTORY_TTL) per le modifiche fatte da altri processi
+"""
+import logging
+import threading
+import time
+
+from common.config import USER_DIRECTORY_TTL
+from chat.cache_invalidation import invalidate_on_write
+from chat.database import SessionLocal
+from chat.models import User
+from common.db.connection import get_db_session
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+def _user_dict(user):
+    return {
+        'id': user.id,
+        'username': user.username,
+        'displayName': user.display_name,
+        'avatarUrl': user.avatar_url,
+        'status': user.status
+    }
+
+class UserDirectory:
+    """
+    Rubrica utenti caricata in blocco e invalidata alle modifiche.
+
+    Args:
+        session_factory: Factory delle sessioni usata per il caricamento
+        ttl (float): Secondi dopo i quali la rubrica viene ricaricata (0 = mai)
+    """
+
+    def __init__(self, session_factory=SessionLocal, ttl=USER_DIRECTORY_TTL):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self._users = None  # id -> dizionario utente
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'loads': 0, 'invalidations': 0}
+
+    def get(self, user_id):
+        """
+        Dizionario di un utente.
+
+        Args:
+            user_id (int): ID dell'utente
+
+        Returns:
+            dict or None: Copia del dizionario dell'utente, None se non esiste
+        """
+        users, from_memory = self._snapshot()
+        user = users.get(user_id)
+        with self._lock:
+            self._stats['hits' if from_memory and user is not None else 'misses'] += 1
+        if user is None:
+            # Utente creato da un altro processo dopo il caricamento
+            user = self._load_one(user_id)
+        return dict(user) if user is not None else None
+
+    def get_many(self, user_ids):
+        """Dizionari di più utenti (id -> dizionario), ignorando quelli inesistenti"""
+        result = {}
+        for user_id in set(user_ids):
+            user = self.get(user_id)
+            if user is not None:
+                result[user_id] = user
+        return result
+
+    def list_users(self):
+        """Tutti gli utenti ordinati per displayName (come /api/users)"""
+        users, from_memory = self._snapshot()
+        with self._lock:
+            self._stats['hits' if from_memory else 'misses'] += 1
+        ordered = sorted(users.values(), key=lambda user: (user['displayName'] is None, user['displayName'] or ''))
+        return [dict(user) for user in ordered]
+
+    def invalidate(self, user_id=None):
+        """Scarta la rubrica (l'intera rubrica anche se è indicato un solo utente)"""
+        with self._lock:
+            self._users = None
+            self._generation += 1
+            self._stats['invalidations'] += 1
+
+    def get_stats(self):
+        """Dimensione e hit rate della rubrica"""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(
+                self._stats,
+                size=len(self._users) if self._users is not None else 0,
+                loaded=self._users is not None,
+                hit_rate=round(self._stats['hits'] / lookups, 4) if lookups else None,
+                ttl=self.ttl,
+            )
+
+    def _snapshot(self):
+        """Restituisce (utenti, servito dalla memoria), ricaricando se necessario"""
+        with self._lock:
+            expired = self.ttl and time.monotonic() - self._loaded_at > self.ttl
+            if self._users is not None and not expired:
+                return self._users, True
+            generation = self._generation
+
+        with get_db_session(self.session_factory) as db:
+            users = {user.id: _user_dict(user) for user in db.query(User).all()}
+
+        with self._lock:
+            self._stats['loads'] += 1
+            # Un'invalidazione durante il caricamento rende i dati letti già vecchi
+            if generation == self._generation:
+                self._users = users
+                self._loaded_at = time.monotonic()
+        return users, False
+
+    def _load_one(self, user_id):
+        with get_db_session(self.session_factory) as db:
+            user = db.query(User).filter(User.id == user_id).first()
+            if user is None:
+                return None
+            user = _user_dict(user)
+        with self._lock:
+            if self._users is not None:
+                self._users = {**self._users, user_id: user}
+        return user
+
+_directory = None
+_directory_lock = threading.Lock()
+
+def get_user_directory():
+    """Restituisce la rubrica condivisa del processo, creandola al primo utilizzo"""
+    global _directory
+    if _directory is None:
+        with _directory_lock:
+            if _directory is None:
+                _directory = UserDirectory()
+    return _directory
+
+def get_user(user_id):
+    """Dizionario di un utente dalla rubrica (None se non esiste)"""
+    return get_user_directory().get(user_id)
+
+def list_users():
+    """Tutti gli utenti dalla rubrica, ordinati per displayName"""
+    return get_user_directory().list_users()
+
+def invalidate_users(user_id=None):
+    """Invalida la rubrica dopo modifiche agli utenti fatte senza ORM"""
+    get_user_directory().invalidate(user_id)
+
+def get_user_directory_stats():
+    """Metriche della rubrica per la dashboard"""
+    return get_user_directory().get_stats()
+
+# Al flush solo l'utente scritto, al commit l'intera rubrica
+invalidate_on_write((User,), invalidate_users, on_write=lambda user: invalidate_users(user.id))
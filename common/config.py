@@ -46,6 +46,106 @@ DB_SCHEMA = os.getenv('DB_SCHEMA', 'workflow_agent')
 CHAT_SCHEMA = os.getenv('CHAT_SCHEMA', 'chat_schema')
 CAL_SCHEMA = os.getenv('CAL_SCHEMA', 'cal_schema')
 
+# Applica all'avvio di ogni worker le migrazioni dello schema chat non ancora registrate
+# (chat/migrations.py). Disattivato: alcune riscrivono tabelle grandi, vanno eseguite come
+# passo del deploy con python -m chat.migrations --pending
+CHAT_AUTO_MIGRATE = os.getenv('CHAT_AUTO_MIGRATE', 'False').lower() in ('true', '1', 't')
+
+# Pool di connessioni condiviso da tutti i moduli (un solo engine per processo)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 300))
+DB_SSLMODE = os.getenv('DB_SSLMODE', 'require')
+
+# Driver Postgres cooperativo con gevent (wait callback di psycopg2)
+DB_GEVENT_COOPERATIVE = os.getenv('DB_GEVENT_COOPERATIVE', 'True').lower() in ('true', '1', 't')
+
+# Coda di messaggi Socket.IO per più worker/nodi (redis://, amqp://, local://host:porta)
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE', '')
+SOCKETIO_CHANNEL = os.getenv('SOCKETIO_CHANNEL', 'socketio')
+# Solo trasporto websocket: evita la necessità di sticky session tra worker
+SOCKETIO_WEBSOCKET_ONLY = os.getenv('SOCKETIO_WEBSOCKET_ONLY', 'False').lower() in ('true', '1', 't')
+
+# Ring buffer in memoria dei messaggi recenti per i join (locale al processo:
+# disattivato di default con più worker, le scritture degli altri worker non lo aggiornano)
+HOT_CACHE_ENABLED = os.getenv('HOT_CACHE_ENABLED', 'False' if SOCKETIO_MESSAGE_QUEUE else 'True').lower() in ('true', '1', 't')
+HOT_CACHE_MAX_BYTES = int(os.getenv('HOT_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+HOT_CACHE_MESSAGES_PER_CONVERSATION = int(os.getenv('HOT_CACHE_MESSAGES_PER_CONVERSATION', 100))
+HOT_CACHE_TTL = float(os.getenv('HOT_CACHE_TTL', 300))
+
+# Rubrica utenti in memoria (chat/user_directory.py): ricarica periodica per le
+# modifiche fatte da altri processi
+USER_DIRECTORY_TTL = float(os.getenv('USER_DIRECTORY_TTL', 300))
+
+# Indice di autocompletamento utenti/canali (chat/autocomplete.py): ricostruzione periodica
+# per le modifiche fatte da altri processi
+AUTOCOMPLETE_TTL = float(os.getenv('AUTOCOMPLETE_TTL', 300))
+
+# Snapshot versionato di utenti e canali per initialData (chat/directory_snapshot.py):
+# ricostruzione periodica per le modifiche di altri processi e versioni precedenti
+# conservate per rispondere con un delta
+DIRECTORY_SNAPSHOT_TTL = float(os.getenv('DIRECTORY_SNAPSHOT_TTL', 300))
+DIRECTORY_SNAPSHOT_HISTORY = int(os.getenv('DIRECTORY_SNAPSHOT_HISTORY', 8))
+
+# Presenza (chat/presence.py): intervallo di invio delle differenze, attesa prima di segnare
+# offline dopo l'ultima disconnessione, connessioni senza heartbeat non più contate e
+# intervallo di rinnovo delle righe user_presence del worker (scadono dopo tre intervalli)
+PRESENCE_TICK_SECONDS = float(os.getenv('PRESENCE_TICK_SECONDS', 2))
+PRESENCE_GRACE_SECONDS = float(os.getenv('PRESENCE_GRACE_SECONDS', 15))
+PRESENCE_HEARTBEAT_TIMEOUT = float(os.getenv('PRESENCE_HEARTBEAT_TIMEOUT', 90))
+PRESENCE_PERSIST_INTERVAL = float(os.getenv('PRESENCE_PERSIST_INTERVAL', 60))
+
+# Ricerca mentre si digita su Socket.IO (chat/live_search.py): attesa senza nuove query
+# prima di cercare nei messaggi
+SEARCH_DEBOUNCE_MS = float(os.getenv('SEARCH_DEBOUNCE_MS', 150))
+
+# Protocollo compatto dei messaggi (chat/protocol.py): caratteri dell'anteprima di replyTo
+REPLY_SNIPPET_CHARS = int(os.getenv('REPLY_SNIPPET_CHARS', 120))
+
+# Recupero dopo la riconnessione (chat/sync.py): modifiche massime per risposta di syncSince
+# e giorni di conservazione dei messaggi eliminati (oltre, il client ricarica la cronologia)
+SYNC_MAX_CHANGES = int(os.getenv('SYNC_MAX_CHANGES', 500))
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.getenv('SYNC_TOMBSTONE_RETENTION_DAYS', 30))
+
+# Backend JSON per Socket.IO e risposte REST: auto (orjson se installato), orjson o json
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto').lower()
+
+# Budget in secondi per "import app" (controllato da tests/test_startup_budget.py)
+STARTUP_IMPORT_BUDGET = float(os.getenv('STARTUP_IMPORT_BUDGET', 3.0))
+
+# Servizio di embedding condiviso (ricerca semantica)
+EMBEDDING_MODEL_NAME = os.getenv('EMBEDDING_MODEL_NAME', 'paraphrase-multilingual-MiniLM-L12-v2')
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', 32))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv('EMBEDDING_MAX_WAIT_MS', 5))
+EMBEDDING_TIMEOUT = float(os.getenv('EMBEDDING_TIMEOUT', 60))
+# Carica il modello all'avvio del worker invece che al primo utilizzo
+EMBEDDING_WARMUP = os.getenv('EMBEDDING_WARMUP', 'False').lower() in ('true', '1', 't')
+
+# Ricerca vettoriale su codice_civile (pgvector)
+CODICE_CIVILE_TABLE = os.getenv('CODICE_CIVILE_TABLE', 'codice_civile')
+VECTOR_INDEX_METHOD = os.getenv('VECTOR_INDEX_METHOD', 'hnsw')  # hnsw o ivfflat
+VECTOR_HNSW_M = int(os.getenv('VECTOR_HNSW_M', 16))
+VECTOR_HNSW_EF_CONSTRUCTION = int(os.getenv('VECTOR_HNSW_EF_CONSTRUCTION', 64))
+VECTOR_HNSW_EF_SEARCH = int(os.getenv('VECTOR_HNSW_EF_SEARCH', 40))
+VECTOR_IVFFLAT_LISTS = int(os.getenv('VECTOR_IVFFLAT_LISTS', 100))
+VECTOR_IVFFLAT_PROBES = int(os.getenv('VECTOR_IVFFLAT_PROBES', 10))
+
+# Backend di recupero: pgvector (SQL) o numpy (indice locale in memoria mappata)
+RAG_BACKEND = os.getenv('RAG_BACKEND', 'pgvector')
+VECTOR_INDEX_DIR = os.getenv('VECTOR_INDEX_DIR', os.path.join('data', 'vector_index'))
+VECTOR_INDEX_DTYPE = os.getenv('VECTOR_INDEX_DTYPE', 'float32')  # float32 o int8
+
+# Ricerca ibrida full-text + vettoriale con Reciprocal Rank Fusion: richiede la colonna
+# tsvector (python -m common.rag.hybrid --create-fulltext-index)
+RAG_HYBRID = os.getenv('RAG_HYBRID', 'False').lower() in ('true', '1', 't')
+RAG_CANDIDATES = int(os.getenv('RAG_CANDIDATES', 20))
+RAG_RRF_K = int(os.getenv('RAG_RRF_K', 60))
+
+# Recupero speculativo con il messaggio grezzo, in parallelo alla chiamata LLM di Jane (utente 4)
+RAG_SPECULATIVE = os.getenv('RAG_SPECULATIVE', 'False').lower() in ('true', '1', 't')
+RAG_SPECULATIVE_THRESHOLD = float(os.getenv('RAG_SPECULATIVE_THRESHOLD', 0.75))
+
 # API Keys
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY', '')
@@ -62,7 +162,8 @@ def log_config_info():
     logger.info(f"DB_SCHEMA principale: {DB_SCHEMA}")
     logger.info(f"CHAT_SCHEMA: {CHAT_SCHEMA}")
     logger.info(f"CAL_SCHEMA: {CAL_SCHEMA}")
-    
+    logger.info(f"DB pool: size={DB_POOL_SIZE}, max_overflow={DB_MAX_OVERFLOW}, recycle={DB_POOL_RECYCLE}s")
+
     # Log delle API keys in modo sicuro (solo prime 5 e ultime 4 caratteri)
     def mask_key(key):
         if not key or len(key) < 10:
@@ -4,11 +4,10 @@ Questo modulo fornisce funzioni e classi per configurare e utilizzare SQLAlchemy
 in modo coerente in tutta l'applicazione.
 """
 import logging
-from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.schema import MetaData
-from common.config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD, DATABASE_URL
+from common.db.connection import get_engine
 
 # Configura il logging
 logger = logging.getLogger(__name__)
@@ -18,6 +17,9 @@ def create_base_for_schema(schema_name):
     """
     Crea una base SQLAlchemy con schema preconfigurato.
     
+    Le tabelle sono qualificate con lo schema tramite i metadata, quindi tutti i moduli
+    condividono lo stesso engine (e lo stesso pool) restituito da get_engine().
+    
     Args:
         schema_name (str): Nome dello schema da utilizzare
         
@@ -26,30 +28,11 @@ def create_base_for_schema(schema_name):
     """
     logger.info(f"Configurando SQLAlchemy per lo schema: {schema_name}")
     
-    # Crea i metadata con lo schema predefinito
+    # Crea i metadata con lo schema predefinito: ogni tabella sarà schema.tabella
     metadata = MetaData(schema=schema_name)
     
-    # Costruisci la stringa di connessione
-    if DATABASE_URL:
-        engine_url = DATABASE_URL
-    else:
-        engine_url = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-    
-    # Mostra info di connessione
-    masked_url = engine_url
-    if DB_PASSWORD:
-        masked_url = engine_url.replace(DB_PASSWORD, "***")
-    logger.info(f"Connessione database: {masked_url}")
-    
-    # Crea il motore SQLAlchemy
-    engine = create_engine(engine_url)
-    
-    # Configura l'event listener per impostare lo schema corretto
-    @event.listens_for(engine, "connect")
-    def set_search_path(dbapi_connection, connection_record):
-        cursor = dbapi_connection.cursor()
-        cursor.execute(f"SET search_path TO {schema_name}, public")
-        cursor.close()
+    # Engine condiviso dal processo
+    engine = get_engine()
     
     # Base per i modelli SQLAlchemy con i metadata preconfigurati
     Base = declarative_base(metadata=metadata)
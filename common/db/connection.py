@@ -3,19 +3,115 @@ Utility di connessione al database basate su SQLAlchemy.
 Sostituisce le vecchie funzioni che utilizzavano psycopg2 con equivalenti SQLAlchemy.
 """
 import logging
+import threading
 import time
 from contextlib import contextmanager
 from sqlalchemy import create_engine, text, event
 from sqlalchemy.exc import OperationalError, DisconnectionError
 from sqlalchemy.orm import sessionmaker
-from common.config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD, CHAT_SCHEMA, CAL_SCHEMA, DATABASE_URL
+from sqlalchemy.pool import QueuePool
+import psycopg2
+from common.db.cooperative import enable_cooperative_driver, disable_cooperative_driver
+from common.config import (DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD, CHAT_SCHEMA, CAL_SCHEMA, DATABASE_URL,
+                           DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_SSLMODE)
 
 # Configura il logging
 logger = logging.getLogger(__name__)
 
+# Registro dell'engine condiviso: un solo engine (e un solo pool) per processo
+_engine = None
+_engine_lock = threading.Lock()
+
+# Metriche del pool, globali per sopravvivere a dispose()/recreate()
+_pool_metrics_lock = threading.Lock()
+_pool_metrics = {
+    "checkouts": 0,
+    "connects": 0,
+    "wait_time_total": 0.0,
+    "wait_time_max": 0.0,
+    "timeouts": 0,
+}
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool che misura il tempo di attesa per ottenere una connessione"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with _pool_metrics_lock:
+                _pool_metrics["timeouts"] += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with _pool_metrics_lock:
+                _pool_metrics["wait_time_total"] += waited
+                if waited > _pool_metrics["wait_time_max"]:
+                    _pool_metrics["wait_time_max"] = waited
+
+def _build_engine_url():
+    """Costruisce la stringa di connessione a partire dalla configurazione"""
+    if DATABASE_URL:
+        return DATABASE_URL
+    return f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+def _connect_args():
+    """Parametri di connessione migliorati per Render, comuni a engine e connessioni raw"""
+    return {
+        "connect_timeout": 60,
+        "keepalives": 1,
+        "keepalives_idle": 20,
+        "keepalives_interval": 5,
+        "keepalives_count": 5,
+        "application_name": "myapp",
+        "sslmode": DB_SSLMODE,
+    }
+
+def _create_shared_engine():
+    """Crea l'engine condiviso con il pool strumentato"""
+    engine_url = _build_engine_url()
+
+    # Mostra info di connessione (maschera la password)
+    masked_url = engine_url
+    if DB_PASSWORD:
+        masked_url = engine_url.replace(DB_PASSWORD, "***")
+    logger.info(f"Connessione database (engine condiviso): {masked_url}")
+
+    # Le attese sul socket di psycopg2 devono cedere il controllo all'hub di gevent
+    enable_cooperative_driver()
+
+    engine = create_engine(
+        engine_url,
+        connect_args=_connect_args(),
+        poolclass=InstrumentedQueuePool,
+        pool_pre_ping=True,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW
+    )
+
+    @event.listens_for(engine, "connect")
+    def count_connect(dbapi_connection, connection_record):
+        with _pool_metrics_lock:
+            _pool_metrics["connects"] += 1
+
+    @event.listens_for(engine, "checkout")
+    def count_checkout(dbapi_connection, connection_record, connection_proxy):
+        with _pool_metrics_lock:
+            _pool_metrics["checkouts"] += 1
+
+    return engine
+
 def get_engine(schema=None):
     """
-    Crea un motore SQLAlchemy con schema opzionale.
+    Restituisce l'engine SQLAlchemy condiviso dal processo.
+    
+    L'engine (e il suo pool) viene creato una sola volta. Lo schema non viene più
+    impostato con SET search_path sulla connessione: se specificato, viene applicato
+    tramite schema_translate_map alle tabelle dei metadata senza schema esplicito,
+    condividendo comunque lo stesso pool.
     
     Args:
         schema (str, optional): Nome dello schema da utilizzare
@@ -23,53 +119,99 @@ def get_engine(schema=None):
     Returns:
         Engine: Motore SQLAlchemy configurato
     """
+    global _engine
+
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                try:
+                    _engine = _create_shared_engine()
+                except Exception as e:
+                    logger.error(f"Errore nella creazione del motore SQLAlchemy: {str(e)}")
+                    raise
+
+    if schema:
+        return _engine.execution_options(schema_translate_map={None: schema})
+    return _engine
+
+def get_raw_connection(cooperative=True):
+    """
+    Apre una connessione psycopg2 diretta con gli stessi parametri dell'engine.
+    Da usare al posto di psycopg2.connect() per garantire la modalità cooperativa gevent.
+    
+    Args:
+        cooperative (bool): False per i comandi offline che usano COPY (copy_expert non è
+            ammesso con la wait callback di gevent). La callback è globale del processo:
+            False la rimuove per tutte le connessioni, da non usare nel server
+    
+    Returns:
+        connection: Connessione DBAPI psycopg2 (va chiusa dal chiamante)
+    """
+    if cooperative:
+        enable_cooperative_driver()
+    else:
+        disable_cooperative_driver()
+    return psycopg2.connect(_build_engine_url(), **_connect_args())
+
+@contextmanager
+def pooled_raw_connection():
+    """
+    Context manager che presta una connessione DBAPI dal pool condiviso.
+    
+    A differenza di get_raw_connection() non apre una nuova connessione: alla chiusura
+    la connessione torna nel pool (con rollback della transazione eventualmente aperta),
+    quindi eventuali prepared statement restano disponibili per le richieste successive.
+    
+    Yields:
+        _ConnectionFairy: Connessione psycopg2 del pool (attributo info persistente)
+    """
+    conn = get_engine().raw_connection()
     try:
-        # Costruisci la stringa di connessione
-        if DATABASE_URL:
-            engine_url = DATABASE_URL
-        else:
-            engine_url = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-        
-        # Mostra info di connessione (maschera la password)
-        masked_url = engine_url
-        if DB_PASSWORD:
-            masked_url = engine_url.replace(DB_PASSWORD, "***")
-        logger.info(f"Connessione database: {masked_url}")
-        
-        # Parametri di connessione migliorati per Render
-        connect_args = {
-            "connect_timeout": 60,
-            "keepalives": 1,
-            "keepalives_idle": 20,
-            "keepalives_interval": 5,
-            "keepalives_count": 5,
-            "application_name": "myapp",
-            "sslmode": "require",
-        }
-        
-        # Crea il motore SQLAlchemy con parametri migliorati
-        engine = create_engine(
-            engine_url, 
-            connect_args=connect_args,
-            pool_pre_ping=True,
-            pool_recycle=60,
-            pool_timeout=30,
-            pool_size=5,
-            max_overflow=10
-        )
-        
-        # Imposta lo schema se specificato
-        if schema:
-            @event.listens_for(engine, "connect")
-            def set_search_path(dbapi_connection, connection_record):
-                cursor = dbapi_connection.cursor()
-                cursor.execute(f"SET search_path TO {schema}, public")
-                cursor.close()
-        
-        return engine
-    except Exception as e:
-        logger.error(f"Errore nella creazione del motore SQLAlchemy: {str(e)}")
-        raise
+        yield conn
+    finally:
+        conn.close()
+
+def dispose_engine():
+    """
+    Chiude tutte le connessioni del pool condiviso.
+    Da chiamare dopo un fork (es. worker Gunicorn) per non condividere socket tra processi.
+    """
+    if _engine is not None:
+        _engine.dispose(close=False)
+
+def get_pool_stats():
+    """
+    Restituisce la telemetria del pool condiviso.
+    
+    Returns:
+        dict: connessioni in uso, overflow, attese e contatori cumulativi
+    """
+    with _pool_metrics_lock:
+        metrics = dict(_pool_metrics)
+
+    stats = {
+        "initialized": _engine is not None,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_out": 0,
+        "checked_in": 0,
+        "overflow": 0,
+        "checkouts": metrics["checkouts"],
+        "connects": metrics["connects"],
+        "timeouts": metrics["timeouts"],
+        "wait_time_total_ms": round(metrics["wait_time_total"] * 1000, 3),
+        "wait_time_max_ms": round(metrics["wait_time_max"] * 1000, 3),
+        "wait_time_avg_ms": round(metrics["wait_time_total"] * 1000 / metrics["checkouts"], 3) if metrics["checkouts"] else 0.0,
+    }
+
+    if _engine is not None:
+        pool = _engine.pool
+        stats["checked_out"] = pool.checkedout()
+        stats["checked_in"] = pool.checkedin()
+        # overflow() è negativo finché il pool non ha raggiunto pool_size
+        stats["overflow"] = max(pool.overflow(), 0)
+
+    return stats
 
 def create_session_factory(engine):
     """
@@ -140,5 +282,5 @@ def ensure_schema_exists(engine, schema_name):
 def get_db_url():
     """Return the database URL used by the application"""
     # This should return the same URL used by your main application
-    return DATABASE_URL
+    return _build_engine_url()
 
@@ -0,0 +1,79 @@
+"""
+Modalità cooperativa del driver Postgres per gevent.
+psycopg2 è un'estensione C: senza una wait callback le attese sul socket bloccano
+l'intero hub di gevent, congelando tutti i client Socket.IO del worker. Registrando
+una wait callback, ogni attesa di I/O viene delegata a gevent e gli altri greenlet
+continuano a essere eseguiti mentre una query è in corso.
+"""
+import logging
+import threading
+
+import psycopg2
+from psycopg2 import extensions
+
+from common.config import DB_GEVENT_COOPERATIVE
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+_enable_lock = threading.Lock()
+
+def gevent_wait_callback(conn, timeout=None):
+    """
+    Wait callback per psycopg2 che attende il socket tramite l'hub di gevent.
+
+    Args:
+        conn: Connessione psycopg2 in modalità asincrona
+        timeout: Timeout opzionale in secondi
+    """
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Risultato inatteso da poll(): {state!r}")
+
+def is_cooperative_enabled():
+    """Indica se la wait callback di gevent è registrata in psycopg2"""
+    return extensions.get_wait_callback() is gevent_wait_callback
+
+def enable_cooperative_driver(force=False):
+    """
+    Registra la wait callback di gevent per tutte le connessioni psycopg2 del processo.
+    L'operazione è idempotente; viene ignorata se gevent non è disponibile o se la
+    modalità è disabilitata da configurazione (DB_GEVENT_COOPERATIVE).
+
+    Args:
+        force (bool): Abilita anche se disabilitata da configurazione
+
+    Returns:
+        bool: True se la modalità cooperativa è attiva
+    """
+    if not (DB_GEVENT_COOPERATIVE or force):
+        return False
+
+    with _enable_lock:
+        if is_cooperative_enabled():
+            return True
+
+        try:
+            import gevent.socket  # noqa: F401
+        except ImportError:
+            logger.warning("gevent non installato: driver Postgres in modalità bloccante")
+            return False
+
+        extensions.set_wait_callback(gevent_wait_callback)
+        logger.info("Driver Postgres in modalità cooperativa gevent")
+        return True
+
+def disable_cooperative_driver():
+    """Ripristina la modalità bloccante standard di psycopg2"""
+    with _enable_lock:
+        if is_cooperative_enabled():
+            extensions.set_wait_callback(None)
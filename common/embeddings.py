@@ -0,0 +1,306 @@
+"""
+Servizio di embedding condiviso dal processo.
+
+Il modello SentenceTransformer viene caricato una sola volta per worker (all'avvio con
+EMBEDDING_WARMUP oppure al primo utilizzo) e tutte le richieste di encode passano da qui.
+Le richieste concorrenti di più greenlet/thread vengono raggruppate in micro-batch: il
+primo richiedente apre una finestra di EMBEDDING_MAX_WAIT_MS durante la quale le altre
+richieste si accodano, poi un solo forward pass calcola gli embedding di tutto il batch.
+Un batch non supera mai EMBEDDING_MAX_BATCH_SIZE testi: le liste più lunghe vengono
+divise in più richieste e una richiesta che non entra nel batch corrente apre il successivo.
+
+Con gevent il forward pass viene eseguito nel threadpool nativo dell'hub, così il calcolo
+(che rilascia il GIL in torch) non blocca gli altri client Socket.IO.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from common.config import (EMBEDDING_MODEL_NAME, EMBEDDING_MAX_BATCH_SIZE,
+                           EMBEDDING_MAX_WAIT_MS, EMBEDDING_TIMEOUT)
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+# Limiti superiori dei bucket dell'istogramma delle dimensioni dei batch
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+LATENCY_WINDOW = 1000
+
+def _load_sentence_transformer(model_name):
+    """Carica il modello SentenceTransformer (import pesante, solo al primo uso)"""
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+def _gevent_threading_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+def _call_blocking(func, *args, **kwargs):
+    """Esegue una funzione CPU-bound senza bloccare l'hub di gevent (se attivo)"""
+    if _gevent_threading_patched():
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
+
+class _EncodeRequest:
+    __slots__ = ('texts', 'event', 'result', 'error', 'enqueued_at')
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.enqueued_at = time.perf_counter()
+
+class EmbeddingService:
+    """
+    Servizio di embedding con modello caldo e micro-batching delle richieste concorrenti.
+
+    Args:
+        model_name (str): Nome del modello SentenceTransformer
+        max_batch_size (int): Numero massimo di testi per forward pass
+        max_wait_ms (float): Attesa massima per riempire un batch
+        model_loader (callable, optional): Funzione model_name -> modello con metodo encode
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME, max_batch_size=EMBEDDING_MAX_BATCH_SIZE,
+                 max_wait_ms=EMBEDDING_MAX_WAIT_MS, model_loader=None):
+        self.model_name = model_name
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._model_loader = model_loader or _load_sentence_transformer
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._stats = {
+            'load_time_ms': None,
+            'requests': 0,
+            'texts': 0,
+            'batches': 0,
+            'errors': 0,
+            'batch_size_max': 0,
+            'forward_time_total_ms': 0.0,
+            'forward_time_max_ms': 0.0,
+            'latency_total_ms': 0.0,
+            'latency_max_ms': 0.0,
+        }
+        self._batch_histogram = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS}
+        self._batch_histogram['more'] = 0
+
+    # Modello
+
+    @property
+    def is_loaded(self):
+        return self._model is not None
+
+    def get_model(self):
+        """Restituisce il modello, caricandolo una sola volta per processo"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    start = time.perf_counter()
+                    logger.info(f"Caricamento modello di embedding {self.model_name}")
+                    self._model = _call_blocking(self._model_loader, self.model_name)
+                    load_time_ms = (time.perf_counter() - start) * 1000
+                    with self._stats_lock:
+                        self._stats['load_time_ms'] = round(load_time_ms, 2)
+                    logger.info(f"Modello di embedding caricato in {load_time_ms:.0f} ms")
+        return self._model
+
+    def warm_up(self, background=False):
+        """
+        Carica il modello ed esegue un primo encode per inizializzare i kernel.
+
+        Args:
+            background (bool): Esegue il warm-up in un thread (greenlet con gevent)
+        """
+        if background:
+            threading.Thread(target=self._safe_warm_up, name='embedding-warmup', daemon=True).start()
+            return
+        self.encode(['warm-up'])
+
+    def _safe_warm_up(self):
+        try:
+            self.warm_up()
+        except Exception as e:
+            logger.error(f"Warm-up del modello di embedding fallito: {e}")
+
+    # Encode
+
+    def encode(self, texts, timeout=EMBEDDING_TIMEOUT):
+        """
+        Calcola gli embedding passando dal micro-batcher.
+
+        Args:
+            texts (str | list): Un testo o una lista di testi
+            timeout (float): Secondi massimi di attesa del risultato
+
+        Returns:
+            numpy.ndarray: vettore 1D per un singolo testo, matrice 2D per una lista
+        """
+        single = isinstance(texts, str)
+        items = [texts] if single else list(texts)
+        if not items:
+            return np.empty((0, 0), dtype=np.float32)
+
+        self._ensure_worker()
+        requests = [_EncodeRequest(items[i:i + self.max_batch_size])
+                    for i in range(0, len(items), self.max_batch_size)]
+        for request in requests:
+            self._queue.put(request)
+        deadline = time.perf_counter() + timeout
+        for request in requests:
+            if not request.event.wait(max(0.0, deadline - time.perf_counter())):
+                raise TimeoutError(f"Encode non completato entro {timeout}s")
+            if request.error is not None:
+                raise request.error
+
+        latency_ms = (time.perf_counter() - requests[0].enqueued_at) * 1000
+        with self._stats_lock:
+            self._stats['requests'] += 1
+            self._stats['texts'] += len(items)
+            self._stats['latency_total_ms'] += latency_ms
+            self._stats['latency_max_ms'] = max(self._stats['latency_max_ms'], latency_ms)
+            self._latencies.append(latency_ms)
+
+        if single:
+            return requests[0].result[0]
+        if len(requests) == 1:
+            return requests[0].result
+        return np.concatenate([request.result for request in requests])
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._batch_loop, name='embedding-batcher', daemon=True)
+                self._worker.start()
+
+    def _batch_loop(self):
+        # Richiesta che non entrava nel batch precedente: apre il successivo
+        carried = None
+        while True:
+            batch = [carried if carried is not None else self._queue.get()]
+            carried = None
+            count = len(batch[0].texts)
+            deadline = time.perf_counter() + self.max_wait
+            while count < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if count + len(request.texts) > self.max_batch_size:
+                    carried = request
+                    break
+                batch.append(request)
+                count += len(request.texts)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        texts = [text for request in batch for text in request.texts]
+        try:
+            model = self.get_model()
+            start = time.perf_counter()
+            embeddings = np.asarray(_call_blocking(model.encode, texts, batch_size=len(texts)))
+            forward_ms = (time.perf_counter() - start) * 1000
+        except Exception as e:
+            logger.error(f"Errore nel calcolo degli embedding: {e}")
+            with self._stats_lock:
+                self._stats['errors'] += len(batch)
+            for request in batch:
+                request.error = e
+                request.event.set()
+            return
+
+        self._record_batch(len(texts), forward_ms)
+        offset = 0
+        for request in batch:
+            request.result = embeddings[offset:offset + len(request.texts)]
+            offset += len(request.texts)
+            request.event.set()
+
+    # Metriche
+
+    def _record_batch(self, size, forward_ms):
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['batch_size_max'] = max(self._stats['batch_size_max'], size)
+            self._stats['forward_time_total_ms'] += forward_ms
+            self._stats['forward_time_max_ms'] = max(self._stats['forward_time_max_ms'], forward_ms)
+            for bucket in BATCH_SIZE_BUCKETS:
+                if size <= bucket:
+                    self._batch_histogram[bucket] += 1
+                    break
+            else:
+                self._batch_histogram['more'] += 1
+
+    def get_stats(self):
+        """
+        Metriche del servizio: caricamento, dimensione dei batch e latenze.
+
+        Returns:
+            dict: Statistiche correnti
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+            latencies = sorted(self._latencies)
+            histogram = {str(k): v for k, v in self._batch_histogram.items()}
+
+        requests_count = stats['requests']
+        batches = stats['batches']
+        return {
+            'model_name': self.model_name,
+            'loaded': self.is_loaded,
+            'load_time_ms': stats['load_time_ms'],
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'queue_depth': self._queue.qsize(),
+            'requests': requests_count,
+            'texts': stats['texts'],
+            'batches': batches,
+            'errors': stats['errors'],
+            'batch_size_avg': round(stats['texts'] / batches, 2) if batches else 0.0,
+            'batch_size_max': stats['batch_size_max'],
+            'batch_size_histogram': histogram,
+            'forward_time_avg_ms': round(stats['forward_time_total_ms'] / batches, 2) if batches else 0.0,
+            'forward_time_max_ms': round(stats['forward_time_max_ms'], 2),
+            'latency_avg_ms': round(stats['latency_total_ms'] / requests_count, 2) if requests_count else 0.0,
+            'latency_p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2) if latencies else 0.0,
+            'latency_max_ms': round(stats['latency_max_ms'], 2),
+        }
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_embedding_service():
+    """Restituisce il servizio di embedding condiviso dal processo"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = EmbeddingService()
+    return _service
+
+def encode(texts):
+    """Scorciatoia per get_embedding_service().encode(texts)"""
+    return get_embedding_service().encode(texts)
+
+def get_embedding_stats():
+    """Metriche del servizio di embedding condiviso"""
+    return get_embedding_service().get_stats()
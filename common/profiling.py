@@ -0,0 +1,161 @@
+"""
+Profilazione del tempo di import all'avvio.
+
+L'avvio di un worker Gunicorn è dominato dagli import: le librerie pesanti (torch,
+sentence_transformers, LangChain, ReportLab) devono essere caricate solo al primo uso.
+Questo modulo esegue l'import in un processo pulito con `python -X importtime` e riporta
+i moduli più costosi, così una regressione è visibile subito.
+
+Utilizzo:
+    python -m common.profiling                 # profila "import app"
+    python -m common.profiling chat.handlers --top 30
+    python -m common.profiling --no-database  # senza Postgres raggiungibile
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+from common.config import STARTUP_IMPORT_BUDGET
+
+# Librerie da non caricare all'avvio: vanno importate al primo utilizzo
+HEAVY_MODULES = ('torch', 'sentence_transformers', 'transformers', 'langchain',
+                 'langchain_openai', 'langchain_community', 'reportlab', 'pandas')
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+# Codice eseguito prima di "import app" senza database: niente verifica dello schema
+# all'import dei modelli, né utenti e conversazioni dei canali creati da register_handlers.
+# Le migrazioni all'avvio si disattivano con CHAT_AUTO_MIGRATE (vedi NO_DATABASE_ENV).
+NO_DATABASE_SETUP = (
+    "import common.db.base as _base, common.db.connection as _connection\n"
+    "_base.ensure_schema_exists = _connection.ensure_schema_exists = lambda *args, **kwargs: None\n"
+    "import chat.handlers as _handlers\n"
+    "_handlers.ensure_users_exist = _handlers.ensure_channel_conversations_exist = lambda: None"
+)
+NO_DATABASE_ENV = {'CHAT_AUTO_MIGRATE': 'false'}
+
+def run_import(module='app', importtime=False, extra_code='', setup_code='', env=None):
+    """
+    Importa un modulo in un interprete pulito e misura il tempo complessivo.
+
+    Args:
+        module (str): Modulo da importare
+        importtime (bool): Abilita -X importtime per il dettaglio per modulo
+        extra_code (str): Codice eseguito dopo l'import (es. ispezione di sys.modules)
+        setup_code (str): Codice eseguito prima dell'import (es. NO_DATABASE_SETUP)
+        env (dict, optional): Variabili d'ambiente aggiunte a quelle correnti
+
+    Returns:
+        tuple: (CompletedProcess, secondi trascorsi)
+    """
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ['-X', 'importtime']
+    code = f"import {module}"
+    if setup_code:
+        code = f"{setup_code}\n{code}"
+    if extra_code:
+        code += f"\n{extra_code}"
+    cmd += ['-c', code]
+
+    start = time.perf_counter()
+    result = subprocess.run(cmd, cwd=PROJECT_ROOT, capture_output=True, text=True,
+                            env=dict(os.environ, **env) if env else None)
+    elapsed = time.perf_counter() - start
+    return result, elapsed
+
+def parse_importtime(output):
+    """
+    Analizza l'output di -X importtime.
+
+    Args:
+        output (str): stderr del processo
+
+    Returns:
+        list: dizionari con module, self_us, cumulative_us, depth
+    """
+    entries = []
+    for line in output.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        entries.append({
+            'module': module,
+            'self_us': int(self_us),
+            'cumulative_us': int(cumulative_us),
+            'depth': len(indent) // 2,
+        })
+    return entries
+
+def loaded_heavy_modules(entries):
+    """Restituisce le librerie pesanti (HEAVY_MODULES) caricate durante l'import"""
+    found = set()
+    for entry in entries:
+        root = entry['module'].split('.')[0]
+        if root in HEAVY_MODULES:
+            found.add(root)
+    return sorted(found)
+
+def profile_import(module='app', top=20, no_database=False):
+    """
+    Profila l'import di un modulo e stampa un report dei moduli più costosi.
+
+    Args:
+        module (str): Modulo da importare
+        top (int): Numero di moduli da mostrare
+        no_database (bool): Importa senza database (NO_DATABASE_SETUP)
+
+    Returns:
+        dict: elapsed, ok, heavy_modules, top_cumulative, top_self
+    """
+    if no_database:
+        result, elapsed = run_import(module, importtime=True, setup_code=NO_DATABASE_SETUP, env=NO_DATABASE_ENV)
+    else:
+        result, elapsed = run_import(module, importtime=True)
+    entries = parse_importtime(result.stderr)
+
+    top_cumulative = sorted(entries, key=lambda e: e['cumulative_us'], reverse=True)[:top]
+    top_self = sorted(entries, key=lambda e: e['self_us'], reverse=True)[:top]
+    heavy = loaded_heavy_modules(entries)
+
+    print(f"Import di '{module}': {elapsed:.2f}s (budget {STARTUP_IMPORT_BUDGET:.2f}s)")
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith('import time:')]
+        print(f"ATTENZIONE: import fallito (codice {result.returncode})")
+        print("\n".join(errors[-10:]))
+
+    print(f"\nTop {top} per tempo cumulativo:")
+    for entry in top_cumulative:
+        print(f"  {entry['cumulative_us'] / 1000:9.1f} ms  {entry['module']}")
+
+    print(f"\nTop {top} per tempo proprio:")
+    for entry in top_self:
+        print(f"  {entry['self_us'] / 1000:9.1f} ms  {entry['module']}")
+
+    if heavy:
+        print(f"\nLibrerie pesanti caricate all'avvio: {', '.join(heavy)}")
+
+    return {
+        'elapsed': elapsed,
+        'ok': result.returncode == 0,
+        'heavy_modules': heavy,
+        'top_cumulative': top_cumulative,
+        'top_self': top_self,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profilazione del tempo di import all'avvio")
+    parser.add_argument('module', nargs='?', default='app')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--no-database', action='store_true', help="Import senza Postgres (solo tempi)")
+    args = parser.parse_args()
+
+    report = profile_import(args.module, args.top, args.no_database)
+    over_budget = report['elapsed'] > STARTUP_IMPORT_BUDGET
+    sys.exit(1 if (not report['ok'] or over_budget or report['heavy_modules']) else 0)
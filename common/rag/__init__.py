@@ -0,0 +1,3 @@
+"""
+Recupero di articoli del codice civile per la RAG di Jane Smith (utente 4).
+"""
@@ -0,0 +1,113 @@
+"""
+Benchmark dei backend di recupero: indice numpy locale contro query SQL pgvector.
+
+Utilizzo:
+    # Confronto reale (richiede Postgres e un indice costruito con common.rag.numpy_index)
+    python -m common.rag.benchmark --queries 200 --top-k 3
+
+    # Solo indice locale su un corpus sintetico (float32 contro int8), senza database
+    python -m common.rag.benchmark --synthetic 100000 --dims 384
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from common.config import VECTOR_INDEX_DIR
+from common.rag.numpy_index import NumpyVectorIndex, write_index
+from common.rag.pgvector_store import search_codice_civile
+
+def _summary(latencies_ms):
+    ordered = sorted(latencies_ms)
+    return {
+        'mean_ms': statistics.mean(ordered),
+        'p50_ms': ordered[len(ordered) // 2],
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+    }
+
+def _time_queries(search, queries, top_k):
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query, top_k))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies, results
+
+def _recall(candidate_results, reference_results):
+    """Frazione dei top-k di riferimento trovati anche dal candidato"""
+    hits = total = 0
+    for candidate, reference in zip(candidate_results, reference_results):
+        expected = {row[0] for row in reference}
+        hits += len(expected & {row[0] for row in candidate})
+        total += len(expected)
+    return hits / total if total else 1.0
+
+def _sample_queries(index, count, noise, seed):
+    """Query realistiche: righe dell'indice perturbate con rumore gaussiano"""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, index.embeddings.shape[0], size=count)
+    base = np.asarray(index.embeddings[rows], dtype=np.float32)
+    if index.scales is not None:
+        base = base * index.scales[rows][:, None]
+    return base + rng.normal(0, noise, size=base.shape).astype(np.float32)
+
+def _print_row(label, latencies, recall=None):
+    summary = _summary(latencies)
+    line = f"{label:<22} mean {summary['mean_ms']:8.2f} ms   p50 {summary['p50_ms']:8.2f} ms   p95 {summary['p95_ms']:8.2f} ms"
+    if recall is not None:
+        line += f"   recall@k {recall:.3f}"
+    print(line)
+
+def run_database_benchmark(queries, top_k, noise, seed, index_path=VECTOR_INDEX_DIR):
+    """Confronta l'indice locale con la query pgvector sugli stessi vettori"""
+    index = NumpyVectorIndex(index_path).load()
+    vectors = _sample_queries(index, queries, noise, seed)
+
+    # Riscaldamento (prepared statement, page cache della matrice)
+    search_codice_civile(vectors[0], top_k)
+    index.search(vectors[0], top_k)
+
+    sql_latencies, sql_results = _time_queries(lambda q, k: search_codice_civile(q, top_k=k), vectors, top_k)
+    np_latencies, np_results = _time_queries(index.search, vectors, top_k)
+
+    print(f"{queries} query, top_k={top_k}, {index.manifest['rows']} righe, indice {index.manifest['dtype']}")
+    _print_row('pgvector (SQL)', sql_latencies)
+    _print_row(f"numpy ({index.manifest['dtype']})", np_latencies, _recall(np_results, sql_results))
+
+def run_synthetic_benchmark(rows, dims, queries, top_k, noise, seed):
+    """Indice locale su corpus sintetico: float32 come riferimento, int8 confrontato"""
+    rng = np.random.default_rng(seed)
+    embeddings = rng.normal(size=(rows, dims)).astype(np.float32)
+    metadata = [(str(i), '') for i in range(rows)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_index(f"{tmp}/float32", metadata, embeddings, 'float32')
+        write_index(f"{tmp}/int8", metadata, embeddings, 'int8')
+        float_index = NumpyVectorIndex(f"{tmp}/float32").load()
+        int8_index = NumpyVectorIndex(f"{tmp}/int8").load()
+        vectors = _sample_queries(float_index, queries, noise, seed)
+
+        float_latencies, float_results = _time_queries(float_index.search, vectors, top_k)
+        int8_latencies, int8_results = _time_queries(int8_index.search, vectors, top_k)
+
+    print(f"{queries} query, top_k={top_k}, corpus sintetico {rows} x {dims}")
+    _print_row('numpy (float32)', float_latencies)
+    _print_row('numpy (int8)', int8_latencies, _recall(int8_results, float_results))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark indice numpy locale contro pgvector")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--noise', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--index-path', default=VECTOR_INDEX_DIR)
+    parser.add_argument('--synthetic', type=int, default=0, help="Righe del corpus sintetico (niente database)")
+    parser.add_argument('--dims', type=int, default=384)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        run_synthetic_benchmark(args.synthetic, args.dims, args.queries, args.top_k, args.noise, args.seed)
+    else:
+        run_database_benchmark(args.queries, args.top_k, args.noise, args.seed, args.index_path)
@@ -0,0 +1,298 @@
+"""
+Ricerca ibrida sul codice civile: full-text Postgres + similarità vettoriale, fuse con RRF.
+
+La sola similarità vettoriale perde spesso i riferimenti esatti ("art. 2043") e i termini
+tecnici giuridici. Qui due rami vengono eseguiti in parallelo:
+- lessicale: tsvector (configurazione italian) con indice GIN, più il match esatto sul
+  numero di articolo citato nella query; lo snippet viene da ts_headline
+- vettoriale: embedding della query + backend RAG_BACKEND (pgvector o indice numpy)
+
+I due elenchi vengono fusi con Reciprocal Rank Fusion: score = somma di 1 / (k + rank).
+Il punteggio restituito è normalizzato su [0, 1] (1 = primo in entrambi i rami).
+Se la colonna tsvector non esiste ancora si usa il solo ramo vettoriale, con la
+similarità coseno come punteggio.
+
+Creazione della colonna tsvector e dell'indice GIN:
+    python -m common.rag.hybrid --create-fulltext-index
+"""
+import argparse
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.config import CODICE_CIVILE_TABLE, RAG_CANDIDATES, RAG_RRF_K
+from common.db.connection import get_raw_connection, pooled_raw_connection
+from common.embeddings import get_embedding_service
+from common.rag.retrieval import search_articles
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+TSVECTOR_COLUMN = 'content_tsv'
+SNIPPET_LENGTH = 500
+# Termini evidenziati in markdown (il default di ts_headline sono tag <b> nel testo passato all'LLM)
+HEADLINE_OPTIONS = 'StartSel=**, StopSel=**, MaxFragments=2, MinWords=15, MaxWords=40'
+UNDEFINED_COLUMN = '42703'
+_ARTICLE_NUMBER_RE = re.compile(r'\b(?:art(?:icol[oi])?\.?)\s*(\d+(?:[- ]?(?:bis|ter|quater|quinquies|sexies))?)', re.IGNORECASE)
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='hybrid-search')
+
+# False dopo il primo errore "colonna inesistente": il ramo lessicale non viene più eseguito
+_fulltext_available = True
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    'searches': 0,
+    'vector_only': 0,
+    'lexical_errors': 0,
+    'vector_errors': 0,
+    'lexical_ms_total': 0.0,
+    'lexical_ms_max': 0.0,
+    'vector_ms_total': 0.0,
+    'vector_ms_max': 0.0,
+    'embedding_ms_total': 0.0,
+    'total_ms_total': 0.0,
+    'total_ms_max': 0.0,
+}
+
+def fulltext_index_sql():
+    """DDL della colonna tsvector generata e del relativo indice GIN"""
+    return [
+        f"ALTER TABLE {CODICE_CIVILE_TABLE} ADD COLUMN IF NOT EXISTS {TSVECTOR_COLUMN} tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('italian', coalesce(article_number::text, '') || ' ' || coalesce(content, ''))) STORED",
+        f"CREATE INDEX IF NOT EXISTS {CODICE_CIVILE_TABLE}_{TSVECTOR_COLUMN}_idx "
+        f"ON {CODICE_CIVILE_TABLE} USING gin ({TSVECTOR_COLUMN})",
+    ]
+
+def create_fulltext_index():
+    """Aggiunge la colonna tsvector e l'indice GIN a codice_civile (idempotente)"""
+    conn = get_raw_connection()
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            for sql in fulltext_index_sql():
+                logger.info(sql)
+                cur.execute(sql)
+    finally:
+        conn.close()
+
+def extract_article_numbers(query):
+    """Numeri di articolo citati esplicitamente nella query (es. 'art. 2043', 'articolo 1418-bis')"""
+    return [re.sub(r'[- ]+', '-', match.lower()) for match in _ARTICLE_NUMBER_RE.findall(query)]
+
+def lexical_search(query, limit=RAG_CANDIDATES):
+    """
+    Ramo full-text: websearch_to_tsquery italiano sull'indice GIN.
+
+    Returns:
+        list: tuple (article_number, snippet, rank)
+    """
+    article_numbers = extract_article_numbers(query)
+    with pooled_raw_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT article_number,
+                           ts_headline('italian', content, q, %(headline)s),
+                           rank
+                    FROM (
+                        SELECT article_number, content, q,
+                               (CASE WHEN article_number::text = ANY(%(numbers)s) THEN 1 ELSE 0 END)
+                                   + ts_rank_cd({TSVECTOR_COLUMN}, q) AS rank
+                        FROM {CODICE_CIVILE_TABLE}, websearch_to_tsquery('italian', %(query)s) AS q
+                        WHERE {TSVECTOR_COLUMN} @@ q OR article_number::text = ANY(%(numbers)s)
+                        ORDER BY rank DESC
+                        LIMIT %(limit)s
+                    ) AS ranked
+                    ORDER BY rank DESC
+                """, {'query': query, 'numbers': article_numbers, 'limit': int(limit),
+                      'headline': HEADLINE_OPTIONS})
+                rows = cur.fetchall()
+            conn.commit()
+            return rows
+        except Exception:
+            conn.rollback()
+            raise
+
+def vector_search(query, limit=RAG_CANDIDATES, ef_search=None, probes=None):
+    """
+    Ramo vettoriale: embedding dal servizio condiviso e backend RAG_BACKEND.
+
+    Returns:
+        tuple: (righe (article_number, content, similarity), ms di embedding)
+    """
+    start = time.perf_counter()
+    query_embedding = get_embedding_service().encode(query)
+    embedding_ms = (time.perf_counter() - start) * 1000
+    rows = search_articles(query_embedding, top_k=limit, ef_search=ef_search, probes=probes)
+    return rows, embedding_ms
+
+def reciprocal_rank_fusion(ranked_lists, k=RAG_RRF_K):
+    """
+    Fonde più classifiche con Reciprocal Rank Fusion.
+
+    Args:
+        ranked_lists (list): Liste di chiavi ordinate per rilevanza
+        k (int): Costante di smorzamento (60 nel lavoro originale)
+
+    Returns:
+        list: coppie (chiave, score) ordinate per score decrescente
+    """
+    scores = {}
+    for ranking in ranked_lists:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs), None, (time.perf_counter() - start) * 1000
+    except Exception as e:
+        return None, e, (time.perf_counter() - start) * 1000
+
+def _truncate(content):
+    content = content or ''
+    return content[:SNIPPET_LENGTH] + "..." if len(content) > SNIPPET_LENGTH else content
+
+def _vector_only(vector_rows, top_k):
+    # Stessa forma della ricerca solo vettoriale di search_semantica
+    return [{
+        'article_number': article_number,
+        'content': _truncate(content),
+        'similarity': round(similarity, 4),
+    } for article_number, content, similarity in vector_rows[:top_k]]
+
+def _is_missing_column(error):
+    return getattr(error, 'pgcode', None) == UNDEFINED_COLUMN
+
+def hybrid_search(query, top_k=3, ef_search=None, probes=None, candidates=RAG_CANDIDATES):
+    """
+    Esegue in parallelo i due rami e li fonde con RRF.
+
+    Args:
+        query (str): Testo della query
+        top_k (int): Numero di articoli restituiti
+        ef_search (int, optional): hnsw.ef_search del ramo vettoriale
+        probes (int, optional): ivfflat.probes del ramo vettoriale
+        candidates (int): Candidati richiesti a ciascun ramo
+
+    Returns:
+        list: dizionari article_number, content (snippet), similarity (score combinato)
+    """
+    global _fulltext_available
+    if not _fulltext_available:
+        vector_rows, _ = vector_search(query, top_k, ef_search, probes)
+        with _metrics_lock:
+            _metrics['vector_only'] += 1
+        return _vector_only(vector_rows, top_k)
+
+    start = time.perf_counter()
+    lexical_future = _executor.submit(_timed, lexical_search, query, candidates)
+    vector_future = _executor.submit(_timed, vector_search, query, candidates, ef_search, probes)
+    lexical_rows, lexical_error, lexical_ms = lexical_future.result()
+    vector_result, vector_error, vector_ms = vector_future.result()
+
+    if lexical_error:
+        logger.warning(f"Ramo full-text non disponibile: {lexical_error}")
+        lexical_rows = []
+    vector_rows, embedding_ms = vector_result if vector_result else ([], 0.0)
+    if vector_error:
+        logger.warning(f"Ramo vettoriale non disponibile: {vector_error}")
+
+    if _is_missing_column(lexical_error):
+        _fulltext_available = False
+        logger.warning(f"Colonna {TSVECTOR_COLUMN} assente: ricerca solo vettoriale "
+                       f"(crearla con python -m common.rag.hybrid --create-fulltext-index)")
+        if vector_error:
+            raise vector_error
+        with _metrics_lock:
+            _metrics['vector_only'] += 1
+        return _vector_only(vector_rows, top_k)
+
+    snippets = {}
+    for article_number, content, _ in reversed(vector_rows):
+        snippets[article_number] = _truncate(content)
+    # Lo snippet del ramo lessicale evidenzia i termini cercati: ha la precedenza
+    for article_number, headline, _ in reversed(lexical_rows):
+        snippets[article_number] = headline
+
+    # Più chunk dello stesso articolo contano una volta sola, alla posizione migliore
+    fused = reciprocal_rank_fusion([
+        list(dict.fromkeys(row[0] for row in lexical_rows)),
+        list(dict.fromkeys(row[0] for row in vector_rows)),
+    ])
+    max_score = 2.0 / (RAG_RRF_K + 1)
+    results = [{
+        'article_number': article_number,
+        'content': snippets[article_number],
+        'similarity': round(score / max_score, 4),
+    } for article_number, score in fused[:top_k]]
+
+    total_ms = (time.perf_counter() - start) * 1000
+    _record(lexical_ms, vector_ms, embedding_ms, total_ms, lexical_error, vector_error)
+    logger.info(f"Ricerca ibrida '{query[:40]}': full-text {lexical_ms:.1f} ms ({len(lexical_rows)}), "
+                f"vettoriale {vector_ms:.1f} ms ({len(vector_rows)}, embedding {embedding_ms:.1f} ms), "
+                f"totale {total_ms:.1f} ms")
+
+    if lexical_error and vector_error:
+        raise vector_error
+    return results
+
+def _record(lexical_ms, vector_ms, embedding_ms, total_ms, lexical_error, vector_error):
+    with _metrics_lock:
+        _metrics['searches'] += 1
+        _metrics['lexical_errors'] += 1 if lexical_error else 0
+        _metrics['vector_errors'] += 1 if vector_error else 0
+        _metrics['lexical_ms_total'] += lexical_ms
+        _metrics['lexical_ms_max'] = max(_metrics['lexical_ms_max'], lexical_ms)
+        _metrics['vector_ms_total'] += vector_ms
+        _metrics['vector_ms_max'] = max(_metrics['vector_ms_max'], vector_ms)
+        _metrics['embedding_ms_total'] += embedding_ms
+        _metrics['total_ms_total'] += total_ms
+        _metrics['total_ms_max'] = max(_metrics['total_ms_max'], total_ms)
+
+def get_hybrid_stats():
+    """
+    Latenze dei due rami della ricerca ibrida.
+
+    Returns:
+        dict: contatori, medie e massimi in millisecondi
+    """
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    searches = metrics['searches']
+
+    def avg(key):
+        return round(metrics[key] / searches, 2) if searches else 0.0
+
+    return {
+        'searches': searches,
+        'vector_only': metrics['vector_only'],
+        'fulltext_available': _fulltext_available,
+        'lexical_errors': metrics['lexical_errors'],
+        'vector_errors': metrics['vector_errors'],
+        'lexical_ms_avg': avg('lexical_ms_total'),
+        'lexical_ms_max': round(metrics['lexical_ms_max'], 2),
+        'vector_ms_avg': avg('vector_ms_total'),
+        'vector_ms_max': round(metrics['vector_ms_max'], 2),
+        'embedding_ms_avg': avg('embedding_ms_total'),
+        'total_ms_avg': avg('total_ms_total'),
+        'total_ms_max': round(metrics['total_ms_max'], 2),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ricerca ibrida sul codice civile")
+    parser.add_argument('--create-fulltext-index', action='store_true')
+    parser.add_argument('--query')
+    parser.add_argument('--top-k', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.create_fulltext_index:
+        create_fulltext_index()
+    if args.query:
+        for article in hybrid_search(args.query, args.top_k):
+            print(f"Art. {article['article_number']} ({article['similarity']}): {article['content'][:120]}")
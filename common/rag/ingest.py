@@ -0,0 +1,377 @@
+"""
+Pipeline di ingestione offline del corpus codice_civile.
+
+Passi:
+1. lettura in streaming degli articoli da un file locale (.jsonl con article_number/content,
+   oppure testo semplice con intestazioni "Art. 2043")
+2. suddivisione degli articoli lunghi in chunk con sovrapposizione
+3. embedding a grandi batch su un pool di processi con il modello EMBEDDING_MODEL_NAME
+4. caricamento massivo con COPY, una transazione per batch di articoli
+5. checkpoint dopo ogni batch: dopo un crash si riparte dal primo batch non confermato
+
+Ogni riga conserva l'hash SHA-256 del testo dell'articolo: alle esecuzioni successive
+vengono ricalcolati solo gli articoli nuovi o modificati.
+
+Utilizzo:
+    python -m common.rag.ingest codice_civile.jsonl --workers 4
+    python -m common.rag.ingest codice_civile.txt --batch-articles 1000 --build-local-index
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from itertools import islice
+
+import numpy as np
+
+from common.config import CODICE_CIVILE_TABLE, EMBEDDING_MODEL_NAME
+from common.rag.pgvector_store import to_vector_literal
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIMS = 384  # paraphrase-multilingual-MiniLM-L12-v2
+DEFAULT_CHUNK_CHARS = 1200
+DEFAULT_CHUNK_OVERLAP = 200
+
+_ARTICLE_HEADER_RE = re.compile(
+    r'^\s*Art(?:icolo|\.)\s*(\d+(?:[- ]?(?:bis|ter|quater|quinquies|sexies|septies|octies))?)\b\.?\s*(.*)$',
+    re.IGNORECASE)
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.;:])\s+')
+
+# Lettura e suddivisione
+
+def _normalize_article_number(value):
+    return re.sub(r'[- ]+', '-', str(value).strip().lower())
+
+def iter_articles(path):
+    """
+    Legge gli articoli dal file in streaming.
+
+    Yields:
+        tuple: (article_number, content)
+    """
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                content = (record.get('content') or '').strip()
+                if content:
+                    yield _normalize_article_number(record['article_number']), content
+            return
+
+        number, lines = None, []
+        for line in f:
+            match = _ARTICLE_HEADER_RE.match(line)
+            if match:
+                if number and any(l.strip() for l in lines):
+                    yield number, ' '.join(l.strip() for l in lines if l.strip())
+                number, lines = _normalize_article_number(match.group(1)), [match.group(2)]
+            elif number:
+                lines.append(line)
+        if number and any(l.strip() for l in lines):
+            yield number, ' '.join(l.strip() for l in lines if l.strip())
+
+def content_hash(content):
+    """Hash SHA-256 del testo di un articolo"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def chunk_text(text, max_chars=DEFAULT_CHUNK_CHARS, overlap=DEFAULT_CHUNK_OVERLAP):
+    """
+    Divide un testo in chunk di al più max_chars, spezzando tra le frasi.
+
+    Args:
+        text (str): Testo dell'articolo
+        max_chars (int): Lunghezza massima di un chunk
+        overlap (int): Caratteri finali del chunk precedente ripetuti all'inizio del successivo
+
+    Returns:
+        list: Chunk di testo (un solo elemento per gli articoli brevi)
+    """
+    if len(text) <= max_chars:
+        return [text]
+
+    sentences = []
+    for sentence in _SENTENCE_SPLIT_RE.split(text):
+        # Frasi più lunghe del limite: taglio netto
+        while len(sentence) > max_chars:
+            sentences.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if sentence:
+            sentences.append(sentence)
+
+    chunks, current = [], ''
+    for sentence in sentences:
+        candidate = f"{current} {sentence}".strip()
+        if len(candidate) <= max_chars or not current:
+            current = candidate
+            continue
+        chunks.append(current)
+        tail = current[-overlap:] if overlap else ''
+        tail = tail[tail.find(' ') + 1:] if ' ' in tail else tail
+        current = f"{tail} {sentence}".strip() if len(tail) + len(sentence) < max_chars else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+# Embedding su pool di processi
+
+_worker_model = None
+
+def _init_worker(model_name):
+    global _worker_model
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_name)
+
+def _embed_texts(texts):
+    return np.asarray(_worker_model.encode(texts, batch_size=len(texts)), dtype=np.float32)
+
+class EmbeddingPool:
+    """
+    Pool di processi, ognuno con il proprio modello caricato una volta sola.
+
+    Args:
+        workers (int): Numero di processi (0 = nel processo corrente)
+        batch_size (int): Testi per singolo encode
+        model_name (str): Modello SentenceTransformer
+    """
+
+    def __init__(self, workers=1, batch_size=128, model_name=EMBEDDING_MODEL_NAME):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.model_name = model_name
+        self._pool = None
+
+    def __enter__(self):
+        if self.workers > 0:
+            # spawn: il fork dopo l'import di torch può bloccare i processi figli
+            context = multiprocessing.get_context('spawn')
+            self._pool = context.Pool(self.workers, initializer=_init_worker, initargs=(self.model_name,))
+        else:
+            _init_worker(self.model_name)
+        return self
+
+    def __exit__(self, *exc):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+
+    def embed(self, texts):
+        """Embedding di una lista di testi, nell'ordine di ingresso"""
+        if not texts:
+            return np.empty((0, EMBEDDING_DIMS), dtype=np.float32)
+        groups = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if self._pool is None:
+            return np.vstack([_embed_texts(group) for group in groups])
+        return np.vstack(list(self._pool.imap(_embed_texts, groups)))
+
+# Database
+
+def ensure_table(conn):
+    """Crea (o completa) la tabella codice_civile con le colonne richieste dall'ingestione"""
+    with conn.cursor() as cur:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {CODICE_CIVILE_TABLE} (
+                id BIGSERIAL PRIMARY KEY,
+                article_number TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL DEFAULT 0,
+                content TEXT NOT NULL,
+                content_hash CHAR(64),
+                embedding vector({EMBEDDING_DIMS})
+            )
+        """)
+        cur.execute(f"ALTER TABLE {CODICE_CIVILE_TABLE} ADD COLUMN IF NOT EXISTS chunk_index INTEGER NOT NULL DEFAULT 0")
+        cur.execute(f"ALTER TABLE {CODICE_CIVILE_TABLE} ADD COLUMN IF NOT EXISTS content_hash CHAR(64)")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {CODICE_CIVILE_TABLE}_article_number_idx "
+                    f"ON {CODICE_CIVILE_TABLE} (article_number, chunk_index)")
+    conn.commit()
+
+def load_existing_hashes(conn):
+    """Hash degli articoli già presenti: {article_number: content_hash}"""
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT DISTINCT ON (article_number) article_number::text, content_hash "
+                    f"FROM {CODICE_CIVILE_TABLE} ORDER BY article_number, chunk_index")
+        hashes = dict(cur.fetchall())
+    conn.commit()
+    return hashes
+
+def _copy_escape(value):
+    return (value.replace('\\', '\\\\').replace('\t', '\\t')
+                 .replace('\n', '\\n').replace('\r', '\\r'))
+
+def build_copy_buffer(rows, embeddings):
+    """
+    Prepara il buffer per COPY ... FROM STDIN in formato testo.
+
+    Args:
+        rows (list): tuple (article_number, chunk_index, content, content_hash)
+        embeddings: Matrice degli embedding allineata alle righe
+
+    Returns:
+        io.StringIO: Buffer pronto per copy_expert
+    """
+    buffer = io.StringIO()
+    for (article_number, chunk_index, content, digest), embedding in zip(rows, embeddings):
+        buffer.write(f"{_copy_escape(article_number)}\t{chunk_index}\t{_copy_escape(content)}\t"
+                     f"{digest}\t{to_vector_literal(embedding)}\n")
+    buffer.seek(0)
+    return buffer
+
+def write_batch(conn, article_numbers, rows, embeddings):
+    """
+    Sostituisce gli articoli del batch in un'unica transazione (DELETE + COPY).
+
+    La connessione non deve essere cooperativa: get_raw_connection(cooperative=False).
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"DELETE FROM {CODICE_CIVILE_TABLE} WHERE article_number::text = ANY(%s)", (list(article_numbers),))
+        cur.copy_expert(f"COPY {CODICE_CIVILE_TABLE} (article_number, chunk_index, content, content_hash, embedding) "
+                        f"FROM STDIN WITH (FORMAT text)", build_copy_buffer(rows, embeddings))
+
+# Checkpoint
+
+def checkpoint_path(input_path):
+    return f"{input_path}.ingest-checkpoint.json"
+
+def load_checkpoint(input_path):
+    """Restituisce il numero di articoli già confermati per il file (0 se nessun checkpoint)"""
+    try:
+        with open(checkpoint_path(input_path), encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if state.get('input_size') != os.path.getsize(input_path):
+        logger.warning("Il file di input è cambiato dall'ultimo checkpoint: ripartenza dall'inizio")
+        return 0
+    return int(state.get('articles_done', 0))
+
+def save_checkpoint(input_path, articles_done):
+    """Scrive il checkpoint in modo atomico"""
+    path = checkpoint_path(input_path)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'input': os.path.abspath(input_path),
+            'input_size': os.path.getsize(input_path),
+            'articles_done': articles_done,
+            'updated_at': time.time(),
+        }, f)
+    os.replace(tmp_path, path)
+
+def clear_checkpoint(input_path):
+    try:
+        os.remove(checkpoint_path(input_path))
+    except OSError:
+        pass
+
+# Pipeline
+
+def ingest(input_path, workers=1, batch_articles=500, embed_batch_size=128,
+           chunk_chars=DEFAULT_CHUNK_CHARS, chunk_overlap=DEFAULT_CHUNK_OVERLAP, resume=True):
+    """
+    Esegue l'ingestione completa del file nel database.
+
+    Args:
+        input_path (str): File degli articoli (.jsonl o testo)
+        workers (int): Processi di embedding (0 = nel processo corrente)
+        batch_articles (int): Articoli per transazione/checkpoint
+        embed_batch_size (int): Testi per singolo encode
+        chunk_chars (int): Lunghezza massima di un chunk
+        chunk_overlap (int): Sovrapposizione tra chunk consecutivi
+        resume (bool): Riprende dal checkpoint, se presente
+
+    Returns:
+        dict: articoli letti, saltati (invariati), aggiornati, chunk scritti, articoli/s
+    """
+    from common.db.connection import get_raw_connection
+
+    stats = {'read': 0, 'skipped': 0, 'embedded': 0, 'chunks': 0}
+    start = time.perf_counter()
+    done = load_checkpoint(input_path) if resume else 0
+    if done:
+        logger.info(f"Ripresa dal checkpoint: {done} articoli già confermati")
+
+    # COPY non è ammesso con la wait callback di gevent: comando offline, driver bloccante
+    conn = get_raw_connection(cooperative=False)
+    try:
+        ensure_table(conn)
+        existing = load_existing_hashes(conn)
+        articles = islice(iter_articles(input_path), done, None)
+
+        with EmbeddingPool(workers, embed_batch_size) as pool:
+            while True:
+                batch = list(islice(articles, batch_articles))
+                if not batch:
+                    break
+                stats['read'] += len(batch)
+
+                changed, rows = [], []
+                for article_number, content in batch:
+                    digest = content_hash(content)
+                    if existing.get(article_number) == digest:
+                        stats['skipped'] += 1
+                        continue
+                    changed.append(article_number)
+                    for index, chunk in enumerate(chunk_text(content, chunk_chars, chunk_overlap)):
+                        rows.append((article_number, index, chunk, digest))
+
+                if rows:
+                    embeddings = pool.embed([row[2] for row in rows])
+                    try:
+                        write_batch(conn, changed, rows, embeddings)
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    for article_number, _, _, digest in rows:
+                        existing[article_number] = digest
+
+                stats['embedded'] += len(changed)
+                stats['chunks'] += len(rows)
+                done += len(batch)
+                save_checkpoint(input_path, done)
+
+                elapsed = time.perf_counter() - start
+                logger.info(f"{done} articoli ({stats['embedded']} embedding, {stats['skipped']} invariati), "
+                            f"{stats['read'] / elapsed:.1f} articoli/s")
+    finally:
+        conn.close()
+
+    clear_checkpoint(input_path)
+    elapsed = time.perf_counter() - start
+    stats['seconds'] = round(elapsed, 2)
+    stats['articles_per_second'] = round(stats['read'] / elapsed, 1) if elapsed else 0.0
+    stats['embedded_per_second'] = round(stats['embedded'] / elapsed, 1) if elapsed else 0.0
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingestione del corpus codice_civile con embedding")
+    parser.add_argument('input', help="File .jsonl (article_number, content) o testo con intestazioni 'Art. N'")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--batch-articles', type=int, default=500)
+    parser.add_argument('--embed-batch-size', type=int, default=128)
+    parser.add_argument('--chunk-chars', type=int, default=DEFAULT_CHUNK_CHARS)
+    parser.add_argument('--chunk-overlap', type=int, default=DEFAULT_CHUNK_OVERLAP)
+    parser.add_argument('--no-resume', action='store_true', help="Ignora il checkpoint esistente")
+    parser.add_argument('--build-local-index', action='store_true', help="Ricostruisce l'indice numpy al termine")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    result = ingest(args.input, args.workers, args.batch_articles, args.embed_batch_size,
+                    args.chunk_chars, args.chunk_overlap, resume=not args.no_resume)
+    print(f"Letti {result['read']} articoli in {result['seconds']}s ({result['articles_per_second']} articoli/s): "
+          f"{result['embedded']} ricalcolati ({result['embedded_per_second']}/s), {result['skipped']} invariati, "
+          f"{result['chunks']} chunk scritti")
+
+    if args.build_local_index:
+        from common.rag.numpy_index import build_from_database
+        build_from_database()
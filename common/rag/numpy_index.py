@@ -0,0 +1,309 @@
+"""
+Indice vettoriale locale in memoria mappata (alternativa a pgvector).
+
+VECTOR_INDEX_DIR è un link simbolico alla versione corrente dell'indice (directory
+sorella .<nome>.v*): una ricostruzione scrive una nuova versione e sposta il link con
+os.replace, così il percorso esiste sempre e punta a un indice completo.
+
+Struttura di una versione dell'indice:
+    manifest.json    dtype, dimensione, numero di righe, data di costruzione
+    embeddings.npy   matrice N x D normalizzata (float32, oppure int8 quantizzata)
+    scales.npy       scala per riga della quantizzazione int8 (solo dtype int8)
+    metadata.json    lista [article_number, content] allineata alle righe
+
+La matrice viene aperta con np.load(mmap_mode='r'): le pagine sono condivise tra i
+worker tramite la page cache del sistema operativo. Il punteggio coseno è un prodotto
+scalare vettorizzato (i vettori sono normalizzati in costruzione) e il top-k usa
+np.argpartition, senza ordinare l'intero corpus. L'indice int8 occupa un quarto della
+memoria ma è più lento (la matrice va convertita a blocchi prima del prodotto).
+
+Costruzione/aggiornamento dalla tabella codice_civile:
+    python -m common.rag.numpy_index --dtype int8
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from common.config import CODICE_CIVILE_TABLE, VECTOR_INDEX_DIR, VECTOR_INDEX_DTYPE
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+INDEX_DTYPES = ('float32', 'int8')
+MANIFEST_FILE = 'manifest.json'
+EMBEDDINGS_FILE = 'embeddings.npy'
+SCALES_FILE = 'scales.npy'
+METADATA_FILE = 'metadata.json'
+# Righe per blocco nel calcolo dei punteggi int8 (limita la memoria temporanea)
+SCORE_CHUNK_ROWS = 65536
+# Candidati per articolo richiesto: un articolo lungo occupa più righe (chunk)
+ARTICLE_OVERFETCH = 4
+
+def _normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def quantize_int8(matrix):
+    """
+    Quantizzazione simmetrica per riga in int8.
+
+    Returns:
+        tuple: (matrice int8, scale float32) con matrix ~= int8 * scale
+    """
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+def _version_prefix(path):
+    return '.' + os.path.basename(os.path.abspath(path)) + '.v'
+
+def _swap_link(path, version_dir):
+    """
+    Punta path alla nuova versione sostituendo il link simbolico con os.replace.
+
+    Returns:
+        str or None: Versione a cui puntava il link prima dello scambio
+    """
+    previous = os.path.realpath(path) if os.path.islink(path) else None
+    if os.path.isdir(path) and previous is None:
+        # Indice scritto dalle versioni precedenti come directory reale: diventa una versione
+        previous = tempfile.mkdtemp(prefix=_version_prefix(path), dir=os.path.dirname(version_dir))
+        os.rmdir(previous)
+        os.rename(path, previous)
+    link = f"{path}.link-{os.getpid()}"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(version_dir), link)
+    os.replace(link, path)
+    return previous
+
+def _remove_old_versions(path, keep):
+    """Elimina le versioni non più puntate, tranne quelle in keep (es. la precedente)"""
+    parent = os.path.dirname(os.path.abspath(path))
+    prefix = _version_prefix(path)
+    keep = {os.path.realpath(version) for version in keep if version}
+    for name in os.listdir(parent):
+        version = os.path.join(parent, name)
+        if name.startswith(prefix) and os.path.realpath(version) not in keep:
+            shutil.rmtree(version, ignore_errors=True)
+
+def write_index(path, metadata, embeddings, dtype=VECTOR_INDEX_DTYPE):
+    """
+    Scrive un indice completo in una nuova versione e vi sposta atomicamente il link path.
+
+    La versione precedente resta su disco fino alla ricostruzione successiva: i processi
+    che la stanno caricando in quel momento non trovano file mancanti.
+
+    Args:
+        path (str): Directory dell'indice
+        metadata (list): Coppie (article_number, content) allineate agli embedding
+        embeddings: Matrice N x D (verrà normalizzata)
+        dtype (str): 'float32' o 'int8'
+    """
+    if dtype not in INDEX_DTYPES:
+        raise ValueError(f"dtype non supportato: {dtype}")
+    matrix = _normalize_rows(embeddings)
+    if len(metadata) != matrix.shape[0]:
+        raise ValueError("metadata ed embedding hanno lunghezze diverse")
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=_version_prefix(path), dir=parent)
+    try:
+        if dtype == 'int8':
+            quantized, scales = quantize_int8(matrix)
+            np.save(os.path.join(tmp_dir, EMBEDDINGS_FILE), quantized)
+            np.save(os.path.join(tmp_dir, SCALES_FILE), scales)
+        else:
+            np.save(os.path.join(tmp_dir, EMBEDDINGS_FILE), matrix)
+        with open(os.path.join(tmp_dir, METADATA_FILE), 'w', encoding='utf-8') as f:
+            json.dump([[article_number, content] for article_number, content in metadata], f, ensure_ascii=False)
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump({
+                'dtype': dtype,
+                'rows': int(matrix.shape[0]),
+                'dims': int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+                'source': CODICE_CIVILE_TABLE,
+                'built_at': datetime.now().isoformat(),
+            }, f)
+        # Sostituzione atomica: i worker vedono il vecchio o il nuovo indice, mai uno parziale
+        previous = _swap_link(path, tmp_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    _remove_old_versions(path, keep=(tmp_dir, previous))
+
+class NumpyVectorIndex:
+    """
+    Indice coseno su matrice numpy in memoria mappata.
+
+    Args:
+        path (str): Directory dell'indice
+    """
+
+    def __init__(self, path=VECTOR_INDEX_DIR):
+        self.path = path
+        self.manifest = None
+        self.embeddings = None
+        self.scales = None
+        self.metadata = None
+        self.loaded_mtime = None
+        self.loaded_version = None
+
+    @staticmethod
+    def exists(path=VECTOR_INDEX_DIR):
+        return os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+    def _manifest_mtime(self):
+        return os.path.getmtime(os.path.join(self.path, MANIFEST_FILE))
+
+    def load(self):
+        """Apre l'indice in memoria mappata (tutti i file dalla stessa versione)"""
+        version = os.path.realpath(self.path)
+        with open(os.path.join(version, MANIFEST_FILE), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.embeddings = np.load(os.path.join(version, EMBEDDINGS_FILE), mmap_mode='r')
+        self.scales = None
+        if self.manifest['dtype'] == 'int8':
+            self.scales = np.load(os.path.join(version, SCALES_FILE))
+        with open(os.path.join(version, METADATA_FILE), encoding='utf-8') as f:
+            self.metadata = json.load(f)
+        self.loaded_version = version
+        self.loaded_mtime = os.path.getmtime(os.path.join(version, MANIFEST_FILE))
+        logger.info(f"Indice vettoriale locale caricato: {self.manifest['rows']} righe, {self.manifest['dtype']}")
+        return self
+
+    def is_stale(self):
+        """Indica se l'indice su disco è stato ricostruito dopo il caricamento"""
+        try:
+            if os.path.realpath(self.path) != self.loaded_version:
+                return True
+            return self._manifest_mtime() != self.loaded_mtime
+        except OSError:
+            return False
+
+    def scores(self, query_embedding):
+        """Similarità coseno tra la query e tutte le righe"""
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        if self.scales is None:
+            return self.embeddings @ query
+
+        rows = self.embeddings.shape[0]
+        result = np.empty(rows, dtype=np.float32)
+        for start in range(0, rows, SCORE_CHUNK_ROWS):
+            chunk = self.embeddings[start:start + SCORE_CHUNK_ROWS].astype(np.float32)
+            result[start:start + SCORE_CHUNK_ROWS] = chunk @ query
+        return result * self.scales
+
+    def search(self, query_embedding, top_k=3):
+        """
+        Restituisce i top-k articoli più simili, uno per article_number (il chunk migliore).
+
+        Returns:
+            list: tuple (article_number, content, similarity), come la ricerca pgvector
+        """
+        rows = self.embeddings.shape[0]
+        if rows == 0 or top_k <= 0:
+            return []
+        scores = self.scores(query_embedding)
+        k = min(int(top_k) * ARTICLE_OVERFETCH, rows)
+        while True:
+            candidates = np.argpartition(-scores, k - 1)[:k]
+            ordered = candidates[np.argsort(-scores[candidates])]
+            results, seen = [], set()
+            for i in ordered:
+                article_number = self.metadata[i][0]
+                if article_number in seen:
+                    continue
+                seen.add(article_number)
+                results.append((article_number, self.metadata[i][1], float(scores[i])))
+                if len(results) == top_k:
+                    return results
+            if k == rows:
+                return results
+            # Troppi chunk degli stessi articoli tra i candidati: ordina tutto il corpus
+            k = rows
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_numpy_index():
+    """
+    Restituisce l'indice locale condiviso dal processo, ricaricandolo se è stato ricostruito.
+
+    Returns:
+        NumpyVectorIndex or None: None se l'indice non è ancora stato costruito
+    """
+    global _index
+    if not NumpyVectorIndex.exists(VECTOR_INDEX_DIR):
+        return None
+    with _index_lock:
+        if _index is None or _index.is_stale():
+            _index = NumpyVectorIndex(VECTOR_INDEX_DIR).load()
+    return _index
+
+def parse_vector(value):
+    """Converte un valore vector restituito da psycopg2 ('[x1,x2,...]') in array numpy"""
+    if isinstance(value, str):
+        return np.array(value.strip('[]').split(','), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+def build_from_database(path=VECTOR_INDEX_DIR, dtype=VECTOR_INDEX_DTYPE, fetch_size=2000):
+    """
+    Esporta codice_civile (article_number, content, embedding) in un indice locale.
+
+    Args:
+        path (str): Directory dell'indice
+        dtype (str): 'float32' o 'int8'
+        fetch_size (int): Righe per fetch dal cursore lato server
+
+    Returns:
+        int: Numero di articoli esportati
+    """
+    from common.db.connection import get_raw_connection
+
+    start = time.perf_counter()
+    conn = get_raw_connection()
+    try:
+        # Cursore con nome: le righe arrivano a blocchi, senza caricare tutto il risultato
+        cur = conn.cursor(name='export_codice_civile')
+        cur.itersize = fetch_size
+        cur.execute(f"SELECT article_number, content, embedding FROM {CODICE_CIVILE_TABLE} "
+                    f"WHERE embedding IS NOT NULL ORDER BY article_number")
+        metadata, vectors = [], []
+        for article_number, content, embedding in cur:
+            metadata.append((article_number, content))
+            vectors.append(parse_vector(embedding))
+        cur.close()
+    finally:
+        conn.close()
+
+    embeddings = np.vstack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+    write_index(path, metadata, embeddings, dtype)
+    logger.info(f"Indice locale costruito: {len(metadata)} articoli ({dtype}) in {time.perf_counter() - start:.1f}s")
+    return len(metadata)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Costruisce/aggiorna l'indice vettoriale locale da codice_civile")
+    parser.add_argument('--path', default=VECTOR_INDEX_DIR)
+    parser.add_argument('--dtype', choices=INDEX_DTYPES, default=VECTOR_INDEX_DTYPE)
+    parser.add_argument('--fetch-size', type=int, default=2000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    count = build_from_database(args.path, args.dtype, args.fetch_size)
+    print(f"Esportati {count} articoli in {args.path}")
@@ -0,0 +1,206 @@
+"""
+Ricerca vettoriale su codice_civile con pgvector.
+
+- Connessioni prese dal pool condiviso (niente psycopg2.connect per query).
+- Prepared statement lato server, preparato una volta per connessione fisica: il
+  vettore della query viaggia una sola volta ed è già tipizzato come vector.
+- Indice ANN (HNSW o IVFFlat) su codice_civile.embedding gestito da qui, con
+  ef_search/probes impostabili per singola chiamata tramite SET LOCAL.
+
+Gestione dell'indice:
+    python -m common.rag.pgvector_store --create-index hnsw
+    python -m common.rag.pgvector_store --drop-index ivfflat
+    python -m common.rag.pgvector_store --info
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+import psycopg2
+
+from common.config import (CODICE_CIVILE_TABLE, VECTOR_INDEX_METHOD, VECTOR_HNSW_M,
+                           VECTOR_HNSW_EF_CONSTRUCTION, VECTOR_HNSW_EF_SEARCH,
+                           VECTOR_IVFFLAT_LISTS, VECTOR_IVFFLAT_PROBES)
+from common.db.connection import get_raw_connection, pooled_raw_connection
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+INDEX_METHODS = ('hnsw', 'ivfflat')
+PREPARED_STATEMENT = 'codice_civile_knn'
+_PREPARED_KEY = 'codice_civile_knn_prepared'
+
+def to_vector_literal(embedding):
+    """
+    Converte un embedding nel formato testuale di pgvector con precisione float32.
+
+    psycopg2 non supporta parametri binari: la rappresentazione compatta a 7 cifre
+    significative coincide con quella che pgvector conserva (float4).
+
+    Args:
+        embedding: Sequenza o array numpy di float
+
+    Returns:
+        str: Vettore nella forma '[x1,x2,...]'
+    """
+    values = np.asarray(embedding, dtype=np.float32).ravel()
+    return '[' + ','.join('%.7g' % value for value in values) + ']'
+
+def index_name(method):
+    """Nome dell'indice ANN per il metodo indicato"""
+    return f"{CODICE_CIVILE_TABLE}_embedding_{method}_idx"
+
+def build_ann_index_sql(method=VECTOR_INDEX_METHOD, m=VECTOR_HNSW_M,
+                        ef_construction=VECTOR_HNSW_EF_CONSTRUCTION, lists=VECTOR_IVFFLAT_LISTS,
+                        concurrently=True):
+    """
+    Costruisce il DDL dell'indice ANN con distanza coseno.
+
+    Args:
+        method (str): 'hnsw' o 'ivfflat'
+        m (int): Connessioni per nodo HNSW
+        ef_construction (int): Ampiezza della lista candidati in costruzione HNSW
+        lists (int): Numero di liste IVFFlat (indicativamente righe/1000)
+        concurrently (bool): Non blocca le scritture durante la costruzione
+
+    Returns:
+        str: Istruzione CREATE INDEX
+    """
+    if method not in INDEX_METHODS:
+        raise ValueError(f"Metodo di indice non supportato: {method}")
+    if method == 'hnsw':
+        options = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+    else:
+        options = f"lists = {int(lists)}"
+    return (f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {index_name(method)} "
+            f"ON {CODICE_CIVILE_TABLE} USING {method} (embedding vector_cosine_ops) WITH ({options})")
+
+def _run_ddl(sql):
+    # CREATE/DROP INDEX CONCURRENTLY non può girare in una transazione
+    conn = get_raw_connection()
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(sql)
+    finally:
+        conn.close()
+
+def create_ann_index(method=VECTOR_INDEX_METHOD, **options):
+    """
+    Crea l'indice ANN su codice_civile.embedding (se non esiste).
+
+    Args:
+        method (str): 'hnsw' o 'ivfflat'
+        **options: m, ef_construction, lists, concurrently (vedi build_ann_index_sql)
+    """
+    sql = build_ann_index_sql(method, **options)
+    logger.info(f"Creazione indice ANN: {sql}")
+    start = time.perf_counter()
+    _run_ddl(sql)
+    if method == 'ivfflat':
+        # IVFFlat calcola i centroidi in costruzione: aggiorna le statistiche
+        _run_ddl(f"ANALYZE {CODICE_CIVILE_TABLE}")
+    logger.info(f"Indice {index_name(method)} pronto in {time.perf_counter() - start:.1f}s")
+
+def drop_ann_index(method=VECTOR_INDEX_METHOD):
+    """Elimina l'indice ANN del metodo indicato"""
+    if method not in INDEX_METHODS:
+        raise ValueError(f"Metodo di indice non supportato: {method}")
+    _run_ddl(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name(method)}")
+
+def get_ann_index_info():
+    """
+    Elenca gli indici ANN presenti su codice_civile.
+
+    Returns:
+        list: dizionari con name, method, definition, size
+    """
+    with pooled_raw_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT i.indexname, i.indexdef, pg_size_pretty(pg_relation_size(c.oid))
+                FROM pg_indexes i
+                JOIN pg_class c ON c.relname = i.indexname
+                WHERE i.tablename = %s AND (i.indexdef ILIKE '%%USING hnsw%%' OR i.indexdef ILIKE '%%USING ivfflat%%')
+            """, (CODICE_CIVILE_TABLE,))
+            rows = cur.fetchall()
+        conn.rollback()
+
+    return [{
+        'name': name,
+        'method': 'hnsw' if 'USING hnsw' in definition else 'ivfflat',
+        'definition': definition,
+        'size': size,
+    } for name, definition, size in rows]
+
+def _ensure_prepared(conn, cur):
+    if conn.info.get(_PREPARED_KEY):
+        return
+    cur.execute(f"""
+        PREPARE {PREPARED_STATEMENT} (vector, integer) AS
+        SELECT article_number, content, 1 - (embedding <=> $1) AS similarity
+        FROM {CODICE_CIVILE_TABLE}
+        ORDER BY embedding <=> $1
+        LIMIT $2
+    """)
+    conn.info[_PREPARED_KEY] = True
+
+def search_codice_civile(query_embedding, top_k=3, ef_search=None, probes=None):
+    """
+    Restituisce gli articoli più vicini all'embedding della query.
+
+    Args:
+        query_embedding: Embedding della query (lista o array numpy)
+        top_k (int): Numero di articoli da restituire
+        ef_search (int, optional): hnsw.ef_search per questa chiamata (default VECTOR_HNSW_EF_SEARCH)
+        probes (int, optional): ivfflat.probes per questa chiamata (default VECTOR_IVFFLAT_PROBES)
+
+    Returns:
+        list: tuple (article_number, content, similarity) ordinate per similarità
+    """
+    vector = to_vector_literal(query_embedding)
+    ef_search = int(ef_search or VECTOR_HNSW_EF_SEARCH)
+    probes = int(probes or VECTOR_IVFFLAT_PROBES)
+
+    with pooled_raw_connection() as conn:
+        for attempt in range(2):
+            try:
+                with conn.cursor() as cur:
+                    _ensure_prepared(conn, cur)
+                    # SET LOCAL: i parametri valgono solo per questa transazione
+                    cur.execute("SET LOCAL hnsw.ef_search = %s; SET LOCAL ivfflat.probes = %s",
+                                (ef_search, probes))
+                    cur.execute(f"EXECUTE {PREPARED_STATEMENT} (%s, %s)", (vector, int(top_k)))
+                    rows = cur.fetchall()
+                conn.commit()
+                return rows
+            except psycopg2.errors.InvalidSqlStatementName:
+                # Il prepared statement non esiste più (es. DISCARD ALL da un proxy)
+                conn.rollback()
+                conn.info.pop(_PREPARED_KEY, None)
+                if attempt == 1:
+                    raise
+            except Exception:
+                conn.rollback()
+                raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gestione dell'indice ANN su codice_civile.embedding")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--create-index', choices=INDEX_METHODS)
+    group.add_argument('--drop-index', choices=INDEX_METHODS)
+    group.add_argument('--info', action='store_true')
+    parser.add_argument('--m', type=int, default=VECTOR_HNSW_M)
+    parser.add_argument('--ef-construction', type=int, default=VECTOR_HNSW_EF_CONSTRUCTION)
+    parser.add_argument('--lists', type=int, default=VECTOR_IVFFLAT_LISTS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.create_index:
+        create_ann_index(args.create_index, m=args.m, ef_construction=args.ef_construction, lists=args.lists)
+    elif args.drop_index:
+        drop_ann_index(args.drop_index)
+    else:
+        for index in get_ann_index_info():
+            print(f"{index['name']} ({index['method']}, {index['size']}): {index['definition']}")
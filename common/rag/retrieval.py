@@ -0,0 +1,66 @@
+"""
+Punto di ingresso unico per il recupero degli articoli: sceglie il backend da RAG_BACKEND.
+
+- pgvector: query preparata su Postgres (common.rag.pgvector_store)
+- numpy:    indice locale in memoria mappata (common.rag.numpy_index); se l'indice non
+            è stato costruito si ricade su pgvector
+
+Un articolo lungo è diviso in più righe (chunk) con lo stesso article_number: ogni
+articolo compare una sola volta nei risultati, con il chunk più simile.
+"""
+import logging
+
+from common.config import RAG_BACKEND
+from common.rag.numpy_index import ARTICLE_OVERFETCH, get_numpy_index
+from common.rag.pgvector_store import search_codice_civile
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+RAG_BACKENDS = ('pgvector', 'numpy')
+
+def unique_articles(rows, top_k):
+    """
+    Tiene la prima riga (la più simile) di ogni articolo.
+
+    Args:
+        rows (list): tuple (article_number, content, similarity) ordinate per similarità
+        top_k (int): Numero massimo di articoli
+
+    Returns:
+        list: al più top_k tuple con article_number distinti
+    """
+    results, seen = [], set()
+    for row in rows:
+        if row[0] in seen:
+            continue
+        seen.add(row[0])
+        results.append(row)
+        if len(results) == top_k:
+            break
+    return results
+
+def search_articles(query_embedding, top_k=3, ef_search=None, probes=None, backend=None):
+    """
+    Restituisce gli articoli più vicini all'embedding della query.
+
+    Args:
+        query_embedding: Embedding della query
+        top_k (int): Numero di articoli
+        ef_search (int, optional): hnsw.ef_search (solo pgvector)
+        probes (int, optional): ivfflat.probes (solo pgvector)
+        backend (str, optional): Forza un backend, default RAG_BACKEND
+
+    Returns:
+        list: tuple (article_number, content, similarity), un articolo per riga
+    """
+    backend = backend or RAG_BACKEND
+    if backend == 'numpy':
+        index = get_numpy_index()
+        if index is not None:
+            return index.search(query_embedding, top_k)
+        logger.warning("RAG_BACKEND=numpy ma l'indice locale non esiste: uso pgvector")
+    # L'indice ANN restituisce chunk: se ne chiedono di più e si tiene il migliore per articolo
+    rows = search_codice_civile(query_embedding, top_k=top_k * ARTICLE_OVERFETCH, ef_search=ef_search,
+                                probes=probes)
+    return unique_articles(rows, top_k)
@@ -0,0 +1,156 @@
+"""
+Recupero speculativo in parallelo alla chiamata LLM (Jane Smith, utente 4).
+
+Senza speculazione una risposta legale paga due latenze in sequenza: la chiamata LLM,
+poi la ricerca con la query estratta dal tag [RAG_QUERY]. In modalità speculativa la
+ricerca parte subito con il messaggio grezzo dell'utente, mentre l'LLM risponde. Quando
+arriva il tag, se la sua query è abbastanza simile al messaggio (coseno tra gli embedding
+>= RAG_SPECULATIVE_THRESHOLD) si riusano i risultati già pronti, altrimenti si esegue
+la ricerca normale. Una ricerca speculativa vuota o fallita (search_semantica restituisce
+[] in caso di errore) conta come miss: si cerca di nuovo con la query del tag.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from common.config import RAG_SPECULATIVE_THRESHOLD
+from common.embeddings import get_embedding_service
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='rag-speculative')
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    'started': 0,
+    'hits': 0,
+    'misses': 0,
+    'unused': 0,
+    'saved_ms_total': 0.0,
+    'wasted_ms_total': 0.0,
+}
+
+def query_similarity(first, second):
+    """Similarità coseno tra gli embedding di due testi (un solo encode in batch)"""
+    embeddings = get_embedding_service().encode([first, second])
+    a, b = embeddings[0], embeddings[1]
+    denominator = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(np.dot(a, b) / denominator) if denominator else 0.0
+
+class SpeculativeRetrieval:
+    """
+    Ricerca avviata in anticipo con il messaggio grezzo.
+
+    Args:
+        message_text (str): Messaggio dell'utente usato come query speculativa
+        search_fn (callable): Funzione di ricerca (query, top_k) -> risultati
+        top_k (int): Numero di articoli
+        threshold (float): Similarità minima per riusare i risultati
+    """
+
+    def __init__(self, message_text, search_fn, top_k=3, threshold=RAG_SPECULATIVE_THRESHOLD):
+        self.message_text = message_text
+        self.search_fn = search_fn
+        self.top_k = top_k
+        self.threshold = threshold
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self._settled = False
+        self._future = _executor.submit(self._run)
+        with _metrics_lock:
+            _metrics['started'] += 1
+
+    def _run(self):
+        try:
+            return self.search_fn(self.message_text, self.top_k)
+        finally:
+            self.finished_at = time.perf_counter()
+
+    def _retrieval_ms(self, until):
+        end = self.finished_at or until
+        return (end - self.started_at) * 1000
+
+    def resolve(self, tag_query):
+        """
+        Restituisce i risultati per la query del tag, riusando la speculazione se possibile.
+
+        Args:
+            tag_query (str): Query estratta dal tag [RAG_QUERY]
+
+        Returns:
+            list: Articoli nello stesso formato di search_semantica
+        """
+        if self._settled:
+            return self.search_fn(tag_query, self.top_k)
+        self._settled = True
+        resolved_at = time.perf_counter()
+
+        try:
+            similarity = query_similarity(self.message_text, tag_query)
+        except Exception as e:
+            logger.warning(f"Similarità tra query non calcolabile: {e}")
+            similarity = 0.0
+
+        if similarity >= self.threshold:
+            try:
+                articles = self._future.result()
+            except Exception as e:
+                logger.warning(f"Ricerca speculativa fallita: {e}")
+                articles = None
+            if articles:
+                # Risparmio: la parte della ricerca che si è sovrapposta alla chiamata LLM
+                saved_ms = min(self._retrieval_ms(resolved_at), (resolved_at - self.started_at) * 1000)
+                with _metrics_lock:
+                    _metrics['hits'] += 1
+                    _metrics['saved_ms_total'] += saved_ms
+                logger.info(f"Speculazione RAG riusata (similarità {similarity:.2f}, risparmiati {saved_ms:.0f} ms)")
+                return articles
+
+        self._future.cancel()
+        with _metrics_lock:
+            _metrics['misses'] += 1
+            _metrics['wasted_ms_total'] += self._retrieval_ms(resolved_at)
+        if similarity >= self.threshold:
+            logger.info("Speculazione RAG senza risultati: ricerca con la query del tag")
+        else:
+            logger.info(f"Speculazione RAG scartata (similarità {similarity:.2f} < {self.threshold})")
+        return self.search_fn(tag_query, self.top_k)
+
+    def discard(self):
+        """Segnala che la risposta non ha richiesto una ricerca (no-op se già risolta)"""
+        if self._settled:
+            return
+        self._settled = True
+        self._future.cancel()
+        with _metrics_lock:
+            _metrics['unused'] += 1
+            _metrics['wasted_ms_total'] += self._retrieval_ms(time.perf_counter())
+
+def start_speculative_retrieval(message_text, search_fn, top_k=3):
+    """Avvia la ricerca speculativa con il messaggio grezzo dell'utente"""
+    return SpeculativeRetrieval(message_text, search_fn, top_k)
+
+def get_speculative_stats():
+    """
+    Metriche della modalità speculativa.
+
+    Returns:
+        dict: hit rate (sulle risposte legali), millisecondi risparmiati e sprecati
+    """
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    resolved = metrics['hits'] + metrics['misses']
+    return {
+        'started': metrics['started'],
+        'hits': metrics['hits'],
+        'misses': metrics['misses'],
+        'unused': metrics['unused'],
+        'hit_rate': round(metrics['hits'] / resolved, 3) if resolved else 0.0,
+        'saved_ms_total': round(metrics['saved_ms_total'], 1),
+        'saved_ms_avg': round(metrics['saved_ms_total'] / metrics['hits'], 1) if metrics['hits'] else 0.0,
+        'wasted_ms_total': round(metrics['wasted_ms_total'], 1),
+    }
@@ -0,0 +1,154 @@
+"""
+Serializzazione JSON dei payload Socket.IO e REST.
+
+- to_jsonable: converte datetime/date/time, UUID, Decimal, tuple e set in tipi JSON
+  con una sola visita della struttura, senza passare da una stringa (sostituisce il
+  giro json.loads(json.dumps(..., cls=CustomJSONEncoder)))
+- dumps/loads: codifica con orjson se installato (JSON_BACKEND=auto|orjson|json),
+  altrimenti con il modulo json della libreria standard
+- SocketIOJSON: modulo JSON con lo stesso backend, per python-socketio
+- SocketIOPacket: pacchetto Socket.IO (SocketIO(serializer=...)) che codifica il payload
+  una sola volta. Il Packet standard visita ricorsivamente tutto il payload per cercare
+  dati binari prima di codificarlo, e sulla cronologia da 50 messaggi quella visita
+  costa più della codifica stessa. Qui una codifica riuscita dimostra che non ci sono
+  bytes, e la stringa ottenuta viene riusata in encode()
+
+orjson è una dipendenza opzionale: senza, tutto funziona con json.
+"""
+import json
+import logging
+from datetime import date, datetime, time
+from decimal import Decimal
+from uuid import UUID
+
+from socketio import packet
+
+from common.config import JSON_BACKEND
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if JSON_BACKEND == 'orjson' and orjson is None:
+    logger.warning("JSON_BACKEND=orjson ma orjson non è installato: uso json della libreria standard")
+
+USE_ORJSON = orjson is not None and JSON_BACKEND in ('auto', 'orjson')
+
+_PRIMITIVES = (str, int, float, bool, type(None))
+
+def _convert(value):
+    """Converte un valore non primitivo (datetime, UUID, ...) o solleva TypeError"""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def to_jsonable(data):
+    """
+    Restituisce una copia di data composta solo da tipi JSON, in una sola passata.
+
+    Args:
+        data: Dizionari, liste e valori annidati
+
+    Returns:
+        Struttura equivalente a json.loads(json.dumps(data, cls=CustomJSONEncoder))
+    """
+    if type(data) in _PRIMITIVES:
+        return data
+    if isinstance(data, dict):
+        return {key if type(key) is str else _json_key(key): to_jsonable(value)
+                for key, value in data.items()}
+    if isinstance(data, (list, tuple, set, frozenset)):
+        return [to_jsonable(value) for value in data]
+    if isinstance(data, _PRIMITIVES):
+        # Sottoclassi di tipi primitivi (es. Enum di stringhe)
+        return data
+    return _convert(data)
+
+def _json_key(key):
+    """Chiave non stringa come la scriverebbe json.dumps"""
+    if key is None:
+        return 'null'
+    if isinstance(key, bool):
+        return 'true' if key else 'false'
+    if isinstance(key, (int, float, str)):
+        return str(key)
+    return str(_convert(key))
+
+if USE_ORJSON:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(data):
+        """Codifica data in una stringa JSON compatta"""
+        try:
+            return orjson.dumps(data, default=_convert, option=_ORJSON_OPTIONS).decode('utf-8')
+        except TypeError:
+            # Casi non supportati da orjson (es. interi oltre 64 bit)
+            return json.dumps(data, default=_convert, separators=(',', ':'))
+
+    def loads(payload):
+        """Decodifica una stringa (o bytes) JSON"""
+        return orjson.loads(payload)
+else:
+    def dumps(data):
+        """Codifica data in una stringa JSON compatta"""
+        return json.dumps(data, default=_convert, separators=(',', ':'))
+
+    def loads(payload):
+        """Decodifica una stringa (o bytes) JSON"""
+        return json.loads(payload)
+
+class SocketIOJSON:
+    """
+    Modulo JSON per python-socketio/python-engineio (SocketIO(json=SocketIOJSON)).
+
+    I pacchetti vengono codificati con dumps(): i datetime nei payload sono convertiti
+    in ISO 8601 durante la codifica, senza passaggi intermedi.
+    """
+
+    @staticmethod
+    def dumps(data, *args, **kwargs):
+        return dumps(data)
+
+    @staticmethod
+    def loads(payload, *args, **kwargs):
+        return loads(payload)
+
+class SocketIOPacket(packet.Packet):
+    """Pacchetto Socket.IO con payload JSON codificato una sola volta (vedi docstring del modulo)"""
+
+    json = SocketIOJSON
+
+    def __init__(self, packet_type=packet.EVENT, data=None, namespace=None, id=None,
+                 binary=None, encoded_packet=None):
+        self._encoded_data = None
+        if binary is None and encoded_packet is None and data is not None \
+                and packet_type in (packet.EVENT, packet.ACK):
+            try:
+                self._encoded_data = dumps(data)
+                binary = False
+            except TypeError:
+                # bytes (allegati binari) o tipi non serializzabili: percorso standard
+                pass
+        super().__init__(packet_type, data, namespace, id, binary, encoded_packet)
+
+    def encode(self):
+        if self._encoded_data is None:
+            return super().encode()
+        encoded_packet = str(self.packet_type)
+        if self.namespace is not None and self.namespace != '/':
+            encoded_packet += self.namespace + ','
+        if self.id is not None:
+            encoded_packet += str(self.id)
+        return encoded_packet + self._encoded_data
+
+def get_backend_name():
+    """Nome del backend JSON in uso"""
+    return 'orjson' if USE_ORJSON else 'json'
@@ -0,0 +1,256 @@
+"""
+Code di messaggi per distribuire Socket.IO su più worker Gunicorn e più nodi.
+
+Ogni worker ha i propri client e le proprie room: senza una coda condivisa, un emit
+fatto in un worker (anche da emit_calendar_update) raggiunge solo i client collegati
+a quel worker. Con SOCKETIO_MESSAGE_QUEUE il client manager pubblica ogni emit sulla
+coda e tutti i worker lo consegnano ai propri client.
+
+Backend supportati:
+- redis://... / rediss://...   -> RedisManager di python-socketio
+- amqp://... / kombu...        -> KombuManager di python-socketio
+- local://host:porta           -> LocalBrokerManager + broker TCP incluso nel repo,
+                                  pensato per sviluppo e test con N worker su una macchina
+
+Avvio del broker locale:
+    python -m common.socketio_queue --host 127.0.0.1 --port 6390
+"""
+import argparse
+import json
+import logging
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+import socketio
+
+from common.config import SOCKETIO_MESSAGE_QUEUE, SOCKETIO_CHANNEL, SOCKETIO_WEBSOCKET_ONLY
+
+# Configura il logging
+logger = logging.getLogger(__name__)
+
+LOCAL_SCHEME = 'local'
+DEFAULT_LOCAL_PORT = 6390
+
+def _parse_local_url(url):
+    """Estrae host e porta da un URL local://host:porta"""
+    parsed = urlparse(url)
+    return parsed.hostname or '127.0.0.1', parsed.port or DEFAULT_LOCAL_PORT
+
+class LocalBroker:
+    """
+    Broker pub/sub minimale su TCP, sostituto locale di Redis.
+
+    Protocollo a righe JSON:
+        {"op": "sub", "channel": "socketio"}              -> iscrive la connessione
+        {"op": "pub", "channel": "socketio", "data": "..."} -> inoltra "data" agli iscritti
+    Gli iscritti ricevono una riga per messaggio contenente solo il campo data.
+    """
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_LOCAL_PORT):
+        self.host = host
+        self.port = port
+        self._subscribers = {}  # canale -> {socket: lock di scrittura}
+        self._lock = threading.Lock()
+        self._server_socket = None
+        self._running = False
+
+    def start(self):
+        """Avvia il broker in un thread in background e restituisce la porta effettiva"""
+        self._server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server_socket.bind((self.host, self.port))
+        self._server_socket.listen(128)
+        self.port = self._server_socket.getsockname()[1]
+        self._running = True
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        logger.info(f"Broker Socket.IO locale in ascolto su {self.host}:{self.port}")
+        return self.port
+
+    def serve_forever(self):
+        """Avvia il broker e blocca il processo corrente"""
+        self.start()
+        try:
+            while self._running:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self):
+        """Ferma il broker e chiude tutte le connessioni"""
+        self._running = False
+        if self._server_socket:
+            try:
+                self._server_socket.close()
+            except OSError:
+                pass
+        with self._lock:
+            for subscribers in self._subscribers.values():
+                for conn in subscribers:
+                    try:
+                        conn.close()
+                    except OSError:
+                        pass
+            self._subscribers.clear()
+
+    def subscriber_count(self, channel):
+        """Numero di connessioni iscritte a un canale"""
+        with self._lock:
+            return len(self._subscribers.get(channel, {}))
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                conn, _ = self._server_socket.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+
+    def _handle_connection(self, conn):
+        channels = []
+        try:
+            reader = conn.makefile('r', encoding='utf-8')
+            for line in reader:
+                try:
+                    frame = json.loads(line)
+                except ValueError:
+                    continue
+                op = frame.get('op')
+                channel = frame.get('channel')
+                if op == 'sub' and channel:
+                    with self._lock:
+                        self._subscribers.setdefault(channel, {})[conn] = threading.Lock()
+                    channels.append(channel)
+                elif op == 'pub' and channel:
+                    self._fanout(channel, frame.get('data'))
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                for channel in channels:
+                    self._subscribers.get(channel, {}).pop(conn, None)
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def _fanout(self, channel, data):
+        payload = (json.dumps(data) + '\n').encode('utf-8')
+        with self._lock:
+            targets = list(self._subscribers.get(channel, {}).items())
+        for conn, write_lock in targets:
+            try:
+                with write_lock:
+                    conn.sendall(payload)
+            except OSError:
+                with self._lock:
+                    self._subscribers.get(channel, {}).pop(conn, None)
+
+class LocalBrokerManager(socketio.PubSubManager):
+    """
+    Client manager di python-socketio che usa il LocalBroker come coda condivisa.
+
+    Args:
+        url (str): URL del broker nella forma local://host:porta
+        channel (str): Canale pub/sub condiviso dai worker
+        write_only (bool): Solo pubblicazione (per emettere da processi esterni)
+    """
+    name = 'localbroker'
+
+    def __init__(self, url='local://127.0.0.1:6390', channel='socketio', write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.host, self.port = _parse_local_url(url)
+        self._publish_socket = None
+        self._publish_lock = threading.Lock()
+
+    def _connect(self):
+        return socket.create_connection((self.host, self.port), timeout=5)
+
+    def _send_frame(self, sock, frame):
+        sock.sendall((json.dumps(frame) + '\n').encode('utf-8'))
+
+    def _publish(self, data):
+        frame = {'op': 'pub', 'channel': self.channel, 'data': self.json.dumps(data)}
+        with self._publish_lock:
+            for retries_left in range(1, -1, -1):  # 2 tentativi
+                try:
+                    if self._publish_socket is None:
+                        self._publish_socket = self._connect()
+                    self._send_frame(self._publish_socket, frame)
+                    return
+                except OSError as e:
+                    self._publish_socket = None
+                    if retries_left == 0:
+                        self._get_logger().error(f"Impossibile pubblicare sul broker locale: {e}")
+
+    def _listen(self):
+        retry_sleep = 1
+        while True:
+            try:
+                sock = self._connect()
+                sock.settimeout(None)
+                self._send_frame(sock, {'op': 'sub', 'channel': self.channel})
+                retry_sleep = 1
+                reader = sock.makefile('r', encoding='utf-8')
+                for line in reader:
+                    # Ogni riga è la stringa JSON pubblicata da _publish
+                    yield json.loads(line)
+                sock.close()
+            except OSError as e:
+                self._get_logger().error(f"Broker locale non raggiungibile, nuovo tentativo tra {retry_sleep}s: {e}")
+            time.sleep(retry_sleep)
+            retry_sleep = min(retry_sleep * 2, 30)
+
+def create_client_manager(url=None, channel=None, write_only=False):
+    """
+    Crea il client manager Socket.IO adatto all'URL della coda.
+
+    Args:
+        url (str, optional): URL della coda, default SOCKETIO_MESSAGE_QUEUE
+        channel (str, optional): Canale pub/sub, default SOCKETIO_CHANNEL
+        write_only (bool): Solo pubblicazione
+
+    Returns:
+        PubSubManager or None: None se non è configurata alcuna coda (singolo worker)
+    """
+    url = url if url is not None else SOCKETIO_MESSAGE_QUEUE
+    channel = channel or SOCKETIO_CHANNEL
+    if not url:
+        return None
+
+    scheme = urlparse(url).scheme
+    if scheme == LOCAL_SCHEME:
+        return LocalBrokerManager(url, channel=channel, write_only=write_only)
+    if scheme.startswith('redis') or scheme == 'unix':
+        return socketio.RedisManager(url, channel=channel, write_only=write_only)
+    return socketio.KombuManager(url, channel=channel, write_only=write_only)
+
+def get_socketio_transports():
+    """Trasporti Engine.IO consentiti (solo websocket se SOCKETIO_WEBSOCKET_ONLY)"""
+    if SOCKETIO_WEBSOCKET_ONLY:
+        return ['websocket']
+    return ['polling', 'websocket']
+
+def get_socketio_queue_kwargs():
+    """
+    Argomenti aggiuntivi per il costruttore di SocketIO in base alla configurazione.
+
+    Returns:
+        dict: client_manager (se è configurata una coda) e transports
+    """
+    kwargs = {'transports': get_socketio_transports()}
+    manager = create_client_manager()
+    if manager is not None:
+        logger.info(f"Socket.IO: coda di messaggi condivisa attiva ({manager.name}, canale {manager.channel})")
+        kwargs['client_manager'] = manager
+    return kwargs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Broker pub/sub locale per Socket.IO multi-worker")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_LOCAL_PORT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    LocalBroker(args.host, args.port).serve_forever()
@@ -25,8 +25,8 @@ def get_dashboard_data():
         from common.db.connection import get_engine
         from sqlalchemy import text
         
-        # Get the engine with the chat schema
-        engine = get_engine(schema='chat_schema')
+        # Get the shared engine (the query below is schema-qualified)
+        engine = get_engine()
         
         # Execute direct SQL query to count messages
         with engine.connect() as connection:
@@ -57,4 +57,67 @@ def get_stats():
         return jsonify(data)
     except Exception as e:
         print("Error getting dashboard stats:", str(e))  # Debug print
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+@dashboard_bp.route('/api/db-pool')
+def get_db_pool_stats():
+    """API per ottenere la telemetria del pool di connessioni condiviso"""
+    from common.db.connection import get_pool_stats
+    return jsonify(get_pool_stats())
+
+@dashboard_bp.route('/api/embeddings')
+def get_embedding_service_stats():
+    """API per ottenere le metriche del servizio di embedding (batch e latenze)"""
+    from common.embeddings import get_embedding_stats
+    return jsonify(get_embedding_stats())
+
+@dashboard_bp.route('/api/rag')
+def get_rag_stats():
+    """API per ottenere le latenze dei rami full-text e vettoriale della ricerca ibrida"""
+    from common.rag.hybrid import get_hybrid_stats
+    from common.rag.speculative import get_speculative_stats
+    stats = get_hybrid_stats()
+    stats['speculative'] = get_speculative_stats()
+    return jsonify(stats)
+
+@dashboard_bp.route('/api/message-cache')
+def get_message_cache_metrics():
+    """API per ottenere hit rate e occupazione del ring buffer dei messaggi recenti"""
+    from chat.message_cache import get_message_cache_stats
+    return jsonify(get_message_cache_stats())
+
+@dashboard_bp.route('/api/user-directory')
+def get_user_directory_metrics():
+    """API per ottenere dimensione e hit rate della rubrica utenti in memoria"""
+    from chat.user_directory import get_user_directory_stats
+    return jsonify(get_user_directory_stats())
+
+@dashboard_bp.route('/api/autocomplete')
+def get_autocomplete_metrics():
+    """API per ottenere dimensione e tempi dell'indice di autocompletamento"""
+    from chat.autocomplete import get_autocomplete_stats
+    return jsonify(get_autocomplete_stats())
+
+@dashboard_bp.route('/api/directory')
+def get_directory_metrics():
+    """API per ottenere versione e risposte (complete, delta, invariate) dello snapshot utenti/canali"""
+    from chat.directory_snapshot import get_directory_snapshot_stats
+    return jsonify(get_directory_snapshot_stats())
+
+@dashboard_bp.route('/api/presence')
+def get_presence_metrics():
+    """API per ottenere connessioni, utenti per stato e scritture della presenza"""
+    from chat.presence import get_presence_stats
+    return jsonify(get_presence_stats())
+
+@dashboard_bp.route('/api/rooms')
+def get_room_metrics():
+    """API per ottenere il numero di connessioni iscritte a ogni room Socket.IO"""
+    from chat.subscriptions import get_subscription_stats
+    return jsonify(get_subscription_stats())
+
+@dashboard_bp.route('/api/protocol')
+def get_protocol_metrics():
+    """API per ottenere le versioni del protocollo in uso e i byte risparmiati"""
+    from chat.protocol import get_protocol_stats
+    return jsonify(get_protocol_stats())
@@ -6,12 +6,26 @@ gevent.monkey.patch_all()  # Esegui il monkey patching PRIMA dell'importazione d
 port = int(os.environ.get("PORT", 10000))
 bind = f"0.0.0.0:{port}"
 
-# Ridotto a 1 worker per evitare problemi con Socket.IO
-workers = 1
+# Numero di worker: più di 1 solo con una coda Socket.IO condivisa (SOCKETIO_MESSAGE_QUEUE),
+# altrimenti gli emit di un worker non raggiungono i client collegati agli altri.
+# Sticky session: il polling di Engine.IO deve restare sullo stesso worker. Gunicorn non
+# garantisce l'affinità tra worker sulla stessa porta, quindi con più worker usare il solo
+# trasporto websocket (SOCKETIO_WEBSOCKET_ONLY=true) oppure un worker per porta dietro un
+# bilanciatore con affinità (es. nginx ip_hash). Tra più nodi serve affinità sul load balancer.
+workers = int(os.environ.get("GUNICORN_WORKERS", 1))
+if workers > 1 and not os.environ.get("SOCKETIO_MESSAGE_QUEUE"):
+    print("ATTENZIONE: più worker senza SOCKETIO_MESSAGE_QUEUE, torno a 1 worker")
+    workers = 1
 worker_class = "geventwebsocket.gunicorn.workers.GeventWebSocketWorker"  # Worker specifico per WebSocket
 timeout = 120
 keepalive = 5
 loglevel = "debug"  # Temporaneamente impostato a debug per vedere più dettagli
 
+def post_fork(server, worker):
+    # Con preload_app il master può aver già aperto connessioni del pool: ogni worker
+    # ne apre di proprie invece di condividere i socket ereditati con il fork
+    from common.db.connection import dispose_engine
+    dispose_engine()
+
 # Imposta l'applicazione per Gunicorn
-wsgi_app = "wsgi:app"  # Torniamo a usare l'app standard
\ No newline at end of file
+wsgi_app = "wsgi:app"  # Torniamo a usare l'app standard
@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+try:
+    # chat.autocomplete verifica lo schema all'import (chat.database): serve un database raggiungibile
+    import chat.autocomplete as autocomplete_module
+    from chat.autocomplete import AutocompleteIndex, normalize, parse_types
+except Exception as e:
+    pytest.skip(f"Database chat non disponibile: {e}", allow_module_level=True)
+
+
+USERS = [
+    {'id': 1, 'username': 'owner', 'displayName': 'Owner', 'avatarUrl': None, 'status': 'online'},
+    {'id': 2, 'username': 'john_doe', 'displayName': 'John Doe', 'avatarUrl': None, 'status': 'online'},
+    {'id': 4, 'username': 'jane_smith', 'displayName': 'Jane Smith', 'avatarUrl': None, 'status': 'offline'},
+    {'id': 8, 'username': 'elodie', 'displayName': 'Élodie Martin', 'avatarUrl': None, 'status': 'away'},
+]
+CHANNELS = [
+    {'id': 1, 'name': 'general', 'description': 'General discussion for everyone', 'isPrivate': False,
+     'memberCount': 6},
+    {'id': 3, 'name': 'development', 'description': 'Development discussions and questions', 'isPrivate': False,
+     'memberCount': 4},
+    {'id': 4, 'name': 'design', 'description': 'Design discussions and feedback', 'isPrivate': False,
+     'memberCount': 3},
+]
+
+
+@pytest.fixture
+def index(monkeypatch):
+    """Indice costruito su dati fissi, senza database"""
+    monkeypatch.setattr(autocomplete_module, 'list_users', lambda: [dict(u) for u in USERS])
+    monkeypatch.setattr(AutocompleteIndex, '_load_channels', lambda self: [dict(c) for c in CHANNELS])
+    return AutocompleteIndex(ttl=0)
+
+
+def test_prefix_matches_rank_before_fallbacks(index):
+    """Campo intero prima delle parole, accenti e maiuscole ignorati, canali con memberCount"""
+    results = index.search('de')
+    assert [c['name'] for c in results['channels']] == ['design', 'development']
+    assert results['channels'][0]['memberCount'] == 3
+
+    assert [u['id'] for u in index.search('ELO')['users']] == [8]
+    assert [u['id'] for u in index.search('smith')['users']] == [4]
+    assert normalize('Élodie') == 'elodie'
+
+
+def test_trigram_and_substring_fallback(index):
+    """Parti interne delle parole (come il vecchio ILIKE) e piccoli refusi"""
+    assert [u['id'] for u in index.search('ohn')['users']] == [2]
+    assert [c['name'] for c in index.search('discusion', types=('channels',))['channels']][:1] == ['general']
+    assert [u['id'] for u in index.search('_', types=('users',))['users']] == [4, 2]
+    assert index.search('zzz') == {'users': [], 'channels': []}
+
+
+def test_parse_types_accepts_single_string():
+    """Un tipo passato come stringa non viene scomposto in caratteri"""
+    assert parse_types('users') == ['users']
+    assert parse_types(['channels', 'users', 'channels', 'u']) == ['users', 'channels']
+    assert parse_types(None) == ['users', 'channels']
+    assert parse_types({'users': True}) == ['users', 'channels']
+    assert parse_types('sconosciuto') == []
+
+
+def test_invalidation_rebuilds_index(index, monkeypatch):
+    """Dopo invalidate() l'indice vede i nuovi utenti; le ricerche successive non ricostruiscono"""
+    index.search('jo')
+    index.search('ja')
+    assert index.get_stats()['builds'] == 1
+
+    monkeypatch.setattr(autocomplete_module, 'list_users', lambda: [dict(u) for u in USERS] + [
+        {'id': 9, 'username': 'joanna', 'displayName': 'Joanna Rossi', 'avatarUrl': None, 'status': 'online'}])
+    index.invalidate()
+    assert [u['id'] for u in index.search('jo')['users']] == [9, 2]
+    stats = index.get_stats()
+    assert stats['builds'] == 2 and stats['invalidations'] == 1
+
+
+def test_lookup_is_submillisecond_on_large_directory(monkeypatch):
+    """Con migliaia di utenti una ricerca resta sotto il millisecondo"""
+    users = [{'id': i, 'username': f"user{i}", 'displayName': f"Nome{i} Cognome{i % 97}", 'avatarUrl': None,
+              'status': 'online'} for i in range(5000)]
+    monkeypatch.setattr(autocomplete_module, 'list_users', lambda: users)
+    monkeypatch.setattr(AutocompleteIndex, '_load_channels', lambda self: [dict(c) for c in CHANNELS])
+    index = AutocompleteIndex(ttl=0)
+    index.search('x')  # costruzione
+
+    start = time.perf_counter()
+    for query in ('nome12', 'cognome4', 'user49', 'dev'):
+        assert index.search(query)
+    assert (time.perf_counter() - start) / 4 < 0.001
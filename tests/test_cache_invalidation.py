@@ -0,0 +1,38 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import Column, Integer, String, create_engine
+from sqlalchemy.orm import Session, declarative_base
+
+from chat.cache_invalidation import invalidate_on_write
+
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = 'items'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50))
+
+
+def test_write_invalidates_at_flush_and_again_at_commit():
+    """Ogni scrittura invalida subito la cache e di nuovo, una volta sola, al commit"""
+    calls = []
+    invalidate_on_write((Item,), lambda: calls.append('all'), on_write=lambda item: calls.append(item.id))
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        session.add_all([Item(id=1, name='uno'), Item(id=2, name='due')])
+        session.flush()
+        assert calls == [1, 2]
+        session.commit()
+        assert calls == [1, 2, 'all']
+
+        session.get(Item, 1).name = 'modificato'
+        session.rollback()
+        assert calls == [1, 2, 'all']
+        session.commit()
+        assert calls == [1, 2, 'all']
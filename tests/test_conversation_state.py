@@ -0,0 +1,230 @@
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from sqlalchemy import text
+
+try:
+    # chat.conversation_state importa la rubrica utenti, che verifica lo schema all'import
+    from common.db.connection import get_engine
+    from chat.migrations import run_cleanup_migrations, run_migrations
+    from chat.conversation_state import (ConversationNotFound, InvalidReadTarget, backfill,
+                                         get_conversation_summaries, is_valid_watermark, mark_conversation_read)
+except Exception as e:
+    pytest.skip(f"Database chat non disponibile: {e}", allow_module_level=True)
+
+# Tabelle minime dello schema chat (vedi chat/schema.sql) su cui applicare la migrazione,
+# più message_read_status dei database precedenti ai watermark di lettura
+BASE_TABLES = [
+    "CREATE TABLE {schema}.users (id SERIAL PRIMARY KEY, username VARCHAR(100) NOT NULL)",
+    "CREATE TABLE {schema}.conversations (id SERIAL PRIMARY KEY, name VARCHAR(255), type VARCHAR(50) NOT NULL)",
+    "CREATE TABLE {schema}.conversation_participants ("
+    " conversation_id INTEGER REFERENCES {schema}.conversations(id) ON DELETE CASCADE,"
+    " user_id INTEGER REFERENCES {schema}.users(id) ON DELETE CASCADE,"
+    " PRIMARY KEY (conversation_id, user_id))",
+    "CREATE TABLE {schema}.messages (id SERIAL PRIMARY KEY,"
+    " conversation_id INTEGER REFERENCES {schema}.conversations(id) ON DELETE CASCADE,"
+    " user_id INTEGER REFERENCES {schema}.users(id) ON DELETE SET NULL,"
+    " text TEXT, message_type VARCHAR(50) DEFAULT 'normal', file_data JSONB,"
+    " created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE {schema}.channels (id SERIAL PRIMARY KEY, name VARCHAR(100) NOT NULL UNIQUE)",
+    "CREATE TABLE {schema}.channel_members ("
+    " channel_id INTEGER REFERENCES {schema}.channels(id) ON DELETE CASCADE,"
+    " user_id INTEGER REFERENCES {schema}.users(id) ON DELETE CASCADE,"
+    " PRIMARY KEY (channel_id, user_id))",
+    "CREATE TABLE {schema}.message_read_status (id SERIAL PRIMARY KEY,"
+    " message_id INTEGER REFERENCES {schema}.messages(id) ON DELETE CASCADE,"
+    " user_id INTEGER REFERENCES {schema}.users(id) ON DELETE CASCADE,"
+    " UNIQUE (message_id, user_id))",
+]
+
+
+@pytest.fixture
+def schema():
+    """Schema temporaneo con le tabelle base e le migrazioni dei contatori, poi i dati"""
+    name = f"chat_state_test_{uuid.uuid4().hex[:8]}"
+    try:
+        engine = get_engine()
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA {name}"))
+            for statement in BASE_TABLES:
+                conn.execute(text(statement.format(schema=name)))
+        run_migrations(['conversation_state', 'conversation_readers'], schema=name)
+        with engine.begin() as conn:
+            # Partecipanti e membri creano le righe dei non letti tramite i trigger
+            conn.execute(text(
+                f"INSERT INTO {name}.users (id, username) VALUES (1, 'owner'), (2, 'john'), (3, 'jane');"
+                f"INSERT INTO {name}.conversations (id, name, type) VALUES (1, 'general', 'channel'), (2, 'dm', 'direct');"
+                f"INSERT INTO {name}.conversation_participants VALUES (2, 1), (2, 2);"
+                f"INSERT INTO {name}.channels (id, name) VALUES (1, 'general');"
+                f"INSERT INTO {name}.channel_members VALUES (1, 1), (1, 2), (1, 3)"
+            ))
+    except Exception as e:
+        pytest.skip(f"Postgres non disponibile: {e}")
+    yield name
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA {name} CASCADE"))
+
+
+def insert_message(conn, schema, conversation_id, user_id, body, created_at, message_type='normal'):
+    return conn.execute(text(
+        f"INSERT INTO {schema}.messages (conversation_id, user_id, text, message_type, created_at) "
+        f"VALUES (:c, :u, :t, :mt, :at) RETURNING id"
+    ), {'c': conversation_id, 'u': user_id, 't': body, 'mt': message_type, 'at': created_at}).scalar()
+
+
+def unread(conn, schema, conversation_id, user_id):
+    return conn.execute(text(
+        f"SELECT unread_count FROM {schema}.conversation_unread WHERE conversation_id = :c AND user_id = :u"
+    ), {'c': conversation_id, 'u': user_id}).scalar()
+
+
+def test_triggers_maintain_counters_and_last_message(schema):
+    """Inserimento, modifica, lettura ed eliminazione aggiornano contatori e ultimo messaggio"""
+    with get_engine().begin() as conn:
+        # Righe già create dai trigger sui membri (nessun messaggio)
+        summaries = get_conversation_summaries(conn, user_id=1, schema=schema)
+        general = next(s for s in summaries if s['id'] == 1)
+        assert general['unreadCount'] == 0 and general['lastActivity'] is None
+
+        first = insert_message(conn, schema, 1, 2, 'ciao', '2024-03-01 10:00')
+        insert_message(conn, schema, 1, 1, 'mio', '2024-03-01 10:01')
+        insert_message(conn, schema, 1, 2, 'nota interna', '2024-03-01 10:02', message_type='memory')
+        last = insert_message(conn, schema, 1, 3, 'ultimo', '2024-03-01 10:03')
+        assert unread(conn, schema, 1, 1) == 2  # né i propri né i 'memory'
+
+        general = next(s for s in get_conversation_summaries(conn, user_id=1, schema=schema) if s['id'] == 1)
+        assert general['lastMessageId'] == last and general['lastMessagePreview'] == 'ultimo'
+        assert general['lastMessageUserId'] == 3
+
+        conn.execute(text(f"UPDATE {schema}.messages SET text = 'modificato' WHERE id = :id"), {'id': last})
+        conn.execute(text(f"DELETE FROM {schema}.messages WHERE id = :id"), {'id': first})
+        assert unread(conn, schema, 1, 1) == 1
+        general = next(s for s in get_conversation_summaries(conn, user_id=1, schema=schema) if s['id'] == 1)
+        assert general['lastMessagePreview'] == 'modificato'
+
+        # Eliminare l'ultimo messaggio riporta al precedente (non 'memory')
+        conn.execute(text(f"DELETE FROM {schema}.messages WHERE id = :id"), {'id': last})
+        general = next(s for s in get_conversation_summaries(conn, user_id=1, schema=schema) if s['id'] == 1)
+        assert general['lastMessagePreview'] == 'mio' and general['unreadCount'] == 0
+
+
+def test_mark_read_moves_watermark(schema):
+    """La lettura fino a un messaggio lascia non letti solo i successivi e non torna indietro"""
+    from sqlalchemy.orm import Session
+
+    with Session(get_engine()) as db:
+        first = insert_message(db, schema, 1, 2, 'uno', '2024-03-01 10:00')
+        second = insert_message(db, schema, 1, 2, 'due', '2024-03-01 10:01')
+        insert_message(db, schema, 1, 2, 'tre', '2024-03-01 10:02')
+        assert unread(db, schema, 1, 1) == 3
+
+        state = mark_conversation_read(db, 1, user_id=1, up_to_message_id=second, schema=schema)
+        assert state == {'conversationId': 1, 'lastReadMessageId': second, 'unreadCount': 1}
+        # Un watermark precedente non annulla le letture già fatte
+        state = mark_conversation_read(db, 1, user_id=1, up_to_message_id=first, schema=schema)
+        assert state['lastReadMessageId'] == second and state['unreadCount'] == 1
+
+        state = mark_conversation_read(db, 1, user_id=1, schema=schema)
+        assert state['unreadCount'] == 0
+        insert_message(db, schema, 1, 2, 'quattro', '2024-03-01 10:03')
+        assert unread(db, schema, 1, 1) == 1
+        db.rollback()
+
+
+def test_mark_read_rejects_unknown_targets(schema):
+    """Conversazione inesistente o messaggio di un'altra conversazione: errore, nessuna scrittura"""
+    from sqlalchemy.orm import Session
+
+    with Session(get_engine()) as db:
+        other = insert_message(db, schema, 2, 2, 'altrove', '2024-03-01 10:00')
+        insert_message(db, schema, 1, 2, 'qui', '2024-03-01 10:01')
+
+        with pytest.raises(ConversationNotFound):
+            mark_conversation_read(db, 99, user_id=1, schema=schema)
+        with pytest.raises(InvalidReadTarget):
+            mark_conversation_read(db, 1, user_id=1, up_to_message_id=other, schema=schema)
+        assert unread(db, schema, 1, 1) == 1
+        db.rollback()
+
+
+def test_watermark_must_be_an_integer():
+    """upToMessageId: None o un intero, mai un booleano (True varrebbe come messaggio 1)"""
+    assert is_valid_watermark(None) and is_valid_watermark(42)
+    assert not is_valid_watermark(True) and not is_valid_watermark(False)
+    assert not is_valid_watermark('42') and not is_valid_watermark(4.2)
+
+
+def test_backfill_recounts_from_watermarks(schema):
+    """Il backfill ricalcola stato e contatori dai messaggi e dai watermark esistenti"""
+    with get_engine().begin() as conn:
+        read_id = insert_message(conn, schema, 1, 2, 'letto', '2024-03-01 09:00')
+        insert_message(conn, schema, 1, 2, 'non letto', '2024-03-01 09:05')
+        insert_message(conn, schema, 2, 2, 'dm', '2024-03-01 09:10')
+        conn.execute(text(f"UPDATE {schema}.conversation_unread SET last_read_message_id = :m, unread_count = 0 "
+                          f"WHERE conversation_id = 1 AND user_id = 1"), {'m': read_id})
+        # Stato senza righe (dati precedenti alla migrazione)
+        conn.execute(text(f"DELETE FROM {schema}.conversation_state"))
+
+    result = backfill(schema)
+    assert result['conversation_state'] == 2
+
+    with get_engine().begin() as conn:
+        assert unread(conn, schema, 1, 1) == 1
+        assert unread(conn, schema, 1, 3) == 2  # membro del canale, nessuna lettura
+        assert unread(conn, schema, 2, 1) == 1
+        assert unread(conn, schema, 2, 2) == 0
+        last_preview = conn.execute(text(
+            f"SELECT last_message_preview FROM {schema}.conversation_state WHERE conversation_id = 2"
+        )).scalar()
+        assert last_preview == 'dm'
+
+
+def test_read_status_rows_collapse_into_watermarks(schema):
+    """La migrazione read_watermarks converte le righe per messaggio in un watermark per utente"""
+    with get_engine().begin() as conn:
+        ids = [insert_message(conn, schema, 1, 2, f"m{i}", f"2024-03-01 09:0{i}") for i in range(4)]
+        conn.execute(text(f"INSERT INTO {schema}.message_read_status (message_id, user_id) "
+                          f"VALUES (:a, 1), (:b, 1), (:a, 3)"), {'a': ids[0], 'b': ids[2]})
+
+    run_migrations(['read_watermarks'], schema=schema)
+
+    with get_engine().begin() as conn:
+        watermarks = dict(conn.execute(text(
+            f"SELECT user_id, last_read_message_id FROM {schema}.conversation_unread"
+            f" WHERE conversation_id = 1 AND last_read_message_id IS NOT NULL"
+        )).all())
+        assert watermarks == {1: ids[2], 3: ids[0]}
+        assert unread(conn, schema, 1, 1) == 1 and unread(conn, schema, 1, 3) == 3
+        # La tabella resta per il rollback del deploy: la elimina solo la pulizia esplicita
+        assert conn.execute(text(f"SELECT to_regclass('{schema}.message_read_status')")).scalar() is not None
+
+    with pytest.raises(ValueError):
+        run_cleanup_migrations([], schema=schema)
+    assert run_cleanup_migrations(['drop_read_status'], schema=schema) == ['drop_read_status']
+    with get_engine().begin() as conn:
+        assert conn.execute(text(f"SELECT to_regclass('{schema}.message_read_status')")).scalar() is None
+
+
+def test_new_readers_get_rows_without_reads(schema):
+    """Nuovi membri, partecipanti e conversazioni di canale creano i contatori; la lista non scrive"""
+    with get_engine().begin() as conn:
+        insert_message(conn, schema, 1, 2, 'prima del nuovo membro', '2024-03-01 09:00')
+        insert_message(conn, schema, 1, 1, 'anche questo', '2024-03-01 09:01')
+        conn.execute(text(f"INSERT INTO {schema}.users (id, username) VALUES (4, 'bob')"))
+        conn.execute(text(f"INSERT INTO {schema}.channel_members VALUES (1, 4)"))
+        assert unread(conn, schema, 1, 4) == 2
+
+        conn.execute(text(f"INSERT INTO {schema}.channels (id, name) VALUES (2, 'random');"
+                          f"INSERT INTO {schema}.channel_members VALUES (2, 1), (2, 3);"
+                          f"INSERT INTO {schema}.conversations (id, name, type) VALUES (3, 'random', 'channel');"
+                          f"INSERT INTO {schema}.conversation_participants VALUES (2, 4)"))
+        assert unread(conn, schema, 3, 1) == 0 and unread(conn, schema, 3, 3) == 0
+        assert unread(conn, schema, 2, 4) == 0
+
+        rows = conn.execute(text(f"SELECT count(*) FROM {schema}.conversation_unread")).scalar()
+        assert {1, 3} <= {s['id'] for s in get_conversation_summaries(conn, user_id=1, schema=schema)}
+        assert conn.execute(text(f"SELECT count(*) FROM {schema}.conversation_unread")).scalar() == rows
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import gevent
+from psycopg2 import extensions
+
+from common.db.cooperative import enable_cooperative_driver, is_cooperative_enabled, gevent_wait_callback
+from common.db.connection import get_raw_connection
+
+
+@pytest.fixture
+def restore_wait_callback():
+    """Ripristina la wait callback di psycopg2 presente prima del test"""
+    previous = extensions.get_wait_callback()
+    yield
+    extensions.set_wait_callback(previous)
+
+
+@pytest.fixture
+def pg_connection():
+    """Connessione raw al database di test; il test viene saltato se Postgres non è raggiungibile"""
+    try:
+        conn = get_raw_connection()
+    except Exception as e:
+        pytest.skip(f"Postgres non disponibile: {e}")
+    yield conn
+    conn.close()
+
+
+def test_enable_registers_wait_callback(restore_wait_callback):
+    """Verifica che la modalità cooperativa registri la wait callback di gevent"""
+    assert enable_cooperative_driver(force=True)
+    assert is_cooperative_enabled()
+    assert extensions.get_wait_callback() is gevent_wait_callback
+
+
+def test_greenlets_progress_during_pg_sleep(restore_wait_callback, pg_connection):
+    """Verifica che altri greenlet avanzino mentre una query pg_sleep è in corso"""
+    enable_cooperative_driver(force=True)
+    ticks = []
+
+    def ticker():
+        while True:
+            ticks.append(time.perf_counter())
+            gevent.sleep(0.05)
+
+    def slow_query():
+        cur = pg_connection.cursor()
+        cur.execute("SELECT pg_sleep(1)")
+        cur.fetchall()
+        cur.close()
+
+    tick_greenlet = gevent.spawn(ticker)
+    start = time.perf_counter()
+    gevent.spawn(slow_query).join()
+    elapsed = time.perf_counter() - start
+    tick_greenlet.kill()
+
+    assert elapsed >= 1.0
+    # Con il driver bloccante il ticker non verrebbe mai eseguito durante la query
+    assert len(ticks) >= 10
+
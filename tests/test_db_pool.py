@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import Column, Integer
+
+from common.db.connection import get_engine, get_pool_stats
+from common.db.base import create_base_for_schema
+
+
+def test_get_engine_is_shared():
+    """Verifica che get_engine restituisca sempre lo stesso engine e lo stesso pool"""
+    engine = get_engine()
+    assert get_engine() is engine
+
+    chat_engine = get_engine(schema='chat_schema')
+    assert chat_engine.pool is engine.pool
+    assert chat_engine.get_execution_options()['schema_translate_map'] == {None: 'chat_schema'}
+
+
+def test_bases_share_engine_and_qualify_tables():
+    """Verifica che le basi per schema usino l'engine condiviso e tabelle qualificate"""
+    ChatBase, chat_engine, _ = create_base_for_schema('test_chat_schema')
+    CalBase, cal_engine, _ = create_base_for_schema('test_cal_schema')
+    assert chat_engine is cal_engine
+
+    class Sample(ChatBase):
+        __tablename__ = 'samples'
+        id = Column(Integer, primary_key=True)
+
+    assert Sample.__table__.fullname == 'test_chat_schema.samples'
+
+
+def test_pool_stats_shape():
+    """Verifica che la telemetria del pool esponga i campi principali"""
+    get_engine()
+    stats = get_pool_stats()
+    for key in ('checked_out', 'overflow', 'checkouts', 'wait_time_avg_ms', 'wait_time_max_ms'):
+        assert key in stats
+    assert stats['initialized'] is True
@@ -0,0 +1,88 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+try:
+    # chat.directory_snapshot importa i modelli, che verificano lo schema all'import
+    from chat.directory_snapshot import DirectorySnapshot
+except Exception as e:
+    pytest.skip(f"Database chat non disponibile: {e}", allow_module_level=True)
+
+
+OWNER = {'id': 1, 'username': 'owner', 'displayName': 'Owner', 'avatarUrl': None, 'status': 'online'}
+JOHN = {'id': 2, 'username': 'john_doe', 'displayName': 'John Doe', 'avatarUrl': None, 'status': 'online'}
+JANE = {'id': 4, 'username': 'jane_smith', 'displayName': 'Jane Smith', 'avatarUrl': None, 'status': 'offline'}
+GENERAL = {'id': 1, 'name': 'general', 'description': 'General discussion', 'isPrivate': False, 'memberCount': 6}
+
+
+class FakeDirectory:
+    """Utenti e canali modificabili, con il numero di caricamenti"""
+
+    def __init__(self):
+        self.users = [OWNER, JOHN]
+        self.channels = [GENERAL]
+        self.loads = 0
+
+    def load_users(self):
+        self.loads += 1
+        return list(self.users)
+
+    def load_channels(self):
+        return list(self.channels)
+
+
+@pytest.fixture
+def source():
+    return FakeDirectory()
+
+
+@pytest.fixture
+def snapshot(source):
+    return DirectorySnapshot(load_users=source.load_users, load_channels=source.load_channels, ttl=0, history=2)
+
+
+def test_unchanged_version_is_not_reloaded(snapshot, source):
+    """Le connessioni successive riusano lo snapshot e ricevono solo 'unchanged'"""
+    first = snapshot.sync()
+    assert first['mode'] == 'full' and first['users'] == [OWNER, JOHN]
+
+    for _ in range(3):
+        again = snapshot.sync(first['directoryVersion'])
+        assert again == {'directoryVersion': first['directoryVersion'], 'mode': 'unchanged'}
+    assert source.loads == 1
+
+    # Ricostruire gli stessi dati non cambia la versione
+    snapshot.invalidate()
+    assert snapshot.sync(first['directoryVersion'])['mode'] == 'unchanged'
+    assert source.loads == 2
+
+
+def test_delta_from_recent_versions_and_full_for_unknown(snapshot, source):
+    """Dopo una modifica i client con una versione recente ricevono solo le differenze"""
+    old_version = snapshot.sync()['directoryVersion']
+
+    source.users = [OWNER, dict(JOHN, status='away'), JANE]
+    source.channels = []
+    snapshot.invalidate()
+
+    result = snapshot.sync(old_version)
+    assert result['mode'] == 'delta' and result['directoryVersion'] != old_version
+    assert result['delta'] == {
+        'users': {'upsert': [dict(JOHN, status='away'), JANE], 'removed': []},
+        'channels': {'upsert': [], 'removed': [1]},
+    }
+    assert snapshot.sync('sconosciuta')['mode'] == 'full'
+
+    # Oltre le versioni conservate il delta non è più disponibile
+    for status in ('busy', 'offline'):
+        source.users = [dict(OWNER, status=status)]
+        snapshot.invalidate()
+        snapshot.sync()
+    assert snapshot.sync(old_version)['mode'] == 'full'
+
+    stats = snapshot.get_stats()
+    assert (stats['unchanged'], stats['delta'], stats['full']) == (0, 1, 5)
+    assert stats['versions_kept'] == 2
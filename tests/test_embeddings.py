@@ -0,0 +1,98 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+
+from common.embeddings import EmbeddingService
+
+
+class RecordingModel:
+    """Modello di prova: embedding deterministico e registro dei forward pass"""
+
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts, batch_size=32):
+        self.batches.append(list(texts))
+        time.sleep(0.05)
+        return np.array([[len(text), float(i)] for i, text in enumerate(texts)], dtype=np.float32)
+
+
+def make_service(**kwargs):
+    loads = []
+    model = RecordingModel()
+
+    def loader(name):
+        loads.append(name)
+        return model
+
+    service = EmbeddingService(model_name='test-model', model_loader=loader, **kwargs)
+    return service, model, loads
+
+
+def test_concurrent_requests_share_forward_pass():
+    """Le richieste concorrenti vengono raggruppate in pochi forward pass con un solo caricamento"""
+    service, model, loads = make_service(max_batch_size=32, max_wait_ms=50)
+    texts = ['a' * (i + 1) for i in range(8)]
+    results = {}
+
+    def worker(text):
+        results[text] = service.encode(text)
+
+    threads = [threading.Thread(target=worker, args=(text,)) for text in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loads == ['test-model']
+    assert sum(len(batch) for batch in model.batches) == 8
+    assert len(model.batches) < 8
+    # Ogni richiedente riceve il proprio vettore
+    for text in texts:
+        assert results[text].shape == (2,)
+        assert results[text][0] == len(text)
+
+    stats = service.get_stats()
+    assert stats['loaded'] is True
+    assert stats['requests'] == 8
+    assert stats['batches'] == len(model.batches)
+    assert stats['batch_size_max'] > 1
+    assert stats['latency_avg_ms'] > 0
+
+
+def test_batch_size_limit_and_list_input():
+    """Una lista restituisce una matrice e i batch rispettano max_batch_size"""
+    service, model, _ = make_service(max_batch_size=2, max_wait_ms=0)
+    embeddings = service.encode(['uno', 'due'])
+    assert embeddings.shape == (2, 2)
+    assert all(len(batch) <= 2 for batch in model.batches)
+    assert service.encode([]).shape == (0, 0)
+
+
+def test_multi_text_requests_never_exceed_batch_size():
+    """Le richieste con più testi vengono divise o rimandate al batch successivo"""
+    service, model, _ = make_service(max_batch_size=4, max_wait_ms=50)
+    results = {}
+
+    def worker(name, count):
+        results[name] = service.encode([name * (i + 1) for i in range(count)])
+
+    threads = [threading.Thread(target=worker, args=(name, count))
+               for name, count in (('a', 3), ('b', 3), ('c', 10))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(len(batch) <= 4 for batch in model.batches)
+    assert sum(len(batch) for batch in model.batches) == 16
+    assert service.get_stats()['batch_size_max'] <= 4
+    # Ogni richiedente riceve i propri vettori, nell'ordine dei testi
+    assert results['c'].shape == (10, 2)
+    assert list(results['c'][:, 0]) == list(range(1, 11))
+    assert list(results['a'][:, 0]) == [1, 2, 3]
@@ -0,0 +1,58 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import common.rag.hybrid as hybrid
+from common.rag.hybrid import extract_article_numbers, reciprocal_rank_fusion
+
+
+def test_rrf_rewards_agreement_between_legs():
+    """Un articolo presente in entrambi i rami supera quelli presenti in uno solo"""
+    fused = reciprocal_rank_fusion([['2043', '1218', '2059'], ['1218', '2051', '2043']], k=60)
+    keys = [key for key, _ in fused]
+    assert keys[:2] == ['1218', '2043']
+    assert set(keys) == {'2043', '1218', '2059', '2051'}
+    assert fused[0][1] == 1 / 62 + 1 / 61
+
+
+def test_extract_article_numbers():
+    """I riferimenti espliciti agli articoli vengono riconosciuti per il match esatto"""
+    assert extract_article_numbers("cosa dice l'art. 2043 c.c.?") == ['2043']
+    assert extract_article_numbers("Articolo 1418 bis e art.2059") == ['1418-bis', '2059']
+    assert extract_article_numbers("responsabilità extracontrattuale") == []
+
+
+class MissingColumn(Exception):
+    """Errore di psycopg2 per una colonna inesistente"""
+    pgcode = '42703'
+
+
+def test_missing_fulltext_column_falls_back_to_vector(monkeypatch):
+    """Senza la colonna tsvector si usano solo i risultati vettoriali, con la loro similarità"""
+    calls = []
+
+    def lexical_search(query, limit):
+        calls.append('lexical')
+        raise MissingColumn('column "content_tsv" does not exist')
+
+    def vector_search(query, limit, ef_search=None, probes=None):
+        calls.append('vector')
+        return [('2043', 'Qualunque fatto doloso o colposo...', 0.91234), ('2059', 'Danni non patrimoniali', 0.8)], 1.0
+
+    monkeypatch.setattr(hybrid, 'lexical_search', lexical_search)
+    monkeypatch.setattr(hybrid, 'vector_search', vector_search)
+    monkeypatch.setattr(hybrid, '_fulltext_available', True)
+
+    results = hybrid.hybrid_search('fatto illecito', top_k=1)
+    assert results == [{'article_number': '2043', 'content': 'Qualunque fatto doloso o colposo...',
+                        'similarity': 0.9123}]
+    # Le ricerche successive non interrogano più il ramo full-text
+    assert hybrid.hybrid_search('fatto illecito', top_k=2)[1]['article_number'] == '2059'
+    assert calls == ['lexical', 'vector', 'vector']
+    assert hybrid.get_hybrid_stats()['fulltext_available'] is False
+
+
+def test_headline_uses_markdown_markers():
+    """Gli snippet di ts_headline evidenziano in markdown, non con tag HTML"""
+    assert 'StartSel=**' in hybrid.HEADLINE_OPTIONS and 'StopSel=**' in hybrid.HEADLINE_OPTIONS
@@ -0,0 +1,120 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+try:
+    # chat.database verifica lo schema all'import: serve un database raggiungibile
+    from common.config import CHAT_SCHEMA
+    from chat.database import Base
+    from chat.models import User, Conversation, Message
+    from chat.pagination import get_message_page
+    from chat.hydration import hydrate_messages
+except Exception as e:
+    pytest.skip(f"Database chat non disponibile: {e}", allow_module_level=True)
+
+
+@pytest.fixture
+def db():
+    """Sessione su SQLite in memoria con lo schema della chat collegato come database"""
+    engine = create_engine('sqlite://')
+
+    @event.listens_for(engine, 'connect')
+    def attach_schema(dbapi_connection, _):
+        dbapi_connection.execute(f"ATTACH DATABASE ':memory:' AS {CHAT_SCHEMA}")
+
+    tables = [User.__table__, Conversation.__table__, Message.__table__]
+    Base.metadata.create_all(engine, tables=tables)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def populate(db, count):
+    """Crea una conversazione con count messaggi, metà risposte e alcuni inoltri da bob"""
+    alice = User(id=1, username='alice', display_name='Alice', status='online')
+    bob = User(id=2, username='bob', display_name=None, avatar_url=None, status=None)
+    channel = Conversation(id=1, name='general', type='channel')
+    db.add_all([alice, bob, channel])
+    db.flush()
+
+    start = datetime(2024, 2, 1)
+    for i in range(1, count + 1):
+        db.add(Message(
+            id=i,
+            conversation_id=1,
+            user_id=1 if i % 2 else 2,
+            text=f"messaggio {i}",
+            reply_to_id=i - 1 if i % 2 == 0 else None,
+            forwarded_from_id=2 if i % 5 == 0 else None,
+            created_at=start + timedelta(minutes=i)
+        ))
+    db.commit()
+
+
+def count_queries(db):
+    """Registra le query SELECT eseguite sulla connessione della sessione"""
+    statements = []
+
+    @event.listens_for(db.get_bind(), 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append(statement)
+
+    return statements
+
+
+@pytest.mark.parametrize('count', [10, 50])
+def test_query_count_is_constant(db, count):
+    """Pagina + una query per gli utenti degli inoltri + una per le risposte, qualunque sia la dimensione"""
+    populate(db, count)
+    statements = count_queries(db)
+
+    page = get_message_page(db, 1, limit=count)
+    messages = hydrate_messages(db, page['rows'])
+
+    assert len(messages) == count
+    assert len(statements) == 3
+
+
+def test_hydrated_shape(db):
+    """Risposte, inoltri e valori di default nel formato del frontend"""
+    populate(db, 10)
+    page = get_message_page(db, 1, limit=10)
+    messages = {message['id']: message for message in hydrate_messages(db, page['rows'])}
+
+    reply = messages[2]
+    assert reply['replyTo']['id'] == 1
+    assert reply['replyTo']['user']['username'] == 'alice'
+    assert reply['user']['displayName'] == 'Unknown User'
+    assert reply['user']['status'] == 'offline'
+    assert reply['isOwn'] is False
+    assert messages[1]['isOwn'] is True
+
+    # forwarded_from_id è l'utente di origine: forwardedFrom ha la forma di un utente
+    assert messages[5]['forwardedFrom'] == {
+        'id': 2,
+        'username': 'bob',
+        'displayName': 'Unknown User',
+        'avatarUrl': 'https://ui-avatars.com/api/?name=Unknown',
+        'status': 'offline'
+    }
+    assert messages[1]['replyTo'] is None and messages[1]['forwardedFrom'] is None
+
+
+def test_plain_messages_load_users_in_one_query(db):
+    """Con oggetti Message senza autore gli utenti sono caricati in blocco"""
+    populate(db, 20)
+    rows = db.query(Message).filter(Message.conversation_id == 1).order_by(Message.id).all()
+    statements = count_queries(db)
+
+    messages = hydrate_messages(db, rows)
+
+    assert [message['id'] for message in messages] == list(range(1, 21))
+    assert len(statements) == 2
@@ -0,0 +1,103 @@
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pytest
+from psycopg2 import extensions
+
+import common.rag.ingest as ingest_module
+from common.db.connection import get_raw_connection
+from common.db.cooperative import enable_cooperative_driver
+from common.rag.ingest import (EMBEDDING_DIMS, build_copy_buffer, chunk_text, content_hash, ensure_table,
+                               iter_articles, load_checkpoint, save_checkpoint, clear_checkpoint, write_batch)
+
+
+@pytest.fixture
+def ingest_table(monkeypatch):
+    """Tabella temporanea al posto di codice_civile; il server ha già attivato la modalità gevent"""
+    previous = extensions.get_wait_callback()
+    enable_cooperative_driver(force=True)
+    try:
+        conn = get_raw_connection(cooperative=False)
+    except Exception as e:
+        extensions.set_wait_callback(previous)
+        pytest.skip(f"Postgres non disponibile: {e}")
+    table = f"codice_civile_test_{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(ingest_module, 'CODICE_CIVILE_TABLE', table)
+    try:
+        ensure_table(conn)
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        extensions.set_wait_callback(previous)
+        pytest.skip(f"pgvector non disponibile: {e}")
+    yield conn, table
+    conn.rollback()
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.commit()
+    conn.close()
+    extensions.set_wait_callback(previous)
+
+
+def test_iter_articles_text_and_jsonl(tmp_path):
+    """Gli articoli vengono letti sia dal testo con intestazioni sia da JSONL"""
+    text_file = tmp_path / 'codice.txt'
+    text_file.write_text("LIBRO IV\nArt. 2043. Risarcimento per fatto illecito.\nQualunque fatto doloso...\n"
+                         "Art. 1418 bis\nNullità del contratto.\n", encoding='utf-8')
+    assert list(iter_articles(str(text_file))) == [
+        ('2043', 'Risarcimento per fatto illecito. Qualunque fatto doloso...'),
+        ('1418-bis', 'Nullità del contratto.'),
+    ]
+
+    jsonl_file = tmp_path / 'codice.jsonl'
+    jsonl_file.write_text('{"article_number": 1, "content": "La capacità giuridica"}\n\n', encoding='utf-8')
+    assert list(iter_articles(str(jsonl_file))) == [('1', 'La capacità giuridica')]
+
+
+def test_chunk_text_respects_limit_and_overlaps():
+    """Gli articoli lunghi vengono divisi tra le frasi entro il limite, con sovrapposizione"""
+    text = ' '.join(f"Frase numero {i} del comma." for i in range(100))
+    chunks = chunk_text(text, max_chars=200, overlap=40)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    assert chunks[1].split(' ')[0] in chunks[0]
+    assert chunk_text("Breve.", max_chars=200) == ["Breve."]
+
+
+def test_copy_buffer_escapes_text():
+    """Il buffer COPY esegue l'escape di tab, a capo e backslash"""
+    rows = [('2043', 0, "riga\tuno\nriga \\ due", content_hash('x'))]
+    line = build_copy_buffer(rows, np.array([[0.5, 1.0]])).getvalue()
+    assert line == f"2043\t0\triga\\tuno\\nriga \\\\ due\t{content_hash('x')}\t[0.5,1]\n"
+
+
+def test_checkpoint_round_trip(tmp_path):
+    """Il checkpoint vale solo per lo stesso file di input"""
+    input_file = tmp_path / 'codice.jsonl'
+    input_file.write_text('{"article_number": 1, "content": "a"}\n', encoding='utf-8')
+    save_checkpoint(str(input_file), 500)
+    assert load_checkpoint(str(input_file)) == 500
+    input_file.write_text('{"article_number": 1, "content": "ab"}\n', encoding='utf-8')
+    assert load_checkpoint(str(input_file)) == 0
+    clear_checkpoint(str(input_file))
+    assert load_checkpoint(str(input_file)) == 0
+
+
+def test_write_batch_replaces_articles_with_copy(ingest_table):
+    """DELETE + COPY sostituiscono i chunk degli articoli del batch, lasciando gli altri"""
+    conn, table = ingest_table
+    rng = np.random.default_rng(0)
+    rows = [('2043', 0, "Qualunque fatto\tdoloso", content_hash('a')), ('2043', 1, "seguito", content_hash('a')),
+            ('1418', 0, "Nullità", content_hash('b'))]
+    write_batch(conn, ['2043', '1418'], rows, rng.normal(size=(3, EMBEDDING_DIMS)))
+    conn.commit()
+
+    write_batch(conn, ['2043'], [('2043', 0, "riscritto", content_hash('c'))], rng.normal(size=(1, EMBEDDING_DIMS)))
+    conn.commit()
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT article_number, chunk_index, content FROM {table} ORDER BY article_number, chunk_index")
+        assert cur.fetchall() == [('1418', 0, 'Nullità'), ('2043', 0, 'riscritto')]
@@ -0,0 +1,103 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+try:
+    # chat.live_search importa l'indice di autocompletamento, che verifica lo schema all'import
+    import chat.live_search as live_search_module
+    from chat.live_search import LiveSearch
+except Exception as e:
+    pytest.skip(f"Database chat non disponibile: {e}", allow_module_level=True)
+
+
+class Recorder:
+    """Raccoglie gli emit e i thread avviati, come farebbe socketio"""
+
+    def __init__(self):
+        self.events = []
+        self.threads = []
+
+    def emit(self, event, payload, to=None):
+        self.events.append((to, payload))
+
+    def start_task(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        self.threads.append(thread)
+        thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join(5)
+
+    def phases(self, sid):
+        return [(payload['seq'], payload['phase']) for to, payload in self.events if to == sid]
+
+
+@pytest.fixture(autouse=True)
+def quick_results(monkeypatch):
+    """Fase 'quick' senza database"""
+    monkeypatch.setattr(live_search_module, 'autocomplete',
+                        lambda query, types, limit: {kind: [{'q': query}] for kind in types})
+
+
+def test_debounce_runs_only_the_last_query():
+    """Le query ravvicinate ricevono la fase quick, i messaggi solo l'ultima"""
+    calls = []
+
+    def message_search(query, filters, set_cancel):
+        calls.append(query)
+        return [{'id': 1, 'text': query}], None
+
+    recorder = Recorder()
+    live = LiveSearch(recorder.emit, recorder.start_task, debounce=0.05, message_search=message_search)
+    for seq, query in enumerate(('r', 'ri', 'riu'), start=1):
+        live.submit('a', {'q': query, 'seq': seq})
+    recorder.join()
+
+    assert calls == ['riu']
+    assert recorder.phases('a') == [(1, 'quick'), (2, 'quick'), (3, 'quick'), (3, 'messages')]
+    assert live.get_stats()['debounced'] == 2
+
+
+def test_superseded_query_is_cancelled_in_flight():
+    """Una nuova query annulla quella in esecuzione e il suo risultato non viene inviato"""
+    started, cancelled = threading.Event(), threading.Event()
+
+    def message_search(query, filters, set_cancel):
+        if query == 'lenta':
+            assert set_cancel(cancelled.set)
+            started.set()
+            # Come pg_cancel: la query termina con un errore dopo l'annullamento
+            if cancelled.wait(5):
+                raise RuntimeError('canceling statement due to user request')
+        return [{'id': 2}], None
+
+    recorder = Recorder()
+    live = LiveSearch(recorder.emit, recorder.start_task, debounce=0, message_search=message_search)
+    live.submit('a', {'q': 'lenta', 'seq': 1})
+    assert started.wait(5)
+    live.submit('a', {'q': 'veloce', 'seq': 2})
+    # Le altre connessioni non sono influenzate
+    live.submit('b', {'q': 'lenta', 'seq': 1, 'type': 'users'})
+    recorder.join()
+
+    assert cancelled.is_set()
+    assert recorder.phases('a') == [(1, 'quick'), (2, 'quick'), (2, 'messages')]
+    assert recorder.phases('b') == [(1, 'quick')]
+    assert live.get_stats()['cancelled'] == 1
+
+
+def test_invalid_filters_and_disconnect():
+    """Filtri non validi producono la fase 'error'; forget() libera lo stato della connessione"""
+    recorder = Recorder()
+    live = LiveSearch(recorder.emit, recorder.start_task, debounce=0,
+                      message_search=lambda query, filters, set_cancel: ([], None))
+    live.submit('a', {'q': 'x', 'seq': 7, 'from': 'ieri'})
+    assert recorder.phases('a') == [(7, 'error')]
+
+    live.forget('a')
+    assert live.get_stats()['connections'] == 0
@@ -0,0 +1,181 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+try:
+    # chat.database verifica lo schema all'import: serve un database raggiungibile
+    from common.config import CHAT_SCHEMA
+    from chat.database import Base
+    from chat.models import User, Conversation, Message
+    from chat.pagination import decode_cursor
+    import chat.message_cache as message_cache
+    from chat.message_cache import HotMessageCache, estimate_size
+except Exception as e:
+    pytest.skip(f"Database chat non disponibile: {e}", allow_module_level=True)
+
+
+def make_messages(conversation_id, count, start_id=1):
+    """Messaggi idratati fittizi in ordine cronologico"""
+    start = datetime(2024, 3, 1)
+    return [{
+        'id': start_id + i,
+        'conversationId': conversation_id,
+        'user': {'id': 1, 'username': 'owner'},
+        'text': f"messaggio {start_id + i}",
+        'timestamp': (start + timedelta(seconds=start_id + i)).isoformat(),
+        'type': 'normal',
+        'replyTo': None,
+        'forwardedFrom': None,
+    } for i in range(count)]
+
+
+def test_hit_after_store_and_window_coverage():
+    """Il join è servito dalla memoria solo se il buffer copre la finestra"""
+    cache = HotMessageCache(max_bytes=10 ** 6, per_conversation=100, ttl=0)
+    assert cache.get_page(1, 50) is None
+
+    cache.store(1, make_messages(1, 30), has_more_before=True)
+    # 30 messaggi, ma ne esistono di precedenti: la finestra da 50 non è coperta
+    assert cache.get_page(1, 50) is None
+    messages, info = cache.get_page(1, 20)
+    assert [m['id'] for m in messages] == list(range(11, 31))
+    assert info['hasMoreBefore'] is True and info['hasMoreAfter'] is False
+    assert decode_cursor(info['before'])[1] == 11
+
+    # Conversazione intera nel buffer: coperta anche se più corta della finestra
+    cache.store(2, make_messages(2, 5), has_more_before=False)
+    messages, info = cache.get_page(2, 50)
+    assert len(messages) == 5 and info['hasMoreBefore'] is False
+
+    stats = cache.get_stats()
+    assert stats['hits'] == 2 and stats['misses'] == 2 and stats['hit_rate'] == 0.5
+
+
+def test_append_update_remove():
+    """Invio, modifica ed eliminazione mantengono il buffer allineato"""
+    cache = HotMessageCache(max_bytes=10 ** 6, per_conversation=3, ttl=0)
+    cache.store(1, make_messages(1, 3), has_more_before=False)
+
+    reply = make_messages(1, 1, start_id=4)[0]
+    reply['replyTo'] = {'id': 3, 'text': 'messaggio 3'}
+    cache.append(1, reply)
+    messages, info = cache.get_page(1, 3)
+    # Il ring buffer è pieno: il messaggio 1 esce ed esistono messaggi precedenti
+    assert [m['id'] for m in messages] == [2, 3, 4]
+    assert info['hasMoreBefore'] is True
+
+    cache.update(1, 3, {'text': 'corretto', 'edited': True})
+    messages, _ = cache.get_page(1, 3)
+    assert messages[1]['text'] == 'corretto' and messages[1]['edited'] is True
+    assert messages[2]['replyTo']['text'] == 'corretto'
+
+    cache.remove(1, 3)
+    assert cache.get_page(1, 3) is None  # la finestra non è più coperta
+    messages, _ = cache.get_page(1, 2)
+    assert [m['id'] for m in messages] == [2, 4]
+    assert messages[1]['replyTo'] is None
+
+
+def test_lru_eviction_respects_memory_bound():
+    """Oltre il limite di memoria si evince la conversazione usata meno di recente"""
+    page = make_messages(1, 10)
+    page_bytes = sum(estimate_size(m) for m in page)
+    cache = HotMessageCache(max_bytes=int(page_bytes * 2.5), per_conversation=100, ttl=0)
+
+    cache.store(1, make_messages(1, 10), has_more_before=False)
+    cache.store(2, make_messages(2, 10), has_more_before=False)
+    cache.get_page(1, 10)  # la conversazione 1 diventa la più recente
+    cache.store(3, make_messages(3, 10), has_more_before=False)
+
+    assert cache.is_cached(1) and cache.is_cached(3)
+    assert not cache.is_cached(2)
+    stats = cache.get_stats()
+    assert stats['evictions'] == 1
+    assert stats['bytes'] <= stats['max_bytes']
+
+
+def test_unapplied_write_forces_database_read(monkeypatch):
+    """Una scrittura ORM non applicata al buffer invalida la conversazione al join"""
+    cache = HotMessageCache(max_bytes=10 ** 6, per_conversation=100, ttl=0)
+    monkeypatch.setattr(message_cache, '_message_cache', cache)
+    monkeypatch.setattr(message_cache, 'HOT_CACHE_ENABLED', True)
+
+    engine = create_engine('sqlite://')
+
+    @event.listens_for(engine, 'connect')
+    def attach_schema(dbapi_connection, _):
+        dbapi_connection.execute(f"ATTACH DATABASE ':memory:' AS {CHAT_SCHEMA}")
+
+    Base.metadata.create_all(engine, tables=[User.__table__, Conversation.__table__, Message.__table__])
+    db = sessionmaker(bind=engine)()
+    db.add_all([User(id=1, username='owner'), Conversation(id=1, name='general', type='channel')])
+    db.commit()
+
+    cache.store(1, make_messages(1, 5), has_more_before=False)
+    db.add(Message(id=10, conversation_id=1, user_id=1, text='da un altro percorso'))
+    db.commit()
+    assert cache.get_page(1, 5) is None
+    assert cache.get_stats()['stale'] == 1
+
+    # Lo stesso inserimento applicato tramite cache_new_message resta un hit
+    cache.store(1, make_messages(1, 5), has_more_before=False)
+    message = Message(id=11, conversation_id=1, user_id=1, text='dagli handler')
+    db.add(message)
+    db.commit()
+    message_cache.cache_new_message(db, message)
+    messages, _ = cache.get_page(1, 6)
+    assert messages[-1]['id'] == 11 and messages[-1]['user']['username'] == 'owner'
+
+    db.close()
+    engine.dispose()
+
+
+def test_write_during_read_discards_store(monkeypatch):
+    """Una scrittura tra la lettura dal database e store() non viene persa dal buffer"""
+    cache = HotMessageCache(max_bytes=10 ** 6, per_conversation=100, ttl=0)
+
+    # Invio dagli handler mentre la pagina viene letta: la conversazione non è in cache
+    generation = cache.begin_load(1)
+    cache.append(1, make_messages(1, 1, start_id=6)[0])
+    assert cache.store(1, make_messages(1, 5), has_more_before=False, generation=generation) is False
+    assert cache.get_page(1, 5) is None and not cache.is_cached(1)
+
+    # Nessuna scrittura nel frattempo: la pagina viene salvata
+    generation = cache.begin_load(1)
+    assert cache.store(1, make_messages(1, 6), has_more_before=False, generation=generation)
+    assert cache.get_page(1, 6) is not None
+
+    # Scrittura ORM da un altro percorso, con commit durante la lettura
+    monkeypatch.setattr(message_cache, '_message_cache', cache)
+    monkeypatch.setattr(message_cache, 'HOT_CACHE_ENABLED', True)
+    engine = create_engine('sqlite://')
+
+    @event.listens_for(engine, 'connect')
+    def attach_schema(dbapi_connection, _):
+        dbapi_connection.execute(f"ATTACH DATABASE ':memory:' AS {CHAT_SCHEMA}")
+
+    Base.metadata.create_all(engine, tables=[User.__table__, Conversation.__table__, Message.__table__])
+    db = sessionmaker(bind=engine)()
+    db.add_all([User(id=1, username='owner'), Conversation(id=2, name='random', type='channel')])
+    db.commit()
+
+    generation = cache.begin_load(2)
+    db.add(Message(id=20, conversation_id=2, user_id=1, text='scritto durante la lettura'))
+    db.commit()
+    assert cache.store(2, make_messages(2, 3), has_more_before=False, generation=generation) is False
+    assert not cache.is_cached(2)
+    assert cache.get_stats()['discarded_stores'] == 2
+
+    # Un'invalidazione totale scarta anche le letture in corso
+    generation = cache.begin_load(3)
+    cache.invalidate()
+    assert cache.store(3, make_messages(3, 3), has_more_before=False, generation=generation) is False
+
+    db.close()
+    engine.dispose()
@@ -0,0 +1,113 @@
+import os
+import sys
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from sqlalchemy import text
+
+try:
+    # chat.message_search importa la rubrica utenti, che verifica lo schema all'import
+    from common.db.connection import get_engine
+    from chat.migrations import run_migrations
+    from chat.pagination import InvalidCursor
+    from chat.message_search import (build_prefix_query, decode_search_cursor, encode_search_cursor,
+                                     render_snippet, search_messages)
+except Exception as e:
+    pytest.skip(f"Database chat non disponibile: {e}", allow_module_level=True)
+
+
+def test_prefix_query_keeps_only_words():
+    """Gli operatori tsquery nel testo dell'utente non arrivano a to_tsquery"""
+    assert build_prefix_query('Riunione doman') == ('Riunione', 'doman:*', '&&')
+    assert build_prefix_query("budget l'API") == ('budget', 'l & api:*', '&&')
+    assert build_prefix_query("a | !drop") == ('a |', 'drop:*', '&&')
+    assert build_prefix_query(' ?! ') is None
+
+
+def test_prefix_query_respects_websearch_operators():
+    """Il prefisso va solo all'ultima parola semplice: -escluso, "frase" e or restano a websearch"""
+    assert build_prefix_query('riunione -budget doman') == ('riunione -budget', 'doman:*', '&&')
+    assert build_prefix_query('riunione -budg') is None
+    assert build_prefix_query('riunione or doman') == ('riunione', 'doman:*', '||')
+    assert build_prefix_query('riunione or') is None
+    assert build_prefix_query('"fine mese"') is None
+    assert build_prefix_query('verbale "fine me') is None
+
+
+def test_search_cursor_round_trip():
+    cursor = encode_search_cursor(0.1, datetime(2024, 3, 1, 10, 5), 42)
+    assert decode_search_cursor(cursor) == (0.1, datetime(2024, 3, 1, 10, 5), 42)
+    with pytest.raises(InvalidCursor):
+        decode_search_cursor('non-un-cursore')
+
+
+def test_snippet_is_escaped():
+    """Il testo del messaggio è escapato, solo i termini trovati diventano <mark>"""
+    assert render_snippet('<b>\ue000ciao\ue001</b>') == '&lt;b&gt;<mark>ciao</mark>&lt;/b&gt;'
+
+
+@pytest.fixture
+def schema():
+    """Schema temporaneo con messages, conversazioni e la colonna search_vector"""
+    name = f"chat_search_test_{uuid.uuid4().hex[:8]}"
+    try:
+        engine = get_engine()
+        with engine.begin() as conn:
+            conn.execute(text(
+                f"CREATE SCHEMA {name};"
+                f"CREATE TABLE {name}.conversations (id INTEGER PRIMARY KEY, name VARCHAR(255), type VARCHAR(50));"
+                f"CREATE TABLE {name}.conversation_participants (conversation_id INTEGER, user_id INTEGER);"
+                f"CREATE TABLE {name}.messages (id SERIAL PRIMARY KEY, conversation_id INTEGER, user_id INTEGER,"
+                f" text TEXT, message_type VARCHAR(50) DEFAULT 'normal', file_data JSONB, created_at TIMESTAMP);"
+                f"INSERT INTO {name}.conversations VALUES (1, 'general', 'channel'), (2, 'dm', 'direct');"
+                f"INSERT INTO {name}.messages (conversation_id, user_id, text, file_data, created_at) VALUES"
+                f" (1, 2, 'Le riunioni di domani sono spostate', NULL, '2024-03-01 09:00'),"
+                f" (1, 3, 'Riunione annullata <urgente>', NULL, '2024-03-01 10:00'),"
+                f" (1, 2, 'Ecco il verbale', '{{\"name\": \"verbale riunione marzo\"}}', '2024-03-01 11:00'),"
+                f" (2, 2, 'Riunione privata', NULL, '2024-03-01 12:00')"
+            ))
+        run_migrations(['messages_search_vector'], schema=name)
+    except Exception as e:
+        pytest.skip(f"Postgres non disponibile: {e}")
+    yield name
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA {name} CASCADE"))
+
+
+def test_search_ranks_filters_and_paginates(schema):
+    """Radici italiane, prefisso, filtri, accesso ai messaggi diretti e pagine senza duplicati"""
+    with get_engine().connect() as conn:
+        results, cursor = search_messages(conn, 'riunione', schema=schema)
+        # Il messaggio diretto non è accessibile (l'utente 1 non è partecipante)
+        assert {r['id'] for r in results} == {1, 2, 3}
+        assert cursor is None
+        assert any('<mark>' in r['snippet'] for r in results)
+        assert all('<urgente>' not in r['snippet'] for r in results)
+
+        # Prefisso sull'ultima parola
+        results, _ = search_messages(conn, 'annull', schema=schema)
+        assert [r['id'] for r in results] == [2]
+
+        results, _ = search_messages(conn, 'riunione', has_file=True, schema=schema)
+        assert [r['id'] for r in results] == [3]
+        results, _ = search_messages(conn, 'riunione', sender_id=2, until=datetime(2024, 3, 1, 10), schema=schema)
+        assert [r['id'] for r in results] == [1]
+
+        # -escluso e or non diventano parole obbligatorie del prefisso
+        results, _ = search_messages(conn, 'riunione -annullata', schema=schema)
+        assert {r['id'] for r in results} == {1, 3}
+        results, _ = search_messages(conn, 'riunione -annull', schema=schema)
+        assert {r['id'] for r in results} == {1, 3}
+        results, _ = search_messages(conn, 'verbale or annull', schema=schema)
+        assert {r['id'] for r in results} == {2, 3}
+
+        pages, cursor = [], None
+        while True:
+            page, cursor = search_messages(conn, 'riunione', limit=1, cursor=cursor, schema=schema)
+            pages.extend(r['id'] for r in page)
+            if cursor is None:
+                break
+        assert sorted(pages) == [1, 2, 3] and len(pages) == 3
@@ -0,0 +1,110 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pytest
+
+from common.rag.numpy_index import NumpyVectorIndex, parse_vector, write_index
+
+
+@pytest.fixture
+def corpus():
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(500, 32)).astype(np.float32)
+    metadata = [(f"Art. {i}", f"contenuto {i}") for i in range(500)]
+    return metadata, embeddings
+
+
+def exact_top_k(embeddings, query, k):
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    scores = normalized @ (query / np.linalg.norm(query))
+    return list(np.argsort(-scores)[:k])
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'int8'])
+def test_search_matches_exact_cosine(tmp_path, corpus, dtype):
+    """Il top-k dell'indice mappato coincide con la ricerca coseno esatta"""
+    metadata, embeddings = corpus
+    write_index(str(tmp_path / 'index'), metadata, embeddings, dtype)
+    index = NumpyVectorIndex(str(tmp_path / 'index')).load()
+    assert isinstance(index.embeddings, np.memmap)
+
+    query = embeddings[42] + 0.01
+    results = index.search(query, top_k=5)
+    assert [row[0] for row in results[:3]] == [metadata[i][0] for i in exact_top_k(embeddings, query, 3)]
+    assert results[0][1] == 'contenuto 42'
+    similarities = [row[2] for row in results]
+    assert similarities == sorted(similarities, reverse=True)
+
+
+def test_rebuild_is_detected(tmp_path, corpus):
+    """Una ricostruzione dell'indice viene rilevata dai processi che lo hanno già aperto"""
+    metadata, embeddings = corpus
+    path = str(tmp_path / 'index')
+    write_index(path, metadata, embeddings)
+    index = NumpyVectorIndex(path).load()
+    os.utime(os.path.join(path, 'manifest.json'), (0, 0))
+    assert index.is_stale()
+
+
+def test_rebuild_swaps_versions_atomically(tmp_path, corpus):
+    """La ricostruzione sposta il link alla nuova versione e conserva solo la precedente"""
+    metadata, embeddings = corpus
+    path = str(tmp_path / 'index')
+    write_index(path, metadata, embeddings)
+    index = NumpyVectorIndex(path).load()
+
+    write_index(path, metadata[:10], embeddings[:10])
+    assert os.path.islink(path) and NumpyVectorIndex.exists(path)
+    assert index.is_stale()
+    # La versione caricata resta leggibile dai processi che non hanno ancora ricaricato
+    assert index.search(embeddings[42], top_k=1)[0][0] == 'Art. 42'
+    assert NumpyVectorIndex(path).load().manifest['rows'] == 10
+
+    write_index(path, metadata[:5], embeddings[:5])
+    versions = [name for name in os.listdir(tmp_path) if name.startswith('.index.v')]
+    assert len(versions) == 2 and not os.path.exists(index.loaded_version)
+
+
+def test_rebuild_replaces_plain_directory(tmp_path, corpus):
+    """Un indice scritto come directory reale viene convertito in versione e sostituito"""
+    metadata, embeddings = corpus
+    path = tmp_path / 'index'
+    path.mkdir()
+    (path / 'manifest.json').write_text('{}')
+    write_index(str(path), metadata[:3], embeddings[:3])
+    assert os.path.islink(path)
+    assert NumpyVectorIndex(str(path)).load().manifest['rows'] == 3
+
+
+def test_parse_vector_text():
+    """Il formato testuale di pgvector viene convertito in float32"""
+    assert parse_vector('[1,2.5,-3]').tolist() == [1.0, 2.5, -3.0]
+
+
+def test_search_returns_each_article_once(tmp_path):
+    """Più chunk dello stesso articolo occupano un solo posto nel top-k, con il punteggio migliore"""
+    base = np.eye(8, dtype=np.float32)
+    # Nove chunk dell'art. 1 vicinissimi alla query, poi gli articoli 2 e 3
+    embeddings = np.vstack([base[0] + 0.01 * i for i in range(9)] + [base[0] + base[1], base[0] + 2 * base[2]])
+    metadata = [("Art. 1", f"chunk {i}") for i in range(9)] + [("Art. 2", "due"), ("Art. 3", "tre")]
+    write_index(str(tmp_path / 'index'), metadata, embeddings)
+    index = NumpyVectorIndex(str(tmp_path / 'index')).load()
+
+    results = index.search(base[0], top_k=3)
+    assert [row[0] for row in results] == ["Art. 1", "Art. 2", "Art. 3"]
+    assert results[0][1] == "chunk 0"
+    # I primi candidati sono tutti chunk dell'art. 1: la ricerca si estende al corpus
+    assert [row[0] for row in index.search(base[0], top_k=2)] == ["Art. 1", "Art. 2"]
+    # Meno articoli distinti che top_k: restituisce quelli esistenti
+    assert len(index.search(base[0], top_k=10)) == 3
+
+
+def test_unique_articles_keeps_best_chunk():
+    """Il ramo pgvector tiene il primo chunk di ogni articolo tra i candidati"""
+    from common.rag.retrieval import unique_articles
+    rows = [('2043', 'a', 0.9), ('2043', 'b', 0.8), ('2059', 'c', 0.7), ('2043', 'd', 0.6), ('1218', 'e', 0.5)]
+    assert unique_articles(rows, 2) == [('2043', 'a', 0.9), ('2059', 'c', 0.7)]
+    assert unique_articles(rows, 5) == [('2043', 'a', 0.9), ('2059', 'c', 0.7), ('1218', 'e', 0.5)]
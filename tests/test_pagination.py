@@ -0,0 +1,67 @@
+import os
+import sys
+from datetime import datetime
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from sqlalchemy import Column
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.sql import visitors
+
+try:
+    # chat.database verifica lo schema all'import: serve un database raggiungibile
+    from chat.models import Message
+    from chat.pagination import InvalidCursor, clamp_page_size, decode_cursor, encode_cursor, get_message_page
+except Exception as e:
+    pytest.skip(f"Database chat non disponibile: {e}", allow_module_level=True)
+
+
+def test_cursor_round_trip_is_opaque():
+    """Il cursore codifica (created_at, id) in una stringa url-safe"""
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    cursor = encode_cursor(created_at, 4242)
+    assert '=' not in cursor and '/' not in cursor and '+' not in cursor
+    assert decode_cursor(cursor) == (created_at, 4242)
+
+
+@pytest.mark.parametrize('cursor', ['', 'non-un-cursore', encode_cursor(datetime(2024, 1, 1), 1)[:-3]])
+def test_invalid_cursor(cursor):
+    """Un cursore non valido solleva InvalidCursor"""
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_page_size_is_clamped():
+    assert clamp_page_size('20') == 20
+    assert clamp_page_size(10000) == 200
+    assert clamp_page_size(0) == 1
+    assert clamp_page_size('abc') == 50
+
+
+def test_keyset_index_is_declared():
+    """L'indice composito covering è dichiarato sul modello"""
+    indexes = {index.name: index for index in Message.__table__.indexes}
+    index = indexes['idx_messages_conversation_created_id']
+    assert [column.name for column in index.columns] == ['conversation_id', 'created_at', 'id']
+    ddl = str(CreateIndex(index).compile(dialect=postgresql.dialect()))
+    assert 'INCLUDE (message_type, user_id)' in ddl
+
+
+def test_keyset_query_reads_only_index_columns():
+    """Il passo keyset seleziona e filtra solo colonne dell'indice covering"""
+    db = MagicMock()
+    db.query.return_value.filter.return_value.order_by.return_value.limit.return_value.all.return_value = []
+    page = get_message_page(db, 7, limit=20)
+    assert page['rows'] == [] and not page['has_more_before']
+
+    selected = db.query.call_args_list[0].args
+    assert [column.key for column in selected] == ['id', 'created_at']
+    where = db.query.return_value.filter.call_args.args
+    index_columns = {'conversation_id', 'created_at', 'id', 'message_type', 'user_id'}
+    filtered = {node.name for condition in where for node in visitors.iterate(condition) if isinstance(node, Column)}
+    assert filtered <= index_columns and {'message_type', 'user_id'} <= filtered
+    # Nessuna riga: nessuna seconda query
+    assert db.query.call_count == 1
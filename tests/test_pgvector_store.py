@@ -0,0 +1,37 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pytest
+
+from common.rag.pgvector_store import build_ann_index_sql, index_name, search_codice_civile, to_vector_literal
+
+
+def test_vector_literal_is_compact_float32():
+    """Il vettore viene serializzato una sola volta con precisione float32"""
+    literal = to_vector_literal(np.array([0.1, -2.5, 3], dtype=np.float64))
+    assert literal == '[0.1,-2.5,3]'
+    assert to_vector_literal([1e-8]) == '[1e-08]'
+
+
+def test_ann_index_sql():
+    """Il DDL dell'indice usa la distanza coseno e le opzioni del metodo scelto"""
+    hnsw = build_ann_index_sql('hnsw', m=24, ef_construction=100)
+    assert 'USING hnsw (embedding vector_cosine_ops) WITH (m = 24, ef_construction = 100)' in hnsw
+    assert hnsw.startswith(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name('hnsw')}")
+    ivfflat = build_ann_index_sql('ivfflat', lists=200, concurrently=False)
+    assert 'USING ivfflat (embedding vector_cosine_ops) WITH (lists = 200)' in ivfflat
+    with pytest.raises(ValueError):
+        build_ann_index_sql('flat')
+
+
+def test_search_uses_prepared_statement():
+    """Due ricerche consecutive riusano il prepared statement sulla connessione del pool"""
+    try:
+        first = search_codice_civile(np.zeros(384), top_k=2, ef_search=80)
+    except Exception as e:
+        pytest.skip(f"Postgres/pgvector o tabella codice_civile non disponibili: {e}")
+    second = search_codice_civile(np.zeros(384), top_k=2, probes=5)
+    assert len(first) <= 2 and len(second) <= 2
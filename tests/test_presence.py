@@ -0,0 +1,249 @@
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from flask import Flask, request
+from sqlalchemy import text
+
+try:
+    # chat.presence importa i modelli, che verificano lo schema all'import
+    from common.db.connection import get_engine
+    from chat.presence import PresenceStore, PresenceTracker
+except Exception as e:
+    pytest.skip(f"Database chat non disponibile: {e}", allow_module_level=True)
+
+
+class SharedStore:
+    """Righe di presenza di più worker con lo stesso aggregato di PresenceStore, in memoria"""
+
+    def __init__(self):
+        self.rows = {}  # (worker_id, user_id) -> (stato, ordine di modifica)
+        self.users = {}  # user_id -> stato aggregato
+        self.changes = 0
+        self.fail = False
+
+    def aggregate(self, user_ids):
+        changes = []
+        for user_id in sorted(set(user_ids) | {u for u, s in self.users.items() if s != 'offline'}):
+            rows = [row for (_, row_user), row in self.rows.items() if row_user == user_id]
+            status = max(rows, key=lambda row: row[1])[0] if rows else 'offline'
+            if self.users.get(user_id, 'offline') != status:
+                self.users[user_id] = status
+                changes.append({'userId': user_id, 'status': status})
+        return changes
+
+
+class WorkerStore:
+    """Vista di un worker su SharedStore, con il registro delle sincronizzazioni"""
+
+    def __init__(self, shared, worker_id):
+        self.shared = shared
+        self.worker_id = worker_id
+        self.syncs = []
+
+    def sync(self, statuses, removed):
+        if self.shared.fail:
+            raise RuntimeError("database non disponibile")
+        self.syncs.append((dict(statuses), set(removed)))
+        for user_id in removed:
+            self.shared.rows.pop((self.worker_id, user_id), None)
+        for user_id, status in statuses.items():
+            previous = self.shared.rows.get((self.worker_id, user_id))
+            if previous is None or previous[0] != status:
+                self.shared.changes += 1
+                self.shared.rows[(self.worker_id, user_id)] = (status, self.shared.changes)
+        return self.shared.aggregate(set(statuses) | set(removed))
+
+    def load(self):
+        return [{'userId': u, 'status': s} for u, s in sorted(self.shared.users.items()) if s != 'offline']
+
+
+class Recorder:
+    """Eventi emessi, task avviati e orologio controllabile"""
+
+    def __init__(self):
+        self.events = []
+        self.tasks = []
+        self.now = 0.0
+
+    def emit(self, event, payload):
+        self.events.append((event, payload))
+
+    def start_task(self, fn):
+        self.tasks.append(fn)
+
+    def clock(self):
+        return self.now
+
+
+@pytest.fixture
+def recorder():
+    return Recorder()
+
+
+@pytest.fixture
+def shared():
+    return SharedStore()
+
+
+def make_tracker(recorder, shared, worker_id='a'):
+    return PresenceTracker(recorder.emit, recorder.start_task, store=WorkerStore(shared, worker_id),
+                           clock=recorder.clock, tick=1, grace=10, heartbeat_timeout=60, persist_interval=30)
+
+
+@pytest.fixture
+def tracker(recorder, shared):
+    return make_tracker(recorder, shared)
+
+
+def test_changes_are_batched_per_tick(tracker, recorder):
+    """Più eventi tra due tick producono un solo 'presence' con lo stato finale"""
+    tracker.connect('a', 1)
+    tracker.connect('b', 2)
+    tracker.set_status('b', 'away')
+    assert recorder.events == [] and len(recorder.tasks) == 1
+
+    assert tracker.tick() == [{'userId': 1, 'status': 'online'}, {'userId': 2, 'status': 'away'}]
+    assert recorder.events == [('presence', {'changes': [{'userId': 1, 'status': 'online'},
+                                                         {'userId': 2, 'status': 'away'}]})]
+    # Nessun cambiamento: nessun evento e nessuna scrittura
+    assert tracker.tick() == [] and len(recorder.events) == 1
+    assert len(tracker.store.syncs) == 1
+    assert tracker.set_status('b', 'invisibile') is None
+
+
+def test_grace_period_hides_reconnects(tracker, recorder):
+    """Una riconnessione entro il periodo di grazia non produce offline/online"""
+    tracker.connect('a', 1)
+    tracker.tick()
+
+    tracker.disconnect('a')
+    recorder.now = 5
+    assert tracker.tick() == []
+    tracker.connect('a2', 1)
+    recorder.now = 20
+    assert tracker.tick() == []
+
+    tracker.disconnect('a2')
+    recorder.now = 31
+    assert tracker.tick() == [{'userId': 1, 'status': 'offline'}]
+    assert tracker.statuses() == []
+
+
+def test_user_moving_between_workers_stays_online(recorder, shared):
+    """Un utente passato a un altro worker non viene mostrato offline e nessuno stato è inviato due volte"""
+    worker_a = make_tracker(recorder, shared, 'a')
+    worker_b = make_tracker(recorder, shared, 'b')
+    worker_a.connect('sid-a', 1)
+    assert worker_a.tick() == [{'userId': 1, 'status': 'online'}]
+
+    worker_a.disconnect('sid-a')
+    worker_b.connect('sid-b', 1)
+    assert worker_b.tick() == []
+    # Fine del periodo di grazia sul primo worker: l'utente resta online sul secondo
+    recorder.now = 20
+    assert worker_a.tick() == []
+    assert worker_b.statuses() == [{'userId': 1, 'status': 'online'}]
+
+    worker_b.set_status('sid-b', 'busy')
+    assert worker_b.tick() == [{'userId': 1, 'status': 'busy'}]
+    worker_b.disconnect('sid-b')
+    recorder.now = 40
+    assert worker_b.tick() == [{'userId': 1, 'status': 'offline'}]
+    assert [payload['changes'] for _, payload in recorder.events] == [
+        [{'userId': 1, 'status': 'online'}], [{'userId': 1, 'status': 'busy'}], [{'userId': 1, 'status': 'offline'}]
+    ]
+
+
+def test_missing_heartbeats_refresh_and_sync_errors(tracker, recorder, shared):
+    """Le connessioni senza heartbeat scadono, le righe vengono rinnovate e gli errori riprovati"""
+    tracker.connect('a', 1)
+    tracker.connect('b', 2)
+    tracker.tick()
+
+    recorder.now = 50
+    assert tracker.heartbeat('b')
+    recorder.now = 70
+    assert tracker.tick() == [{'userId': 1, 'status': 'offline'}]
+    assert not tracker.heartbeat('a')
+    # Oltre persist_interval le righe dei propri utenti vengono riscritte anche senza cambiamenti
+    assert tracker.store.syncs[-1] == ({2: 'online'}, {1})
+
+    shared.fail = True
+    tracker.set_status('b', 'busy')
+    assert tracker.tick() == []
+    shared.fail = False
+    assert tracker.tick() == [{'userId': 2, 'status': 'busy'}]
+
+    stats = tracker.get_stats()
+    assert stats['expired_sessions'] == 1 and stats['sync_errors'] == 1
+    assert stats['users_by_status'] == {'busy': 1} and stats['connections'] == 1
+
+
+def test_client_traffic_counts_as_heartbeat(tracker, recorder):
+    """Una connessione che invia eventi ma nessun heartbeat resta online"""
+    received = []
+    handler = tracker.on_traffic(lambda data: received.append(data))
+    tracker.connect('a', 1)
+    tracker.tick()
+
+    app = Flask(__name__)
+    for now in (40, 80, 120):
+        recorder.now = now
+        with app.test_request_context():
+            request.sid = 'a'
+            handler({'message': now})
+        assert tracker.tick() == []
+
+    assert len(received) == 3
+    assert tracker.statuses() == [{'userId': 1, 'status': 'online'}]
+    assert tracker.get_stats()['expired_sessions'] == 0
+
+
+@pytest.fixture
+def presence_schema():
+    """Schema temporaneo con users e user_presence"""
+    name = f"chat_presence_test_{uuid.uuid4().hex[:8]}"
+    try:
+        with get_engine().begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA {name}"))
+            conn.execute(text(f"CREATE TABLE {name}.users (id SERIAL PRIMARY KEY, username VARCHAR(100),"
+                              f" status VARCHAR(50) DEFAULT 'offline')"))
+            conn.execute(text(f"CREATE TABLE {name}.user_presence (worker_id VARCHAR(100) NOT NULL,"
+                              f" user_id INTEGER NOT NULL REFERENCES {name}.users(id) ON DELETE CASCADE,"
+                              f" status VARCHAR(50) NOT NULL, updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,"
+                              f" expires_at TIMESTAMP NOT NULL, PRIMARY KEY (worker_id, user_id))"))
+            conn.execute(text(f"INSERT INTO {name}.users (id, username, status) VALUES"
+                              f" (1, 'owner', 'offline'), (2, 'john', 'online')"))
+    except Exception as e:
+        pytest.skip(f"Postgres non disponibile: {e}")
+    yield name
+    with get_engine().begin() as conn:
+        conn.execute(text(f"DROP SCHEMA {name} CASCADE"))
+
+
+def test_store_aggregates_workers_in_postgres(presence_schema, monkeypatch):
+    """users.status è lo stato aggregato delle righe dei worker; solo chi lo cambia lo riceve"""
+    import chat.presence as presence_module
+    invalidated = []
+    monkeypatch.setattr(presence_module, 'invalidate_autocomplete', lambda: invalidated.append('autocomplete'))
+    worker_a = PresenceStore('a', ttl=60, schema=presence_schema)
+    worker_b = PresenceStore('b', ttl=60, schema=presence_schema)
+
+    # Lo stato 'online' lasciato senza righe viene corretto alla prima sincronizzazione
+    assert worker_a.sync({1: 'online'}, ()) == [{'userId': 1, 'status': 'online'},
+                                                {'userId': 2, 'status': 'offline'}]
+    # Gli utenti dell'autocompletamento riportano lo stato: l'indice va ricostruito
+    assert invalidated == ['autocomplete']
+    assert worker_b.sync({1: 'online'}, ()) == []
+    assert worker_a.sync({}, {1}) == []
+    assert worker_b.load() == [{'userId': 1, 'status': 'online'}]
+    assert worker_b.sync({}, {1}) == [{'userId': 1, 'status': 'offline'}]
+
+    # Le righe non rinnovate di un worker fermo scadono
+    stopped = PresenceStore('c', ttl=-1, schema=presence_schema)
+    assert stopped.sync({2: 'away'}, ()) == []
+    assert worker_a.load() == []
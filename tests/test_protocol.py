@@ -0,0 +1,72 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from chat.protocol import PROTOCOL_COMPACT, PROTOCOL_FULL, ProtocolRegistry, compact_message, truncate_snippet
+
+JOHN = {'id': 2, 'username': 'john_doe', 'displayName': 'John Doe',
+        'avatarUrl': 'https://ui-avatars.com/api/?name=John+Doe', 'status': 'online'}
+OWNER = {'id': 1, 'username': 'owner', 'displayName': 'Owner',
+         'avatarUrl': 'https://ui-avatars.com/api/?name=Owner', 'status': 'online'}
+
+
+def make_message(message_id, user, reply_to=None):
+    """Messaggio nel formato di chat/hydration.py"""
+    return {
+        'id': message_id, 'conversationId': 1, 'user': user, 'text': f"messaggio {message_id}",
+        'timestamp': '2024-03-01T10:00:00', 'type': 'normal', 'fileData': None, 'replyTo': reply_to,
+        'forwardedFrom': None, 'message_metadata': {}, 'edited': False, 'editedAt': None,
+        'isOwn': user['id'] == 1
+    }
+
+
+def test_compact_message_references_users_and_truncates_reply():
+    """L'autore diventa userId, replyTo un'anteprima troncata senza fileData"""
+    reply = {'id': 1, 'text': 'x' * 500, 'message_type': 'normal',
+             'fileData': {'name': 'verbale.pdf', 'size': 1000}, 'user': OWNER}
+    original = make_message(2, JOHN, reply_to=reply)
+    users = {}
+    compact = compact_message(original, users)
+
+    assert 'user' not in compact and compact['userId'] == 2
+    assert compact['replyTo'] == {'id': 1, 'userId': 1, 'snippet': truncate_snippet('x' * 500),
+                                  'message_type': 'normal', 'fileName': 'verbale.pdf'}
+    assert len(compact['replyTo']['snippet']) <= 120
+    assert users == {1: OWNER, 2: JOHN}
+    # Il messaggio originale (condiviso con la cache) non cambia
+    assert original['user'] == JOHN and original['replyTo'] is reply
+
+
+def test_negotiation_keeps_old_clients_on_full_payloads():
+    """Senza negoziazione (o con versioni sconosciute) i payload restano quelli di sempre"""
+    registry = ProtocolRegistry()
+    messages = [make_message(i, JOHN) for i in range(3)]
+    assert registry.history_payload('old', messages) is messages
+
+    assert registry.negotiate('new', 99) == PROTOCOL_COMPACT
+    assert registry.negotiate('bad', 'x') == PROTOCOL_FULL
+    assert registry.compact_sids(['old', 'new', 'bad']) == ['new']
+
+
+def test_users_are_sent_once_and_bytes_saved_reported():
+    """Gli utenti noti al client non vengono ripetuti; i byte risparmiati sono contati"""
+    registry = ProtocolRegistry()
+    registry.negotiate('a', PROTOCOL_COMPACT)
+    registry.remember_users('a', [OWNER])
+
+    history = [make_message(i, JOHN if i % 2 else OWNER) for i in range(50)]
+    payload = registry.history_payload('a', history)
+    assert payload['users'] == [JOHN]
+    assert {m['userId'] for m in payload['messages']} == {1, 2}
+
+    # Utente già inviato: il nuovo messaggio non ha la tabella users
+    assert 'users' not in registry.message_payload('a', make_message(51, JOHN))
+    # Profilo cambiato: viene inviato di nuovo
+    away = dict(JOHN, status='away')
+    assert registry.message_payload('a', make_message(52, away))['users'] == [away]
+
+    stats = registry.get_stats()
+    assert stats['compact_payloads'] == 3
+    assert stats['bytes_saved'] > 0 and stats['saved_ratio'] > 0.3
+    assert stats['connections_by_version'] == {'2': 1}
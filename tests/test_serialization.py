@@ -0,0 +1,64 @@
+import json
+import os
+import sys
+from datetime import datetime, date
+from decimal import Decimal
+from uuid import UUID
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from socketio import packet
+
+from common.serialization import SocketIOPacket, dumps, loads, to_jsonable
+from common.utils import CustomJSONEncoder
+
+
+PAYLOAD = {
+    'id': 7,
+    'timestamp': datetime(2024, 5, 1, 12, 30, 15, 123456),
+    'user': {'id': 1, 'displayName': 'Owner', 'status': None},
+    'tags': ('a', 'b'),
+    'scores': {1: 0.5, 2: 1.0},
+    'fileData': None,
+    'edited': False,
+    'nested': [{'at': datetime(2024, 5, 2)}, [1, 2, [3]]],
+}
+
+
+def test_to_jsonable_matches_legacy_round_trip():
+    """Una sola passata produce lo stesso risultato del giro dumps/loads con CustomJSONEncoder"""
+    legacy = json.loads(json.dumps(PAYLOAD, cls=CustomJSONEncoder))
+    assert to_jsonable(PAYLOAD) == legacy
+
+
+def test_to_jsonable_extra_types():
+    """UUID, Decimal e date sono convertiti; il dizionario di partenza non viene modificato"""
+    data = {'uuid': UUID('12345678-1234-5678-1234-567812345678'), 'amount': Decimal('1.5'),
+            'day': date(2024, 1, 2)}
+    assert to_jsonable(data) == {'uuid': '12345678-1234-5678-1234-567812345678', 'amount': 1.5,
+                                 'day': '2024-01-02'}
+    assert isinstance(data['day'], date)
+
+
+def test_dumps_round_trip():
+    assert loads(dumps(PAYLOAD)) == to_jsonable(PAYLOAD)
+
+
+def test_packet_encoding_matches_standard_packet():
+    """SocketIOPacket produce un pacchetto equivalente a quello standard"""
+    data = ['messageHistory', to_jsonable(PAYLOAD)]
+    for namespace, packet_id in (('/', None), ('/chat', 12)):
+        fast = SocketIOPacket(packet.EVENT, data=data, namespace=namespace, id=packet_id).encode()
+        standard = packet.Packet(packet.EVENT, data=data, namespace=namespace, id=packet_id).encode()
+        decoded_fast = packet.Packet(encoded_packet=fast)
+        decoded_standard = packet.Packet(encoded_packet=standard)
+        assert decoded_fast.data == decoded_standard.data == data
+        assert (decoded_fast.namespace, decoded_fast.id) == (decoded_standard.namespace, decoded_standard.id)
+
+
+def test_packet_with_bytes_uses_binary_event():
+    """I payload con bytes seguono il percorso standard con allegati binari"""
+    pkt = SocketIOPacket(packet.EVENT, data=['upload', {'chunk': b'\x00\x01'}])
+    assert pkt.packet_type == packet.BINARY_EVENT
+    encoded = pkt.encode()
+    assert isinstance(encoded, list) and encoded[1] == b'\x00\x01'
@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import socketio
+
+from common.socketio_queue import LocalBroker, LocalBrokerManager, create_client_manager
+
+
+@pytest.fixture
+def broker():
+    """Broker locale su una porta libera"""
+    local_broker = LocalBroker('127.0.0.1', 0)
+    local_broker.start()
+    yield local_broker
+    local_broker.stop()
+
+
+def make_worker(url):
+    """Crea un server Socket.IO che simula un worker Gunicorn collegato al broker"""
+    server = socketio.Server(async_mode='threading',
+                             client_manager=LocalBrokerManager(url, channel='test-socketio'))
+    sent = []
+    server._send_eio_packet = lambda eio_sid, pkt: sent.append((eio_sid, pkt))
+    server.manager_initialized = True
+    server.manager.initialize()
+    return server, sent
+
+
+def connect_fake_client(server, room):
+    """Registra un client nel manager del worker e lo fa entrare in una room"""
+    eio_sid = server.eio.generate_id()
+    sid = server.manager.connect(eio_sid, '/')
+    server.manager.enter_room(sid, '/', room, eio_sid=eio_sid)
+    return eio_sid
+
+
+def wait_for(predicate, timeout=3.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_emit_reaches_room_on_other_worker(broker):
+    """Un emit da un worker raggiunge i client della room collegati a un altro worker"""
+    url = f"local://127.0.0.1:{broker.port}"
+    server_a, sent_a = make_worker(url)
+    server_b, sent_b = make_worker(url)
+
+    connect_fake_client(server_a, 'channel:random')
+    eio_sid_b = connect_fake_client(server_b, 'channel:general')
+    assert wait_for(lambda: broker.subscriber_count('test-socketio') == 2)
+
+    # Emit fuori dal contesto di richiesta, come fa emit_calendar_update
+    server_a.emit('newMessage', {'text': 'ciao'}, to='channel:general')
+
+    assert wait_for(lambda: len(sent_b) == 1)
+    eio_sid, pkt = sent_b[0]
+    assert eio_sid == eio_sid_b
+    assert pkt.data == '2["newMessage",{"text":"ciao"}]'
+    # Il client del worker A non è nella room
+    assert sent_a == []
+
+
+def test_create_client_manager_by_scheme():
+    """La factory sceglie il manager in base allo schema dell'URL"""
+    assert create_client_manager('') is None
+    manager = create_client_manager('local://127.0.0.1:7000', channel='chan')
+    assert isinstance(manager, LocalBrokerManager)
+    assert (manager.host, manager.port, manager.channel) == ('127.0.0.1', 7000, 'chan')
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pytest
+
+import common.embeddings as embeddings
+from common.rag import speculative
+
+
+class BagOfWordsModel:
+    """Modello di prova: vettore delle parole su un vocabolario fisso"""
+    VOCAB = ['risarcimento', 'danno', 'contratto', 'nullità', 'meteo', 'oggi']
+
+    def encode(self, texts, batch_size=32):
+        return np.array([[float(word in text.lower()) for word in self.VOCAB] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture(autouse=True)
+def fake_embedding_service(monkeypatch):
+    service = embeddings.EmbeddingService(model_loader=lambda name: BagOfWordsModel(), max_wait_ms=0)
+    monkeypatch.setattr(embeddings, '_service', service)
+
+
+def slow_search(query, top_k=3):
+    time.sleep(0.1)
+    return [{'article_number': query, 'content': '', 'similarity': 1.0}]
+
+
+def test_similar_tag_query_reuses_speculative_results():
+    """Con una query del tag simile al messaggio si riusano i risultati già calcolati"""
+    before = speculative.get_speculative_stats()
+    speculation = speculative.start_speculative_retrieval("Come funziona il risarcimento del danno?", slow_search)
+    time.sleep(0.15)  # chiamata LLM simulata
+
+    start = time.perf_counter()
+    articles = speculation.resolve("risarcimento danno")
+    assert (time.perf_counter() - start) < 0.1
+    assert articles[0]['article_number'] == "Come funziona il risarcimento del danno?"
+
+    stats = speculative.get_speculative_stats()
+    assert stats['hits'] == before['hits'] + 1
+    assert stats['saved_ms_total'] >= before['saved_ms_total'] + 90
+
+
+def test_different_tag_query_runs_normal_search():
+    """Con una query diversa la speculazione viene scartata e si cerca con la query del tag"""
+    before = speculative.get_speculative_stats()
+    speculation = speculative.start_speculative_retrieval("Che tempo fa oggi? meteo", slow_search)
+    articles = speculation.resolve("nullità del contratto")
+    assert articles[0]['article_number'] == "nullità del contratto"
+    speculation.discard()  # già risolta: nessun effetto
+
+    stats = speculative.get_speculative_stats()
+    assert stats['misses'] == before['misses'] + 1
+    assert stats['unused'] == before['unused']
+
+
+def test_empty_speculative_results_run_tag_search():
+    """Una ricerca speculativa vuota (o fallita) non viene riusata anche se la query è simile"""
+    queries = []
+
+    def search(query, top_k=3):
+        queries.append(query)
+        # search_semantica restituisce [] anche in caso di errore
+        return [] if query.startswith("Come") else [{'article_number': query, 'content': '', 'similarity': 1.0}]
+
+    before = speculative.get_speculative_stats()
+    speculation = speculative.start_speculative_retrieval("Come funziona il risarcimento del danno?", search)
+    articles = speculation.resolve("risarcimento danno")
+    assert articles[0]['article_number'] == "risarcimento danno"
+    assert queries == ["Come funziona il risarcimento del danno?", "risarcimento danno"]
+
+    stats = speculative.get_speculative_stats()
+    assert stats['misses'] == before['misses'] + 1 and stats['hits'] == before['hits']
@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from common.config import STARTUP_IMPORT_BUDGET
+from common.profiling import HEAVY_MODULES, NO_DATABASE_ENV, NO_DATABASE_SETUP, run_import
+
+CHECK_HEAVY = (
+    "import sys\n"
+    f"heavy = sorted(m for m in sys.modules if m.split('.')[0] in {HEAVY_MODULES!r})\n"
+    "print('HEAVY=' + ','.join(heavy))"
+)
+
+
+def heavy_loaded(stdout):
+    for line in stdout.splitlines():
+        if line.startswith('HEAVY='):
+            return [m for m in line[len('HEAVY='):].split(',') if m]
+    return None
+
+
+def test_agent_packages_import_without_heavy_dependencies():
+    """I package degli agenti si importano senza caricare LangChain, ReportLab o torch"""
+    modules = 'agent.chat_agents_middleware, agent.db_agent, agent.db_agent.routes, agent.file_agent, agent.cal'
+    result, _ = run_import(modules, extra_code=CHECK_HEAVY)
+    assert result.returncode == 0, result.stderr
+    assert heavy_loaded(result.stdout) == []
+
+
+def test_import_app_within_budget():
+    """L'import di app resta entro STARTUP_IMPORT_BUDGET e non carica librerie pesanti"""
+    # Senza database: si misura l'import, non la connessione a Postgres
+    result, elapsed = run_import('app', extra_code=CHECK_HEAVY, setup_code=NO_DATABASE_SETUP, env=NO_DATABASE_ENV)
+    if result.returncode != 0 and 'ModuleNotFoundError' in result.stderr:
+        pytest.skip(f"dipendenza non installata: {result.stderr.strip().splitlines()[-1:]}")
+    assert result.returncode == 0, result.stderr
+    assert heavy_loaded(result.stdout) == []
+    assert elapsed <= STARTUP_IMPORT_BUDGET, f"import app: {elapsed:.2f}s > budget {STARTUP_IMPORT_BUDGET:.2f}s"
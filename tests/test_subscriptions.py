@@ -0,0 +1,58 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from chat.subscriptions import RoomSubscriptions
+
+
+def make_manager():
+    """Gestore che registra join e leave invece di chiamare Socket.IO"""
+    calls = []
+    manager = RoomSubscriptions(join=lambda room, sid: calls.append(('join', room, sid)),
+                                leave=lambda room, sid: calls.append(('leave', room, sid)))
+    return manager, calls
+
+
+def test_opening_a_conversation_leaves_the_previous_one():
+    """Solo la conversazione aperta resta sottoscritta; riaprirla non la duplica"""
+    manager, calls = make_manager()
+    manager.activate('a', 'channel:general')
+    assert manager.activate('a', 'channel:random') == ['channel:general']
+    assert manager.activate('a', 'channel:random') == []
+    manager.activate('b', 'channel:random')
+
+    assert calls == [('join', 'channel:general', 'a'), ('join', 'channel:random', 'a'),
+                     ('leave', 'channel:general', 'a'), ('join', 'channel:random', 'b')]
+    assert manager.room_counts() == {'channel:random': 2}
+
+
+def test_pinned_rooms_survive_navigation():
+    """Le room fissate restano anche cambiando conversazione, finché non vengono tolte"""
+    manager, calls = make_manager()
+    manager.activate('a', 'channel:general')
+    assert manager.subscribe('a', ['channel:general', 'dm:2']) == {
+        'active': 'channel:general', 'rooms': ['channel:general', 'dm:2']}
+
+    assert manager.activate('a', 'channel:random') == []
+    assert manager.rooms_of('a')['rooms'] == ['channel:general', 'channel:random', 'dm:2']
+
+    # Togliere la room attiva dalle fissate non la abbandona
+    manager.unsubscribe('a', ['channel:random', 'channel:general'])
+    assert manager.rooms_of('a') == {'active': 'channel:random', 'rooms': ['channel:random', 'dm:2']}
+    assert calls[-1] == ('leave', 'channel:general', 'a')
+
+
+def test_disconnect_clears_counts():
+    """forget() rimuove la connessione da tutti i conteggi"""
+    manager, calls = make_manager()
+    manager.activate('a', 'channel:general')
+    manager.subscribe('a', ['dm:2'])
+    manager.activate('b', 'channel:general')
+
+    manager.forget('a')
+    assert manager.room_counts() == {'channel:general': 1}
+    stats = manager.get_stats()
+    assert stats['connections'] == 1 and stats['subscriptions'] == 1
+    # Socket.IO toglie già la connessione dalle room: nessun leave esplicito
+    assert not [call for call in calls if call[0] == 'leave']
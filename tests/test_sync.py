@@ -0,0 +1,166 @@
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+try:
+    # chat.sync importa i modelli, che verificano lo schema all'import
+    from common.config import CHAT_SCHEMA
+    from common.db.connection import get_engine
+    from chat.database import Base
+    from chat.migrations import run_migrations
+    from chat.models import User, Conversation, Message
+    from chat.sync import get_changes_since, get_conversation_seq, prune_tombstones
+except Exception as e:
+    pytest.skip(f"Database chat non disponibile: {e}", allow_module_level=True)
+
+
+@pytest.fixture
+def db():
+    """Sessione su uno schema temporaneo con le migrazioni conversation_state e message_sequence"""
+    name = f"chat_sync_test_{uuid.uuid4().hex[:8]}"
+    try:
+        engine = get_engine().execution_options(schema_translate_map={CHAT_SCHEMA: name})
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA {name}"))
+        Base.metadata.create_all(engine, tables=[User.__table__, Conversation.__table__, Message.__table__])
+        run_migrations(['conversation_state', 'message_sequence'], schema=name)
+    except Exception as e:
+        pytest.skip(f"Postgres non disponibile: {e}")
+    session = Session(engine)
+    session.add_all([User(id=1, username='owner'), User(id=2, username='john'),
+                     Conversation(id=1, name='general', type='channel')])
+    session.commit()
+    yield session
+    session.close()
+    with get_engine().begin() as conn:
+        conn.execute(text(f"DROP SCHEMA {name} CASCADE"))
+
+
+def add_message(db, body, user_id=2):
+    message = Message(conversation_id=1, user_id=user_id, text=body)
+    db.add(message)
+    db.commit()
+    return message
+
+
+def test_sync_returns_only_changes_since_watermark(db):
+    """Inserimenti, modifiche ed eliminazioni dopo il watermark, ciascuno una volta"""
+    first, second = add_message(db, 'uno'), add_message(db, 'due')
+    assert (first.seq, second.seq) == (1, 2)
+    watermark = get_conversation_seq(db, 1)
+
+    third = add_message(db, 'tre')
+    first.text, first.edited = 'uno (modificato)', True
+    db.commit()
+    second_id = second.id
+    db.delete(second)
+    db.commit()
+
+    changes = get_changes_since(db, 1, watermark)
+    assert [m['id'] for m in changes['messages']] == [third.id, first.id]
+    assert changes['messages'][1]['text'] == 'uno (modificato)'
+    assert changes['deleted'] == [second_id]
+    assert changes['seq'] == get_conversation_seq(db, 1) and not changes['hasMore']
+
+    # Già allineato: nessuna modifica
+    assert get_changes_since(db, 1, changes['seq'])['messages'] == []
+
+
+def test_sync_pages_and_resets_after_prune(db):
+    """Con più modifiche del limite si procede a pagine; dopo il prune i client vecchi ricaricano"""
+    for i in range(5):
+        add_message(db, f"m{i}")
+
+    seen, since = [], 0
+    while True:
+        changes = get_changes_since(db, 1, since, limit=2)
+        seen.extend(m['seq'] for m in changes['messages'])
+        since = changes['seq']
+        if not changes['hasMore']:
+            break
+    assert seen == [1, 2, 3, 4, 5]
+
+    db.delete(db.get(Message, 1))
+    db.commit()
+    schema = db.get_bind().get_execution_options()['schema_translate_map'][CHAT_SCHEMA]
+    assert prune_tombstones(days=-1, schema=schema) == 1
+    assert get_changes_since(db, 1, 5)['reset'] is True
+    assert get_changes_since(db, 1, 6)['reset'] is False
+
+
+def test_pending_migrations_run_once():
+    """All'avvio le migrazioni mancanti vengono applicate e registrate, poi non più rieseguite"""
+    from chat.migrations import MIGRATIONS, run_pending_migrations
+
+    name = f"chat_migrations_test_{uuid.uuid4().hex[:8]}"
+    try:
+        engine = get_engine().execution_options(schema_translate_map={CHAT_SCHEMA: name})
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA {name}"))
+    except Exception as e:
+        pytest.skip(f"Postgres non disponibile: {e}")
+    try:
+        # Schema come prima delle migrazioni: messages senza seq
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {name}.messages DROP COLUMN seq"))
+
+        assert run_pending_migrations(schema=name) == [migration for migration, _ in MIGRATIONS]
+        assert run_pending_migrations(schema=name) == []
+
+        session = Session(engine)
+        session.add_all([User(id=1, username='owner'), Conversation(id=1, name='general', type='channel')])
+        session.commit()
+        message = add_message(session, 'dopo la migrazione', user_id=1)
+        assert message.seq == 1
+        session.close()
+    finally:
+        with get_engine().begin() as conn:
+            conn.execute(text(f"DROP SCHEMA {name} CASCADE"))
+
+
+def test_invalid_concurrent_index_is_rebuilt():
+    """Un indice lasciato INVALID da un CREATE INDEX CONCURRENTLY fallito viene ricreato"""
+    import psycopg2
+    from common.db.connection import get_raw_connection
+
+    name = f"chat_migrations_test_{uuid.uuid4().hex[:8]}"
+    try:
+        engine = get_engine().execution_options(schema_translate_map={CHAT_SCHEMA: name})
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA {name}"))
+    except Exception as e:
+        pytest.skip(f"Postgres non disponibile: {e}")
+    try:
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP INDEX {name}.idx_messages_conversation_created_id"))
+            conn.execute(text(f"INSERT INTO {name}.conversations (id, name, type) VALUES (1, 'general', 'channel')"))
+            conn.execute(text(f"INSERT INTO {name}.messages (conversation_id, text) VALUES (1, 'a'), (1, 'b')"))
+
+        # Un indice unico su valori duplicati fallisce e resta INVALID con lo stesso nome
+        raw = get_raw_connection()
+        raw.autocommit = True
+        with raw.cursor() as cur:
+            with pytest.raises(psycopg2.Error):
+                cur.execute(f"CREATE UNIQUE INDEX CONCURRENTLY idx_messages_conversation_created_id "
+                            f"ON {name}.messages (conversation_id)")
+        raw.close()
+
+        run_migrations(['messages_keyset_index'], schema=name)
+        with engine.begin() as conn:
+            valid = conn.execute(text(
+                "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "WHERE n.nspname = :schema AND c.relname = 'idx_messages_conversation_created_id'"
+            ), {'schema': name}).scalar()
+        assert valid is True
+    finally:
+        with get_engine().begin() as conn:
+            conn.execute(text(f"DROP SCHEMA {name} CASCADE"))
@@ -0,0 +1,94 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+try:
+    # chat.database verifica lo schema all'import: serve un database raggiungibile
+    from common.config import CHAT_SCHEMA
+    from chat.database import Base
+    from chat.models import User
+    import chat.user_directory as user_directory
+    from chat.user_directory import UserDirectory
+except Exception as e:
+    pytest.skip(f"Database chat non disponibile: {e}", allow_module_level=True)
+
+
+@pytest.fixture
+def directory(monkeypatch):
+    """Rubrica condivisa su SQLite in memoria, con i contatori delle SELECT sugli utenti"""
+    engine = create_engine('sqlite://')
+
+    @event.listens_for(engine, 'connect')
+    def attach_schema(dbapi_connection, _):
+        dbapi_connection.execute(f"ATTACH DATABASE ':memory:' AS {CHAT_SCHEMA}")
+
+    Base.metadata.create_all(engine, tables=[User.__table__])
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as db:
+        db.add_all([
+            User(id=1, username='owner', display_name='Owner', status='online'),
+            User(id=2, username='john_doe', display_name='John Doe', status='online'),
+            User(id=4, username='jane', display_name='Jane Smith', status='offline'),
+        ])
+        db.commit()
+
+    selects = []
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_selects(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith('SELECT'):
+            selects.append(statement)
+
+    instance = UserDirectory(session_factory=session_factory, ttl=0)
+    monkeypatch.setattr(user_directory, '_directory', instance)
+    instance.selects = selects
+    yield instance
+    engine.dispose()
+
+
+def test_lookups_served_from_memory(directory):
+    """Un solo caricamento serve tutte le richieste successive"""
+    assert directory.get(1)['displayName'] == 'Owner'
+    assert directory.get(4)['username'] == 'jane'
+    assert [user['id'] for user in directory.list_users()] == [4, 2, 1]
+    assert len(directory.selects) == 1
+
+    stats = directory.get_stats()
+    assert stats['size'] == 3 and stats['loads'] == 1
+    assert stats['hits'] == 2 and stats['misses'] == 1
+
+
+def test_returned_dicts_are_copies(directory):
+    user = directory.get(1)
+    user['status'] = 'modificato'
+    assert directory.get(1)['status'] == 'online'
+
+
+def test_orm_update_invalidates(directory):
+    """Una modifica a una riga User (es. ensure_users_exist) invalida la rubrica"""
+    directory.get(2)
+    with directory.session_factory() as db:
+        db.get(User, 2).status = 'away'
+        db.commit()
+
+    assert directory.get(2)['status'] == 'away'
+    assert directory.get_stats()['invalidations'] >= 1
+    assert len(directory.selects) == 3  # caricamento iniziale, get della sessione, ricaricamento
+
+
+def test_unknown_user_is_loaded_individually(directory):
+    """Un utente creato dopo il caricamento viene letto singolarmente"""
+    directory.get(1)
+    directory.invalidate = lambda user_id=None: None  # simula un inserimento da un altro processo
+    with directory.session_factory() as db:
+        db.add(User(id=7, username='file_agent', display_name='File Analysis'))
+        db.commit()
+
+    assert directory.get(7)['displayName'] == 'File Analysis'
+    assert directory.get(99) is None
+    assert directory.get_stats()['size'] == 4